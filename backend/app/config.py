@@ -39,6 +39,8 @@ class Config:
     HOST = '0.0.0.0'
     PORT = int(os.getenv('PORT', 5000))
     DEBUG = os.getenv('FLASK_ENV', 'dev') == 'dev'
+    # run.py 启动的Web进程内是否运行调度器，使用独立的 run_worker.py 调度进程时设置为 false；导入 app.main 不会启动调度
+    RUN_SCHEDULER = os.getenv('RUN_SCHEDULER', 'true').lower() in ('1', 'true', 'yes')
     
     # 安全配置
     SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-here')
@@ -65,6 +67,41 @@ class Config:
         'mark_pan_dir': os.path.join(DATA_DIR, 'mark_pan'),  # 标记中间目录
         'lora_pan_upload_dir': os.path.join(DATA_DIR, 'lora_pan'),  # Lora上传中间目录
         'mark_poll_interval': 5,  # 标记轮询间隔（秒）
+        'dispatch_workers': int(os.getenv('DISPATCH_WORKERS', 8)),  # 任务派发（上传+提交）并发线程数
+        'completion_workers': int(os.getenv('COMPLETION_WORKERS', 4)),  # 任务完成处理（结果下载、状态更新）并发线程数
+        'status_poll_workers': int(os.getenv('STATUS_POLL_WORKERS', 4)),  # 状态轮询读取数据库和配置的线程数，与完成处理线程分开
+        'asset_request_concurrency': int(os.getenv('ASSET_REQUEST_CONCURRENCY', 4)),  # 状态监控对单个资产的最大并发请求数
+        'lease_ttl': int(os.getenv('LEASE_TTL', 60)),  # 任务租约有效期（秒），多进程调度时未续约的租约过期后可被接管
+        'scheduler_signal_poll_interval': float(os.getenv('SCHEDULER_SIGNAL_POLL_INTERVAL', 2)),  # 调度进程轮询跨进程唤醒信号的间隔（秒），0为不轮询
+        'sftp_parallelism': int(os.getenv('SFTP_PARALLELISM', 4)),  # 目录上传下载的并发SFTP通道数
+        'bulk_transfer_min_files': 16,  # 需要传输的文件数达到该值且平均大小较小时使用tar流传输
+        'bulk_transfer_max_avg_size': 2 * 1024 * 1024,  # tar流传输的文件平均大小上限（字节）
+        'tar_transfer_compress': False,  # tar流是否使用gzip压缩
+        'resumable_transfer_min_size': 32 * 1024 * 1024,  # 达到该大小的文件分块续传并校验sha256（字节）
+        'transfer_chunk_size': 4 * 1024 * 1024,  # 分块传输的块大小（字节）
+        'transfer_max_retries': 3,  # 大文件传输中断或校验失败时的重试次数
+        'ssh_liveness_window': 30,  # SSH连接确认可用后的该时间内复用不再执行命令探测（秒）
+        'ssh_health_probe_interval': int(os.getenv('SSH_HEALTH_PROBE_INTERVAL', 0)),  # 后台探测空闲SSH连接的间隔（秒），0为不探测
+        'ssh_pool_max_connections': int(os.getenv('SSH_POOL_MAX_CONNECTIONS', 2)),  # 每个主机最多保持的SSH连接数
+        'ssh_max_channels_per_connection': 8,  # 每个SSH连接同时借出的最大通道数（需小于服务端MaxSessions，默认10）
+        'ssh_checkout_timeout': 0,  # 等待可用SSH连接的最长时间（秒），0为一直等待，连接池繁忙时不使任务失败
+        'remote_dir_cache_ttl': 300,  # 已确认存在的远程目录缓存有效期（秒）
+        'training_sync_interval': int(os.getenv('TRAINING_SYNC_INTERVAL', 60)),  # 训练中增量同步输出目录的间隔（秒），0为不同步
+        'training_sync_workers': 2,  # 训练中增量同步的并发线程数
+        'training_sync_finish_timeout': 120,  # 训练完成后等待进行中的增量同步结束的最长时间（秒），超时后直接完整同步
+        'ws_safety_poll_interval': 30,  # WebSocket推送可用时打标状态的兜底轮询间隔（秒）
+        'mark_preprocess_images': os.getenv('MARK_PREPROCESS_IMAGES', 'false').lower() == 'true',  # 自动裁剪时是否在本地先缩小图片再上传到打标资产
+        'preprocess_workers': int(os.getenv('PREPROCESS_WORKERS', 2)),  # 图片预处理进程数
+        'mark_shard_min_images': int(os.getenv('MARK_SHARD_MIN_IMAGES', 400)),  # 图片数达到该值的打标任务拆分到多个空闲资产并行打标，0为不拆分
+        'mark_shard_min_size': 200,  # 每个打标分片的最少图片数
+        'mark_max_shards': int(os.getenv('MARK_MAX_SHARDS', 4)),  # 单个打标任务最多拆分的分片数
+        'mark_batch_max_tasks': int(os.getenv('MARK_BATCH_MAX_TASKS', 0)),  # 批量打标每批最多合并的任务数，0或1为不合并
+        'mark_batch_task_max_images': 50,  # 图片数不超过该值的打标任务才参与合并
+        'mark_batch_max_images': 300,  # 每批合并的图片总数上限
+        'mark_batch_max_wait': int(os.getenv('MARK_BATCH_MAX_WAIT', 30)),  # 未凑满的批次最长等待时间（秒），超时后按现有任务执行
+        'mark_workflow_debug_dump': os.getenv('MARK_WORKFLOW_DEBUG_DUMP', 'false').lower() == 'true',  # 是否把每次提交的打标工作流写入 mark_workflow_api_new.json
+        'mark_precheck_workflow': os.getenv('MARK_PRECHECK_WORKFLOW', 'false').lower() == 'true',  # 提交打标前是否用缓存的节点信息校验工作流
+        'comfyui_cache_ttl': 3600,  # ComfyUI节点信息和模型列表缓存的有效期（秒），过期后在后台刷新
     }
     
     # 打标全局配置
@@ -113,6 +150,17 @@ class Config:
         }
     }
     
+    # 资产HTTP客户端配置（ComfyUI和训练引擎）
+    HTTP_CLIENT_CONFIG = {
+        'pool_connections': 4,  # 每个会话缓存的连接池数量
+        'pool_maxsize': int(os.getenv('HTTP_POOL_MAXSIZE', 16)),  # 单个主机的最大keep-alive连接数
+        'connect_timeout': 5,  # 连接超时（秒）
+        'read_timeout': 30,  # 默认读取超时（秒），请求未指定timeout时使用
+        'max_retries': 2,  # 幂等请求（GET）的重试次数
+        'backoff_factor': 0.3,  # 重试退避系数
+        'poll_read_timeout': 10,  # 状态轮询请求的读取超时（秒），轮询请求不重试，失败由下一轮轮询兜底
+    }
+    
     # Lora训练全局配置
     LORA_TRAINING_CONFIG = {
         'model_train_type': 'flux-lora',
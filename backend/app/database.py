@@ -40,6 +40,8 @@ def init_db():
     from .models import task  # noqa
     from .models import training  # noqa
     from .models import asset  # noqa
+    from .models import task_lease  # noqa
+    from .models import scheduler_signal  # noqa
     
     # 创建所有表
     Base.metadata.create_all(bind=engine)
@@ -15,8 +15,15 @@ import atexit
 
 logger = setup_logger('main')
 
-def create_app():
-    """创建 Flask 应用"""
+def create_app(start_scheduler: bool = False):
+    """
+    创建 Flask 应用
+    
+    Args:
+        start_scheduler: 是否在当前进程启动任务调度器和监控。默认为纯API模式，导入模块、
+            测试客户端和命令行工具创建应用时不会启动调度；由 run.py 按配置 RUN_SCHEDULER 开启，
+            或由独立的 run_worker.py 进程负责调度
+    """
     logger.info("开始创建Flask应用...")
     app = Flask(__name__)
     
@@ -75,13 +82,14 @@ def create_app():
         return send_from_directory(directory, filename)
     
     # 初始化任务服务和调度器
-    SchedulerService.init_scheduler()
-    logger.info("任务服务已启动")
+    if start_scheduler:
+        SchedulerService.init_scheduler()
+        logger.info("任务服务已启动")
+    else:
+        logger.info("API模式启动，任务调度由独立的调度进程负责")
     
     # 注册应用关闭处理函数
     atexit.register(close_ssh_connection_pool)
     logger.info("注册了SSH连接池关闭函数")
     
     return app
-
-app = create_app() 
\ No newline at end of file
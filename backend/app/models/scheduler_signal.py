@@ -0,0 +1,12 @@
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, DateTime
+from ..database import Base
+
+class SchedulerSignal(Base):
+    """跨进程的调度唤醒信号，纯API模式的Web进程提交任务或释放资产时递增序号，调度进程轮询序号变化后立即调度"""
+    __tablename__ = 'scheduler_signals'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(100), unique=True, nullable=False, comment='信号名称')
+    seq = Column(Integer, default=0, nullable=False, comment='递增序号')
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now, nullable=False)
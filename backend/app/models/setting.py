@@ -30,6 +30,16 @@ class Setting(Base):
                 'value': '15',
                 'description': '训练任务轮询间隔(秒)'
             },
+            'scheduler_sweep_interval': {
+                'type': 'integer',
+                'value': '60',
+                'description': '调度器兜底轮询间隔(秒)，任务提交和资产释放会立即唤醒调度器'
+            },
+            'asset_placement_strategy': {
+                'type': 'string',
+                'value': 'least_loaded',
+                'description': '资产放置策略: first_available, least_loaded, data_locality, weighted_throughput'
+            },
             'scheduling_minute': {
                 'type': 'integer',
                 'value': '5',
@@ -0,0 +1,23 @@
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, DateTime
+from ..database import Base
+
+class TaskLease(Base):
+    """任务租约，保证多个调度进程之间同一任务阶段只由一个进程处理"""
+    __tablename__ = 'task_leases'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    resource = Column(String(100), unique=True, nullable=False, comment='租约资源，如 marking_1、training_1')
+    owner = Column(String(100), nullable=False, comment='持有者，格式为 主机名:进程号:随机串')
+    expires_at = Column(DateTime, nullable=False, comment='过期时间，持有者需在过期前续约')
+    created_at = Column(DateTime, default=datetime.now, nullable=False)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now, nullable=False)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'resource': self.resource,
+            'owner': self.owner,
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
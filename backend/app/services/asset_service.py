@@ -10,6 +10,7 @@ from ..utils.common import copy_attributes, generate_domain_url
 from ..services.terminal_service import TerminalService
 from ..models.constants import DOMAIN_ACCESS_CONFIG
 from ..utils.train_handler import TrainRequestHandler
+from ..utils.http_client import HttpClientRegistry
 from task_scheduler.comfyui_api import ComfyUIAPI,ComfyUIConfig
 from urllib.parse import urlparse
 
@@ -120,6 +121,8 @@ class AssetService:
                 
                 db.commit()
                 db.refresh(asset)
+                # 地址、端口或引擎配置可能已变化，关闭旧的HTTP连接
+                HttpClientRegistry.invalidate(asset_id)
                 return Asset.from_orm(asset)
         except Exception as e:
             logger.error(f"Update asset failed: {str(e)}")
@@ -134,6 +137,7 @@ class AssetService:
                 if asset:
                     db.delete(asset)
                     db.commit()
+                    HttpClientRegistry.invalidate(asset_id)
                     return True
                 return False
         except Exception as e:
@@ -329,6 +333,8 @@ class AssetService:
                 logger.info(f"资产 {asset_id} ({asset.name}) 状态已更新为: {'启用' if enabled else '禁用'}")
                 
                 db.commit()
+                if not enabled:
+                    HttpClientRegistry.invalidate(asset_id)
                 db.refresh(asset)
                 return Asset.from_orm(asset)
         except Exception as e:
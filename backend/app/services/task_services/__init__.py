@@ -7,6 +7,7 @@ from .marking_service import MarkingService
 from .training_service import TrainingService
 from .result_service import ResultService
 from .scheduler_service import SchedulerService
+from .placement_service import PlacementService
 
 __all__ = [
     'BaseTaskService',
@@ -14,5 +15,6 @@ __all__ = [
     'MarkingService',
     'TrainingService',
     'ResultService',
-    'SchedulerService'
+    'SchedulerService',
+    'PlacementService'
 ] 
\ No newline at end of file
@@ -11,6 +11,8 @@ from ...config import config
 from ...services.common_service import CommonService
 from ...utils.train_handler import TrainRequestHandler
 from ...utils.mark_handler import MarkRequestHandler
+from .scheduler_events import SchedulerEvents
+from .claim_service import ClaimService
 import shutil
 
 logger = setup_logger('base_task_service')
@@ -370,6 +372,16 @@ class BaseTaskService:
                     logger.warning(f"终止打标任务 {task_id} 失败")
                     cancel_message = "无法通过API终止打标任务，但已回滚任务状态"
             
+            # 取消本进程中该任务的状态监控协程
+            from .status_poller import StatusPollerService
+            StatusPollerService.cancel(task_id)
+            
+            if task.status == TaskStatus.MARKING:
+                # 分片打标时中断其他分片并释放其资产
+                from .marking_service import MarkingService
+                with MarkingService._shard_lock:
+                    MarkingService._release_shards(db, task, interrupt=True)
+            
             # 回滚任务状态
             rollback_success = BaseTaskService._rollback_task_state(
                 db=db,
@@ -520,14 +532,16 @@ class BaseTaskService:
                 # 清除资产关联
             if clear_assets:
                 if target_status == TaskStatus.NEW and task.marking_asset:
-                    task.marking_asset.marking_tasks_count = max(0, task.marking_asset.marking_tasks_count - 1)
+                    ClaimService.release_asset_slot(db, task.marking_asset_id, 'marking')
                     task.marking_asset_id = None
                 
                 if task.training_asset:
-                    task.training_asset.training_tasks_count = max(0, task.training_asset.training_tasks_count - 1)
+                    ClaimService.release_asset_slot(db, task.training_asset_id, 'training')
                     task.training_asset_id = None
                 
             db.commit()
+            if clear_assets:
+                SchedulerEvents.notify('asset_released')
             return True
         
         except Exception as e:
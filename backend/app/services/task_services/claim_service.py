@@ -0,0 +1,237 @@
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional, Set
+from sqlalchemy import case
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from ...models.task import Task, TaskStatus
+from ...models.asset import Asset
+from ...models.task_lease import TaskLease
+from ...database import get_db
+from ...config import Config
+from ...utils.logger import setup_logger
+
+logger = setup_logger('claim_service')
+
+
+class ClaimService:
+    """
+    基于数据库的任务租约和资产槽位认领
+
+    多个调度进程（或共享同一数据库的多个节点）通过条件更新原子地认领任务和资产槽位，
+    租约由心跳线程定期续约，进程退出后租约过期，其他进程可以接管。
+    """
+    _owner_id: Optional[str] = None
+    _owner_pid: Optional[int] = None
+    _held: Set[str] = set()
+    _held_lock = threading.Lock()
+    _heartbeat_thread: Optional[threading.Thread] = None
+    _heartbeat_stop = threading.Event()
+
+    @staticmethod
+    def get_owner_id() -> str:
+        """获取当前进程的租约持有者标识，fork后的子进程会生成新的标识"""
+        if ClaimService._owner_pid != os.getpid():
+            ClaimService._owner_pid = os.getpid()
+            ClaimService._owner_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+            with ClaimService._held_lock:
+                ClaimService._held = set()
+        return ClaimService._owner_id
+
+    @staticmethod
+    def get_lease_ttl() -> int:
+        """租约有效期（秒）"""
+        return Config.SYSTEM_CONFIG.get('lease_ttl', 60)
+
+    @staticmethod
+    def acquire_lease(resource: str) -> bool:
+        """
+        认领租约
+
+        租约不存在或已过期时认领成功；租约被其他进程（或本进程）持有且未过期时认领失败。
+
+        Args:
+            resource: 租约资源，如 marking_1
+
+        Returns:
+            是否认领成功
+        """
+        owner = ClaimService.get_owner_id()
+        now = datetime.now()
+        expires_at = now + timedelta(seconds=ClaimService.get_lease_ttl())
+
+        with get_db() as db:
+            # 接管已过期的租约
+            updated = db.query(TaskLease).filter(
+                TaskLease.resource == resource,
+                TaskLease.expires_at < now
+            ).update({
+                TaskLease.owner: owner,
+                TaskLease.expires_at: expires_at,
+                TaskLease.updated_at: now
+            }, synchronize_session=False)
+
+            if not updated:
+                db.add(TaskLease(resource=resource, owner=owner, expires_at=expires_at))
+            try:
+                db.commit()
+            except IntegrityError:
+                # 租约已被其他进程持有
+                db.rollback()
+                return False
+
+        with ClaimService._held_lock:
+            ClaimService._held.add(resource)
+        return True
+
+    @staticmethod
+    def release_lease(resource: str):
+        """释放本进程持有的租约"""
+        with ClaimService._held_lock:
+            ClaimService._held.discard(resource)
+        try:
+            with get_db() as db:
+                db.query(TaskLease).filter(
+                    TaskLease.resource == resource,
+                    TaskLease.owner == ClaimService.get_owner_id()
+                ).delete(synchronize_session=False)
+                db.commit()
+        except Exception as e:
+            logger.error(f"释放租约 {resource} 失败: {str(e)}")
+
+    @staticmethod
+    def is_lease_active(resource: str) -> bool:
+        """租约是否被某个进程持有且未过期"""
+        with get_db() as db:
+            return db.query(TaskLease.id).filter(
+                TaskLease.resource == resource,
+                TaskLease.expires_at >= datetime.now()
+            ).first() is not None
+
+    @staticmethod
+    def renew_leases():
+        """续约本进程持有的全部租约，续约失败（已被接管）的租约从持有列表中移除"""
+        with ClaimService._held_lock:
+            held = list(ClaimService._held)
+        if not held:
+            return
+
+        owner = ClaimService.get_owner_id()
+        now = datetime.now()
+        expires_at = now + timedelta(seconds=ClaimService.get_lease_ttl())
+        with get_db() as db:
+            db.query(TaskLease).filter(
+                TaskLease.resource.in_(held),
+                TaskLease.owner == owner
+            ).update({
+                TaskLease.expires_at: expires_at,
+                TaskLease.updated_at: now
+            }, synchronize_session=False)
+            db.commit()
+            renewed = {row.resource for row in db.query(TaskLease.resource).filter(
+                TaskLease.resource.in_(held),
+                TaskLease.owner == owner
+            ).all()}
+
+        lost = set(held) - renewed
+        if lost:
+            logger.warning(f"租约已失效，停止持有: {', '.join(sorted(lost))}")
+            with ClaimService._held_lock:
+                ClaimService._held -= lost
+
+    @staticmethod
+    def _heartbeat_loop():
+        """租约心跳循环，每1/3有效期续约一次"""
+        while not ClaimService._heartbeat_stop.wait(max(ClaimService.get_lease_ttl() / 3, 1)):
+            try:
+                ClaimService.renew_leases()
+            except Exception as e:
+                logger.error(f"租约续约失败: {str(e)}")
+
+    @staticmethod
+    def start_heartbeat():
+        """启动租约心跳线程"""
+        if ClaimService._heartbeat_thread and ClaimService._heartbeat_thread.is_alive():
+            return
+        ClaimService._heartbeat_stop.clear()
+        ClaimService._heartbeat_thread = threading.Thread(
+            target=ClaimService._heartbeat_loop,
+            name="lease_heartbeat",
+            daemon=True
+        )
+        ClaimService._heartbeat_thread.start()
+
+    @staticmethod
+    def stop_heartbeat():
+        """停止租约心跳线程"""
+        ClaimService._heartbeat_stop.set()
+
+    @staticmethod
+    def claim_asset_slot(db: Session, asset_id: int, kind: str, capacity: int) -> bool:
+        """
+        原子地占用资产的一个任务槽位（不提交事务）
+
+        Args:
+            db: 数据库会话
+            asset_id: 资产ID
+            kind: marking 或 training
+            capacity: 资产最大并发任务数
+
+        Returns:
+            资产还有空闲槽位并占用成功时返回True
+        """
+        column = Asset.marking_tasks_count if kind == 'marking' else Asset.training_tasks_count
+        updated = db.query(Asset).filter(
+            Asset.id == asset_id,
+            column < capacity
+        ).update({column: column + 1}, synchronize_session=False)
+        return updated == 1
+
+    @staticmethod
+    def release_asset_slot(db: Session, asset_id: Optional[int], kind: str):
+        """
+        原子地释放资产的一个任务槽位（不提交事务），计数不会小于0
+
+        Args:
+            db: 数据库会话
+            asset_id: 资产ID
+            kind: marking 或 training
+        """
+        if not asset_id:
+            return
+        column = Asset.marking_tasks_count if kind == 'marking' else Asset.training_tasks_count
+        db.query(Asset).filter(Asset.id == asset_id).update(
+            {column: case((column > 0, column - 1), else_=0)},
+            synchronize_session=False
+        )
+
+    @staticmethod
+    def claim_task_asset(db: Session, task_id: int, asset_id: int, kind: str) -> bool:
+        """
+        原子地把资产分配给仍在等待的任务（不提交事务）
+
+        Args:
+            db: 数据库会话
+            task_id: 任务ID
+            asset_id: 资产ID
+            kind: marking 或 training
+
+        Returns:
+            任务仍处于等待分配状态并分配成功时返回True
+        """
+        if kind == 'marking':
+            updated = db.query(Task).filter(
+                Task.id == task_id,
+                Task.status == TaskStatus.SUBMITTED,
+                Task.marking_asset_id.is_(None)
+            ).update({Task.marking_asset_id: asset_id}, synchronize_session=False)
+        else:
+            updated = db.query(Task).filter(
+                Task.id == task_id,
+                Task.status == TaskStatus.TRAINING,
+                Task.training_asset_id.is_(None)
+            ).update({Task.training_asset_id: asset_id}, synchronize_session=False)
+        return updated == 1
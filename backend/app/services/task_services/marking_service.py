@@ -1,4 +1,5 @@
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from sqlalchemy.orm import Session
 from ...models.task import Task, TaskStatus
@@ -6,27 +7,52 @@ from ...models.asset import Asset
 from ...database import get_db
 from ...utils.logger import setup_logger
 from ...services.config_service import ConfigService
-from ...utils.file_handler import generate_unique_folder_path
+from ...utils.file_handler import generate_unique_folder_path, link_or_copy
 from ...utils.mark_handler import MarkRequestHandler, MarkConfig
 from ...utils.common import copy_attributes
 from ...services.asset_service import AssetService
 from ...config import Config
+from .scheduler_events import SchedulerEvents
+from .claim_service import ClaimService
 from ...utils.ssh import create_ssh_client_from_asset
+from ...utils.image_preprocess import ImagePreprocessor, IMAGE_EXTENSIONS
 import json
 import traceback
 import os
+import shutil
+import threading
 import time
 
 logger = setup_logger('marking_service')
 
+# 分片打标时各分片的本地输入目录
+SHARD_DIR = os.path.join(Config.DATA_DIR, 'mark_shards')
+# 批量打标的合并输入目录和本地资产的合并输出目录
+BATCH_DIR = os.path.join(Config.DATA_DIR, 'mark_batches')
+# 同一批次的任务必须一致的打标参数
+BATCH_COMPAT_KEYS = ('mark_algorithm', 'resolution', 'auto_crop', 'default_crop_ratio', 'min_confidence', 'max_tokens')
+# 打标运行时写入 task.mark_config 的状态，不属于任务的打标配置
+RUN_STATE_KEYS = ('shards', 'batch')
+
 class MarkingService:
+    # 单个资产的最大并发任务数
+    MAX_TASKS_PER_ASSET = 10
+    # 分片状态的读写锁，同一任务的多个分片可能同时完成
+    _shard_lock = threading.Lock()
+    # 分片任务各分片的实时进度 {task_id: {asset_id: 进度}}
+    _shard_progress: Dict[int, Dict[int, int]] = {}
+    # 等待凑批的任务首次被调度的时间 {task_id: 时间戳}
+    _batch_waiting: Dict[int, float] = {}
+    _batch_timer: Optional[threading.Timer] = None
+    # 批次成员结束时检查整批是否结束的锁，避免多个成员同时结束时都认为其他成员仍在打标
+    _batch_lock = threading.Lock()
+
     @staticmethod
     def get_available_marking_assets() -> List[Asset]:
         """获取可用于标记的资产"""
         try:
             assets = AssetService.verify_all_assets('ai_engine')
-            # 标记资产最大并发数固定为10
-            return [asset for asset in assets if asset.marking_tasks_count < 10]
+            return [asset for asset in assets if asset.marking_tasks_count < MarkingService.MAX_TASKS_PER_ASSET]
         except Exception as e:
             logger.error(f"获取可用标记资产失败: {str(e)}")
             return []
@@ -55,6 +81,7 @@ class MarkingService:
 
             # 更新任务状态为已提交，并传递数据库会话
             task.update_status(TaskStatus.SUBMITTED, '任务已提交', db=db)
+            SchedulerEvents.notify('task_submitted')
 
             return task.to_dict()
             
@@ -121,6 +148,9 @@ class MarkingService:
             # 记录成功提交的任务ID
             succeeded_ids.append(task_id)
         
+        if succeeded_ids:
+            SchedulerEvents.notify('task_submitted')
+        
         return succeeded_ids
             
     @staticmethod
@@ -139,7 +169,7 @@ class MarkingService:
                 # 更新任务状态，记录开始处理标记
                 task.update_status(TaskStatus.MARKING, f'开始处理标记任务，使用资产: {asset.name}',db=db)
 
-                mark_config = ConfigService.get_task_mark_config(task.id)
+                mark_config = MarkingService._load_mark_config(task.id)
                 
                 # 准备输入输出目录
                 input_dir = os.path.join(Config.UPLOAD_DIR, str(task_id))
@@ -169,13 +199,15 @@ class MarkingService:
                 if not asset.is_local:
                     task.add_log('资产不是本地资产，需要同步文件...',db)
                     
+                    upload_dir = MarkingService._preprocess_images(task, input_dir, mark_config, db)
+
                     # 使用同步工具上传图片到远程服务器
                     task.add_log(f'开始同步图片到远程服务器: {remote_input_dir}',db)
                     # 创建SSH客户端工具
                     ssh_client = create_ssh_client_from_asset(asset)
-                    # 下载打标结果
+                    # 上传待打标图片
                     success, message, stats = ssh_client.upload_directory(
-                        local_path=input_dir,
+                        local_path=upload_dir,
                         remote_path=remote_input_dir
                     )
                     
@@ -214,8 +246,9 @@ class MarkingService:
                     task.update_status(TaskStatus.ERROR, f'标记请求失败: {str(req_error)}', db=db)
                     task.add_log(error_json, db=db)
                     if task.marking_asset:
-                        task.marking_asset.marking_tasks_count = max(0, task.marking_asset.marking_tasks_count - 1)
+                        ClaimService.release_asset_slot(db, task.marking_asset_id, 'marking')
                         db.commit()
+                        SchedulerEvents.notify('marking_asset_released')
                     raise ValueError(f"标记请求失败: {str(req_error)}")
 
                 if not prompt_id:
@@ -244,132 +277,874 @@ class MarkingService:
                         "traceback": str(traceback.format_exc())
                     }, indent=2), db=db)
                     if task.marking_asset:
-                        task.marking_asset.marking_tasks_count = max(0, task.marking_asset.marking_tasks_count - 1)
+                        ClaimService.release_asset_slot(db, task.marking_asset_id, 'marking')
                         db.commit()
+                        SchedulerEvents.notify('marking_asset_released')
             raise
             
     @staticmethod
-    def _monitor_mark_status(task_id: int, asset_id: int, prompt_id: str):
-        """监控标记任务状态"""
+    def _preprocess_images(task: Task, input_dir: str, mark_config: Dict, db: Session) -> str:
+        """
+        自动裁剪时在本地把图片缩小到工作流的缩放长度，返回待上传目录
+
+        未开启预处理、未开启自动裁剪或预处理失败时返回原图目录。
+        """
+        if not mark_config.get('auto_crop', True) or not ImagePreprocessor.is_available():
+            return input_dir
+        try:
+            upload_dir, stats = ImagePreprocessor.prepare(task.id, input_dir, int(mark_config.get('resolution', 1024)))
+            task.add_log(
+                f"图片预处理完成: 缩放 {stats['resized']} 张, 缓存 {stats['cached']} 张, "
+                f"{stats['original_bytes'] / 1024 / 1024:.1f}MB -> {stats['prepared_bytes'] / 1024 / 1024:.1f}MB",
+                db
+            )
+            return upload_dir
+        except Exception as e:
+            logger.warning(f"任务 {task.id} 图片预处理失败，上传原图: {str(e)}")
+            task.add_log(f'图片预处理失败，上传原图: {str(e)}', db)
+            return input_dir
+
+    @staticmethod
+    def _load_mark_config(task_id: int) -> Dict:
+        """获取任务的打标配置，去掉上一次打标运行记录的分片和批量信息"""
+        mark_config = ConfigService.get_task_mark_config(task_id) or {}
+        for key in RUN_STATE_KEYS:
+            mark_config.pop(key, None)
+        return mark_config
+
+    @staticmethod
+    def count_task_images(task_id: int) -> int:
+        """统计任务上传目录中的图片数"""
+        input_dir = os.path.join(Config.UPLOAD_DIR, str(task_id))
+        if not os.path.isdir(input_dir):
+            return 0
+        return sum(
+            1 for name in os.listdir(input_dir)
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+        )
+
+    @staticmethod
+    def plan_shard_count(task_id: int) -> int:
+        """
+        根据任务的图片数计算打标分片数，图片数未达到 mark_shard_min_images 时不分片
+
+        Returns:
+            分片数，1表示不分片
+        """
+        min_images = Config.SYSTEM_CONFIG.get('mark_shard_min_images', 0)
+        if min_images <= 0:
+            return 1
+        image_count = MarkingService.count_task_images(task_id)
+        if image_count < min_images:
+            return 1
+        shard_size = max(1, Config.SYSTEM_CONFIG.get('mark_shard_min_size', 200))
+        return max(1, min(Config.SYSTEM_CONFIG.get('mark_max_shards', 4), image_count // shard_size))
+
+    @staticmethod
+    def _split_into_shards(task_id: int, source_dir: str, count: int) -> List[Tuple[str, int]]:
+        """
+        把待打标文件均分到各分片目录（硬链接），同名的图片和文本文件分到同一分片
+
+        Returns:
+            [(分片目录, 图片数)]
+        """
+        groups: Dict[str, List[str]] = {}
+        for name in sorted(os.listdir(source_dir)):
+            if os.path.isfile(os.path.join(source_dir, name)):
+                groups.setdefault(os.path.splitext(name)[0], []).append(name)
+        stems = list(groups)
+
+        base_dir = os.path.join(SHARD_DIR, str(task_id))
+        shutil.rmtree(base_dir, ignore_errors=True)
+        shards = []
+        for index in range(count):
+            shard_dir = os.path.join(base_dir, str(index))
+            os.makedirs(shard_dir, exist_ok=True)
+            images = 0
+            for stem in stems[index::count]:
+                for name in groups[stem]:
+                    link_or_copy(os.path.join(source_dir, name), os.path.join(shard_dir, name))
+                    if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                        images += 1
+            shards.append((shard_dir, images))
+        return shards
+
+    @staticmethod
+    def _shard_remote_input_dir(task_id: int, index: int) -> str:
+        return f"{Config.REMOTE_UPLOAD_DIR}/{task_id}_shard{index}"
+
+    @staticmethod
+    def _cleanup_shards(db: Session, task_id: int, shards: List[Dict]):
+        """删除分片的本地输入目录，以及远程资产上各分片的输入和输出目录，清理失败只记录日志"""
+        shutil.rmtree(os.path.join(SHARD_DIR, str(task_id)), ignore_errors=True)
+        remote_dirs: Dict[int, List[str]] = {}
+        for shard in shards:
+            remote_dirs.setdefault(shard['asset_id'], []).extend([
+                MarkingService._shard_remote_input_dir(task_id, shard['index']),
+                shard['remote_output_dir']
+            ])
+        if not remote_dirs:
+            return
+        for asset in db.query(Asset).filter(Asset.id.in_(list(remote_dirs))).all():
+            if asset.is_local:
+                continue
+            try:
+                result = create_ssh_client_from_asset(asset).remove_directories(remote_dirs[asset.id])
+                if result.returncode != 0:
+                    logger.warning(f"清理任务 {task_id} 在资产 {asset.name} 上的分片目录失败: {result.stderr}")
+            except Exception as e:
+                logger.warning(f"清理任务 {task_id} 在资产 {asset.name} 上的分片目录失败: {str(e)}")
+
+    @staticmethod
+    def _process_marking_shards(task_id: int, asset_ids: List[int]) -> List[Tuple[int, str]]:
+        """
+        分片处理标记任务：图片均分到多个资产，各分片并行上传和提交
+
+        每个分片使用独立的输入目录，远程资产的结果输出到 remote_output_dir/shard_序号，
+        由各分片的监控在完成后下载合并到 task.marked_images_path。分片信息保存在
+        task.mark_config['shards'] 中。
+
+        Args:
+            task_id: 任务ID
+            asset_ids: 执行各分片的资产ID，第一个为任务分配的资产
+
+        Returns:
+            [(资产ID, prompt_id)]
+        """
+        submitted: List[Tuple[Asset, str]] = []
+        shards: List[Dict] = []
         try:
             with get_db() as db:
                 task = db.query(Task).filter(Task.id == task_id).first()
-                asset = db.query(Asset).filter(Asset.id == asset_id).first()
-
-                if not task or not asset:
+                assets = {asset.id: asset for asset in db.query(Asset).filter(Asset.id.in_(asset_ids)).all()}
+                if not task or len(assets) != len(asset_ids):
                     raise ValueError("任务或资产不存在")
-                
-                # 记录开始监控
-                task.add_log(f'开始监控标记任务状态, prompt_id={prompt_id}', db=db)
-                handler = MarkRequestHandler(asset)
-                poll_interval = ConfigService.get_value('mark_poll_interval', 5)
-                mark_config = ConfigService.get_task_mark_config(task.id)
-                last_progress = 0
-                error_count = 0
-                
-                while True:
+
+                logger.info(f"开始分片处理标记任务 {task_id}，分片数: {len(asset_ids)}")
+                asset_names = ', '.join(assets[asset_id].name for asset_id in asset_ids)
+                task.update_status(TaskStatus.MARKING, f'开始分片打标，使用资产: {asset_names}', db=db)
+
+                mark_config = MarkingService._load_mark_config(task.id)
+                input_dir = os.path.join(Config.UPLOAD_DIR, str(task_id))
+                output_dir = task.marked_images_path
+                task.add_log(f'输入目录: {input_dir}', db)
+                task.add_log(f'输出目录: {output_dir}', db)
+
+                output_suffix = task.marked_images_path.replace(Config.MARKED_DIR, '').replace('\\', '/')
+                remote_output_dir = f"{Config.REMOTE_MARKED_DIR}{output_suffix}"
+
+                # 有远程资产时先预处理，各分片共用预处理结果
+                if any(not asset.is_local for asset in assets.values()):
+                    input_dir = MarkingService._preprocess_images(task, input_dir, mark_config, db)
+                split = MarkingService._split_into_shards(task_id, input_dir, len(asset_ids))
+
+                shards = [{
+                    'index': index,
+                    'asset_id': asset_id,
+                    'images': split[index][1],
+                    'status': 'pending',
+                    'prompt_id': None,
+                    'remote_output_dir': f"{remote_output_dir}/shard_{index}"
+                } for index, asset_id in enumerate(asset_ids)]
+                task.add_log(
+                    '图片分片: ' + ', '.join(f"分片{s['index']}={s['images']}张" for s in shards), db
+                )
+                submit_config = dict(mark_config)
+                mark_config['remote_output_dir'] = remote_output_dir
+                mark_config['shards'] = shards
+                task.mark_config = mark_config
+                db.add(task)
+                db.commit()
+
+                # 提交后资产属性已过期，重新加载后脱离会话供分片线程使用
+                for asset in assets.values():
+                    db.refresh(asset)
+                    db.expunge(asset)
+
+            # 各分片的上传和提交互不依赖，并行执行
+            with ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix="MarkShard") as pool:
+                futures = [
+                    pool.submit(
+                        MarkingService._submit_shard, task_id, assets[shard['asset_id']],
+                        split[shard['index']][0], output_dir, shard, submit_config
+                    )
+                    for shard in shards
+                ]
+                errors = []
+                for shard, future in zip(shards, futures):
                     try:
-                        completed, success, task_info = handler.check_status(prompt_id, mark_config)
-                        logger.info(f"检查标记任务状态: completed={completed}, success={success}, task_info={task_info}")
-                        with get_db() as complete_db:
-                            task = complete_db.query(Task).filter(Task.id == task_id).first()
-                            # 可能在打标过程中取消了任务，不再继续监听
-                            if task and task.status != TaskStatus.MARKING:
-                                logger.info("任务状态为非打标状态，退出监听")
-                                break
-                                
-                            if completed and task:
-                                if success:
-                                    # 如果是非本地资产，需要下载结果
-                                    if not asset.is_local and task.mark_config and task.mark_config.get('remote_output_dir'):
-                                        task.add_log('打标完成，开始从远程服务器同步结果...', db=complete_db)
-                                        
-                                        # 创建SSH客户端工具
-                                        ssh_client = create_ssh_client_from_asset(asset)
-                                        # 下载打标结果
-                                        success, message, stats = ssh_client.download_directory(
-                                            local_path=task.marked_images_path,
-                                            remote_path=task.mark_config['remote_output_dir']
-                                        )
-                                        
-                                        if not success:
-                                            task.add_log(f'同步结果失败: {message}', db=complete_db)
-                                            task.update_status(TaskStatus.ERROR, f'同步打标结果失败: {message}', db=complete_db)
-                                            break
-                                        
-                                        task.add_log(f'打标结果同步成功: {message}', db=complete_db)
-                                    
-                                    task.update_status(TaskStatus.MARKED, '标记完成', db=complete_db)
-                                    task.progress = 100
-                                    task.add_log('标记任务成功完成', db=complete_db)
-                                    
-                                    # 检查是否自动开始训练
-                                    if task.auto_training:
-                                        logger.info(f"任务 {task_id} 启用自动训练，将自动开始训练流程")
-                                        task.add_log('启用自动训练，设置状态为训练中，等待调度器分配资产', db=complete_db)
-                                        task.update_status(TaskStatus.TRAINING, '准备开始训练', db=complete_db)
-                                    else:
-                                        task.add_log('未启用自动训练，请手动提交训练任务', db=complete_db)
-                                else:
-                                    # 处理失败情况
-                                    error_info = task_info.get("error_info", {})
-                                    task.update_status(
-                                        TaskStatus.ERROR,
-                                        f'标记失败: {error_info.get("error_message")}',
-                                        db=complete_db
-                                    )
-                                    task.add_log(json.dumps({
-                                        "message": error_info.get("error_message"),
-                                        "type": error_info.get("error_type"),
-                                        "node": error_info.get("node_type"),
-                                        "details": {
-                                            "inputs": error_info.get("inputs"),
-                                            "traceback": error_info.get("traceback")
-                                        }
-                                    }, indent=2), db=complete_db)
-                                
-                                # 更新资产任务计数
-                                if task.marking_asset:
-                                    task.marking_asset.marking_tasks_count = max(0, task.marking_asset.marking_tasks_count - 1)
-                                    complete_db.commit()
-                                break
-                        
-                        time.sleep(poll_interval)
-                        # 重置错误计数
-                        error_count = 0
-                    except Exception as check_err:
-                        # 处理检查状态的错误
-                        error_count += 1
-                        # 记录错误并在多次失败后停止监控
-                        with get_db() as err_db:
-                            task = err_db.query(Task).filter(Task.id == task_id).first()
-                            if task:
-                                task.add_log(f'检查任务状态出错 ({error_count}/3): {str(check_err)}', db=err_db)
-                            if error_count >= 3:
-                                task = err_db.query(Task).filter(Task.id == task_id).first()
-                                if task:
-                                    task.update_status(TaskStatus.ERROR, f'连续3次检查状态失败，停止监控: {str(check_err)}', db=err_db)
-                                    if task.marking_asset:
-                                        task.marking_asset.marking_tasks_count = max(0, task.marking_asset.marking_tasks_count - 1)
-                                        err_db.commit()
-                                break
-                
-                    time.sleep(poll_interval)
+                        shard['prompt_id'] = future.result()
+                        shard['status'] = 'marking'
+                        submitted.append((assets[shard['asset_id']], shard['prompt_id']))
+                    except Exception as e:
+                        errors.append(f"分片{shard['index']}: {str(e)}")
+            if errors:
+                raise ValueError(f"分片提交失败: {'; '.join(errors)}")
 
-                logger.info("已退出监听标记任务状态")
+            with get_db() as db:
+                task = db.query(Task).filter(Task.id == task_id).first()
+                if not task:
+                    raise ValueError("任务不存在")
+                MarkingService._save_shards(task, shards)
+                task.prompt_id = shards[0]['prompt_id']
+                task.add_log(
+                    '分片标记任务创建成功: ' + ', '.join(f"分片{s['index']} prompt_id={s['prompt_id']}" for s in shards),
+                    db=db
+                )
+                db.commit()
+
+            MarkingService._shard_progress[task_id] = {asset_id: 0 for asset_id in asset_ids}
+            return [(shard['asset_id'], shard['prompt_id']) for shard in shards]
 
         except Exception as e:
-            # 处理整体监控异常
-            logger.error(f"监控标记任务状态失败: {str(e)}")
+            logger.error(f"分片标记任务 {task_id} 处理失败: {str(e)}", exc_info=True)
+            # 已提交的分片不再需要，中断其执行
+            for asset, prompt_id in submitted:
+                MarkRequestHandler(asset).interrupt()
             with get_db() as db:
                 task = db.query(Task).filter(Task.id == task_id).first()
                 if task:
-                    task.update_status(TaskStatus.ERROR, f'监控失败: {str(e)}', db=db)
+                    task.update_status(TaskStatus.ERROR, f'标记处理失败: {str(e)}', db=db)
+                    task.add_log(json.dumps({
+                        "message": str(e),
+                        "type": type(e).__name__,
+                        "traceback": str(traceback.format_exc())
+                    }, indent=2), db=db)
+                for asset_id in asset_ids:
+                    ClaimService.release_asset_slot(db, asset_id, 'marking')
+                db.commit()
+                SchedulerEvents.notify('marking_asset_released')
+                MarkingService._cleanup_shards(db, task_id, shards)
+            raise
+
+    @staticmethod
+    def _submit_shard(task_id: int, asset: Asset, shard_dir: str, output_dir: str,
+                      shard: Dict, mark_config: Dict) -> str:
+        """上传一个分片的图片并提交标记请求，返回prompt_id"""
+        input_dir = shard_dir
+        if not asset.is_local:
+            remote_input_dir = MarkingService._shard_remote_input_dir(task_id, shard['index'])
+            ssh_client = create_ssh_client_from_asset(asset)
+            success, message, stats = ssh_client.upload_directory(
+                local_path=shard_dir,
+                remote_path=remote_input_dir
+            )
+            if not success:
+                raise Exception(f"同步图片失败: {message}")
+            input_dir = remote_input_dir
+
+        config = MarkConfig(
+            input_folder=input_dir,
+            output_folder=shard['remote_output_dir'] if not asset.is_local else output_dir
+        )
+        copy_attributes(mark_config, config)
+        prompt_id = MarkRequestHandler(asset).mark_request(config)
+        if not prompt_id:
+            raise ValueError("未获取到prompt_id")
+        return prompt_id
+
+    @staticmethod
+    def plan_batches(tasks: List[Task]) -> Tuple[List[List[Task]], List[Task]]:
+        """
+        把可合并的小任务分成批次
+
+        图片数不超过 mark_batch_task_max_images 且打标参数一致的任务按提交顺序合并，每批不超过
+        mark_batch_max_tasks 个任务和 mark_batch_max_images 张图片。未凑满的批次最多等待
+        mark_batch_max_wait 秒，超时后按现有任务数执行。
+
+        Args:
+            tasks: 按提交顺序排列的待分配任务
+
+        Returns:
+            (批次列表, 单独处理的任务列表)，等待凑批的任务不在返回结果中
+        """
+        max_tasks = Config.SYSTEM_CONFIG.get('mark_batch_max_tasks', 0)
+        if max_tasks <= 1:
+            return [], tasks
+
+        task_max_images = Config.SYSTEM_CONFIG.get('mark_batch_task_max_images', 50)
+        max_images = Config.SYSTEM_CONFIG.get('mark_batch_max_images', 300)
+        max_wait = Config.SYSTEM_CONFIG.get('mark_batch_max_wait', 30)
+        now = time.time()
+
+        singles = []
+        groups: Dict[tuple, List[Tuple[Task, int]]] = {}
+        for task in tasks:
+            images = MarkingService.count_task_images(task.id)
+            if images == 0 or images > task_max_images:
+                singles.append(task)
+                continue
+            mark_config = MarkingService._load_mark_config(task.id)
+            key = tuple(mark_config.get(name) for name in BATCH_COMPAT_KEYS)
+            groups.setdefault(key, []).append((task, images))
+
+        # 清理已不在等待列表中的任务
+        waiting_ids = {task.id for members in groups.values() for task, _ in members}
+        for task_id in list(MarkingService._batch_waiting):
+            if task_id not in waiting_ids:
+                MarkingService._batch_waiting.pop(task_id, None)
+
+        batches = []
+        next_deadline = None
+        for members in groups.values():
+            batch, batch_images = [], 0
+            for task, images in members:
+                if batch and (len(batch) >= max_tasks or batch_images + images > max_images):
+                    batches.append(batch)
+                    batch, batch_images = [], 0
+                batch.append(task)
+                batch_images += images
+            if not batch:
+                continue
+            if len(batch) >= max_tasks:
+                batches.append(batch)
+                continue
+            # 未凑满的批次按其中最早的任务计算等待时间
+            first_seen = min(MarkingService._batch_waiting.setdefault(task.id, now) for task in batch)
+            if now - first_seen >= max_wait:
+                batches.append(batch)
+            else:
+                deadline = first_seen + max_wait
+                next_deadline = deadline if next_deadline is None else min(next_deadline, deadline)
+
+        if next_deadline is not None:
+            MarkingService._schedule_batch_wakeup(next_deadline - now)
+
+        # 只有一个任务的批次按普通任务处理
+        for batch in [batch for batch in batches if len(batch) == 1]:
+            batches.remove(batch)
+            singles.append(batch[0])
+        for batch in batches:
+            for task in batch:
+                MarkingService._batch_waiting.pop(task.id, None)
+        for task in singles:
+            MarkingService._batch_waiting.pop(task.id, None)
+        return batches, singles
+
+    @staticmethod
+    def _schedule_batch_wakeup(delay: float):
+        """凑批等待超时后唤醒调度器"""
+        timer = MarkingService._batch_timer
+        if timer and timer.is_alive():
+            return
+        timer = threading.Timer(max(delay, 0.1), SchedulerEvents.notify, args=('mark_batch_wait',))
+        timer.daemon = True
+        timer.start()
+        MarkingService._batch_timer = timer
+
+    @staticmethod
+    def _process_marking_batch(task_ids: List[int], asset_id: int) -> str:
+        """
+        批量处理标记任务：多个任务的图片加上 t{任务ID}__ 前缀合并到同一输入目录，一次工作流执行完成打标
+
+        各任务的触发词不同，工作流中不写入触发词，拆分结果时在本地为各任务的标注加上触发词。
+        批次信息保存在各任务的 mark_config['batch'] 中。
+
+        Args:
+            task_ids: 同一批次的任务ID
+            asset_id: 已分配给批次中所有任务的资产ID
+
+        Returns:
+            prompt_id
+        """
+        batch_id = f"{task_ids[0]}_{int(time.time())}"
+        try:
+            with get_db() as db:
+                tasks = db.query(Task).filter(Task.id.in_(task_ids)).order_by(Task.id.asc()).all()
+                asset = db.query(Asset).filter(Asset.id == asset_id).first()
+                if len(tasks) != len(task_ids) or not asset:
+                    raise ValueError("任务或资产不存在")
+
+                logger.info(f"开始批量处理标记任务 {task_ids}，批次: {batch_id}")
+                batch_dir = os.path.join(BATCH_DIR, batch_id)
+                input_dir = os.path.join(batch_dir, 'input')
+                os.makedirs(input_dir, exist_ok=True)
+                if asset.is_local:
+                    output_dir = os.path.join(batch_dir, 'output')
+                else:
+                    output_dir = f"{Config.REMOTE_MARKED_DIR}/batch_{batch_id}"
+
+                mark_config = None
+                for task in tasks:
+                    others = ', '.join(str(task_id) for task_id in task_ids if task_id != task.id)
+                    task.update_status(
+                        TaskStatus.MARKING, f'开始批量打标（与任务 {others} 合并执行），使用资产: {asset.name}', db=db
+                    )
+                    task_config = MarkingService._load_mark_config(task.id)
+                    source_dir = os.path.join(Config.UPLOAD_DIR, str(task.id))
+                    if not asset.is_local:
+                        source_dir = MarkingService._preprocess_images(task, source_dir, task_config, db)
+                    prefix = f"t{task.id}__"
+                    for name in os.listdir(source_dir):
+                        if os.path.isfile(os.path.join(source_dir, name)):
+                            link_or_copy(os.path.join(source_dir, name), os.path.join(input_dir, prefix + name))
+
+                    if mark_config is None:
+                        mark_config = dict(task_config)
+                    if not asset.is_local:
+                        task_config['remote_output_dir'] = output_dir
+                    task_config['batch'] = {
+                        'id': batch_id,
+                        'task_ids': task_ids,
+                        'asset_id': asset_id,
+                        'output_dir': output_dir,
+                        'prefix': prefix
+                    }
+                    task.mark_config = task_config
+                    task.add_log(f'批量打标批次: {batch_id}, 输出目录: {task.marked_images_path}', db)
+                db.commit()
+
+                if not asset.is_local:
+                    remote_input_dir = MarkingService._batch_remote_input_dir(batch_id)
+                    ssh_client = create_ssh_client_from_asset(asset)
+                    success, message, stats = ssh_client.upload_directory(
+                        local_path=input_dir,
+                        remote_path=remote_input_dir
+                    )
+                    if not success:
+                        raise Exception(f"同步图片失败: {message}")
+                    for task in tasks:
+                        task.add_log(f'批量打标图片同步成功: {message}', db)
+                    input_dir = remote_input_dir
+
+                config = MarkConfig(input_folder=input_dir, output_folder=output_dir)
+                copy_attributes(mark_config, config)
+                # 触发词在拆分结果时按任务添加
+                config.trigger_words = ''
+                prompt_id = MarkRequestHandler(asset).mark_request(config)
+                if not prompt_id:
+                    raise ValueError("创建标记任务失败，未获取到prompt_id")
+
+                for task in tasks:
+                    task.prompt_id = prompt_id
+                    task.add_log(f'批量标记任务创建成功，prompt_id={prompt_id}', db=db)
+                db.commit()
+                return prompt_id
+
+        except Exception as e:
+            logger.error(f"批量标记任务 {task_ids} 处理失败: {str(e)}", exc_info=True)
+            with get_db() as db:
+                for task in db.query(Task).filter(Task.id.in_(task_ids)).all():
+                    task.update_status(TaskStatus.ERROR, f'批量标记处理失败: {str(e)}', db=db)
                     task.add_log(json.dumps({
                         "message": str(e),
                         "type": type(e).__name__,
                         "traceback": str(traceback.format_exc())
                     }, indent=2), db=db)
                     if task.marking_asset:
-                        task.marking_asset.marking_tasks_count = max(0, task.marking_asset.marking_tasks_count - 1)
-                        db.commit() 
\ No newline at end of file
+                        ClaimService.release_asset_slot(db, task.marking_asset_id, 'marking')
+                db.commit()
+                SchedulerEvents.notify('marking_asset_released')
+                MarkingService._cleanup_batch(
+                    db, {'id': batch_id, 'asset_id': asset_id,
+                         'output_dir': f"{Config.REMOTE_MARKED_DIR}/batch_{batch_id}"}
+                )
+            raise
+
+    @staticmethod
+    def _batch_remote_input_dir(batch_id: str) -> str:
+        return f"{Config.REMOTE_UPLOAD_DIR}/batch_{batch_id}"
+
+    @staticmethod
+    def _cleanup_batch(db: Session, batch: Dict):
+        """删除批次的本地目录（合并输入、本地输出和各任务拆分目录）以及远程资产上的输入、输出目录"""
+        shutil.rmtree(os.path.join(BATCH_DIR, batch['id']), ignore_errors=True)
+        asset = db.query(Asset).filter(Asset.id == batch.get('asset_id')).first()
+        if not asset or asset.is_local:
+            return
+        try:
+            result = create_ssh_client_from_asset(asset).remove_directories(
+                [MarkingService._batch_remote_input_dir(batch['id']), batch['output_dir']]
+            )
+            if result.returncode != 0:
+                logger.warning(f"清理批次 {batch['id']} 的远程目录失败: {result.stderr}")
+        except Exception as e:
+            logger.warning(f"清理批次 {batch['id']} 的远程目录失败: {str(e)}")
+
+    @staticmethod
+    def _release_batch_member(task_id: int):
+        """
+        批次中的任务已取出结果或离开打标状态，批次中已没有仍在打标的任务时清理批次目录
+        """
+        with MarkingService._batch_lock, get_db() as db:
+            task = db.query(Task).filter(Task.id == task_id).first()
+            batch = (task.mark_config or {}).get('batch') if task else None
+            if not batch or task.status == TaskStatus.MARKING:
+                return
+            members = db.query(Task).filter(
+                Task.id.in_(batch['task_ids']),
+                Task.status == TaskStatus.MARKING
+            ).all()
+            # 重新打标的任务已属于其他批次
+            if any(((member.mark_config or {}).get('batch') or {}).get('id') == batch['id'] for member in members):
+                return
+            logger.info(f"批次 {batch['id']} 的任务均已结束，清理批次目录")
+            MarkingService._cleanup_batch(db, batch)
+
+    @staticmethod
+    def _collect_batch_output(task: Task, asset: Asset) -> Tuple[bool, str]:
+        """
+        从批量打标的合并输出中取出本任务的结果：去掉文件名前缀移动到 marked_images_path，标注加上触发词
+
+        Returns:
+            (是否成功, 说明)
+        """
+        batch = task.mark_config['batch']
+        prefix = batch['prefix']
+        if asset.is_local:
+            source_dir = batch['output_dir']
+        else:
+            # 只下载本任务的文件
+            source_dir = os.path.join(BATCH_DIR, batch['id'], 'tasks', str(task.id))
+            success, message, stats = create_ssh_client_from_asset(asset).download_directory(
+                remote_path=batch['output_dir'],
+                local_path=source_dir,
+                recursive=False,
+                include=lambda rel_path, info: rel_path.startswith(prefix)
+            )
+            if not success:
+                return False, message
+
+        trigger_words = (task.mark_config.get('trigger_words') or '').strip()
+        os.makedirs(task.marked_images_path, exist_ok=True)
+        count = 0
+        for name in os.listdir(source_dir):
+            if not name.startswith(prefix):
+                continue
+            source = os.path.join(source_dir, name)
+            target = os.path.join(task.marked_images_path, name[len(prefix):])
+            if name.endswith('.txt'):
+                with open(source, 'r', encoding='utf-8') as f:
+                    # 工作流的触发词为空，标注以分隔符开头
+                    caption = f.read().lstrip(', ').strip()
+                with open(target, 'w', encoding='utf-8') as f:
+                    f.write(f"{trigger_words}, {caption}" if trigger_words else caption)
+                os.remove(source)
+            else:
+                shutil.move(source, target)
+            count += 1
+        if count == 0:
+            return False, '批量打标结果中没有本任务的文件'
+        return True, f'从批量打标结果中拆分出 {count} 个文件'
+
+    @staticmethod
+    def _update_mark_progress(task_id: int, progress: int, asset_id: Optional[int] = None):
+        """
+        更新打标进度（来自ComfyUI的实时推送），任务已离开打标状态时不更新
+
+        Args:
+            task_id: 任务ID
+            progress: 进度百分比
+            asset_id: 推送进度的资产ID，分片任务按各分片进度的平均值更新
+        """
+        shard_progress = MarkingService._shard_progress.get(task_id)
+        if shard_progress is not None and asset_id in shard_progress:
+            shard_progress[asset_id] = progress
+            progress = min(99, sum(shard_progress.values()) // len(shard_progress))
+        try:
+            with get_db() as db:
+                db.query(Task).filter(
+                    Task.id == task_id,
+                    Task.status == TaskStatus.MARKING
+                ).update({Task.progress: progress}, synchronize_session=False)
+                db.commit()
+        except Exception as e:
+            logger.error(f"更新任务 {task_id} 打标进度失败: {str(e)}")
+
+    @staticmethod
+    def _handle_mark_status(task_id: int, asset_id: int, completed: bool, success: bool, task_info: Dict) -> bool:
+        """
+        处理一次标记任务状态检查的结果
+        
+        Args:
+            task_id: 任务ID
+            asset_id: 资产ID
+            completed: 是否已完成
+            success: 是否成功
+            task_info: 状态详情
+            
+        Returns:
+            是否结束监控（任务已完成、失败或不再处于标记状态）
+        """
+        with get_db() as complete_db:
+            task = complete_db.query(Task).filter(Task.id == task_id).first()
+            # 可能在打标过程中取消了任务，不再继续监听
+            if not task or task.status != TaskStatus.MARKING:
+                logger.info("任务状态为非打标状态，退出监听")
+                return True
+            
+            if not completed:
+                return False
+            
+            if MarkingService._get_shards(task):
+                return MarkingService._handle_shard_status(complete_db, task, asset_id, success, task_info)
+            
+            if success:
+                asset = complete_db.query(Asset).filter(Asset.id == asset_id).first()
+                if asset and task.mark_config and task.mark_config.get('batch'):
+                    collected, message = MarkingService._collect_batch_output(task, asset)
+                    if not collected:
+                        task.add_log(f'拆分批量打标结果失败: {message}', db=complete_db)
+                        task.update_status(TaskStatus.ERROR, f'拆分批量打标结果失败: {message}', db=complete_db)
+                        MarkingService._release_batch_member(task_id)
+                        return True
+                    task.add_log(f'批量打标结果拆分成功: {message}', db=complete_db)
+                # 如果是非本地资产，需要下载结果
+                elif asset and not asset.is_local and task.mark_config and task.mark_config.get('remote_output_dir'):
+                    task.add_log('打标完成，开始从远程服务器同步结果...', db=complete_db)
+                    
+                    # 创建SSH客户端工具
+                    ssh_client = create_ssh_client_from_asset(asset)
+                    # 下载打标结果
+                    success, message, stats = ssh_client.download_directory(
+                        local_path=task.marked_images_path,
+                        remote_path=task.mark_config['remote_output_dir']
+                    )
+                    
+                    if not success:
+                        task.add_log(f'同步结果失败: {message}', db=complete_db)
+                        task.update_status(TaskStatus.ERROR, f'同步打标结果失败: {message}', db=complete_db)
+                        return True
+                    
+                    task.add_log(f'打标结果同步成功: {message}', db=complete_db)
+                
+                MarkingService._finish_marking(task, complete_db)
+            else:
+                # 处理失败情况
+                error_info = task_info.get("error_info", {})
+                task.update_status(
+                    TaskStatus.ERROR,
+                    f'标记失败: {error_info.get("error_message")}',
+                    db=complete_db
+                )
+                MarkingService._log_mark_error(task, task_info, complete_db)
+            
+            # 更新资产任务计数
+            if task.marking_asset:
+                ClaimService.release_asset_slot(complete_db, task.marking_asset_id, 'marking')
+                complete_db.commit()
+                SchedulerEvents.notify('marking_asset_released')
+            if task.mark_config and task.mark_config.get('batch'):
+                MarkingService._release_batch_member(task_id)
+            return True
+    
+    @staticmethod
+    def _finish_marking(task: Task, db: Session):
+        """打标结果已就绪，任务置为已标记，启用自动训练时进入训练状态"""
+        task.update_status(TaskStatus.MARKED, '标记完成', db=db)
+        task.progress = 100
+        task.add_log('标记任务成功完成', db=db)
+        
+        # 检查是否自动开始训练
+        if task.auto_training:
+            logger.info(f"任务 {task.id} 启用自动训练，将自动开始训练流程")
+            task.add_log('启用自动训练，设置状态为训练中，等待调度器分配资产', db=db)
+            task.update_status(TaskStatus.TRAINING, '准备开始训练', db=db)
+            SchedulerEvents.notify('training_submitted')
+        else:
+            task.add_log('未启用自动训练，请手动提交训练任务', db=db)
+
+    @staticmethod
+    def _log_mark_error(task: Task, task_info: Dict, db: Session):
+        """记录ComfyUI返回的打标错误详情"""
+        error_info = task_info.get("error_info", {})
+        task.add_log(json.dumps({
+            "message": error_info.get("error_message"),
+            "type": error_info.get("error_type"),
+            "node": error_info.get("node_type"),
+            "details": {
+                "inputs": error_info.get("inputs"),
+                "traceback": error_info.get("traceback")
+            }
+        }, indent=2), db=db)
+
+    @staticmethod
+    def _get_shards(task: Task) -> List[Dict]:
+        """获取打标中任务的分片信息（副本），未分片时返回空列表"""
+        if task.status != TaskStatus.MARKING or not task.mark_config:
+            return []
+        return [dict(shard) for shard in task.mark_config.get('shards') or []]
+
+    @staticmethod
+    def _save_shards(task: Task, shards: List[Dict]):
+        # 重新赋值整个字典，确保SQLAlchemy检测到变化
+        task.mark_config = {**(task.mark_config or {}), 'shards': shards}
+
+    @staticmethod
+    def _release_shards(db: Session, task: Task, asset_ids: Optional[List[int]] = None,
+                        interrupt: bool = False) -> int:
+        """
+        取消仍在执行的分片并释放额外分片资产的槽位，任务分配的资产由调用方按原有流程释放。
+        处理全部分片时同时清理分片的本地和远程目录
+
+        Args:
+            asset_ids: 只处理这些资产上的分片，为空时处理全部分片
+            interrupt: 是否中断额外分片资产上正在执行的打标
+
+        Returns:
+            释放的槽位数，调用方负责提交
+        """
+        shards = MarkingService._get_shards(task)
+        if not shards:
+            return 0
+        released = 0
+        for shard in shards:
+            if shard['status'] not in ('pending', 'marking'):
+                continue
+            if asset_ids is not None and shard['asset_id'] not in asset_ids:
+                continue
+            shard['status'] = 'cancelled'
+            if shard['asset_id'] == task.marking_asset_id:
+                continue
+            if interrupt:
+                asset = db.query(Asset).filter(Asset.id == shard['asset_id']).first()
+                if asset:
+                    MarkRequestHandler(asset).interrupt()
+            ClaimService.release_asset_slot(db, shard['asset_id'], 'marking')
+            released += 1
+        MarkingService._save_shards(task, shards)
+        if asset_ids is None:
+            MarkingService._shard_progress.pop(task.id, None)
+            MarkingService._cleanup_shards(db, task.id, shards)
+        return released
+
+    @staticmethod
+    def _handle_shard_status(db: Session, task: Task, asset_id: int, success: bool, task_info: Dict) -> bool:
+        """
+        处理一个分片的完成结果：下载合并分片结果并释放额外分片资产，全部分片完成后任务置为已标记并清理分片目录，
+        任一分片失败时取消其余分片，任务置为错误状态
+
+        Returns:
+            是否结束该分片的监控
+        """
+        shard = next((s for s in MarkingService._get_shards(task) if s['asset_id'] == asset_id), None)
+        if not shard or shard['status'] != 'marking':
+            return True
+        index = shard['index']
+
+        error_message = None
+        if success:
+            asset = db.query(Asset).filter(Asset.id == asset_id).first()
+            if asset and not asset.is_local:
+                task.add_log(f'分片{index}打标完成，开始从远程服务器同步结果...', db=db)
+                ssh_client = create_ssh_client_from_asset(asset)
+                # 各分片的结果文件名不重复，直接下载到同一输出目录
+                synced, message, stats = ssh_client.download_directory(
+                    local_path=task.marked_images_path,
+                    remote_path=shard['remote_output_dir']
+                )
+                if synced:
+                    task.add_log(f'分片{index}打标结果同步成功: {message}', db=db)
+                else:
+                    error_message = f'同步分片{index}打标结果失败: {message}'
+        else:
+            error_message = f'分片{index}标记失败: {task_info.get("error_info", {}).get("error_message")}'
+            MarkingService._log_mark_error(task, task_info, db)
+
+        with MarkingService._shard_lock:
+            db.refresh(task)
+            # 其他分片失败或任务被终止时不再处理
+            shards = MarkingService._get_shards(task)
+            shard = next((s for s in shards if s['asset_id'] == asset_id), None)
+            if not shard or shard['status'] != 'marking':
+                return True
+
+            shard['status'] = 'error' if error_message else 'done'
+            if asset_id != task.marking_asset_id:
+                ClaimService.release_asset_slot(db, asset_id, 'marking')
+            MarkingService._save_shards(task, shards)
+
+            finished = True
+            if error_message:
+                MarkingService._release_shards(db, task, interrupt=True)
+                task.update_status(TaskStatus.ERROR, error_message, db=db)
+            else:
+                done = sum(1 for s in shards if s['status'] == 'done')
+                task.add_log(f'分片{index}完成 ({done}/{len(shards)})', db=db)
+                finished = done == len(shards)
+                if finished:
+                    MarkingService._shard_progress.pop(task.id, None)
+                    MarkingService._finish_marking(task, db)
+                else:
+                    shard_progress = MarkingService._shard_progress.get(task.id)
+                    if shard_progress is not None:
+                        shard_progress[asset_id] = 100
+                        task.progress = min(99, sum(shard_progress.values()) // len(shard_progress))
+
+            # 任务结束时释放任务分配的资产
+            if finished and task.marking_asset:
+                ClaimService.release_asset_slot(db, task.marking_asset_id, 'marking')
+            db.commit()
+            SchedulerEvents.notify('marking_asset_released')
+
+        # 失败时已在取消其余分片时清理
+        if finished and not error_message:
+            MarkingService._cleanup_shards(db, task.id, shards)
+        return True
+
+    @staticmethod
+    def _handle_shard_cancelled(task_id: int, asset_id: int):
+        """分片监控因任务状态变化退出时，释放该分片仍占用的资产槽位"""
+        with MarkingService._shard_lock, get_db() as db:
+            task = db.query(Task).filter(Task.id == task_id).first()
+            if not task or not task.mark_config or not task.mark_config.get('shards'):
+                return
+            # 任务已离开打标状态，按保存的分片状态释放
+            shards = [dict(shard) for shard in task.mark_config['shards']]
+            shard = next((s for s in shards if s['asset_id'] == asset_id), None)
+            if not shard or shard['status'] not in ('pending', 'marking'):
+                return
+            shard['status'] = 'cancelled'
+            task.mark_config = {**task.mark_config, 'shards': shards}
+            if asset_id != task.marking_asset_id:
+                ClaimService.release_asset_slot(db, asset_id, 'marking')
+            db.commit()
+            SchedulerEvents.notify('marking_asset_released')
+            # 最后一个分片退出后清理分片目录
+            if not any(s['status'] in ('pending', 'marking') for s in shards):
+                MarkingService._cleanup_shards(db, task_id, shards)
+    
+    @staticmethod
+    def _handle_mark_check_error(task_id: int, error_count: int, check_err: Exception, max_retries: int = 3) -> bool:
+        """
+        处理检查标记状态时的错误
+        
+        Returns:
+            是否结束监控（连续失败次数达到上限）
+        """
+        with get_db() as err_db:
+            task = err_db.query(Task).filter(Task.id == task_id).first()
+            if task:
+                task.add_log(f'检查任务状态出错 ({error_count}/{max_retries}): {str(check_err)}', db=err_db)
+            if error_count < max_retries:
+                return False
+            
+            if task:
+                MarkingService._release_shards(err_db, task)
+                task.update_status(TaskStatus.ERROR, f'连续{max_retries}次检查状态失败，停止监控: {str(check_err)}', db=err_db)
+                if task.marking_asset:
+                    ClaimService.release_asset_slot(err_db, task.marking_asset_id, 'marking')
+                    err_db.commit()
+                    SchedulerEvents.notify('marking_asset_released')
+        MarkingService._release_batch_member(task_id)
+        return True
+    
+    @staticmethod
+    def _handle_mark_monitor_failure(task_id: int, e: Exception):
+        """处理监控过程中的意外异常，将任务置为错误状态并释放资产"""
+        logger.error(f"监控标记任务状态失败: {str(e)}")
+        with get_db() as db:
+            task = db.query(Task).filter(Task.id == task_id).first()
+            if task:
+                MarkingService._release_shards(db, task)
+                task.update_status(TaskStatus.ERROR, f'监控失败: {str(e)}', db=db)
+                task.add_log(json.dumps({
+                    "message": str(e),
+                    "type": type(e).__name__,
+                    "traceback": str(traceback.format_exc())
+                }, indent=2), db=db)
+                if task.marking_asset:
+                    ClaimService.release_asset_slot(db, task.marking_asset_id, 'marking')
+                    db.commit()
+                    SchedulerEvents.notify('marking_asset_released')
+        MarkingService._release_batch_member(task_id)
@@ -0,0 +1,294 @@
+from typing import List, Dict, Optional, Set
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from ...models.task import Task, TaskExecutionHistory, TaskStatusHistory, TaskStatus
+from ...models.asset import Asset
+from ...database import get_db
+from ...utils.logger import setup_logger
+from ...services.config_service import ConfigService
+
+logger = setup_logger('placement_service')
+
+# 统计历史记录的时间窗口（天）
+HISTORY_WINDOW_DAYS = 30
+
+
+class AssetSlot:
+    """一轮调度内单个资产的容量快照"""
+
+    def __init__(self, asset_id: int, capacity: int, running: int, order: int = 0):
+        self.asset_id = asset_id
+        self.capacity = capacity
+        self.running = running
+        self.order = order
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.capacity - self.running)
+
+    @property
+    def load(self) -> float:
+        """当前负载比例，0表示空闲"""
+        return self.running / self.capacity if self.capacity else 1.0
+
+
+class AssetHistoryStats:
+    """资产历史执行统计"""
+
+    def __init__(self, completed: int = 0, failed: int = 0, avg_duration: Optional[float] = None):
+        self.completed = completed
+        self.failed = failed
+        self.avg_duration = avg_duration
+
+    @property
+    def success_rate(self) -> float:
+        """成功率，无历史时按1.0处理"""
+        total = self.completed + self.failed
+        return self.completed / total if total else 1.0
+
+
+class PlacementStrategy:
+    """资产放置策略基类，score越小越优先"""
+    name = ''
+
+    def score(self, task: Task, slot: AssetSlot, stats: Dict[int, AssetHistoryStats]) -> float:
+        raise NotImplementedError
+
+    def select(self, task: Task, slots: List[AssetSlot], stats: Dict[int, AssetHistoryStats]) -> Optional[int]:
+        """从有空闲槽位的资产中选出得分最低的资产，得分相同时保持资产原有顺序"""
+        candidates = [slot for slot in slots if slot.remaining > 0]
+        if not candidates:
+            return None
+        best = min(candidates, key=lambda slot: (self.score(task, slot, stats), slot.order))
+        return best.asset_id
+
+
+class FirstAvailableStrategy(PlacementStrategy):
+    """第一个可用资产（原有行为）"""
+    name = 'first_available'
+
+    def score(self, task, slot, stats):
+        return 0
+
+
+class LeastLoadedStrategy(PlacementStrategy):
+    """选择负载比例最低的资产"""
+    name = 'least_loaded'
+
+    def score(self, task, slot, stats):
+        return slot.load
+
+
+class DataLocalityStrategy(LeastLoadedStrategy):
+    """优先选择已持有任务数据的资产（打标资产），训练时可以跳过打标结果的同步"""
+    name = 'data_locality'
+
+    def select(self, task, slots, stats):
+        local_asset_id = getattr(task, 'marking_asset_id', None)
+        if local_asset_id:
+            for slot in slots:
+                if slot.asset_id == local_asset_id and slot.remaining > 0:
+                    return slot.asset_id
+        return super().select(task, slots, stats)
+
+
+class WeightedThroughputStrategy(PlacementStrategy):
+    """按历史平均耗时和成功率估算任务完成时间，选择预计最快完成的资产"""
+    name = 'weighted_throughput'
+
+    def score(self, task, slot, stats):
+        asset_stats = stats.get(slot.asset_id)
+        known = [s.avg_duration for s in stats.values() if s.avg_duration]
+        # 没有历史的资产按已知资产的平均耗时估算，避免新资产永远不被选中
+        default_duration = sum(known) / len(known) if known else 1.0
+        duration = asset_stats.avg_duration if asset_stats and asset_stats.avg_duration else default_duration
+        success_rate = max(asset_stats.success_rate if asset_stats else 1.0, 0.1)
+        # 已有任务会与新任务分享资产算力，排队越多预计完成越晚
+        return (slot.running + 1) / max(slot.capacity, 1) * duration / success_rate
+
+
+PLACEMENT_STRATEGIES: Dict[str, PlacementStrategy] = {
+    strategy.name: strategy for strategy in [
+        FirstAvailableStrategy(),
+        LeastLoadedStrategy(),
+        DataLocalityStrategy(),
+        WeightedThroughputStrategy(),
+    ]
+}
+
+DEFAULT_STRATEGY = 'least_loaded'
+
+
+class PlacementPlan:
+    """
+    一轮调度的资产放置计划
+
+    持有本轮可用资产的容量快照和历史统计，每次分配后在本地扣减容量，
+    同一轮内无需重复查询资产。
+    """
+
+    def __init__(self, kind: str, slots: List[AssetSlot], strategy: PlacementStrategy,
+                 stats: Optional[Dict[int, AssetHistoryStats]] = None):
+        self.kind = kind
+        self.slots = slots
+        self.strategy = strategy
+        self.stats = stats or {}
+
+    def choose(self, task: Task) -> Optional[int]:
+        """为任务选择资产，没有可用资产时返回None"""
+        return self.strategy.select(task, self.slots, self.stats)
+
+    def choose_idle(self, task: Task, exclude: Set[int]) -> Optional[int]:
+        """为任务的分片选择额外资产，只选择没有运行任务的资产，不占用其他任务可用的槽位"""
+        idle = [slot for slot in self.slots if slot.running == 0 and slot.asset_id not in exclude]
+        return self.strategy.select(task, idle, self.stats)
+
+    def _get_slot(self, asset_id: int) -> Optional[AssetSlot]:
+        return next((slot for slot in self.slots if slot.asset_id == asset_id), None)
+
+    def get_capacity(self, asset_id: int) -> int:
+        """资产的最大并发任务数"""
+        slot = self._get_slot(asset_id)
+        return slot.capacity if slot else 0
+
+    def assign(self, asset_id: int):
+        """记录资产已分配一个任务"""
+        slot = self._get_slot(asset_id)
+        if slot:
+            slot.running += 1
+
+    def exclude(self, asset_id: int):
+        """本轮不再使用该资产（如资产已被删除）"""
+        slot = self._get_slot(asset_id)
+        if slot:
+            slot.capacity = 0
+
+    def has_capacity(self) -> bool:
+        return any(slot.remaining > 0 for slot in self.slots)
+
+
+class PlacementService:
+    """资产放置服务"""
+
+    @staticmethod
+    def get_strategy(name: Optional[str] = None) -> PlacementStrategy:
+        """
+        获取放置策略
+
+        Args:
+            name: 策略名称，为空时读取设置 asset_placement_strategy
+        """
+        if not name:
+            name = ConfigService.get_value('asset_placement_strategy', DEFAULT_STRATEGY)
+        strategy = PLACEMENT_STRATEGIES.get(name)
+        if not strategy:
+            logger.warning(f"未知的资产放置策略 {name}，使用默认策略 {DEFAULT_STRATEGY}")
+            strategy = PLACEMENT_STRATEGIES[DEFAULT_STRATEGY]
+        return strategy
+
+    @staticmethod
+    def build_slots(assets: List[Asset], kind: str, max_tasks: int) -> List[AssetSlot]:
+        """
+        根据可用资产计算容量快照
+
+        Args:
+            assets: 可用资产列表
+            kind: marking 或 training
+            max_tasks: 单个资产的最大并发任务数
+        """
+        count_field = 'marking_tasks_count' if kind == 'marking' else 'training_tasks_count'
+        slots = []
+        for order, asset in enumerate(assets):
+            capacity = max_tasks
+            if asset.max_concurrent_tasks:
+                capacity = min(capacity, asset.max_concurrent_tasks)
+            slots.append(AssetSlot(asset.id, capacity, getattr(asset, count_field) or 0, order))
+        return slots
+
+    @staticmethod
+    def load_history_stats(kind: str, asset_ids: List[int]) -> Dict[int, AssetHistoryStats]:
+        """
+        从执行历史中统计各资产的完成数、失败数和平均耗时
+
+        训练统计来自 TaskExecutionHistory；执行历史只在训练阶段创建，
+        打标耗时取自 TaskStatusHistory 中的 MARKING 阶段，并按 TaskExecutionHistory
+        中记录的打标资产统计成功和失败次数。
+        """
+        stats: Dict[int, AssetHistoryStats] = {}
+        if not asset_ids:
+            return stats
+
+        since = datetime.now() - timedelta(days=HISTORY_WINDOW_DAYS)
+        asset_column = TaskExecutionHistory.marking_asset_id if kind == 'marking' \
+            else TaskExecutionHistory.training_asset_id
+
+        try:
+            with get_db() as db:
+                rows = db.query(
+                    asset_column, TaskExecutionHistory.status, func.count(TaskExecutionHistory.id)
+                ).filter(
+                    asset_column.in_(asset_ids),
+                    TaskExecutionHistory.end_time.isnot(None),
+                    TaskExecutionHistory.start_time >= since
+                ).group_by(asset_column, TaskExecutionHistory.status).all()
+
+                for asset_id, status, count in rows:
+                    asset_stats = stats.setdefault(asset_id, AssetHistoryStats())
+                    if status == 'COMPLETED':
+                        asset_stats.completed += count
+                    else:
+                        asset_stats.failed += count
+
+                if kind == 'marking':
+                    durations = db.query(
+                        Task.marking_asset_id, TaskStatusHistory.start_time, TaskStatusHistory.end_time
+                    ).join(
+                        TaskStatusHistory, TaskStatusHistory.task_id == Task.id
+                    ).filter(
+                        Task.marking_asset_id.in_(asset_ids),
+                        TaskStatusHistory.status == TaskStatus.MARKING.value,
+                        TaskStatusHistory.end_time.isnot(None),
+                        TaskStatusHistory.start_time >= since
+                    ).all()
+                else:
+                    durations = db.query(
+                        TaskExecutionHistory.training_asset_id,
+                        TaskExecutionHistory.start_time,
+                        TaskExecutionHistory.end_time
+                    ).filter(
+                        TaskExecutionHistory.training_asset_id.in_(asset_ids),
+                        TaskExecutionHistory.status == 'COMPLETED',
+                        TaskExecutionHistory.end_time.isnot(None),
+                        TaskExecutionHistory.start_time >= since
+                    ).all()
+
+                totals: Dict[int, List[float]] = {}
+                for asset_id, start_time, end_time in durations:
+                    seconds = (end_time - start_time).total_seconds()
+                    if seconds > 0:
+                        totals.setdefault(asset_id, []).append(seconds)
+                for asset_id, values in totals.items():
+                    stats.setdefault(asset_id, AssetHistoryStats()).avg_duration = sum(values) / len(values)
+        except Exception as e:
+            logger.error(f"统计资产执行历史失败: {str(e)}")
+
+        return stats
+
+    @staticmethod
+    def create_plan(kind: str, assets: List[Asset], max_tasks: int,
+                    strategy_name: Optional[str] = None) -> PlacementPlan:
+        """
+        创建一轮调度的放置计划
+
+        Args:
+            kind: marking 或 training
+            assets: 可用资产列表
+            max_tasks: 单个资产的最大并发任务数
+            strategy_name: 策略名称，为空时读取设置
+        """
+        strategy = PlacementService.get_strategy(strategy_name)
+        slots = PlacementService.build_slots(assets, kind, max_tasks)
+        stats = {}
+        if isinstance(strategy, WeightedThroughputStrategy):
+            stats = PlacementService.load_history_stats(kind, [slot.asset_id for slot in slots])
+        return PlacementPlan(kind, slots, strategy, stats)
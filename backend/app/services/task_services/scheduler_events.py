@@ -0,0 +1,134 @@
+import threading
+import time
+from typing import List, Optional
+from sqlalchemy.exc import IntegrityError
+from ...config import Config
+from ...database import get_db
+from ...models.scheduler_signal import SchedulerSignal
+from ...utils.logger import setup_logger
+
+logger = setup_logger('scheduler_events')
+
+# 跨进程唤醒信号的名称
+WAKEUP_SIGNAL = 'scheduler_wakeup'
+
+
+class SchedulerEvents:
+    """
+    调度器唤醒通道
+
+    任务提交、资产释放等会影响调度结果的事件发生时调用 notify，
+    调度循环会立即醒来执行一次调度，而不必等待下一次兜底轮询。
+
+    本进程未运行调度循环时（纯API模式的Web进程），notify 改为递增数据库中的唤醒信号序号，
+    独立调度进程在等待期间每隔 scheduler_signal_poll_interval 秒检查一次序号，变化时立即醒来。
+    """
+    _event = threading.Event()
+    _lock = threading.Lock()
+    _reasons: List[str] = []
+    _notify_count = 0
+    # 本进程是否运行调度循环
+    _local_scheduler = False
+    # 最近一次读取的跨进程唤醒信号序号
+    _remote_seq: Optional[int] = None
+
+    @staticmethod
+    def set_local_scheduler(running: bool):
+        """调度循环启动和停止时调用，决定 notify 在进程内唤醒还是写入跨进程信号"""
+        SchedulerEvents._local_scheduler = running
+        SchedulerEvents._remote_seq = None
+
+    @staticmethod
+    def notify(reason: str = 'unknown'):
+        """
+        唤醒调度循环
+
+        Args:
+            reason: 唤醒原因，仅用于日志
+        """
+        with SchedulerEvents._lock:
+            SchedulerEvents._reasons.append(reason)
+            SchedulerEvents._notify_count += 1
+        SchedulerEvents._event.set()
+        if not SchedulerEvents._local_scheduler:
+            SchedulerEvents._publish()
+        logger.debug(f"调度器唤醒通知: {reason}")
+
+    @staticmethod
+    def _publish():
+        """递增跨进程唤醒信号序号，失败只记录日志，调度进程仍会在兜底轮询时处理"""
+        try:
+            with get_db() as db:
+                updated = db.query(SchedulerSignal).filter(SchedulerSignal.name == WAKEUP_SIGNAL).update(
+                    {SchedulerSignal.seq: SchedulerSignal.seq + 1}, synchronize_session=False
+                )
+                if not updated:
+                    db.add(SchedulerSignal(name=WAKEUP_SIGNAL, seq=1))
+                try:
+                    db.commit()
+                except IntegrityError:
+                    # 其他进程同时创建了信号行
+                    db.rollback()
+                    db.query(SchedulerSignal).filter(SchedulerSignal.name == WAKEUP_SIGNAL).update(
+                        {SchedulerSignal.seq: SchedulerSignal.seq + 1}, synchronize_session=False
+                    )
+                    db.commit()
+        except Exception as e:
+            logger.warning(f"写入跨进程调度唤醒信号失败: {str(e)}")
+
+    @staticmethod
+    def _remote_notified() -> bool:
+        """跨进程唤醒信号序号是否变化，首次读取只记录序号"""
+        try:
+            with get_db() as db:
+                signal = db.query(SchedulerSignal.seq).filter(SchedulerSignal.name == WAKEUP_SIGNAL).first()
+        except Exception as e:
+            logger.warning(f"读取跨进程调度唤醒信号失败: {str(e)}")
+            return False
+        seq = signal[0] if signal else 0
+        previous = SchedulerEvents._remote_seq
+        SchedulerEvents._remote_seq = seq
+        return previous is not None and seq != previous
+
+    @staticmethod
+    def wait(timeout: Optional[float] = None, coalesce: float = 0.0) -> List[str]:
+        """
+        等待唤醒通知或超时
+
+        Args:
+            timeout: 最长等待时间（秒），None表示一直等待
+            coalesce: 被唤醒后额外等待的时间（秒），用于合并短时间内的连续通知
+
+        Returns:
+            本次等待期间收到的唤醒原因列表，超时返回空列表
+        """
+        poll_interval = Config.SYSTEM_CONFIG.get('scheduler_signal_poll_interval', 2)
+        if SchedulerEvents._local_scheduler and poll_interval > 0:
+            # 分段等待，每段结束时检查其他进程写入的唤醒信号
+            SchedulerEvents._remote_notified()
+            deadline = None if timeout is None else time.time() + timeout
+            woken = False
+            while not woken:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                woken = SchedulerEvents._event.wait(poll_interval if remaining is None else min(poll_interval, remaining))
+                if not woken and SchedulerEvents._remote_notified():
+                    with SchedulerEvents._lock:
+                        SchedulerEvents._reasons.append('remote_notify')
+                    woken = True
+        else:
+            woken = SchedulerEvents._event.wait(timeout)
+        if woken and coalesce > 0:
+            time.sleep(coalesce)
+
+        with SchedulerEvents._lock:
+            SchedulerEvents._event.clear()
+            reasons = SchedulerEvents._reasons
+            SchedulerEvents._reasons = []
+        return reasons
+
+    @staticmethod
+    def get_notify_count() -> int:
+        """获取累计收到的唤醒通知次数"""
+        return SchedulerEvents._notify_count
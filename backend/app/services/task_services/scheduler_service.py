@@ -3,27 +3,34 @@ from datetime import datetime
 from sqlalchemy.orm import Session
 from ...models.task import Task, TaskStatus
 from ...models.asset import Asset
+from ...models.task_lease import TaskLease
 from ...database import get_db
 from ...utils.logger import setup_logger
 import threading
 import traceback
 from .marking_service import MarkingService
 from .training_service import TrainingService
+from .scheduler_events import SchedulerEvents
+from .placement_service import PlacementService, PlacementPlan
+from .claim_service import ClaimService
+from .status_poller import StatusPollerService
+from ...services.config_service import ConfigService
 import time
 import os
 from concurrent.futures import ThreadPoolExecutor
+from ...config import Config
 
 logger = setup_logger('scheduler_service')
 scheduler_lock = threading.Lock()
 scheduler_thread = None
 scheduler_running = False
 
-# 添加线程池用于监控任务
-monitor_pool = ThreadPoolExecutor(max_workers=5, thread_name_prefix="MonitorWorker")
+# 派发线程池，执行任务的上传和提交，避免慢资产阻塞其他任务的派发
+dispatch_pool = ThreadPoolExecutor(
+    max_workers=Config.SYSTEM_CONFIG.get('dispatch_workers', 8),
+    thread_name_prefix="DispatchWorker"
+)
 
-# 添加一个任务处理中的标记集合
-_processing_task_ids = set()
-_processing_lock = threading.Lock()
 
 class SchedulerService:
 
@@ -51,20 +58,21 @@ class SchedulerService:
             return submitted_tasks, training_tasks
     
     @staticmethod
-    def process_task(task: Task):
+    def process_task(task: Task, plan: Optional[PlacementPlan] = None):
         """
         根据任务状态处理单个任务
         
         Args:
             task: 任务对象
+            plan: 本轮调度的资产放置计划，为空时单独查询可用资产
         """
         try:
             if task.status == TaskStatus.SUBMITTED:
                 # 处理已提交的打标任务
-                SchedulerService._process_submitted_task(task)
+                SchedulerService._process_submitted_task(task, plan)
             elif task.status == TaskStatus.TRAINING:
                 # 处理训练任务
-                SchedulerService._process_training_task(task)
+                SchedulerService._process_training_task(task, plan)
         except Exception as e:
             logger.error(f"处理任务 {task.id} 失败: {str(e)}")
             with get_db() as db:
@@ -73,33 +81,131 @@ class SchedulerService:
                     task.update_status(TaskStatus.ERROR, f"任务调度失败: {str(e)}", db=db)
     
     @staticmethod
-    def _process_submitted_task(task: Task):
+    def _claim_asset(db: Session, task: Task, plan: PlacementPlan) -> Optional[int]:
         """
-        处理已提交的打标任务
+        按放置计划为任务认领资产槽位，并把资产分配给任务
+        
+        资产计数和任务分配都通过条件更新完成，多个调度进程并发认领时不会超出资产容量，
+        也不会重复分配同一任务。
         
         Args:
+            db: 数据库会话
             task: 任务对象
+            plan: 资产放置计划
+            
+        Returns:
+            分配的资产ID，没有可用资产或任务已被分配时返回None
         """
-        # 检查任务是否已经在处理中
-        with _processing_lock:
-            task_key = f"marking_{task.id}"
-            if task_key in _processing_task_ids:
-                logger.info(f"标记任务 {task.id} 已在处理中，跳过本次处理")
-                return
-            # 标记任务为处理中
-            _processing_task_ids.add(task_key)
+        task_id = task.id
+        while True:
+            asset_id = plan.choose(task)
+            if not asset_id:
+                return None
+            
+            if not ClaimService.claim_asset_slot(db, asset_id, plan.kind, plan.get_capacity(asset_id)):
+                # 资产已满（可能被其他进程占用），本轮不再使用
+                db.rollback()
+                plan.exclude(asset_id)
+                continue
+            
+            if not ClaimService.claim_task_asset(db, task_id, asset_id, plan.kind):
+                # 任务已被分配，撤销槽位占用
+                db.rollback()
+                return None
+            
+            db.commit()
+            plan.assign(asset_id)
+            return asset_id
+    
+    @staticmethod
+    def _claim_shard_assets(db: Session, task: Task, plan: PlacementPlan, asset_id: int) -> List[int]:
+        """
+        图片较多的打标任务在空闲资产上额外认领槽位，拆分为多个分片并行打标
+        
+        Returns:
+            执行各分片的资产ID，第一个为任务分配的资产；不分片时只包含该资产
+        """
+        asset_ids = [asset_id]
+        if not plan.choose_idle(task, set(asset_ids)):
+            return asset_ids
+        
+        shard_count = MarkingService.plan_shard_count(task.id)
+        while len(asset_ids) < shard_count:
+            extra_id = plan.choose_idle(task, set(asset_ids))
+            if not extra_id:
+                break
+            if not ClaimService.claim_asset_slot(db, extra_id, plan.kind, plan.get_capacity(extra_id)):
+                db.rollback()
+                plan.exclude(extra_id)
+                continue
+            db.commit()
+            plan.assign(extra_id)
+            asset_ids.append(extra_id)
+        return asset_ids
+    
+    @staticmethod
+    def _start_monitor(kind: str, task_key: str, task_id: int, asset_id: int, remote_id: str):
+        """把任务交给所在资产的状态轮询器监控，监控结束后释放任务租约"""
+        StatusPollerService.watch(
+            kind,
+            task_id,
+            asset_id,
+            remote_id,
+            on_finished=lambda: ClaimService.release_lease(task_key)
+        )
+    
+    @staticmethod
+    def _start_shard_monitors(task_key: str, task_id: int, prompts: List[Tuple[int, str]]):
+        """分片打标任务的各分片由所在资产的轮询器分别监控，全部监控结束后释放任务租约"""
+        if not prompts:
+            ClaimService.release_lease(task_key)
+            return
+        remaining = [len(prompts)]
+        lock = threading.Lock()
         
+        def on_finished():
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] > 0:
+                    return
+            ClaimService.release_lease(task_key)
+        
+        for asset_id, prompt_id in prompts:
+            StatusPollerService.watch('marking', task_id, asset_id, prompt_id, on_finished=on_finished)
+    
+    @staticmethod
+    def _process_submitted_task(task: Task, plan: Optional[PlacementPlan] = None):
+        """
+        处理已提交的打标任务：在调度锁内分配资产，上传和提交交给派发线程池
+        
+        Args:
+            task: 任务对象
+            plan: 本轮调度的标记资产放置计划
+        """
+        # 认领任务租约，任务已被本进程或其他调度进程处理时跳过
+        task_key = f"marking_{task.id}"
+        if not ClaimService.acquire_lease(task_key):
+            logger.info(f"标记任务 {task.id} 已在处理中，跳过本次处理")
+            return
+        
+        dispatched = False
         try:
             with get_db() as db:
                 task = db.query(Task).filter(Task.id == task.id).first()
                 if not task or task.status != TaskStatus.SUBMITTED:
                     return
+                task_id = task.id
                 
-                # 获取可用的标记资产
-                available_assets = MarkingService.get_available_marking_assets()
+                if plan is None:
+                    plan = PlacementService.create_plan(
+                        'marking',
+                        MarkingService.get_available_marking_assets(),
+                        MarkingService.MAX_TASKS_PER_ASSET
+                    )
+                asset_id = SchedulerService._claim_asset(db, task, plan)
                 
-                if not available_assets:
-                    logger.info(f"没有可用于标记的资产，任务 {task.id} 将继续等待")
+                if not asset_id:
+                    logger.info(f"没有可用于标记的资产，任务 {task_id} 将继续等待")
                     
                     # 检查最近的日志，避免重复添加相同的等待消息
                     recent_logs = task.get_all_logs(limit=5)
@@ -111,72 +217,189 @@ class SchedulerService:
                         task.add_log(wait_message, db=db)
                     
                     return
-                    
-                # 获取第一个可用资产
-                asset = available_assets[0]
                 
-                # 分配资产并更新任务
-                task.marking_asset_id = asset.id
-                # 更新资产的任务计数
-                asset.marking_tasks_count += 1
-                db.add(asset)
-                db.commit()
+                logger.info(f"为标记任务 {task_id} 分配资产 {asset_id}")
+                
+                shard_asset_ids = SchedulerService._claim_shard_assets(db, task, plan, asset_id)
+                if len(shard_asset_ids) > 1:
+                    logger.info(f"标记任务 {task_id} 拆分为 {len(shard_asset_ids)} 个分片，资产: {shard_asset_ids}")
+                else:
+                    shard_asset_ids = None
+            
+            # 上传和提交耗时较长，交给派发线程池执行，不阻塞其他任务的分配
+            dispatch_pool.submit(SchedulerService._dispatch_marking, task_id, asset_id, task_key, shard_asset_ids)
+            dispatched = True
+        finally:
+            if not dispatched:
+                ClaimService.release_lease(task_key)
+    
+    @staticmethod
+    def _dispatch_marking(task_id: int, asset_id: int, task_key: str,
+                          shard_asset_ids: Optional[List[int]] = None):
+        """
+        在派发线程中执行标记任务的上传和提交，并启动监控
+        
+        Args:
+            task_id: 任务ID
+            asset_id: 已分配的资产ID
+            task_key: 任务租约
+            shard_asset_ids: 分片打标时执行各分片的资产ID
+        """
+        monitoring = False
+        try:
+            if shard_asset_ids:
+                start_time = time.time()
+                prompts = MarkingService._process_marking_shards(task_id, shard_asset_ids)
+                logger.info(f"分片标记任务 {task_id} 提交完成，耗时: {time.time() - start_time:.2f}秒")
+                SchedulerService._start_shard_monitors(task_key, task_id, prompts)
+                monitoring = True
+                return
+            
+            # 执行标记处理
+            start_time = time.time()
+            prompt_id = MarkingService._process_marking(task_id, asset_id)
+            end_time = time.time()
+            logger.info(f"标记任务 {task_id} 提交完成，耗时: {end_time - start_time:.2f}秒")
+            
+            # 如果获取到prompt_id，启动监控
+            if prompt_id:
+                logger.info(f"标记任务 {task_id} 获取到prompt_id: {prompt_id}，启动监控")
+                SchedulerService._start_monitor(
+                    'marking',
+                    task_key,
+                    task_id,
+                    asset_id,
+                    prompt_id
+                )
+                monitoring = True
+        except Exception as e:
+            logger.error(f"标记任务 {task_id} 处理或启动监控失败: {str(e)}", exc_info=True)
+        finally:
+            # 监控未启动时释放租约，启动后由监控结束时释放
+            if not monitoring:
+                ClaimService.release_lease(task_key)
+    
+    @staticmethod
+    def _process_mark_batch(tasks: List[Task], plan: PlacementPlan):
+        """
+        处理一批可合并的打标任务：为批次中的任务分配同一资产，合并为一次工作流执行
+        
+        每个任务各占用一个资产槽位，任务的释放流程与单独打标时一致。资产剩余槽位不足时
+        只合并能分配到槽位的任务，其余任务留到下一轮。
+        
+        Args:
+            tasks: 同一批次的任务
+            plan: 本轮调度的标记资产放置计划
+        """
+        task_keys = {}
+        for task in tasks:
+            task_key = f"marking_{task.id}"
+            if ClaimService.acquire_lease(task_key):
+                task_keys[task.id] = task_key
+        
+        claimed: List[int] = []
+        dispatched = False
+        try:
+            with get_db() as db:
+                batch_tasks = db.query(Task).filter(
+                    Task.id.in_(list(task_keys)),
+                    Task.status == TaskStatus.SUBMITTED,
+                    Task.marking_asset_id.is_(None)
+                ).order_by(Task.created_at.asc()).all()
+                if not batch_tasks:
+                    return
+                
+                asset_id = SchedulerService._claim_asset(db, batch_tasks[0], plan)
+                if not asset_id:
+                    logger.info(f"没有可用于标记的资产，批次任务 {list(task_keys)} 将继续等待")
+                    return
+                claimed.append(batch_tasks[0].id)
                 
-                # 启动新线程执行标记任务处理
-                logger.info(f"为标记任务 {task.id} 分配资产 {asset.id} ({asset.name})")
+                for task in batch_tasks[1:]:
+                    if not ClaimService.claim_asset_slot(db, asset_id, 'marking', plan.get_capacity(asset_id)):
+                        db.rollback()
+                        break
+                    if not ClaimService.claim_task_asset(db, task.id, asset_id, 'marking'):
+                        db.rollback()
+                        continue
+                    db.commit()
+                    plan.assign(asset_id)
+                    claimed.append(task.id)
                 
-                try:
-                    # 执行标记处理
-                    start_time = time.time()
-                    prompt_id = MarkingService._process_marking(task.id, asset.id)
-                    end_time = time.time()
-                    logger.info(f"标记任务 {task.id} 提交完成，耗时: {end_time - start_time:.2f}秒")
-                    
-                    # 如果获取到prompt_id，启动监控
-                    if prompt_id:
-                        logger.info(f"标记任务 {task.id} 获取到prompt_id: {prompt_id}，启动监控")
-                        monitor_pool.submit(
-                            MarkingService._monitor_mark_status,
-                            task.id,
-                            asset.id,
-                            prompt_id
-                        )
-                except Exception as e:
-                    logger.error(f"标记任务 {task.id} 处理或启动监控失败: {str(e)}", exc_info=True)
+                logger.info(f"为批量标记任务 {claimed} 分配资产 {asset_id}")
+            
+            if len(claimed) == 1:
+                dispatch_pool.submit(SchedulerService._dispatch_marking, claimed[0], asset_id, task_keys[claimed[0]])
+            else:
+                dispatch_pool.submit(
+                    SchedulerService._dispatch_marking_batch, claimed, asset_id,
+                    {task_id: task_keys[task_id] for task_id in claimed}
+                )
+            dispatched = True
         finally:
-            # 处理完成后，移除任务处理中的标记
-            with _processing_lock:
-                _processing_task_ids.discard(task_key)
+            for task_id, task_key in task_keys.items():
+                if not dispatched or task_id not in claimed:
+                    ClaimService.release_lease(task_key)
     
+    @staticmethod
+    def _dispatch_marking_batch(task_ids: List[int], asset_id: int, task_keys: Dict[int, str]):
+        """
+        在派发线程中执行批量标记任务的上传和提交，并为批次中的每个任务启动监控
+        
+        Args:
+            task_ids: 同一批次的任务ID
+            asset_id: 已分配的资产ID
+            task_keys: 各任务的租约
+        """
+        monitoring = set()
+        try:
+            start_time = time.time()
+            prompt_id = MarkingService._process_marking_batch(task_ids, asset_id)
+            logger.info(f"批量标记任务 {task_ids} 提交完成，耗时: {time.time() - start_time:.2f}秒")
+            for task_id in task_ids:
+                SchedulerService._start_monitor('marking', task_keys[task_id], task_id, asset_id, prompt_id)
+                monitoring.add(task_id)
+        except Exception as e:
+            logger.error(f"批量标记任务 {task_ids} 处理或启动监控失败: {str(e)}", exc_info=True)
+        finally:
+            for task_id in task_ids:
+                if task_id not in monitoring:
+                    ClaimService.release_lease(task_keys[task_id])
     
     @staticmethod
-    def _process_training_task(task: Task):
+    def _process_training_task(task: Task, plan: Optional[PlacementPlan] = None):
         """
-        处理训练任务
+        处理训练任务：在调度锁内分配资产，上传和提交交给派发线程池
         
         Args:
             task: 任务对象
+            plan: 本轮调度的训练资产放置计划
         """
-        # 检查任务是否已经在处理中
-        with _processing_lock:
-            task_key = f"training_{task.id}"
-            if task_key in _processing_task_ids:
-                logger.info(f"任务 {task.id} 已在处理中，跳过本次处理")
-                return
-            # 标记任务为处理中
-            _processing_task_ids.add(task_key)
+        # 认领任务租约，任务已被本进程或其他调度进程处理时跳过
+        task_key = f"training_{task.id}"
+        if not ClaimService.acquire_lease(task_key):
+            logger.info(f"任务 {task.id} 已在处理中，跳过本次处理")
+            return
         logger.info(f"开始处理训练任务 {task.id}》》》》》")
+        
+        dispatched = False
         try:
             with get_db() as db:
                 task = db.query(Task).filter(Task.id == task.id).first()
                 if not task or task.status != TaskStatus.TRAINING or task.training_asset_id:
                     return
+                task_id = task.id
                 
-                # 获取可用的训练资产
-                available_assets = TrainingService.get_available_training_assets()
+                if plan is None:
+                    plan = PlacementService.create_plan(
+                        'training',
+                        TrainingService.get_available_training_assets(),
+                        TrainingService.MAX_TASKS_PER_ASSET
+                    )
+                asset_id = SchedulerService._claim_asset(db, task, plan)
                 
-                if not available_assets:
-                    logger.info(f"没有可用于训练的资产，任务 {task.id} 将继续等待")
+                if not asset_id:
+                    logger.info(f"没有可用于训练的资产，任务 {task_id} 将继续等待")
                     
                     # 检查最近的日志，避免重复添加相同的等待消息
                     recent_logs = task.get_all_logs(limit=5)
@@ -187,58 +410,89 @@ class SchedulerService:
                         # 添加任务日志，记录任务正在等待可用训练资产
                         task.add_log(wait_message, db=db)
                     return
-                    
-                try:
-                    # 获取第一个可用资产
-                    asset = available_assets[0]
-                    
-                    # 分配资产并更新任务
-                    logger.info(f"为训练任务 {task.id} 分配资产 {asset.id} ({asset.name})")
-                    task.training_asset_id = asset.id
-                    # 更新资产的任务计数
-                    asset.training_tasks_count += 1
-                    db.add(asset)
-                    db.commit()
-                    
-                    # 执行训练处理并记录耗时
-                    start_time = time.time()
-                    training_task_id = TrainingService._process_training(task.id, asset.id)
-                    end_time = time.time()
-                    logger.info(f"训练任务 {task.id} 提交完成，耗时: {end_time - start_time:.2f}秒")
-                    
-                    # 如果获取到training_task_id，启动监控
-                    if training_task_id:
-                        logger.info(f"训练任务 {task.id} 获取到training_task_id: {training_task_id}，启动监控")
-                        monitor_pool.submit(
-                            TrainingService._monitor_training_status,
-                            task.id,
-                            asset.id,
-                            training_task_id
-                        )
-                except Exception as e:
-                    logger.error(f"训练任务 {task.id} 处理或启动监控失败: {str(e)}", exc_info=True)
+                
+                logger.info(f"为训练任务 {task_id} 分配资产 {asset_id}")
+            
+            # 上传和提交耗时较长，交给派发线程池执行，不阻塞其他任务的分配
+            dispatch_pool.submit(SchedulerService._dispatch_training, task_id, asset_id, task_key)
+            dispatched = True
         finally:
-            # 处理完成后，移除任务处理中的标记
-            with _processing_lock:
-                _processing_task_ids.discard(task_key)
+            if not dispatched:
+                ClaimService.release_lease(task_key)
+    
+    @staticmethod
+    def _dispatch_training(task_id: int, asset_id: int, task_key: str):
+        """
+        在派发线程中执行训练任务的上传和提交，并启动监控
+        
+        Args:
+            task_id: 任务ID
+            asset_id: 已分配的资产ID
+            task_key: 任务租约
+        """
+        monitoring = False
+        try:
+            # 执行训练处理并记录耗时
+            start_time = time.time()
+            training_task_id = TrainingService._process_training(task_id, asset_id)
+            end_time = time.time()
+            logger.info(f"训练任务 {task_id} 提交完成，耗时: {end_time - start_time:.2f}秒")
+            
+            # 如果获取到training_task_id，启动监控
+            if training_task_id:
+                logger.info(f"训练任务 {task_id} 获取到training_task_id: {training_task_id}，启动监控")
+                SchedulerService._start_monitor(
+                    'training',
+                    task_key,
+                    task_id,
+                    asset_id,
+                    training_task_id
+                )
+                monitoring = True
+        except Exception as e:
+            logger.error(f"训练任务 {task_id} 处理或启动监控失败: {str(e)}", exc_info=True)
+        finally:
+            # 监控未启动时释放租约，启动后由监控结束时释放
+            if not monitoring:
+                ClaimService.release_lease(task_key)
     
     @staticmethod
     def run_scheduler_once():
         """
         运行一次调度器
+        
+        调度锁内只做资产分配（查询可用资产一次，按放置策略逐个分配），
+        上传和提交由派发线程池并行执行。
         """
         try:
             # 使用锁保证同一时间只有一个线程在执行调度逻辑
             with scheduler_lock:
                 # 获取待处理的任务
                 submitted_tasks, training_tasks = SchedulerService.get_pending_tasks()
+                
                 # 处理提交的打标任务
-                for task in submitted_tasks:
-                    SchedulerService.process_task(task)
+                if submitted_tasks:
+                    marking_plan = PlacementService.create_plan(
+                        'marking',
+                        MarkingService.get_available_marking_assets(),
+                        MarkingService.MAX_TASKS_PER_ASSET
+                    )
+                    # 可合并的小任务按批次分配，未凑满的批次等待下一轮
+                    batches, submitted_tasks = MarkingService.plan_batches(submitted_tasks)
+                    for batch in batches:
+                        SchedulerService._process_mark_batch(batch, marking_plan)
+                    for task in submitted_tasks:
+                        SchedulerService.process_task(task, marking_plan)
                     
                 # 处理训练任务
-                for task in training_tasks:
-                    SchedulerService.process_task(task)
+                if training_tasks:
+                    training_plan = PlacementService.create_plan(
+                        'training',
+                        TrainingService.get_available_training_assets(),
+                        TrainingService.MAX_TASKS_PER_ASSET
+                    )
+                    for task in training_tasks:
+                        SchedulerService.process_task(task, training_plan)
                     
         except Exception as e:
             logger.error(f"调度器运行失败: {str(e)}")
@@ -251,15 +505,24 @@ class SchedulerService:
         """
         global scheduler_running
         
+        last_lease_sweep = time.time()
         try:
             while scheduler_running:
                 try:
                     # 执行一次调度
                     SchedulerService.run_scheduler_once()
                     
-                    # 等待一段时间再次执行
-                    time.sleep(10)  # 10秒检查一次，减少重复检查的频率
-                    # logger.info(f"调度器循环执行完成，当前线程ID: {threading.get_ident()}")
+                    # 定期接管其他调度进程退出后遗留的任务
+                    if time.time() - last_lease_sweep >= ClaimService.get_lease_ttl():
+                        last_lease_sweep = time.time()
+                        SchedulerService.sweep_expired_leases()
+                    
+                    # 等待唤醒通知，超时后执行兜底调度
+                    sweep_interval = ConfigService.get_value('scheduler_sweep_interval', 60)
+                    timeout = min(sweep_interval, ClaimService.get_lease_ttl())
+                    reasons = SchedulerEvents.wait(timeout=timeout, coalesce=0.1)
+                    if reasons:
+                        logger.debug(f"调度器被唤醒: {', '.join(set(reasons))}")
                 except Exception as loop_error:
                     logger.error(f"调度循环出错: {str(loop_error)}")
                     time.sleep(30)  # 错误后等待30秒再次尝试
@@ -280,12 +543,16 @@ class SchedulerService:
         with scheduler_lock:
             if scheduler_thread is None or not scheduler_thread.is_alive():
                 scheduler_running = True
+                # 本进程运行调度循环，notify直接在进程内唤醒，并轮询其他进程的唤醒信号
+                SchedulerEvents.set_local_scheduler(True)
                 scheduler_thread = threading.Thread(
                     target=SchedulerService._scheduler_loop,
                     name="task_scheduler",
                     daemon=True
                 )
                 scheduler_thread.start()
+                # 启动租约心跳，定期续约本进程持有的任务租约
+                ClaimService.start_heartbeat()
                 logger.info("任务调度器已启动")
                 return True
             else:
@@ -303,8 +570,12 @@ class SchedulerService:
             if scheduler_running:
                 scheduler_running = False
                 logger.info("正在停止任务调度器...")
-                # 关闭监控线程池
-                monitor_pool.shutdown(wait=False)
+                # 唤醒调度循环使其尽快退出
+                SchedulerEvents.notify('scheduler_stopping')
+                SchedulerEvents.set_local_scheduler(False)
+                ClaimService.stop_heartbeat()
+                # 关闭派发线程池
+                dispatch_pool.shutdown(wait=False)
                 return True
             else:
                 logger.warning("任务调度器已经停止")
@@ -313,9 +584,23 @@ class SchedulerService:
     @staticmethod
     def init_scheduler():
         """
-        初始化任务调度器，应用启动时调用
+        初始化任务调度器，Web进程（RUN_SCHEDULER开启时）或独立调度进程启动时调用
         """
-        # 检查可能中断的任务，重置状态
+        # 多个调度进程同时启动时只由一个进程恢复中断的任务
+        if ClaimService.acquire_lease('scheduler_recovery'):
+            try:
+                SchedulerService._recover_interrupted_tasks()
+            finally:
+                ClaimService.release_lease('scheduler_recovery')
+        else:
+            logger.info("其他调度进程正在恢复中断的任务，跳过本进程的恢复")
+            
+        # 启动调度器
+        SchedulerService.start_scheduler()
+    
+    @staticmethod
+    def _recover_interrupted_tasks():
+        """检查可能中断的任务，重置状态并恢复监控"""
         with get_db() as db:
             # 找到所有处于SUBMITTED状态但已分配资产的任务
             pending_mark_tasks = db.query(Task).filter(
@@ -335,34 +620,132 @@ class SchedulerService:
                 Task.prompt_id.is_(None)  # 但还没有开始训练（没有prompt_id）
             ).all()
             
+            # 其他调度进程持有租约的任务仍在处理中，不做重置
+            pending_mark_tasks = [
+                task for task in pending_mark_tasks + marking_tasks
+                if not ClaimService.is_lease_active(f"marking_{task.id}")
+            ]
+            pending_train_tasks = [
+                task for task in pending_train_tasks
+                if not ClaimService.is_lease_active(f"training_{task.id}")
+            ]
+            
             # 重置打标任务状态
-            for task in pending_mark_tasks + marking_tasks:
+            for task in pending_mark_tasks:
+                # 分片任务只有部分分片完成时输出不完整，需要重新打标
+                partial = any(shard['status'] != 'done' for shard in MarkingService._get_shards(task))
                 # 检查任务的输出目录是否存在并有文件
-                if task.marked_images_path and os.path.exists(task.marked_images_path) and os.listdir(task.marked_images_path):
+                if not partial and task.marked_images_path and os.path.exists(task.marked_images_path) and os.listdir(task.marked_images_path):
                     # 有输出文件，说明打标可能已完成
                     task.update_status(TaskStatus.MARKED, "系统重启，检测到打标输出，标记为已完成", db=db)
                 else:
                     # 没有输出文件，重置为SUBMITTED状态
-                    if task.marking_asset:
-                        # 减少资产的计数
-                        task.marking_asset.marking_tasks_count = max(0, task.marking_asset.marking_tasks_count - 1)
+                    # 减少资产的计数
+                    MarkingService._release_shards(db, task)
+                    ClaimService.release_asset_slot(db, task.marking_asset_id, 'marking')
                     task.marking_asset_id = None
                     task.update_status(TaskStatus.SUBMITTED, "系统重启，打标任务重置为等待状态", db=db)
             
             # 重置训练任务状态
             for task in pending_train_tasks:
-                if task.training_asset:
-                    # 减少资产的计数
-                    task.training_asset.training_tasks_count = max(0, task.training_asset.training_tasks_count - 1)
+                # 减少资产的计数
+                ClaimService.release_asset_slot(db, task.training_asset_id, 'training')
                 task.training_asset_id = None
                 task.update_status(TaskStatus.TRAINING, "系统重启，训练任务重置为等待状态", db=db)
                 
             # 恢复处理中的任务监控
             SchedulerService._recover_task_monitors(db)
+        
+    @staticmethod
+    def _attach_task_monitor(kind: str, task: Task, task_key: str):
+        """为已提交到资产的任务启动状态监控，调用前需已持有任务租约"""
+        if kind == 'marking':
+            shards = MarkingService._get_shards(task)
+            if shards:
+                SchedulerService._start_shard_monitors(task_key, task.id, [
+                    (shard['asset_id'], shard['prompt_id'])
+                    for shard in shards if shard['status'] == 'marking'
+                ])
+                return
+            SchedulerService._start_monitor('marking', task_key, task.id, task.marking_asset_id, task.prompt_id)
+        else:
+            SchedulerService._start_monitor('training', task_key, task.id, task.training_asset_id, task.prompt_id)
+    
+    @staticmethod
+    def sweep_expired_leases():
+        """
+        接管租约已过期的任务
+        
+        调度进程退出后其持有的任务租约不再续约，存活的调度进程定期认领过期的租约：
+        已提交到资产的任务重新启动状态监控，尚未提交的任务释放资产槽位后重新排队。
+        """
+        with get_db() as db:
+            resources = [row.resource for row in db.query(TaskLease.resource).filter(
+                TaskLease.expires_at < datetime.now()
+            ).all()]
+        
+        # 本进程仍在监控的任务（如续约因数据库繁忙失败）不重复接管
+        watched = {
+            f"{key.split('_')[0]}_{task_id}"
+            for key, task_ids in StatusPollerService.get_watched_tasks().items() for task_id in task_ids
+        }
+        for resource in resources:
+            kind, _, task_id = resource.rpartition('_')
+            if kind not in ('marking', 'training') or not task_id.isdigit() or resource in watched:
+                continue
+            if not ClaimService.acquire_lease(resource):
+                continue
+            monitoring = False
+            try:
+                monitoring = SchedulerService._adopt_task(kind, int(task_id), resource)
+            except Exception as e:
+                logger.error(f"接管任务 {resource} 失败: {str(e)}", exc_info=True)
+            finally:
+                # 启动监控后租约由监控持有，否则释放（同时清理已结束任务的过期租约）
+                if not monitoring:
+                    ClaimService.release_lease(resource)
+    
+    @staticmethod
+    def _adopt_task(kind: str, task_id: int, task_key: str) -> bool:
+        """
+        接管持有者已退出的任务，调用前需已认领任务租约
+        
+        Returns:
+            是否已启动状态监控
+        """
+        with get_db() as db:
+            # 认领租约后重新读取任务，原持有者在租约过期前可能已更新了任务状态
+            task = db.query(Task).filter(Task.id == task_id).first()
+            if not task:
+                return False
             
-        # 启动调度器
-        SchedulerService.start_scheduler()
+            if kind == 'marking':
+                if not task.marking_asset_id or task.status not in (TaskStatus.SUBMITTED, TaskStatus.MARKING):
+                    return False
+                if task.status == TaskStatus.MARKING and task.prompt_id:
+                    logger.info(f"标记任务 {task_id} 的租约已过期，接管状态监控")
+                    SchedulerService._attach_task_monitor('marking', task, task_key)
+                    return True
+                # 提交前中断，释放资产槽位后重新排队
+                MarkingService._release_shards(db, task)
+                ClaimService.release_asset_slot(db, task.marking_asset_id, 'marking')
+                task.marking_asset_id = None
+                task.update_status(TaskStatus.SUBMITTED, "调度进程已退出，打标任务重置为等待状态", db=db)
+            else:
+                if task.status != TaskStatus.TRAINING or not task.training_asset_id:
+                    return False
+                if task.prompt_id:
+                    logger.info(f"训练任务 {task_id} 的租约已过期，接管状态监控")
+                    SchedulerService._attach_task_monitor('training', task, task_key)
+                    return True
+                ClaimService.release_asset_slot(db, task.training_asset_id, 'training')
+                task.training_asset_id = None
+                task.update_status(TaskStatus.TRAINING, "调度进程已退出，训练任务重置为等待状态", db=db)
         
+        logger.info(f"任务 {task_key} 的租约已过期，已释放资产槽位并重新排队")
+        SchedulerEvents.notify('lease_expired')
+        return False
+    
     @staticmethod
     def _recover_task_monitors(db: Session):
         """恢复任务状态监控"""
@@ -375,13 +758,12 @@ class SchedulerService:
             
             for task in marking_tasks:
                 if task.marking_asset_id and task.prompt_id:
+                    task_key = f"marking_{task.id}"
+                    # 已由其他调度进程监控的任务不重复监控
+                    if not ClaimService.acquire_lease(task_key):
+                        continue
                     logger.info(f"恢复标记任务 {task.id} 的状态监控")
-                    monitor_pool.submit(
-                        MarkingService._monitor_mark_status,
-                        task.id,
-                        task.marking_asset_id,
-                        task.prompt_id
-                    )
+                    SchedulerService._attach_task_monitor('marking', task, task_key)
 
             # 恢复训练中的任务监控
             training_tasks = db.query(Task).filter(
@@ -392,13 +774,12 @@ class SchedulerService:
             
             for task in training_tasks:
                 if task.training_asset_id and task.prompt_id:
+                    task_key = f"training_{task.id}"
+                    # 已由其他调度进程监控的任务不重复监控
+                    if not ClaimService.acquire_lease(task_key):
+                        continue
                     logger.info(f"恢复训练任务 {task.id} 的状态监控")
-                    monitor_pool.submit(
-                        TrainingService._monitor_training_status,
-                        task.id,
-                        task.training_asset_id,
-                        task.prompt_id
-                    )
+                    SchedulerService._attach_task_monitor('training', task, task_key)
                     
         except Exception as e:
             logger.error(f"恢复任务监控失败: {str(e)}", exc_info=True) 
\ No newline at end of file
@@ -0,0 +1,623 @@
+import asyncio
+import atexit
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Callable, Any, Tuple
+from ...models.task import Task, TaskStatus
+from ...models.asset import Asset
+from ...database import get_db
+from ...config import Config
+from ...utils.logger import setup_logger
+from ...utils.mark_handler import MarkRequestHandler
+from ...utils.comfyui_ws_multiplexer import ComfyUIEventMultiplexer, EVENT_PROGRESS
+from ...utils.train_handler import TrainRequestHandler
+from ...services.config_service import ConfigService
+from .marking_service import MarkingService
+from .training_service import TrainingService
+from .training_output_syncer import TrainingOutputSyncer
+
+try:
+    import aiohttp
+except ImportError:  # 未安装aiohttp时在线程池中调用同步客户端
+    aiohttp = None
+
+logger = setup_logger('status_poller')
+
+# 轮询线程池：读取任务状态和配置等短时操作，不阻塞事件循环；与完成处理分开，
+# 结果下载耗时较长时不影响各资产的状态轮询
+poll_pool = ThreadPoolExecutor(
+    max_workers=Config.SYSTEM_CONFIG.get('status_poll_workers', 4),
+    thread_name_prefix="StatusPollWorker"
+)
+
+# 完成处理线程池：结果下载、输出同步和状态更新
+completion_pool = ThreadPoolExecutor(
+    max_workers=Config.SYSTEM_CONFIG.get('completion_workers', 4),
+    thread_name_prefix="CompletionWorker"
+)
+
+# 轮询间隔的随机抖动比例，避免大量资产同时发起请求
+POLL_JITTER = 0.1
+
+# 监控被取消的标记
+_CANCELLED = object()
+
+
+class StatusWatch:
+    """一个正在监控的远程任务，由独立的协程处理其状态变化"""
+
+    def __init__(self, task_id: int, remote_id: str, on_finished: Optional[Callable[[], None]] = None):
+        self.task_id = task_id
+        self.remote_id = remote_id
+        self.on_finished = on_finished
+        self.error_count = 0
+        self.busy = False
+        self.inbox: Optional[asyncio.Queue] = None
+        self.runner: Optional[asyncio.Task] = None
+
+
+class AssetStatusPoller:
+    """
+    单个资产的状态轮询器
+
+    一个资产上所有在途任务共用一个轮询协程，每轮只向资产发起一次批量状态查询，
+    再把结果投递给各任务的监控协程。没有在途任务时轮询协程自动退出。
+    """
+    kind = ''
+    active_status = None
+    poll_interval_key = ''
+    default_poll_interval = 5
+    max_error_retries = 3
+
+    def __init__(self, asset_id: int):
+        self.asset_id = asset_id
+        self._watches: Dict[int, StatusWatch] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._runner: Optional[asyncio.Task] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._completion_semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._http = None
+        # 最近一次读取的轮询间隔，事件循环中不查询数据库
+        self._interval = self.default_poll_interval
+
+    # ---------- 以下方法在事件循环线程中调用 ----------
+
+    def add(self, watch: StatusWatch):
+        """添加监控任务，为其创建监控协程，必要时启动轮询协程"""
+        if self._semaphore is None:
+            concurrency = Config.SYSTEM_CONFIG.get('asset_request_concurrency', 4)
+            # 状态查询和结果下载分别限流，下载中的任务不占用状态查询的名额
+            self._semaphore = asyncio.Semaphore(concurrency)
+            self._completion_semaphore = asyncio.Semaphore(concurrency)
+            self._wakeup = asyncio.Event()
+            self._loop = asyncio.get_event_loop()
+
+        old = self._watches.get(watch.task_id)
+        if old and old.runner:
+            old.runner.cancel()
+
+        watch.inbox = asyncio.Queue(maxsize=1)
+        watch.runner = asyncio.ensure_future(self._monitor(watch))
+        self._watches[watch.task_id] = watch
+        self.on_watch_added(watch)
+
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.ensure_future(self._run())
+        self._wakeup.set()
+
+    def cancel(self, task_id: int) -> bool:
+        """取消任务的监控协程"""
+        watch = self._watches.get(task_id)
+        if watch and watch.runner and not watch.runner.done():
+            watch.runner.cancel()
+            return True
+        return False
+
+    def get_task_ids(self) -> List[int]:
+        return list(self._watches.keys())
+
+    def wakeup(self):
+        """立即执行下一轮轮询，可在任意线程中调用"""
+        if self._loop and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def on_watch_added(self, watch: StatusWatch):
+        """开始监控任务时调用，子类可订阅推送事件"""
+        pass
+
+    def on_watch_removed(self, watch: StatusWatch):
+        """任务监控结束时调用"""
+        pass
+
+    def on_running(self, watch: StatusWatch, result: Any):
+        """查询到任务仍在执行时调用，不能阻塞事件循环"""
+        pass
+
+    async def _run(self):
+        """轮询协程：批量查询状态并投递给监控协程"""
+        # 首次轮询随机错开，避免多个资产同时请求
+        try:
+            await asyncio.sleep(random.uniform(0, 1))
+            while self._watches:
+                # 先清除唤醒标记，轮询期间收到的唤醒会让下一轮立即执行
+                self._wakeup.clear()
+                interval = await self._poll()
+                jittered = interval * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=jittered)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            # 没有在途任务时关闭HTTP会话，下次轮询时重新创建；事件循环停止后由 shutdown 关闭
+            if self._loop and self._loop.is_running():
+                await self.close_http()
+
+    async def close_http(self):
+        http, self._http = self._http, None
+        if http is not None and not http.closed:
+            await http.close()
+
+    async def _poll(self) -> float:
+        """执行一轮批量状态查询，返回下一次轮询的等待时间"""
+        loop = asyncio.get_event_loop()
+        watches = [watch for watch in self._watches.values() if not watch.busy]
+        if not watches:
+            return self._interval
+
+        try:
+            statuses, asset, interval = await loop.run_in_executor(
+                poll_pool, self._load_state, [watch.task_id for watch in watches]
+            )
+        except Exception as e:
+            logger.error(f"资产 {self.asset_id} {self.kind}状态轮询读取数据库失败: {str(e)}")
+            return self._interval
+        self._interval = interval
+
+        # 任务已被取消或状态已变化，通知监控协程退出
+        running = []
+        for watch in watches:
+            if statuses.get(watch.task_id) != self.active_status:
+                self._deliver(watch, _CANCELLED)
+            else:
+                running.append(watch)
+        if not running:
+            return interval
+
+        try:
+            if not asset:
+                raise ValueError(f"资产ID {self.asset_id} 不存在")
+            async with self._semaphore:
+                results = await self._fetch(asset, [watch.remote_id for watch in running])
+        except Exception as e:
+            for watch in running:
+                self._deliver(watch, e)
+            return self._error_interval(running, interval)
+
+        for watch in running:
+            self._deliver(watch, results.get(watch.remote_id))
+        return interval
+
+    def _deliver(self, watch: StatusWatch, result: Any):
+        """投递状态给监控协程，监控协程仍在处理上一次状态时丢弃本次结果"""
+        try:
+            watch.inbox.put_nowait(result)
+        except asyncio.QueueFull:
+            pass
+
+    async def _monitor(self, watch: StatusWatch):
+        """单个任务的监控协程"""
+        loop = asyncio.get_event_loop()
+        try:
+            while True:
+                result = await watch.inbox.get()
+                watch.busy = True
+                try:
+                    if result is _CANCELLED:
+                        await loop.run_in_executor(completion_pool, self.handle_cancelled, watch.task_id)
+                        return
+
+                    if isinstance(result, Exception):
+                        watch.error_count += 1
+                        finished = await loop.run_in_executor(
+                            completion_pool, self.handle_error, watch.task_id, watch.error_count, result
+                        )
+                        if finished:
+                            return
+                        continue
+
+                    watch.error_count = 0
+                    if self.is_completed(result):
+                        async with self._completion_semaphore:
+                            finished = await loop.run_in_executor(
+                                completion_pool, self.handle_result, watch.task_id, result
+                            )
+                        if finished:
+                            return
+                    else:
+                        self.on_running(watch, result)
+                finally:
+                    watch.busy = False
+        except asyncio.CancelledError:
+            logger.info(f"{self.kind}任务 {watch.task_id} 的状态监控已取消")
+        except Exception as e:
+            await loop.run_in_executor(completion_pool, self.handle_failure, watch.task_id, e)
+        finally:
+            if self._watches.get(watch.task_id) is watch:
+                del self._watches[watch.task_id]
+            self.on_watch_removed(watch)
+            if watch.on_finished and not loop.is_closed():
+                loop.run_in_executor(poll_pool, self._run_finished_callback, watch)
+
+    @staticmethod
+    def _run_finished_callback(watch: StatusWatch):
+        try:
+            watch.on_finished()
+        except Exception as e:
+            logger.error(f"任务 {watch.task_id} 监控结束回调失败: {str(e)}")
+
+    async def _fetch(self, asset: Asset, remote_ids: List[str]) -> Dict[str, Any]:
+        """批量获取远程任务状态，安装了aiohttp时使用异步客户端"""
+        if aiohttp is None:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(poll_pool, self.fetch_statuses, asset, remote_ids)
+        if self._http is None or self._http.closed:
+            # 与同步客户端的轮询会话一致：短超时，失败由下一轮轮询兜底
+            config = Config.HTTP_CLIENT_CONFIG
+            self._http = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(
+                sock_connect=config['connect_timeout'], sock_read=config['poll_read_timeout']
+            ))
+        return await self.fetch_statuses_async(self._http, asset, remote_ids)
+
+    # ---------- 以下方法在线程池中调用 ----------
+
+    def _load_state(self, task_ids: List[int]) -> Tuple[Dict[int, Any], Optional[Asset], float]:
+        """读取任务状态、资产信息和轮询间隔"""
+        with get_db() as db:
+            statuses = dict(db.query(Task.id, Task.status).filter(Task.id.in_(task_ids)).all())
+            asset = db.query(Asset).filter(Asset.id == self.asset_id).first()
+            if asset:
+                db.expunge(asset)
+        return statuses, asset, self._default_interval()
+
+    def _default_interval(self) -> float:
+        return ConfigService.get_value(self.poll_interval_key, self.default_poll_interval)
+
+    def _error_interval(self, watches: List[StatusWatch], interval: float) -> float:
+        """查询出错后的下一次轮询间隔"""
+        return interval
+
+    # ---------- 以下由具体轮询器实现 ----------
+
+    def fetch_statuses(self, asset: Asset, remote_ids: List[str]) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    async def fetch_statuses_async(self, http, asset: Asset, remote_ids: List[str]) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def is_completed(self, result: Any) -> bool:
+        raise NotImplementedError
+
+    def handle_result(self, task_id: int, result: Any) -> bool:
+        raise NotImplementedError
+
+    def handle_cancelled(self, task_id: int):
+        pass
+
+    def handle_error(self, task_id: int, error_count: int, error: Exception) -> bool:
+        raise NotImplementedError
+
+    def handle_failure(self, task_id: int, error: Exception):
+        raise NotImplementedError
+
+
+async def _get_json(http, url: str, headers: Optional[Dict] = None) -> Dict:
+    async with http.get(url, headers=headers) as response:
+        response.raise_for_status()
+        return await response.json(content_type=None)
+
+
+class MarkingStatusPoller(AssetStatusPoller):
+    """ComfyUI标记任务轮询器"""
+    kind = 'marking'
+    active_status = TaskStatus.MARKING
+    poll_interval_key = 'mark_poll_interval'
+    default_poll_interval = 5
+    max_error_retries = 3
+    # 实时进度写入数据库的最小间隔（秒）
+    progress_update_interval = 2
+
+    def __init__(self, asset_id: int):
+        super().__init__(asset_id)
+        self._mux: Optional[ComfyUIEventMultiplexer] = None
+        self._progress_updated_at: Dict[str, float] = {}
+
+    def on_watch_added(self, watch):
+        self._loop.run_in_executor(poll_pool, self._subscribe, watch)
+
+    def on_watch_removed(self, watch):
+        # 同一prompt仍有其他监控（任务被重新监控或批量打标的其他任务）时保留订阅
+        if self._has_prompt(watch.remote_id):
+            return
+        self._loop.run_in_executor(poll_pool, self._unsubscribe, watch)
+
+    def _has_prompt(self, remote_id: str) -> bool:
+        return any(watch.remote_id == remote_id for watch in list(self._watches.values()))
+
+    def _subscribe(self, watch: StatusWatch):
+        """订阅ComfyUI的WebSocket推送，订阅失败时仅依赖HTTP轮询"""
+        try:
+            with get_db() as db:
+                asset = db.query(Asset).filter(Asset.id == self.asset_id).first()
+                if not asset:
+                    return
+                config = MarkRequestHandler(asset).comfy_config
+            mux = ComfyUIEventMultiplexer.for_asset(self.asset_id, config)
+            self._mux = mux
+            mux.subscribe(watch.remote_id, lambda event, data: self._on_event(watch.remote_id, event, data))
+            # 订阅完成前监控可能已经结束
+            if watch.runner and watch.runner.done() and not self._has_prompt(watch.remote_id):
+                self._unsubscribe(watch)
+        except Exception as e:
+            logger.warning(f"订阅标记任务 {watch.task_id} 的WebSocket推送失败，使用HTTP轮询: {str(e)}")
+
+    def _unsubscribe(self, watch: StatusWatch):
+        self._progress_updated_at.pop(watch.remote_id, None)
+        if self._mux:
+            self._mux.unsubscribe(watch.remote_id)
+
+    def _on_event(self, remote_id: str, event: str, data: Dict):
+        """处理WebSocket推送，在WebSocket线程中调用"""
+        if event == EVENT_PROGRESS:
+            max_value = data.get('max') or 0
+            if max_value <= 0:
+                return
+            now = time.time()
+            if now - self._progress_updated_at.get(remote_id, 0) < self.progress_update_interval:
+                return
+            self._progress_updated_at[remote_id] = now
+            # 100%留给结果同步完成后设置
+            progress = min(99, int(data.get('value', 0) * 100 / max_value))
+            # 批量打标时同一prompt对应多个任务
+            for watch in list(self._watches.values()):
+                if watch.remote_id == remote_id:
+                    poll_pool.submit(MarkingService._update_mark_progress, watch.task_id, progress, self.asset_id)
+        else:
+            # 完成或出错时立即轮询一次，由HTTP结果确认最终状态
+            self.wakeup()
+
+    def _default_interval(self):
+        interval = super()._default_interval()
+        if self._mux and self._mux.connected:
+            # 推送可用时只需低频兜底轮询
+            return max(interval, Config.SYSTEM_CONFIG.get('ws_safety_poll_interval', 30))
+        return interval
+
+    def fetch_statuses(self, asset, remote_ids):
+        return MarkRequestHandler(asset).check_status_batch(remote_ids)
+
+    async def fetch_statuses_async(self, http, asset, remote_ids):
+        handler = MarkRequestHandler(asset)
+        base_url = handler.comfy_config.base_url
+        active_ids = handler.parse_active_prompt_ids(await _get_json(http, f"{base_url}/api/queue"))
+
+        results = {}
+        for prompt_id in remote_ids:
+            if prompt_id in active_ids:
+                results[prompt_id] = (False, False, {"status": "processing", "progress": 0})
+                continue
+            try:
+                history = await _get_json(http, f"{base_url}/api/history/{prompt_id}")
+                results[prompt_id] = handler.parse_history(prompt_id, history)
+            except Exception as e:
+                logger.error(f"检查任务状态出错: {str(e)}")
+                results[prompt_id] = (False, False, {"status": "error_checking", "error": str(e), "progress": 0})
+        return results
+
+    def is_completed(self, result: Optional[Tuple[bool, bool, Dict]]) -> bool:
+        return bool(result and result[0])
+
+    def handle_result(self, task_id, result):
+        completed, success, task_info = result
+        return MarkingService._handle_mark_status(task_id, self.asset_id, completed, success, task_info)
+
+    def handle_cancelled(self, task_id):
+        logger.info(f"标记任务 {task_id} 状态为非打标状态，退出监听")
+        MarkingService._handle_shard_cancelled(task_id, self.asset_id)
+        MarkingService._release_batch_member(task_id)
+
+    def handle_error(self, task_id, error_count, error):
+        return MarkingService._handle_mark_check_error(task_id, error_count, error, self.max_error_retries)
+
+    def handle_failure(self, task_id, error):
+        MarkingService._handle_mark_monitor_failure(task_id, error)
+
+
+class TrainingStatusPoller(AssetStatusPoller):
+    """训练引擎任务轮询器"""
+    kind = 'training'
+    active_status = TaskStatus.TRAINING
+    poll_interval_key = 'train_poll_interval'
+    default_poll_interval = 30
+    max_error_retries = 10
+
+    def on_running(self, watch, result):
+        # 训练中在后台增量同步已生成的模型和预览图
+        TrainingOutputSyncer.request_sync(watch.task_id, self.asset_id)
+
+    def on_watch_removed(self, watch):
+        TrainingOutputSyncer.discard(watch.task_id)
+
+    def _error_interval(self, watches, interval):
+        # 出错初期使用较短的重试间隔
+        if any(watch.error_count < self.max_error_retries // 2 for watch in watches):
+            return 5
+        return interval
+
+    def fetch_statuses(self, asset, remote_ids):
+        handler = TrainRequestHandler(asset)
+        training_headers = ConfigService.get_asset_lora_headers(asset.id)
+        return handler.check_status_batch(remote_ids, training_headers)
+
+    async def fetch_statuses_async(self, http, asset, remote_ids):
+        handler = TrainRequestHandler(asset)
+        loop = asyncio.get_event_loop()
+        training_headers = await loop.run_in_executor(
+            poll_pool, ConfigService.get_asset_lora_headers, asset.id
+        )
+        try:
+            data = await _get_json(http, f"{handler.api_base_url}/tasks", headers=training_headers or {})
+            tasks_data = handler.parse_tasks_response(data)
+        except Exception as e:
+            raise ValueError(f"获取训练任务列表失败: {str(e)}")
+        return handler.map_task_statuses(tasks_data, remote_ids)
+
+    def is_completed(self, result: Optional[str]) -> bool:
+        return TrainingService._resolve_training_status(result)[0]
+
+    def handle_result(self, task_id, result):
+        return TrainingService._handle_training_status(task_id, self.asset_id, result)
+
+    def handle_cancelled(self, task_id):
+        TrainingService._handle_training_cancelled(task_id)
+
+    def handle_error(self, task_id, error_count, error):
+        return TrainingService._handle_training_check_error(task_id, error_count, error, self.max_error_retries)
+
+    def handle_failure(self, task_id, error):
+        TrainingService._handle_training_monitor_failure(task_id, error)
+
+
+class StatusPollerService:
+    """
+    任务状态监控引擎
+
+    在独立线程中运行asyncio事件循环，每个在途任务对应一个监控协程，
+    每个资产对应一个批量轮询协程，并限制单个资产的并发请求数。
+    """
+    _pollers: Dict[Tuple[str, int], AssetStatusPoller] = {}
+    _loop: Optional[asyncio.AbstractEventLoop] = None
+    _thread: Optional[threading.Thread] = None
+    _lock = threading.Lock()
+    _atexit_registered = False
+    _poller_classes = {
+        'marking': MarkingStatusPoller,
+        'training': TrainingStatusPoller,
+    }
+
+    @staticmethod
+    def _get_loop() -> asyncio.AbstractEventLoop:
+        """获取监控事件循环，首次调用时启动事件循环线程"""
+        with StatusPollerService._lock:
+            if StatusPollerService._thread is None or not StatusPollerService._thread.is_alive():
+                loop = asyncio.new_event_loop()
+                StatusPollerService._loop = loop
+                StatusPollerService._pollers = {}
+                StatusPollerService._thread = threading.Thread(
+                    target=StatusPollerService._run_loop,
+                    args=(loop,),
+                    name="status_monitor_loop",
+                    daemon=True
+                )
+                StatusPollerService._thread.start()
+                if not StatusPollerService._atexit_registered:
+                    atexit.register(StatusPollerService.shutdown)
+                    StatusPollerService._atexit_registered = True
+            return StatusPollerService._loop
+
+    @staticmethod
+    def _run_loop(loop: asyncio.AbstractEventLoop):
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+    @staticmethod
+    def _get_poller(kind: str, asset_id: int) -> AssetStatusPoller:
+        """获取资产轮询器，只在事件循环线程中调用"""
+        key = (kind, asset_id)
+        poller = StatusPollerService._pollers.get(key)
+        if poller is None:
+            poller = StatusPollerService._poller_classes[kind](asset_id)
+            StatusPollerService._pollers[key] = poller
+        return poller
+
+    @staticmethod
+    def watch(kind: str, task_id: int, asset_id: int, remote_id: str,
+              on_finished: Optional[Callable[[], None]] = None):
+        """
+        开始监控任务状态
+
+        Args:
+            kind: marking 或 training
+            task_id: 任务ID
+            asset_id: 执行任务的资产ID
+            remote_id: 远程任务ID（ComfyUI的prompt_id或训练引擎的任务ID）
+            on_finished: 监控结束后的回调，如释放任务租约
+        """
+        label = '标记' if kind == 'marking' else '训练'
+        with get_db() as db:
+            task = db.query(Task).filter(Task.id == task_id).first()
+            if task:
+                id_name = 'prompt_id' if kind == 'marking' else 'training_task_id'
+                task.add_log(f'开始监控{label}任务状态, {id_name}={remote_id}', db=db)
+
+        watch = StatusWatch(task_id, remote_id, on_finished)
+        loop = StatusPollerService._get_loop()
+        loop.call_soon_threadsafe(lambda: StatusPollerService._get_poller(kind, asset_id).add(watch))
+
+    @staticmethod
+    def cancel(task_id: int) -> bool:
+        """
+        取消任务的状态监控（如任务被终止时）
+
+        Returns:
+            是否找到并取消了监控协程
+        """
+        loop = StatusPollerService._loop
+        if loop is None or loop.is_closed() or not loop.is_running():
+            return False
+
+        async def _cancel():
+            # 分片任务在多个资产上都有监控，需全部取消
+            cancelled = [poller.cancel(task_id) for poller in list(StatusPollerService._pollers.values())]
+            return any(cancelled)
+
+        try:
+            return asyncio.run_coroutine_threadsafe(_cancel(), loop).result(timeout=5)
+        except Exception as e:
+            logger.error(f"取消任务 {task_id} 的状态监控失败: {str(e)}")
+            return False
+
+    @staticmethod
+    def shutdown(timeout: float = 5):
+        """
+        停止监控事件循环并关闭各轮询器的HTTP会话
+
+        不触发监控结束回调，任务租约不会释放，过期后由其他调度进程接管监控。
+        """
+        with StatusPollerService._lock:
+            loop, thread = StatusPollerService._loop, StatusPollerService._thread
+        if loop is None or loop.is_closed() or not loop.is_running():
+            return
+
+        async def _close():
+            for poller in list(StatusPollerService._pollers.values()):
+                await poller.close_http()
+
+        try:
+            asyncio.run_coroutine_threadsafe(_close(), loop).result(timeout=timeout)
+        except Exception as e:
+            logger.error(f"关闭状态监控的HTTP会话失败: {str(e)}")
+        loop.call_soon_threadsafe(loop.stop)
+        if thread and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    @staticmethod
+    def get_watched_tasks() -> Dict[str, List[int]]:
+        """获取各资产正在监控的任务ID，用于排查"""
+        pollers = list(StatusPollerService._pollers.items())
+        return {f"{kind}_{asset_id}": poller.get_task_ids() for (kind, asset_id), poller in pollers}
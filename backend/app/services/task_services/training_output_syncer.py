@@ -0,0 +1,127 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, Optional, Tuple
+from ...models.task import Task, TaskExecutionHistory
+from ...models.asset import Asset
+from ...database import get_db
+from ...config import Config
+from ...utils.logger import setup_logger
+from ...utils.ssh import create_ssh_client_from_asset
+
+logger = setup_logger('training_output_syncer')
+
+
+class _SyncState:
+    """单个训练任务的增量同步状态"""
+
+    def __init__(self):
+        self.last_sync = 0.0
+        self.future: Optional[Future] = None
+        # 上次列出的远程文件 {相对路径: (大小, 修改时间)}
+        self.seen: Dict[str, Tuple[int, str]] = {}
+
+
+class TrainingOutputSyncer:
+    """
+    训练过程中的输出目录增量同步
+
+    训练运行期间定期拉取远程 output_dir 中新生成的模型和预览图，训练中即可在界面查看预览，
+    训练完成后的最终同步只需下载剩余文件。为避免下载正在写入的文件，只下载大小和修改时间
+    与上一次列目录结果一致的文件。
+    """
+    _states: Dict[int, _SyncState] = {}
+    _lock = threading.Lock()
+    _executor = ThreadPoolExecutor(
+        max_workers=Config.SYSTEM_CONFIG.get('training_sync_workers', 2),
+        thread_name_prefix="TrainingOutputSync"
+    )
+
+    @staticmethod
+    def request_sync(task_id: int, asset_id: int):
+        """训练仍在运行时调用，距上次同步超过间隔且没有进行中的同步时在后台同步一次"""
+        interval = Config.SYSTEM_CONFIG.get('training_sync_interval', 60)
+        if interval <= 0:
+            return
+        with TrainingOutputSyncer._lock:
+            state = TrainingOutputSyncer._states.setdefault(task_id, _SyncState())
+            if state.future and not state.future.done():
+                return
+            if time.time() - state.last_sync < interval:
+                return
+            state.last_sync = time.time()
+            state.future = TrainingOutputSyncer._executor.submit(
+                TrainingOutputSyncer._sync, task_id, asset_id, state
+            )
+
+    @staticmethod
+    def finish(task_id: int, timeout: Optional[float] = None) -> bool:
+        """
+        结束任务的增量同步，等待进行中的同步完成，最终同步前调用以免同时写入同一文件
+
+        Args:
+            timeout: 最长等待时间（秒），为空时一直等待
+
+        Returns:
+            进行中的同步是否已结束，超时返回False
+        """
+        with TrainingOutputSyncer._lock:
+            state = TrainingOutputSyncer._states.pop(task_id, None)
+        if not state or not state.future:
+            return True
+        try:
+            state.future.result(timeout=timeout)
+        except FutureTimeoutError:
+            logger.warning(f"等待训练任务 {task_id} 的增量同步超过 {timeout} 秒，不再等待")
+            return False
+        except Exception as e:
+            logger.warning(f"等待训练任务 {task_id} 的增量同步结束失败: {str(e)}")
+        return True
+
+    @staticmethod
+    def discard(task_id: int):
+        """任务监控结束时清理同步状态，不等待进行中的同步"""
+        with TrainingOutputSyncer._lock:
+            TrainingOutputSyncer._states.pop(task_id, None)
+
+    @staticmethod
+    def _sync(task_id: int, asset_id: int, state: _SyncState):
+        try:
+            with get_db() as db:
+                task = db.query(Task).filter(Task.id == task_id).first()
+                asset = db.query(Asset).filter(Asset.id == asset_id).first()
+                if not task or not asset or asset.is_local or not task.execution_history_id:
+                    return
+                execution_history = db.query(TaskExecutionHistory).filter(
+                    TaskExecutionHistory.id == task.execution_history_id
+                ).first()
+                training_config = execution_history.training_config if execution_history else None
+                if not training_config or not training_config.get('output_dir'):
+                    return
+                remote_dir = training_config['output_dir']
+                local_dir = execution_history.training_output_path
+                ssh_client = create_ssh_client_from_asset(asset)
+
+            seen = state.seen
+            current = {}
+
+            def is_stable(rel_path: str, info: Dict) -> bool:
+                key = (info['size'], info['mtime'])
+                current[rel_path] = key
+                return seen.get(rel_path) == key
+
+            success, message, stats = ssh_client.download_directory(remote_dir, local_dir, include=is_stable)
+            state.seen = current
+            if not success:
+                logger.warning(f"训练任务 {task_id} 增量同步失败: {message}")
+                return
+
+            synced = stats['added'] + stats['updated']
+            if synced:
+                logger.info(f"训练任务 {task_id} 增量同步 {synced} 个文件")
+                with get_db() as db:
+                    task = db.query(Task).filter(Task.id == task_id).first()
+                    if task:
+                        task.add_log(f'训练中同步结果: {message}', db=db)
+        except Exception as e:
+            logger.error(f"训练任务 {task_id} 增量同步出错: {str(e)}")
@@ -1,4 +1,4 @@
-from typing import List, Dict,Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime
 from sqlalchemy.orm import Session
 from ...models.task import Task, TaskStatus, TaskExecutionHistory
@@ -12,6 +12,9 @@ from ...utils.common import copy_attributes
 from ...utils.ssh import create_ssh_client_from_asset, SSHClientTool
 from ...services.asset_service import AssetService
 from ...config import Config
+from .scheduler_events import SchedulerEvents
+from .claim_service import ClaimService
+from .training_output_syncer import TrainingOutputSyncer
 import json
 import traceback
 import os
@@ -22,13 +25,15 @@ import shutil
 logger = setup_logger('training_service')
 
 class TrainingService:
+    # 单个资产的最大并发任务数
+    MAX_TASKS_PER_ASSET = 1
+
     @staticmethod
     def get_available_training_assets() -> List[Asset]:
         """获取可用于训练的资产"""
         try:
             assets = AssetService.verify_all_assets('lora_training')
-            # 训练资产最大并发数固定为1
-            return [asset for asset in assets if asset.training_tasks_count < 1]
+            return [asset for asset in assets if asset.training_tasks_count < TrainingService.MAX_TASKS_PER_ASSET]
         except Exception as e:
             logger.error(f"获取可用训练资产失败: {str(e)}")
             return []
@@ -100,6 +105,7 @@ class TrainingService:
         
         # 更新任务状态
         task.update_status(TaskStatus.TRAINING, '准备开始训练', db=db)
+        SchedulerEvents.notify('training_submitted')
         return task.to_dict()
     
     @staticmethod
@@ -319,26 +325,22 @@ class TrainingService:
         
         # 创建SSH客户端工具
         ssh_client = create_ssh_client_from_asset(asset)
-        
-        # 在远程服务器上创建训练数据目录
-        success, message = ssh_client.mkdir(remote_train_data_dir)
-        if not success:
-            raise ValueError(f"创建远程训练数据目录失败: {message}")
-        
-        # 清空远程训练数据目录
-        result = ssh_client.execute_command(f"rm -rf {remote_train_data_dir}/*")
-        if result.returncode != 0:
-            task.add_log(f'清空目录警告: {result.stderr}', db=db)
 
         # 检查是否需要同步标记结果（如果训练和打标资产不同）
         if not task.marking_asset or task.marking_asset_id != asset.id:
             task.add_log('训练和打标资产不同，需要同步打标结果到训练资产...', db=db)
             
-            # 上传打标结果
+            # 在远程服务器上创建训练数据目录（已确认存在时不执行远程命令）
+            success, message = ssh_client.mkdir(remote_train_data_dir)
+            if not success:
+                raise ValueError(f"创建远程训练数据目录失败: {message}")
+            
+            # 增量上传打标结果，并删除远程训练数据目录中多余的文件（不再整体清空后重传）
             success, message, stats = ssh_client.upload_directory(
                 local_path=input_dir,
                 remote_path=remote_train_data_dir,
-                recursive = False
+                recursive = False,
+                prune = True
             )
             
             if not success:
@@ -346,6 +348,10 @@ class TrainingService:
             
             task.add_log(f'打标结果同步成功: {message}', db=db)
         else:
+            # 创建并清空远程训练数据目录，一条命令完成
+            result = ssh_client.clear_directory(remote_train_data_dir)
+            if result.returncode != 0:
+                task.add_log(f'清空目录警告: {result.stderr}', db=db)
             task.add_log('训练和打标使用相同资产，无需同步打标结果', db=db)
     
     @staticmethod
@@ -493,8 +499,9 @@ class TrainingService:
                     task.update_status(TaskStatus.ERROR, f'训练请求失败: {str(req_error)}', db=db)
                     task.add_log(error_json, db=db)
                     if task.training_asset:
-                        task.training_asset.training_tasks_count = max(0, task.training_asset.training_tasks_count - 1)
+                        ClaimService.release_asset_slot(db, task.training_asset_id, 'training')
                         db.commit()
+                        SchedulerEvents.notify('training_asset_released')
                     raise ValueError(f"训练请求失败: {str(req_error)}")
                     
         except Exception as e:
@@ -509,216 +516,207 @@ class TrainingService:
                         "traceback": str(traceback.format_exc())
                     }, indent=2), db=db)
                     if task.training_asset:
-                        task.training_asset.training_tasks_count = max(0, task.training_asset.training_tasks_count - 1)
+                        ClaimService.release_asset_slot(db, task.training_asset_id, 'training')
                         db.commit()
+                        SchedulerEvents.notify('training_asset_released')
             raise
             
     @staticmethod
-    def _monitor_training_status(task_id: int, asset_id: int, training_task_id: str):
-        """监控训练任务状态"""
-        try:
-            with get_db() as db:
-                task = db.query(Task).filter(Task.id == task_id).first()
-                asset = db.query(Asset).filter(Asset.id == asset_id).first()
-
-                if not task or not asset:
-                    raise ValueError("任务或资产不存在")
-                
-                # 记录开始监控
-                task.add_log(f'开始监控训练任务状态, training_task_id={training_task_id}', db=db)
-                poll_interval = ConfigService.get_value('train_poll_interval', 30)
-                error_count = 0
-                max_error_retries = 10
+    def _resolve_training_status(status: str) -> Tuple[bool, bool]:
+        """
+        根据训练引擎返回的状态判断任务是否完成
+        
+        Returns:
+            (是否完成, 是否成功)
+        """
+        if status == "FINISHED":
+            return True, True
+        if status in ["FAILED", "TERMINATED"]:
+            return True, False
+        if status == "NOT_FOUND":
+            logger.warning("训练任务未找到，可能训练引擎已经重启")
+            return True, False
+        return False, False
+    
+    @staticmethod
+    def _handle_training_cancelled(task_id: int):
+        """训练过程中任务被取消，更新执行历史记录状态为ERROR"""
+        logger.info("监听训练过程中任务被取消")
+        with get_db() as db:
+            task = db.query(Task).filter(Task.id == task_id).first()
+            if not task or not task.execution_history_id:
+                return
+            execution_history = db.query(TaskExecutionHistory).filter(
+                TaskExecutionHistory.id == task.execution_history_id
+            ).first()
+            if execution_history and execution_history.status == 'RUNNING':
+                execution_history.status = 'ERROR'
+                execution_history.end_time = datetime.now()
+                execution_history.description += f"\n任务被取消于 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+                db.commit()
+    
+    @staticmethod
+    def _handle_training_status(task_id: int, asset_id: int, status: str) -> bool:
+        """
+        处理一次训练状态检查的结果
+        
+        Args:
+            task_id: 任务ID
+            asset_id: 资产ID
+            status: 训练引擎返回的任务状态
+            
+        Returns:
+            是否结束监控（任务已完成、失败或被取消）
+        """
+        is_completed, is_success = TrainingService._resolve_training_status(status)
+        
+        with get_db() as complete_db:
+            task = complete_db.query(Task).filter(Task.id == task_id).first()
+            if not task:
+                return True
+            # 检查任务是否被取消
+            if task.status != TaskStatus.TRAINING:
+                TrainingService._handle_training_cancelled(task_id)
+                return True
+            
+            if not is_completed:
+                return False
+            
+            # 获取执行历史记录
+            execution_history = None
+            if task.execution_history_id:
+                execution_history = complete_db.query(TaskExecutionHistory).filter(
+                    TaskExecutionHistory.id == task.execution_history_id
+                ).first()
+            
+            if is_success:
+                # 获取最新的asset对象，避免会话分离问题
+                current_asset = complete_db.query(Asset).filter(Asset.id == asset_id).first()
                 
-                while True:
-                    try:
-                        # 在每次循环中使用新的数据库会话获取新的asset对象
-                        with get_db() as status_db:
-                            current_asset = status_db.query(Asset).filter(Asset.id == asset_id).first()
-                            if not current_asset:
-                                raise ValueError(f"资产ID {asset_id} 不存在")
-                                
-                            # 创建训练处理器，使用新获取的资产对象
-                            handler = TrainRequestHandler(current_asset)
-                            
-                            # 获取训练状态
-                            training_headers = ConfigService.get_asset_lora_headers(asset.id)
-                            status = handler.check_status(training_task_id, training_headers)
-                            logger.info(f"检查训练任务状态: {status}")
-                        
-                        # 判断任务状态
-                        is_completed = False
-                        is_success = False
-                        
-                        if status == "FINISHED":
-                            is_completed = True
-                            is_success = True
-                        elif status in ["FAILED", "TERMINATED"]:
-                            is_completed = True
-                            is_success = False
-                        elif status == "NOT_FOUND":
-                            logger.warning("训练任务未找到，可能训练引擎已经重启")
-                            is_completed = True
-                            is_success = False
-                        
-                        with get_db() as complete_db:
-                            task = complete_db.query(Task).filter(Task.id == task_id).first()
-                            # 检查任务是否被取消
-                            if task and task.status != TaskStatus.TRAINING:
-                                logger.info("监听训练过程中任务被取消")
-                                
-                                # 更新执行历史记录状态为ERROR
-                                if task.execution_history_id:
-                                    execution_history = complete_db.query(TaskExecutionHistory).filter(
-                                        TaskExecutionHistory.id == task.execution_history_id
-                                    ).first()
-                                    if execution_history:
-                                        execution_history.status = 'ERROR'
-                                        execution_history.end_time = datetime.now()
-                                        execution_history.description += f"\n任务被取消于 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-                                        complete_db.commit()
-                                
-                                break
-                            
-                            # 任务完成处理
-                            if is_completed and task:
-                                # 获取执行历史记录
-                                execution_history = None
-                                if task.execution_history_id:
-                                    execution_history = complete_db.query(TaskExecutionHistory).filter(
-                                        TaskExecutionHistory.id == task.execution_history_id
-                                    ).first()
-                                
-                                if is_success:
-                                    # 获取最新的asset对象，避免会话分离问题
-                                    current_asset = complete_db.query(Asset).filter(Asset.id == asset_id).first()
-                                    
-                                    # 如果是非本地资产，需要下载训练结果
-                                    if current_asset and not current_asset.is_local and execution_history.training_config and execution_history.training_config.get('output_dir'):
-                                        task.add_log('训练完成，开始从远程服务器同步结果...', db=complete_db)
-                                        
-                                        # 创建SSH客户端工具
-                                        ssh_client = create_ssh_client_from_asset(current_asset)
-                                        
-                                        # 使用SSH客户端下载远程输出目录到本地
-                                        success, message, stats = ssh_client.download_directory(
-                                            remote_path=execution_history.training_config['output_dir'],
-                                            local_path=execution_history.training_output_path
-                                        )
-                                        
-                                        if not success:
-                                            task.add_log(f'同步结果失败: {message}', db=complete_db)
-                                            task.update_status(TaskStatus.ERROR, f'同步训练结果失败: {message}', db=complete_db)
-                                            break
-                                        
-                                        task.add_log(f'训练结果同步成功: {message}', db=complete_db)
-                                    
-                                    # 更新任务状态为完成
-                                    task.update_status(TaskStatus.COMPLETED, '训练完成', db=complete_db)
-                                    task.progress = 100
-                                    task.add_log('训练任务成功完成', db=complete_db)
-                                    
-                                    # 记录输出文件路径
-                                    output_dir = execution_history.training_output_path
-                                    task.add_log(f'训练输出目录: {output_dir}', db=complete_db)
-                                    
-                                    # 获取训练结果
-                                    from ...services.task_services.result_service import ResultService
-                                    training_results = ResultService.get_training_results(task_id)
-                                    
-                                    # 获取训练loss数据
-                                    try:
-                                        loss_result = ResultService.get_training_loss_data(task_id)
-                                        if loss_result and loss_result.get('success') and loss_result.get('series'):
-                                            loss_data = {'series': loss_result.get('series')}
-                                        else:
-                                            loss_data = None
-                                    except Exception as loss_err:
-                                        logger.error(f"获取训练loss数据失败: {str(loss_err)}")
-                                        loss_data = None
-                                    
-                                    # 如果有执行历史记录，更新其状态和结果
-                                    if execution_history:
-                                        execution_history.status = 'COMPLETED'
-                                        execution_history.end_time = datetime.now()
-                                        execution_history.training_results = training_results
-                                        # 保存loss数据
-                                        if loss_data:
-                                            execution_history.loss_data = loss_data
-                                        execution_history.description += f"\n训练成功完成于 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-                                        complete_db.commit()
-                                else:
-                                    # 处理训练失败情况
-                                    task.update_status(
-                                        TaskStatus.ERROR,
-                                        f'训练失败，任务状态为: {status}',
-                                        db=complete_db
-                                    )
-                                    
-                                    # 更新执行历史记录状态
-                                    if execution_history:
-                                        execution_history.status = 'ERROR'
-                                        execution_history.end_time = datetime.now()
-                                        execution_history.description += f"\n训练失败于 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}: {status}"
-                                        complete_db.commit()
-                            
-                                # 更新资产任务计数
-                                if task.training_asset:
-                                    task.training_asset.training_tasks_count = max(0, task.training_asset.training_tasks_count - 1)
-                                    complete_db.commit()
-                                break
+                # 如果是非本地资产，需要下载训练结果
+                if current_asset and not current_asset.is_local and execution_history.training_config and execution_history.training_config.get('output_dir'):
+                    task.add_log('训练完成，开始从远程服务器同步结果...', db=complete_db)
+                    # 等待训练中的增量同步结束，之后只需下载剩余文件；同步卡住时不再等待，直接完整同步
+                    if not TrainingOutputSyncer.finish(
+                        task_id, timeout=Config.SYSTEM_CONFIG.get('training_sync_finish_timeout', 120)
+                    ):
+                        task.add_log('训练中的增量同步未按时结束，继续完整同步', db=complete_db)
                     
-                        # 重置错误计数
-                        if error_count > 0:
-                            logger.info(f"从错误状态恢复，重置错误计数器。之前错误次数: {error_count}")
-                        error_count = 0
+                    # 创建SSH客户端工具
+                    ssh_client = create_ssh_client_from_asset(current_asset)
                     
-                    except Exception as check_err:
-                        # 处理检查状态时的错误
-                        error_count += 1
-                        
-                        # 根据错误次数决定等待时间
-                        wait_time = 5 if error_count <= max_error_retries // 2 else poll_interval
-                        logger.error(f"检查训练状态时出错 ({error_count}/{max_error_retries}): {str(check_err)}, 将在{wait_time}秒后重试")
-                        
-                        with get_db() as err_db:
-                            task = err_db.query(Task).filter(Task.id == task_id).first()
-                            if task:
-                                task.add_log(f'检查任务状态出错 ({error_count}/{max_error_retries}): {str(check_err)}', db=err_db)
-                            
-                            # 如果错误次数达到上限，停止监控
-                            if error_count >= max_error_retries:
-                                task = err_db.query(Task).filter(Task.id == task_id).first()
-                                if task:
-                                    task.update_status(
-                                        TaskStatus.ERROR, 
-                                        f'连续{max_error_retries}次检查状态失败，停止监控: {str(check_err)}', 
-                                        db=err_db
-                                    )
-                                    if task.training_asset:
-                                        task.training_asset.training_tasks_count = max(0, task.training_asset.training_tasks_count - 1)
-                                        err_db.commit()
-                                break
-                        
-                        # 等待一段时间后重试
-                        time.sleep(wait_time)
-                        continue
+                    # 使用SSH客户端下载远程输出目录到本地
+                    success, message, stats = ssh_client.download_directory(
+                        remote_path=execution_history.training_config['output_dir'],
+                        local_path=execution_history.training_output_path
+                    )
+                    
+                    if not success:
+                        task.add_log(f'同步结果失败: {message}', db=complete_db)
+                        task.update_status(TaskStatus.ERROR, f'同步训练结果失败: {message}', db=complete_db)
+                        return True
+                    
+                    task.add_log(f'训练结果同步成功: {message}', db=complete_db)
                 
-                    # 正常轮询间隔
-                    time.sleep(poll_interval)
-
-        except Exception as e:
-            # 处理整体监控异常
-            logger.error(f"监控训练任务状态失败: {str(e)}")
-            with get_db() as db:
-                task = db.query(Task).filter(Task.id == task_id).first()
-                if task:
-                    task.update_status(TaskStatus.ERROR, f'监控失败: {str(e)}', db=db)
-                    task.add_log(json.dumps({
-                        "message": str(e),
-                        "type": type(e).__name__,
-                        "traceback": str(traceback.format_exc())
-                    }, indent=2), db=db)
-                    if task.training_asset:
-                        task.training_asset.training_tasks_count = max(0, task.training_asset.training_tasks_count - 1)
-                        db.commit() 
\ No newline at end of file
+                # 更新任务状态为完成
+                task.update_status(TaskStatus.COMPLETED, '训练完成', db=complete_db)
+                task.progress = 100
+                task.add_log('训练任务成功完成', db=complete_db)
+                
+                # 记录输出文件路径
+                output_dir = execution_history.training_output_path
+                task.add_log(f'训练输出目录: {output_dir}', db=complete_db)
+                
+                # 获取训练结果
+                from ...services.task_services.result_service import ResultService
+                training_results = ResultService.get_training_results(task_id)
+                
+                # 获取训练loss数据
+                try:
+                    loss_result = ResultService.get_training_loss_data(task_id)
+                    if loss_result and loss_result.get('success') and loss_result.get('series'):
+                        loss_data = {'series': loss_result.get('series')}
+                    else:
+                        loss_data = None
+                except Exception as loss_err:
+                    logger.error(f"获取训练loss数据失败: {str(loss_err)}")
+                    loss_data = None
+                
+                # 如果有执行历史记录，更新其状态和结果
+                if execution_history:
+                    execution_history.status = 'COMPLETED'
+                    execution_history.end_time = datetime.now()
+                    execution_history.training_results = training_results
+                    # 保存loss数据
+                    if loss_data:
+                        execution_history.loss_data = loss_data
+                    execution_history.description += f"\n训练成功完成于 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+                    complete_db.commit()
+            else:
+                # 处理训练失败情况
+                task.update_status(
+                    TaskStatus.ERROR,
+                    f'训练失败，任务状态为: {status}',
+                    db=complete_db
+                )
+                
+                # 更新执行历史记录状态
+                if execution_history:
+                    execution_history.status = 'ERROR'
+                    execution_history.end_time = datetime.now()
+                    execution_history.description += f"\n训练失败于 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}: {status}"
+                    complete_db.commit()
+            
+            # 更新资产任务计数
+            if task.training_asset:
+                ClaimService.release_asset_slot(complete_db, task.training_asset_id, 'training')
+                complete_db.commit()
+                SchedulerEvents.notify('training_asset_released')
+            return True
+    
+    @staticmethod
+    def _handle_training_check_error(task_id: int, error_count: int, check_err: Exception, max_retries: int = 10) -> bool:
+        """
+        处理检查训练状态时的错误
+        
+        Returns:
+            是否结束监控（连续失败次数达到上限）
+        """
+        logger.error(f"检查训练状态时出错 ({error_count}/{max_retries}): {str(check_err)}")
+        with get_db() as err_db:
+            task = err_db.query(Task).filter(Task.id == task_id).first()
+            if task:
+                task.add_log(f'检查任务状态出错 ({error_count}/{max_retries}): {str(check_err)}', db=err_db)
+            if error_count < max_retries:
+                return False
+            
+            # 如果错误次数达到上限，停止监控
+            if task:
+                task.update_status(
+                    TaskStatus.ERROR, 
+                    f'连续{max_retries}次检查状态失败，停止监控: {str(check_err)}', 
+                    db=err_db
+                )
+                if task.training_asset:
+                    ClaimService.release_asset_slot(err_db, task.training_asset_id, 'training')
+                    err_db.commit()
+                    SchedulerEvents.notify('training_asset_released')
+            return True
+    
+    @staticmethod
+    def _handle_training_monitor_failure(task_id: int, e: Exception):
+        """处理监控过程中的意外异常，将任务置为错误状态并释放资产"""
+        logger.error(f"监控训练任务状态失败: {str(e)}")
+        with get_db() as db:
+            task = db.query(Task).filter(Task.id == task_id).first()
+            if task:
+                task.update_status(TaskStatus.ERROR, f'监控失败: {str(e)}', db=db)
+                task.add_log(json.dumps({
+                    "message": str(e),
+                    "type": type(e).__name__,
+                    "traceback": str(traceback.format_exc())
+                }, indent=2), db=db)
+                if task.training_asset:
+                    ClaimService.release_asset_slot(db, task.training_asset_id, 'training')
+                    db.commit()
+                    SchedulerEvents.notify('training_asset_released')
@@ -0,0 +1,132 @@
+import threading
+from typing import Dict, Callable, Optional, Tuple
+from .logger import setup_logger
+from task_scheduler.comfyui_api import ComfyUIConfig
+from task_scheduler.comfyui_ws_api import ComfyUIWebSocketAPI, WebSocketCallbacks
+
+logger = setup_logger('comfyui_ws_multiplexer')
+
+# 事件类型
+EVENT_PROGRESS = 'progress'
+EVENT_COMPLETED = 'completed'
+EVENT_ERROR = 'error'
+
+
+class ComfyUIEventMultiplexer:
+    """
+    ComfyUI WebSocket 事件多路复用器
+
+    每个ComfyUI实例只保持一条WebSocket连接，按 prompt_id 把 progress、完成和错误事件
+    分发给订阅该 prompt 的监听函数。监听函数在WebSocket线程中调用，不应执行耗时操作。
+
+    ComfyUI只把执行事件推送给提交prompt时使用的 client_id，因此连接必须使用与提交时相同的
+    client_id（lora_tool）。
+    """
+    _instances: Dict[Tuple[int, str], 'ComfyUIEventMultiplexer'] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, config: ComfyUIConfig):
+        self.config = config
+        self._listeners: Dict[str, Callable[[str, Dict], None]] = {}
+        self._lock = threading.Lock()
+        self._running_prompt_id: Optional[str] = None
+        self.ws_api = ComfyUIWebSocketAPI(
+            config,
+            WebSocketCallbacks(
+                on_connected=self._on_connected,
+                on_disconnected=self._on_disconnected,
+                on_executing=self._on_executing,
+                on_progress=self._on_progress,
+                on_execution_error=self._on_execution_error,
+                on_custom_message=self._on_custom_message
+            ),
+            max_retries=None
+        )
+
+    @staticmethod
+    def for_asset(asset_id: int, config: ComfyUIConfig) -> 'ComfyUIEventMultiplexer':
+        """获取资产对应的多路复用器，地址变化时创建新的连接"""
+        key = (asset_id, f"{config.base_url}|{config.client_id}")
+        with ComfyUIEventMultiplexer._instances_lock:
+            mux = ComfyUIEventMultiplexer._instances.get(key)
+            if mux is None:
+                # 资产地址变化后关闭旧连接
+                for old_key in [k for k in ComfyUIEventMultiplexer._instances if k[0] == asset_id]:
+                    ComfyUIEventMultiplexer._instances.pop(old_key).close()
+                mux = ComfyUIEventMultiplexer(config)
+                ComfyUIEventMultiplexer._instances[key] = mux
+            return mux
+
+    @property
+    def connected(self) -> bool:
+        return self.ws_api.is_connected
+
+    def subscribe(self, prompt_id: str, listener: Callable[[str, Dict], None]):
+        """
+        订阅prompt的执行事件，必要时建立连接
+
+        Args:
+            prompt_id: ComfyUI的prompt_id
+            listener: 监听函数 listener(event, data)，event为 progress、completed 或 error
+        """
+        with self._lock:
+            self._listeners[prompt_id] = listener
+            if not self.ws_api.is_running:
+                self.ws_api.connect()
+
+    def unsubscribe(self, prompt_id: str):
+        """取消订阅，没有订阅者时关闭连接"""
+        with self._lock:
+            self._listeners.pop(prompt_id, None)
+            idle = not self._listeners
+        if idle:
+            self.close()
+
+    def close(self):
+        """关闭WebSocket连接"""
+        try:
+            self.ws_api.disconnect()
+        except Exception as e:
+            logger.error(f"关闭ComfyUI WebSocket连接失败: {str(e)}")
+
+    def _dispatch(self, event: str, data: Dict, prompt_id: Optional[str] = None):
+        prompt_id = prompt_id or data.get('prompt_id')
+        if not prompt_id:
+            return
+        with self._lock:
+            listener = self._listeners.get(prompt_id)
+        if listener:
+            try:
+                listener(event, data)
+            except Exception as e:
+                logger.error(f"处理prompt {prompt_id} 的 {event} 事件失败: {str(e)}")
+
+    def _on_connected(self):
+        logger.info(f"ComfyUI事件连接已建立: {self.config.base_url}")
+
+    def _on_disconnected(self):
+        logger.warning(f"ComfyUI事件连接已断开: {self.config.base_url}，期间使用HTTP轮询")
+
+    def _on_executing(self, data: Dict):
+        prompt_id = data.get('prompt_id')
+        if data.get('node') is None:
+            # node为空表示整个prompt执行结束
+            self._running_prompt_id = None
+            self._dispatch(EVENT_COMPLETED, data, prompt_id)
+        else:
+            self._running_prompt_id = prompt_id
+
+    def _on_progress(self, data: Dict):
+        # 旧版本ComfyUI的progress事件不带prompt_id，使用当前执行中的prompt
+        self._dispatch(EVENT_PROGRESS, data, data.get('prompt_id') or self._running_prompt_id)
+
+    def _on_execution_error(self, data: Dict):
+        self._dispatch(EVENT_ERROR, data)
+
+    def _on_custom_message(self, message: Dict):
+        msg_type = message.get('type')
+        data = message.get('data', {}) or {}
+        if msg_type == 'execution_success':
+            self._dispatch(EVENT_COMPLETED, data)
+        elif msg_type == 'execution_interrupted':
+            self._dispatch(EVENT_ERROR, data)
@@ -1,6 +1,7 @@
 import json
 import os
 import hashlib
+import shutil
 from typing import Dict, List, Any
 from ..utils.logger import setup_logger
 
@@ -48,6 +49,17 @@ def calculate_md5(file_path: str) -> str:
         logger.error(f"计算文件MD5失败 {file_path}: {e}")
         return ""
 
+def link_or_copy(src: str, dst: str):
+    """硬链接文件到目标路径，跨文件系统时复制，目标已存在时覆盖"""
+    if os.path.exists(dst):
+        if os.path.samefile(src, dst):
+            return
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
 def generate_unique_folder_path(base_dir: str, task_id: int, path_type: str) -> str:
     """
     生成唯一的文件夹路径，格式为 base_dir/task_id_序号
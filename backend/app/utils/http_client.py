@@ -0,0 +1,125 @@
+import threading
+from typing import Any, Dict, Optional, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .logger import setup_logger
+from ..config import Config
+
+logger = setup_logger('http_client')
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """未指定timeout的请求使用默认超时时间"""
+
+    def __init__(self, *args, timeout: Optional[Tuple[float, float]] = None, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+class HttpClientRegistry:
+    """
+    进程内的HTTP会话注册表
+
+    按资产和服务地址缓存 requests.Session，复用keep-alive连接（域名模式下同时复用TLS会话），
+    避免每次状态查询都重新建立连接。资产信息变更后调用 invalidate 关闭旧连接；
+    其他进程（如独立调度进程）通过传入资产的 updated_at 发现变更，自动关闭旧会话。
+
+    状态轮询使用单独的会话：读取超时较短且不重试，避免远程服务无响应时长时间占用轮询线程，
+    失败的查询由下一轮轮询兜底。
+    """
+    _sessions: Dict[Tuple[Optional[int], str, bool], requests.Session] = {}
+    # 资产ID -> 创建会话时的资产 updated_at
+    _versions: Dict[Optional[int], Any] = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _create_session(poll: bool = False) -> requests.Session:
+        config = Config.HTTP_CLIENT_CONFIG
+        if poll:
+            retry = Retry(total=0, raise_on_status=False)
+            timeout = (config['connect_timeout'], config['poll_read_timeout'])
+        else:
+            # 只重试幂等请求，避免重复提交打标或训练任务
+            retry = Retry(
+                total=config['max_retries'],
+                connect=config['max_retries'],
+                read=config['max_retries'],
+                backoff_factor=config['backoff_factor'],
+                status_forcelist=(502, 503, 504),
+                allowed_methods=frozenset(['GET', 'HEAD', 'OPTIONS']),
+                raise_on_status=False
+            )
+            timeout = (config['connect_timeout'], config['read_timeout'])
+        adapter = TimeoutHTTPAdapter(
+            pool_connections=config['pool_connections'],
+            pool_maxsize=config['pool_maxsize'],
+            max_retries=retry,
+            timeout=timeout
+        )
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    @staticmethod
+    def get_session(asset_id: Optional[int], base_url: str, version: Any = None,
+                    poll: bool = False) -> requests.Session:
+        """
+        获取资产服务地址对应的会话，不存在时创建
+
+        Args:
+            asset_id: 资产ID
+            base_url: 服务地址，如 http://1.2.3.4:8188
+            version: 资产的 updated_at，与缓存会话创建时不同时先关闭该资产的全部旧会话
+            poll: 是否为状态轮询会话（短超时、不重试）
+        """
+        key = (asset_id, base_url, poll)
+        session = HttpClientRegistry._sessions.get(key)
+        if session is not None and (version is None or HttpClientRegistry._versions.get(asset_id) == version):
+            return session
+        if version is not None and HttpClientRegistry._versions.get(asset_id, version) != version:
+            logger.info(f"资产 {asset_id} 信息已变更，关闭旧的HTTP会话")
+            HttpClientRegistry.invalidate(asset_id)
+        with HttpClientRegistry._lock:
+            if version is not None:
+                HttpClientRegistry._versions[asset_id] = version
+            session = HttpClientRegistry._sessions.get(key)
+            if session is None:
+                session = HttpClientRegistry._create_session(poll)
+                HttpClientRegistry._sessions[key] = session
+                logger.debug(f"创建HTTP会话: 资产 {asset_id} {base_url}")
+            return session
+
+    @staticmethod
+    def invalidate(asset_id: int):
+        """关闭并移除资产的全部会话，资产地址或端口变更、资产删除时调用"""
+        with HttpClientRegistry._lock:
+            keys = [key for key in HttpClientRegistry._sessions if key[0] == asset_id]
+            sessions = [HttpClientRegistry._sessions.pop(key) for key in keys]
+            HttpClientRegistry._versions.pop(asset_id, None)
+        for session in sessions:
+            try:
+                session.close()
+            except Exception as e:
+                logger.error(f"关闭资产 {asset_id} 的HTTP会话失败: {str(e)}")
+        if sessions:
+            logger.info(f"已关闭资产 {asset_id} 的 {len(sessions)} 个HTTP会话")
+
+    @staticmethod
+    def close_all():
+        """关闭全部会话"""
+        with HttpClientRegistry._lock:
+            sessions = list(HttpClientRegistry._sessions.values())
+            HttpClientRegistry._sessions.clear()
+            HttpClientRegistry._versions.clear()
+        for session in sessions:
+            try:
+                session.close()
+            except Exception:
+                pass
@@ -0,0 +1,153 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+from .logger import setup_logger
+from .sync_manifest import build_local_manifest
+from .file_handler import link_or_copy
+from ..config import Config
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # 未安装Pillow时不做本地预处理，直接上传原图
+    Image = None
+
+logger = setup_logger('image_preprocess')
+
+# 预处理结果缓存目录，文件名为 {原图sha256}_{分辨率}{扩展名}
+PREPROCESS_CACHE_DIR = os.path.join(Config.DATA_DIR, '.preprocess_cache')
+# 各任务预处理后的待上传目录
+PREPROCESS_DIR = os.path.join(Config.DATA_DIR, 'preprocessed')
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp'}
+
+_pool: Optional[ProcessPoolExecutor] = None
+_missing_pillow_warned = False
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # 使用spawn启动子进程，避免在多线程进程中fork
+        _pool = ProcessPoolExecutor(
+            max_workers=Config.SYSTEM_CONFIG.get('preprocess_workers', 2),
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _pool
+
+
+def resize_to_short_side(src: str, dst: str, length: int) -> bool:
+    """
+    按EXIF方向摆正图片，短边大于length时等比缩小到length，在进程池中执行
+
+    Returns:
+        是否进行了缩放，未缩放时不写入dst
+    """
+    with Image.open(src) as image:
+        width, height = image.size
+        if min(width, height) <= length:
+            return False
+        image_format = image.format
+        image = ImageOps.exif_transpose(image)
+        width, height = image.size
+        scale = length / min(width, height)
+        resized = image.resize((round(width * scale), round(height * scale)), Image.LANCZOS)
+
+        save_kwargs = {}
+        if image_format == 'JPEG':
+            if resized.mode not in ('RGB', 'L'):
+                resized = resized.convert('RGB')
+            save_kwargs = {'quality': 95}
+        temp_path = f"{dst}.tmp"
+        resized.save(temp_path, format=image_format, **save_kwargs)
+    os.replace(temp_path, dst)
+    return True
+
+
+class ImagePreprocessor:
+    """
+    打标前的本地图片预处理
+
+    打标工作流开启自动裁剪时，ComfyUI会把图片裁剪并缩放到 scale_to_length。在本地先把
+    短边缩小到该长度（不裁剪，裁剪比例和主体位置仍由远程工作流决定），再上传缩小后的图片，
+    大幅减少上传的数据量。结果按原图内容hash缓存，同一图片不会重复处理。
+    """
+
+    @staticmethod
+    def is_available() -> bool:
+        global _missing_pillow_warned
+        if not Config.SYSTEM_CONFIG.get('mark_preprocess_images', False):
+            return False
+        if Image is None:
+            # 已开启预处理但未安装Pillow，只提示一次，之后直接上传原图
+            if not _missing_pillow_warned:
+                _missing_pillow_warned = True
+                logger.warning("已开启 mark_preprocess_images 但未安装Pillow，将直接上传原图，请执行 pip install Pillow")
+            return False
+        return True
+
+    @staticmethod
+    def prepare(task_id: int, input_dir: str, resolution: int) -> Tuple[str, Dict]:
+        """
+        生成任务的待上传目录，图片替换为缩小后的版本，其他文件原样保留
+
+        Args:
+            task_id: 任务ID
+            input_dir: 原图目录
+            resolution: 工作流的 scale_to_length
+
+        Returns:
+            (待上传目录, 统计信息 {images, resized, cached, original_bytes, prepared_bytes})
+        """
+        stats = {'images': 0, 'resized': 0, 'cached': 0, 'original_bytes': 0, 'prepared_bytes': 0}
+        target_dir = os.path.join(PREPROCESS_DIR, str(task_id))
+        os.makedirs(target_dir, exist_ok=True)
+        os.makedirs(PREPROCESS_CACHE_DIR, exist_ok=True)
+
+        # 复用同步清单的hash缓存，未变化的原图不重复计算hash
+        manifest = build_local_manifest(input_dir, recursive=False)
+        pending = {}
+        sources = {}
+        for name, entry in manifest.items():
+            src = os.path.join(input_dir, name)
+            ext = os.path.splitext(name)[1].lower()
+            stats['original_bytes'] += entry['size']
+            if ext not in IMAGE_EXTENSIONS:
+                sources[name] = src
+                continue
+            stats['images'] += 1
+            cached = os.path.join(PREPROCESS_CACHE_DIR, f"{entry['sha256']}_{resolution}{ext}")
+            if os.path.exists(cached):
+                stats['cached'] += 1
+                sources[name] = cached
+            else:
+                pending[name] = (src, cached)
+                sources[name] = src
+
+        futures = {
+            name: _get_pool().submit(resize_to_short_side, src, cached, resolution)
+            for name, (src, cached) in pending.items()
+        }
+        for name, future in futures.items():
+            src, cached = pending[name]
+            try:
+                if future.result():
+                    stats['resized'] += 1
+                    sources[name] = cached
+            except Exception as e:
+                logger.warning(f"预处理图片失败，上传原图: {src}, {str(e)}")
+
+        # 删除上次预处理留下、原图已不存在的文件
+        for name in os.listdir(target_dir):
+            if name not in sources:
+                os.remove(os.path.join(target_dir, name))
+        for name, src in sources.items():
+            link_or_copy(src, os.path.join(target_dir, name))
+            stats['prepared_bytes'] += os.path.getsize(src)
+
+        logger.info(
+            f"任务 {task_id} 图片预处理完成: {stats['images']} 张图片, 缩放 {stats['resized']}, "
+            f"缓存命中 {stats['cached']}, {stats['original_bytes'] / 1024 / 1024:.1f}MB -> "
+            f"{stats['prepared_bytes'] / 1024 / 1024:.1f}MB"
+        )
+        return target_dir, stats
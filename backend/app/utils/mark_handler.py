@@ -1,14 +1,25 @@
+import copy
 import json
 import os
 import random
-from typing import Tuple, Dict, Optional, Any
+from typing import Tuple, Dict, Optional, Any, List
 from ..utils.logger import setup_logger
 from ..config import Config
 from dataclasses import dataclass
+from .http_client import HttpClientRegistry
+from .workflow_templates import WorkflowTemplateRegistry
 from task_scheduler.comfyui_api import ComfyUIAPI, ComfyUIConfig
+from task_scheduler.comfyui_cache import ComfyUIInfoCache
+from task_scheduler.comfyui_precheck import ComfyUIPreCheck
 
 logger = setup_logger('mark_handler')
 
+# ComfyUI节点信息和模型列表的磁盘缓存，供提交前校验工作流
+comfyui_info_cache = ComfyUIInfoCache(
+    os.path.join(Config.DATA_DIR, '.comfyui_cache'),
+    ttl=Config.SYSTEM_CONFIG.get('comfyui_cache_ttl', 3600)
+)
+
 @dataclass
 class MarkConfig:
     """标记配置参数类"""
@@ -45,7 +56,41 @@ class MarkRequestHandler:
             port=self.mark_port,
             client_id="lora_tool"
         )
-        self.api = ComfyUIAPI(self.comfy_config)
+        # 复用资产的keep-alive连接，资产信息变更后重建
+        version = getattr(asset, 'updated_at', None)
+        self.api = ComfyUIAPI(
+            self.comfy_config,
+            session=HttpClientRegistry.get_session(asset.id, self.comfy_config.base_url, version)
+        )
+        # 状态查询使用短超时、不重试的会话，避免无响应的服务长时间占用轮询线程
+        self.poll_api = ComfyUIAPI(
+            self.comfy_config,
+            session=HttpClientRegistry.get_session(asset.id, self.comfy_config.base_url, version, poll=True)
+        )
+
+    @staticmethod
+    def get_workflow_path(algorithm: str) -> str:
+        """
+        获取打标算法对应的工作流文件路径
+        
+        Args:
+            algorithm: 打标算法名称
+        """
+        workflow_dir = os.path.join(Config.DATA_DIR, 'workflow')
+        # 根据算法选择工作流文件
+        if algorithm == 'joycaption2':
+            workflow_file = os.path.join(workflow_dir, 'mark_workflow_api_joycaption2.json')
+        else:
+            # 所有WD系列算法使用相同的工作流文件
+            workflow_file = os.path.join(workflow_dir, 'mark_workflow_api_wd.json')
+        
+        # 如果文件不存在，使用默认工作流
+        if not os.path.exists(workflow_file):
+            logger.warning(f"工作流文件 {workflow_file} 不存在，使用默认工作流")
+            workflow_file = os.path.join(workflow_dir, 'mark_workflow_api_list.json')
+            if not os.path.exists(workflow_file):
+                workflow_file = os.path.join(workflow_dir, 'mark_workflow_api.json')
+        return workflow_file
 
     def load_workflow_api(self, algorithm: str) -> Dict:
         """
@@ -55,23 +100,10 @@ class MarkRequestHandler:
             algorithm: 打标算法名称
         
         Returns:
-            工作流配置字典
+            工作流配置字典（独立副本，可以修改）
         """
         try:
-            # 根据算法选择工作流文件
-            if algorithm == 'joycaption2':
-                workflow_file = os.path.join(Config.DATA_DIR, 'workflow', 'mark_workflow_api_joycaption2.json')
-            else:
-                # 所有WD系列算法使用相同的工作流文件
-                workflow_file = os.path.join(Config.DATA_DIR, 'workflow', 'mark_workflow_api_wd.json')
-            
-            # 如果文件不存在，使用默认工作流
-            if not os.path.exists(workflow_file):
-                logger.warning(f"工作流文件 {workflow_file} 不存在，使用默认工作流")
-                workflow_file = os.path.join(Config.DATA_DIR, 'workflow', 'mark_workflow_api_list.json')
-                
-            with open(workflow_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            return copy.deepcopy(WorkflowTemplateRegistry.get(self.get_workflow_path(algorithm)))
         except Exception as e:
             logger.error(f"加载工作流配置失败: {str(e)}")
             return {}
@@ -87,26 +119,32 @@ class MarkRequestHandler:
             # 获取打标算法
             algorithm = mark_config.mark_algorithm
             
-            # 更新工作流配置
-            workflow = self.load_workflow_api(algorithm)
-            
-            # 设置基本参数
-            workflow["209"]["inputs"]["boolean"] = mark_config.auto_crop
-            workflow["35"]["inputs"]["aspect_ratio"] = mark_config.default_crop_ratio
-            workflow["35"]["inputs"]["scale_to_length"] = mark_config.resolution
-            workflow["208"]["inputs"]["string"] = mark_config.input_folder
-            workflow["155"]["inputs"]["string"] = mark_config.output_folder
-            workflow["210"]["inputs"]["string"] = mark_config.trigger_words
+            # 按节点ID绑定参数，模板已缓存时不读取文件
+            workflow_file = self.get_workflow_path(algorithm)
+            bindings = {
+                ("209", "boolean"): mark_config.auto_crop,
+                ("35", "aspect_ratio"): mark_config.default_crop_ratio,
+                ("35", "scale_to_length"): mark_config.resolution,
+                ("208", "string"): mark_config.input_folder,
+                ("155", "string"): mark_config.output_folder,
+                ("210", "string"): mark_config.trigger_words,
+            }
             
             # 如果是WD系列算法，设置模型名称
-            if algorithm != 'joycaption2' and "220" in workflow:
-                workflow["220"]["inputs"]["threshold"] = mark_config.min_confidence
-                workflow["220"]["inputs"]["model"] = algorithm
+            if algorithm != 'joycaption2' and "220" in WorkflowTemplateRegistry.get(workflow_file):
+                bindings[("220", "threshold")] = mark_config.min_confidence
+                bindings[("220", "model")] = algorithm
+            
+            workflow = WorkflowTemplateRegistry.render(workflow_file, bindings)
             
-            # 保存修改后的工作流配置
-            workflow_new_file = os.path.join(Config.DATA_DIR, 'workflow', 'mark_workflow_api_new.json')
-            with open(workflow_new_file, 'w', encoding='utf-8') as f:
-                json.dump(workflow, f, ensure_ascii=False, indent=4)
+            # 调试时保存修改后的工作流配置
+            if Config.SYSTEM_CONFIG.get('mark_workflow_debug_dump', False):
+                WorkflowTemplateRegistry.dump(
+                    workflow, os.path.join(Config.DATA_DIR, 'workflow', 'mark_workflow_api_new.json')
+                )
+
+            if Config.SYSTEM_CONFIG.get('mark_precheck_workflow', False):
+                self.precheck_workflow(workflow)
 
             logger.debug(f"发送标记请求到 http://{self.asset_ip}:{self.mark_port}，使用算法: {algorithm}")
             
@@ -132,6 +170,25 @@ class MarkRequestHandler:
             
             raise ValueError(json.dumps(error_info))
             
+    def precheck_workflow(self, workflow: Dict):
+        """
+        提交前校验工作流的节点、参数和模型文件，缓存预热后不发起网络请求
+
+        无法获取节点信息时跳过校验，不影响提交。
+
+        Raises:
+            ValueError: 工作流校验不通过
+        """
+        precheck = ComfyUIPreCheck(self.api, comfyui_info_cache)
+        if not precheck.ensure_cache():
+            logger.warning("无法获取ComfyUI节点信息，跳过工作流校验")
+            return
+        result = precheck.validate_workflow(workflow)
+        if not result["valid"]:
+            issues = result["structure_issues"] + result["parameter_issues"] + result["model_issues"]
+            messages = [issue.get("message", "") for issue in issues]
+            raise ValueError(f"工作流校验失败（{result['issues_count']}个问题）: {'; '.join(messages[:5])}")
+
     def check_status(self, prompt_id: str, mark_config: MarkConfig) -> Tuple[bool, bool, Dict[str, Any]]:
         """
         检查标记任务状态
@@ -141,43 +198,76 @@ class MarkRequestHandler:
         """
         try:
             # 使用ComfyUIAPI获取任务历史
-            history_data = self.api.get_history_by_id(prompt_id)
-            
-            # 检查响应是否为空
-            if not history_data or not isinstance(history_data, dict) or prompt_id not in history_data:
-                logger.debug(f"任务 {prompt_id} 执行中...")
-                return False, False, {"status": "processing", "progress": 0}
-    
-            # 获取任务状态
-            task_info = history_data.get(prompt_id, {}).get("status", {})
-            status = task_info.get("status_str")
-    
-            # 提取错误信息
-            error_info = self._extract_error_info(task_info)
-    
-            result_info = {
-                "status": status,
-                "progress": task_info.get("progress", 0),
-                "execution_time": task_info.get("exec_time", 0),
-                "error_info": error_info
-            }
-    
-            if status == "success":
-                logger.info(f"任务 {prompt_id} 完成")
-                return True, True, result_info
-            elif status == "error":
-                error_msg = error_info.get("error_message", "未知错误")
-                logger.error(f"任务 {prompt_id} 失败: {error_msg}")
-                return True, False, result_info
-            else:
-                logger.debug(f"任务 {prompt_id} 状态: {status}, 进度: {result_info['progress']}%")
-                return False, False, result_info
-                
+            history_data = self.poll_api.get_history_by_id(prompt_id)
+            return self.parse_history(prompt_id, history_data)
         except Exception as e:
             logger.error(f"检查任务状态出错: {str(e)}", exc_info=True)
             # 返回处理中状态，允许后续重试
             return False, False, {"status": "error_checking", "error": str(e), "progress": 0}
+    
+    def parse_history(self, prompt_id: str, history_data: Dict) -> Tuple[bool, bool, Dict[str, Any]]:
+        """
+        解析 /api/history/{prompt_id} 的响应
+        :return: (is_completed, is_success, task_info)
+        """
+        # 检查响应是否为空
+        if not history_data or not isinstance(history_data, dict) or prompt_id not in history_data:
+            logger.debug(f"任务 {prompt_id} 执行中...")
+            return False, False, {"status": "processing", "progress": 0}
+
+        # 获取任务状态
+        task_info = history_data.get(prompt_id, {}).get("status", {})
+        status = task_info.get("status_str")
+
+        # 提取错误信息
+        error_info = self._extract_error_info(task_info)
+
+        result_info = {
+            "status": status,
+            "progress": task_info.get("progress", 0),
+            "execution_time": task_info.get("exec_time", 0),
+            "error_info": error_info
+        }
+
+        if status == "success":
+            logger.info(f"任务 {prompt_id} 完成")
+            return True, True, result_info
+        elif status == "error":
+            error_msg = error_info.get("error_message", "未知错误")
+            logger.error(f"任务 {prompt_id} 失败: {error_msg}")
+            return True, False, result_info
+        else:
+            logger.debug(f"任务 {prompt_id} 状态: {status}, 进度: {result_info['progress']}%")
+            return False, False, result_info
+    
+    @staticmethod
+    def parse_active_prompt_ids(queue: Dict) -> set:
+        """从 /api/queue 的响应中提取仍在排队或执行中的prompt_id"""
+        active_ids = set()
+        for key in ('queue_running', 'queue_pending'):
+            for item in (queue or {}).get(key, []) or []:
+                if isinstance(item, (list, tuple)) and len(item) > 1:
+                    active_ids.add(item[1])
+        return active_ids
             
+    def check_status_batch(self, prompt_ids: List[str]) -> Dict[str, Tuple[bool, bool, Dict[str, Any]]]:
+        """
+        批量检查多个标记任务的状态
+        
+        先通过一次队列查询找出仍在排队或执行中的任务，只有已离开队列的任务才查询历史记录。
+        :param prompt_ids: 任务ID列表
+        :return: {prompt_id: (is_completed, is_success, task_info)}
+        """
+        active_ids = self.parse_active_prompt_ids(self.poll_api.get_queue())
+        
+        results = {}
+        for prompt_id in prompt_ids:
+            if prompt_id in active_ids:
+                results[prompt_id] = (False, False, {"status": "processing", "progress": 0})
+            else:
+                results[prompt_id] = self.check_status(prompt_id, None)
+        return results
+        
     def _extract_error_info(self, task_info: Dict) -> Dict:
         """从任务状态中提取错误信息"""
         error_info = {}
@@ -0,0 +1,297 @@
+import hashlib
+import os
+import queue
+import shlex
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional
+import paramiko
+from .logger import setup_logger
+from ..config import Config
+
+logger = setup_logger('sftp_transfer')
+
+# 传输中的临时文件后缀，传输并校验完成后重命名为目标文件
+PART_SUFFIX = '.part'
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """计算文件的sha256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class TransferItem(NamedTuple):
+    """一个待传输的文件"""
+    local_path: str
+    remote_path: str
+    size: int
+    action: str  # added 或 updated
+    sha256: Optional[str] = None  # 源文件的sha256，已知时用于校验，未知时在源端计算
+
+
+def new_transfer_stats() -> Dict:
+    """目录传输统计信息"""
+    return {
+        'added': 0,      # 新增文件数
+        'updated': 0,    # 更新文件数
+        'unchanged': 0,  # 未变更文件数
+        'failed': 0,     # 失败文件数
+        'resumed': 0,    # 断点续传的文件数
+        'bytes': 0,      # 传输字节数
+        'elapsed': 0.0,  # 耗时（秒）
+        'throughput': 0.0  # 平均吞吐量（字节/秒）
+    }
+
+
+def format_transfer_summary(action: str, stats: Dict) -> str:
+    """生成传输结果摘要"""
+    return (f"目录{action}完成！新增:{stats['added']}, 更新:{stats['updated']}, "
+            f"未变更:{stats['unchanged']}, 失败:{stats['failed']}, "
+            f"{stats['bytes'] / 1024 / 1024:.1f}MB, {stats['throughput'] / 1024 / 1024:.2f}MB/s")
+
+
+class SftpTransferEngine:
+    """
+    多通道并行SFTP传输
+
+    在同一个SSH传输层上打开多个SFTP通道，由多个工作线程并发传输文件。
+    需要传输哪些文件由调用方（如 ManifestSync）比对后决定。
+
+    下载先写入本地 .part 临时文件再重命名，中断时不会留下写了一半的目标文件。
+    大文件（如LoRA模型）上传下载都分块写入 .part 文件：已有 .part 时从其末尾续传，
+    传输后比对两端sha256，一致才重命名，校验失败则删除临时文件重新传输。
+    """
+
+    def __init__(self, ssh: paramiko.SSHClient, parallelism: Optional[int] = None):
+        """
+        Args:
+            ssh: 已连接的SSH客户端（连接池中的连接）
+            parallelism: 并发SFTP通道数，默认读取 SYSTEM_CONFIG['sftp_parallelism']
+        """
+        self.ssh = ssh
+        self.parallelism = max(1, parallelism or Config.SYSTEM_CONFIG.get('sftp_parallelism', 4))
+        self.resumable_min_size = Config.SYSTEM_CONFIG.get('resumable_transfer_min_size', 32 * 1024 * 1024)
+        self.chunk_size = Config.SYSTEM_CONFIG.get('transfer_chunk_size', 4 * 1024 * 1024)
+        self.max_retries = Config.SYSTEM_CONFIG.get('transfer_max_retries', 3)
+
+    def _open_sftp(self) -> paramiko.SFTPClient:
+        return self.ssh.open_sftp()
+
+    def make_remote_dirs(self, remote_dirs: List[str]):
+        """一条命令创建全部远程目录"""
+        if not remote_dirs:
+            return
+        command = 'mkdir -p ' + ' '.join(shlex.quote(d) for d in remote_dirs)
+        stdin, stdout, stderr = self.ssh.exec_command(command)
+        if stdout.channel.recv_exit_status() != 0:
+            raise IOError(f"创建远程目录失败: {stderr.read().decode('utf-8').strip()}")
+
+    # ---------- 并发传输 ----------
+
+    def transfer(self, items: List[TransferItem], stats: Dict, upload: bool) -> List[TransferItem]:
+        """
+        多个SFTP通道并发传输文件，大文件优先以减少尾部等待
+
+        Returns:
+            传输失败的文件
+        """
+        failed: List[TransferItem] = []
+        if not items:
+            return failed
+
+        work: "queue.Queue[TransferItem]" = queue.Queue()
+        for item in sorted(items, key=lambda i: i.size, reverse=True):
+            work.put(item)
+
+        lock = threading.Lock()
+        workers = [
+            threading.Thread(
+                target=self._worker, args=(work, stats, lock, upload, failed),
+                name=f"sftp_transfer_{i}", daemon=True
+            )
+            for i in range(min(self.parallelism, len(items)))
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        # 所有通道都打开失败时，剩余文件计为失败
+        while not work.empty():
+            item = work.get_nowait()
+            stats['failed'] += 1
+            failed.append(item)
+            logger.error(f"文件未能传输: {item.local_path if upload else item.remote_path}")
+        return failed
+
+    def _worker(self, work: "queue.Queue[TransferItem]", stats: Dict, lock: threading.Lock, upload: bool,
+                failed: List[TransferItem]):
+        try:
+            sftp = self._open_sftp()
+        except Exception as e:
+            # 通道数可能超过服务器限制，剩余文件由其他通道处理
+            logger.warning(f"打开SFTP通道失败: {str(e)}")
+            return
+
+        try:
+            while True:
+                try:
+                    item = work.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    if item.size >= self.resumable_min_size:
+                        resumed = self._transfer_resumable(sftp, item, upload)
+                    else:
+                        self._transfer_small(sftp, item, upload)
+                        resumed = False
+                    with lock:
+                        stats[item.action] += 1
+                        stats['bytes'] += item.size
+                        if resumed:
+                            stats['resumed'] += 1
+                except Exception as e:
+                    source, target = (item.local_path, item.remote_path) if upload else (item.remote_path, item.local_path)
+                    logger.error(f"{'上传' if upload else '下载'}文件失败: {source} -> {target}, {str(e)}")
+                    with lock:
+                        stats['failed'] += 1
+                        failed.append(item)
+        finally:
+            sftp.close()
+
+    # ---------- 单个文件 ----------
+
+    @staticmethod
+    def _transfer_small(sftp: paramiko.SFTPClient, item: TransferItem, upload: bool):
+        """小文件整体传输，下载先写入本地临时文件再重命名"""
+        if upload:
+            # 大小已在列目录时比对，跳过put后的stat确认
+            sftp.put(item.local_path, item.remote_path, confirm=False)
+            return
+        temp_path = item.local_path + PART_SUFFIX
+        try:
+            sftp.get(item.remote_path, temp_path)
+            os.replace(temp_path, item.local_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _transfer_resumable(self, sftp: paramiko.SFTPClient, item: TransferItem, upload: bool) -> bool:
+        """
+        大文件分块续传并校验sha256，通道中断时打开新的SFTP通道从断点继续
+
+        Returns:
+            是否从已有的临时文件续传
+        """
+        resumed = False
+        channel = sftp
+        try:
+            for attempt in range(1, self.max_retries + 1):
+                try:
+                    if upload:
+                        offset = self._upload_chunks(channel, item)
+                    else:
+                        offset = self._download_chunks(channel, item)
+                    resumed = resumed or offset > 0
+                    if self._verify_and_commit(channel, item, upload):
+                        return resumed
+                    logger.warning(f"文件校验失败，重新传输({attempt}/{self.max_retries}): "
+                                   f"{item.local_path if upload else item.remote_path}")
+                except (IOError, EOFError, paramiko.SSHException) as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    logger.warning(f"传输中断，从断点续传({attempt}/{self.max_retries}): {str(e)}")
+                    time.sleep(min(2 ** attempt, 10))
+                    if channel is not sftp:
+                        channel.close()
+                    channel = self._open_sftp()
+            raise IOError(f"文件校验失败: {item.local_path if upload else item.remote_path}")
+        finally:
+            if channel is not sftp:
+                channel.close()
+
+    def _upload_chunks(self, sftp: paramiko.SFTPClient, item: TransferItem) -> int:
+        """从远程临时文件末尾继续上传，返回续传起点"""
+        temp_path = item.remote_path + PART_SUFFIX
+        try:
+            offset = sftp.stat(temp_path).st_size
+        except IOError:
+            offset = 0
+        if offset > item.size:
+            offset = 0
+        if offset:
+            logger.info(f"从 {offset / 1024 / 1024:.1f}MB 处续传: {item.local_path}")
+
+        with open(item.local_path, 'rb') as local_file, \
+                sftp.open(temp_path, 'r+b' if offset else 'wb') as remote_file:
+            remote_file.set_pipelined(True)
+            remote_file.seek(offset)
+            local_file.seek(offset)
+            for chunk in iter(lambda: local_file.read(self.chunk_size), b''):
+                remote_file.write(chunk)
+        return offset
+
+    def _download_chunks(self, sftp: paramiko.SFTPClient, item: TransferItem) -> int:
+        """从本地临时文件末尾继续下载，返回续传起点"""
+        temp_path = item.local_path + PART_SUFFIX
+        offset = os.path.getsize(temp_path) if os.path.exists(temp_path) else 0
+        if offset > item.size:
+            offset = 0
+        if offset:
+            logger.info(f"从 {offset / 1024 / 1024:.1f}MB 处续传: {item.remote_path}")
+
+        with sftp.open(item.remote_path, 'rb') as remote_file, \
+                open(temp_path, 'ab' if offset else 'wb') as local_file:
+            remote_file.seek(offset)
+            remote_file.prefetch(item.size)
+            for chunk in iter(lambda: remote_file.read(self.chunk_size), b''):
+                local_file.write(chunk)
+        return offset
+
+    def _remote_sha256(self, remote_path: str) -> Optional[str]:
+        """在远程计算文件sha256，远程没有sha256sum时返回None"""
+        stdin, stdout, stderr = self.ssh.exec_command(f"sha256sum -- {shlex.quote(remote_path)}")
+        output = stdout.read().decode('utf-8', 'replace')
+        if stdout.channel.recv_exit_status() != 0 or not output:
+            return None
+        return output.split()[0].lstrip('\\')
+
+    def _verify_and_commit(self, sftp: paramiko.SFTPClient, item: TransferItem, upload: bool) -> bool:
+        """
+        比对临时文件与源文件的sha256，一致时重命名为目标文件，不一致时删除临时文件
+
+        远程无法计算sha256时只校验大小。
+        """
+        if upload:
+            temp_path = item.remote_path + PART_SUFFIX
+            expected = item.sha256 or file_sha256(item.local_path)
+            actual = self._remote_sha256(temp_path)
+            if actual is None:
+                actual = expected if sftp.stat(temp_path).st_size == item.size else None
+            if actual != expected:
+                sftp.remove(temp_path)
+                return False
+            sftp.posix_rename(temp_path, item.remote_path)
+            return True
+
+        temp_path = item.local_path + PART_SUFFIX
+        actual = file_sha256(temp_path)
+        expected = item.sha256 or self._remote_sha256(item.remote_path)
+        if expected is None:
+            expected = actual if os.path.getsize(temp_path) == item.size else None
+        if actual != expected:
+            os.remove(temp_path)
+            return False
+        os.replace(temp_path, item.local_path)
+        return True
+
+    @staticmethod
+    def finish_stats(stats: Dict, start: float):
+        stats['elapsed'] = round(time.time() - start, 3)
+        if stats['elapsed'] > 0:
+            stats['throughput'] = round(stats['bytes'] / stats['elapsed'], 1)
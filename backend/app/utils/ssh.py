@@ -1,11 +1,16 @@
 import paramiko
 import os
+import posixpath
+import shlex
 import stat
 import io
 import time
+from contextlib import contextmanager
 from typing import Tuple, Optional, NamedTuple, BinaryIO, List, Dict, Iterator, Callable
 from ..config import config
 from .logger import setup_logger
+from .sftp_transfer import new_transfer_stats, format_transfer_summary
+from .sync_manifest import ManifestSync
 import paramiko
 import threading
 import select
@@ -13,9 +18,44 @@ import json
 
 logger = setup_logger('ssh')
 
+class PooledConnection:
+    """连接池中的一个SSH连接"""
+
+    def __init__(self, pool: '_HostPool', ssh: paramiko.SSHClient, channels: int):
+        self.pool = pool
+        self.ssh = ssh
+        self.channels = channels  # 已借出的通道数
+        self.last_used = time.time()
+        self.last_verified = time.time()  # 最后一次确认可用的时间（创建、探测成功或调用方使用成功）
+        self.retired = False  # 已失效，不再借出，通道全部归还后关闭
+        self.closed = False
+
+    def is_active(self) -> bool:
+        transport = self.ssh.get_transport()
+        return transport is not None and transport.is_active()
+
+
+class _HostPool:
+    """同一主机（连接键）的连接集合"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.connections: List[PooledConnection] = []
+        self.creating = 0  # 正在建立的连接数
+        self.cond = threading.Condition()
+
+
 # 添加SSH连接缓存管理器
 class SSHConnectionManager:
-    """SSH连接缓存管理器，用于复用SSH连接"""
+    """
+    SSH连接池
+
+    每个主机最多保持 ssh_pool_max_connections 个连接，每个连接同时借出的通道数不超过
+    ssh_max_channels_per_connection。借出时选择负载最低的连接，都已占满且连接数未达上限时
+    新建连接；目录同步等可减少并发的操作按剩余通道借出，否则等待归还。ssh_checkout_timeout
+    大于0时等待超时抛出 TimeoutError，默认一直等待，借出连接不会因连接池繁忙而失败。
+    建立连接在锁外进行，不阻塞其他主机和同一主机已有连接的借出。
+    """
     _instance = None
     _lock = threading.Lock()
     
@@ -27,168 +67,479 @@ class SSHConnectionManager:
             return cls._instance
     
     def _init(self):
-        self._connections = {}  # 存储SSH连接的字典
-        self._last_used = {}    # 记录连接最后使用时间
+        self._pools: Dict[str, _HostPool] = {}  # 连接键 -> 主机连接集合
+        self._clients: Dict[int, PooledConnection] = {}  # id(SSHClient) -> 连接
         self._lock = threading.Lock()
         self._cleanup_interval = 300  # 清理间隔（秒）
         self._connection_timeout = 600  # 连接超时时间（秒）
-        
-        # 启动清理线程
-        self._start_cleanup_thread()
+        # 确认可用后的该时间内复用连接只检查transport状态，不再执行命令探测（秒）
+        self._liveness_window = config.SYSTEM_CONFIG.get('ssh_liveness_window', 30)
+        # 后台探测空闲连接的间隔（秒），0为不探测
+        self._probe_interval = config.SYSTEM_CONFIG.get('ssh_health_probe_interval', 0)
+        self._max_connections = max(1, config.SYSTEM_CONFIG.get('ssh_pool_max_connections', 2))
+        self._max_channels = max(1, config.SYSTEM_CONFIG.get('ssh_max_channels_per_connection', 8))
+        self._checkout_timeout = config.SYSTEM_CONFIG.get('ssh_checkout_timeout', 0)
+        self._metrics = {
+            'checkouts': 0,        # 借出次数
+            'waits': 0,            # 需要等待归还的借出次数
+            'wait_time': 0.0,      # 累计等待时间（秒）
+            'timeouts': 0,         # 等待超时次数
+            'creations': 0,        # 新建连接数
+            'create_failures': 0,  # 建立连接失败次数
+            'evictions': 0,        # 因失效、过期或关闭移除的连接数
+        }
+        self._metrics_lock = threading.Lock()
+        self._cleanup_thread = None  # 清理线程在首次获取连接时启动，仅导入模块不会启动线程
+        self._probe_thread = None
     
     def _start_cleanup_thread(self):
         """启动定期清理过期连接的线程"""
+        if self._cleanup_thread and self._cleanup_thread.is_alive():
+            return
+        
         def cleanup_task():
             while True:
                 time.sleep(self._cleanup_interval)
                 self._cleanup_expired_connections()
         
-        t = threading.Thread(target=cleanup_task)
+        t = threading.Thread(target=cleanup_task, name="ssh_connection_cleanup")
         t.daemon = True
         t.start()
-    
+        self._cleanup_thread = t
+
+    def _start_probe_thread(self):
+        """启动后台健康探测线程，提前发现失效的空闲连接"""
+        if self._probe_interval <= 0 or (self._probe_thread and self._probe_thread.is_alive()):
+            return
+
+        def probe_task():
+            while True:
+                time.sleep(self._probe_interval)
+                self._probe_idle_connections()
+
+        t = threading.Thread(target=probe_task, name="ssh_health_probe")
+        t.daemon = True
+        t.start()
+        self._probe_thread = t
+
+    def _count(self, name: str, value=1):
+        with self._metrics_lock:
+            self._metrics[name] += value
+
+    def _all_pools(self) -> List[_HostPool]:
+        with self._lock:
+            return list(self._pools.values())
+
     def _cleanup_expired_connections(self):
-        """清理过期的连接"""
+        """清理长时间未使用的空闲连接和已断开的连接"""
         current_time = time.time()
-        with self._lock:
-            expired_keys = []
-            for key, last_used in self._last_used.items():
-                if current_time - last_used > self._connection_timeout:
-                    expired_keys.append(key)
-            
-            for key in expired_keys:
-                try:
-                    logger.info(f"关闭过期连接: {key}")
-                    self._connections[key].close()
-                except Exception as e:
-                    logger.error(f"关闭过期连接出错: {e}")
-                finally:
-                    del self._connections[key]
-                    del self._last_used[key]
+        for pool in self._all_pools():
+            with pool.cond:
+                expired = [
+                    conn for conn in pool.connections
+                    if conn.channels == 0 and (current_time - conn.last_used > self._connection_timeout
+                                               or not conn.is_active())
+                ]
+            for conn in expired:
+                logger.info(f"关闭过期连接: {pool.key}")
+                self._evict(conn)
+
+    def _probe_idle_connections(self):
+        """探测超过确认窗口未使用的空闲连接，失效的连接直接移除"""
+        now = time.time()
+        for pool in self._all_pools():
+            with pool.cond:
+                candidates = [
+                    conn for conn in pool.connections
+                    if conn.channels == 0 and now - conn.last_verified >= self._liveness_window
+                ]
+                # 探测期间占用一个通道，避免被清理线程关闭
+                for conn in candidates:
+                    conn.channels += 1
+            for conn in candidates:
+                alive = self._ping(conn.ssh)
+                if alive:
+                    conn.last_verified = time.time()
+                else:
+                    logger.warning(f"后台探测发现连接已失效: {pool.key}")
+                self._release(conn, 1, evict=not alive)
+
+    @staticmethod
+    def _ping(ssh: paramiko.SSHClient) -> bool:
+        """执行简单命令确认连接可用"""
+        try:
+            transport = ssh.get_transport()
+            if transport is None or not transport.is_active():
+                return False
+            # 设置较短的超时时间，避免卡住
+            chan = transport.open_session()
+            chan.settimeout(3)
+            chan.exec_command('echo ping')
+            exit_status = chan.recv_exit_status()
+            chan.close()
+            return exit_status == 0
+        except Exception as e:
+            logger.warning(f"SSH连接测试失败: {str(e)}")
+            return False
+
+    def _evict(self, conn: PooledConnection):
+        """从连接池移除并立即关闭连接"""
+        pool = conn.pool
+        with pool.cond:
+            if conn.closed:
+                return
+            conn.closed = True
+            if conn in pool.connections:
+                pool.connections.remove(conn)
+            pool.cond.notify_all()
+        self._close(conn)
+
+    def _close(self, conn: PooledConnection):
+        """关闭已移出连接池的连接"""
+        self._clients.pop(id(conn.ssh), None)
+        self._count('evictions')
+        try:
+            conn.ssh.close()
+        except Exception as e:
+            logger.error(f"关闭SSH连接出错: {e}")
+
+    def mark_alive(self, ssh: paramiko.SSHClient):
+        """调用方使用连接成功后调用，刷新确认时间，之后的复用不必再探测"""
+        conn = self._clients.get(id(ssh))
+        if conn is not None:
+            conn.last_verified = time.time()
     
     def _get_connection_key(self, hostname, port, username, key_filename=None, password=None):
         """生成连接的唯一键"""
         auth_type = 'key' if key_filename else 'password'
         auth_value = key_filename if key_filename else '***'  # 不存储实际密码
         return f"{hostname}:{port}:{username}:{auth_type}:{auth_value}"
-    
-    def get_connection(self, hostname, port, username, key_filename=None, 
-                      password=None, timeout=10):
-        """获取SSH连接，如果缓存中存在则复用，否则创建新连接"""
+
+    def _get_pool(self, conn_key: str) -> _HostPool:
+        with self._lock:
+            pool = self._pools.get(conn_key)
+            if pool is None:
+                pool = _HostPool(conn_key)
+                self._pools[conn_key] = pool
+            return pool
+
+    def _pick(self, pool: _HostPool, channels: int) -> Optional[PooledConnection]:
+        """选择剩余通道足够且负载最低的连接，调用方需持有 pool.cond"""
+        best = None
+        for conn in list(pool.connections):
+            if conn.retired:
+                continue
+            if not conn.is_active():
+                # 已断开的连接若无人使用直接移除，否则等归还时移除
+                if conn.channels == 0:
+                    conn.closed = True
+                    pool.connections.remove(conn)
+                    self._clients.pop(id(conn.ssh), None)
+                    self._count('evictions')
+                    logger.warning(f"连接已失效 (transport inactive): {pool.key}")
+                continue
+            if conn.channels + channels <= self._max_channels and (best is None or conn.channels < best.channels):
+                best = conn
+        return best
+
+    def _pick_partial(self, pool: _HostPool, min_channels: int) -> Optional[PooledConnection]:
+        """选择剩余通道最多且不少于 min_channels 的连接，调用方需持有 pool.cond"""
+        best = None
+        for conn in pool.connections:
+            if conn.retired or not conn.is_active():
+                continue
+            if self._max_channels - conn.channels >= min_channels and (best is None or conn.channels < best.channels):
+                best = conn
+        return best
+
+    def checkout(self, hostname, port, username, key_filename=None, password=None,
+                 timeout=10, channels: int = 1, wait_timeout: Optional[float] = None) -> PooledConnection:
+        """
+        借出连接并占用通道，用完后调用 release 归还
+
+        Args:
+            channels: 本次操作同时使用的通道数，如并发SFTP通道数
+            wait_timeout: 等待可用连接的最长时间（秒），默认读取 SYSTEM_CONFIG['ssh_checkout_timeout']，不大于0时一直等待
+
+        Raises:
+            TimeoutError: 等待超时
+        """
+        return self.checkout_upto(hostname, port, username, key_filename, password, timeout,
+                                  channels, channels, wait_timeout)[0]
+
+    def checkout_upto(self, hostname, port, username, key_filename=None, password=None, timeout=10,
+                      channels: int = 1, min_channels: int = 1,
+                      wait_timeout: Optional[float] = None) -> Tuple[PooledConnection, int]:
+        """
+        借出连接，最多占用 channels 个通道：没有足够通道且不能新建连接时，按已有连接的剩余通道借出，
+        不少于 min_channels，用完后按实际借出的通道数调用 release 归还
+
+        Returns:
+            (连接, 实际借出的通道数)
+
+        Raises:
+            TimeoutError: 等待超时
+        """
+        self._start_cleanup_thread()
+        self._start_probe_thread()
         conn_key = self._get_connection_key(hostname, port, username, key_filename, password)
+        pool = self._get_pool(conn_key)
+        channels = max(1, min(channels, self._max_channels))
+        min_channels = max(1, min(min_channels, channels))
+        wait_timeout = self._checkout_timeout if wait_timeout is None else wait_timeout
+        deadline = time.time() + wait_timeout if wait_timeout > 0 else None
+        wait_start = None
+
+        while True:
+            create = False
+            with pool.cond:
+                while True:
+                    conn = self._pick(pool, channels)
+                    if conn is not None:
+                        granted = channels
+                        conn.channels += granted
+                        break
+                    if len(pool.connections) + pool.creating < self._max_connections:
+                        pool.creating += 1
+                        create = True
+                        break
+                    conn = self._pick_partial(pool, min_channels) if min_channels < channels else None
+                    if conn is not None:
+                        granted = self._max_channels - conn.channels
+                        conn.channels += granted
+                        break
+                    if wait_start is None:
+                        wait_start = time.time()
+                        self._count('waits')
+                    if deadline is None:
+                        pool.cond.wait()
+                        continue
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self._count('timeouts')
+                        raise TimeoutError(f"等待SSH连接超时: {hostname}:{port}")
+                    pool.cond.wait(remaining)
+
+            if create:
+                granted = channels
+                conn = self._create(pool, granted, hostname, port, username, key_filename, password, timeout)
+                break
+            # 确认窗口内只检查transport状态，超出窗口才执行命令探测
+            if time.time() - conn.last_verified < self._liveness_window or self._ping(conn.ssh):
+                conn.last_verified = time.time()
+                logger.debug(f"复用SSH连接: {hostname}:{port}")
+                break
+            logger.warning(f"缓存的连接已失效，将建立新连接: {hostname}:{port}")
+            self._release(conn, granted, evict=True)
+
+        if wait_start is not None:
+            self._count('wait_time', time.time() - wait_start)
+        self._count('checkouts')
+        conn.last_used = time.time()
+        return conn, granted
+
+    def _create(self, pool: _HostPool, channels: int, hostname, port, username, key_filename,
+                password, timeout) -> PooledConnection:
+        """在锁外建立新连接并加入连接池"""
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         
-        with self._lock:
-            # 检查是否有缓存的连接
-            if conn_key in self._connections:
-                ssh = self._connections[conn_key]
-                try:
-                    # 检查连接是否仍然活跃 - 改进检测方法
-                    transport = ssh.get_transport()
-                    if transport is None or not transport.is_active():
-                        logger.warning(f"连接已失效 (transport inactive): {hostname}:{port}")
-                        raise Exception("SSH transport not active")
-                    
-                    # 添加更可靠的检测：发送简单命令测试连接
-                    try:
-                        # 设置较短的超时时间，避免卡住
-                        chan = transport.open_session()
-                        chan.settimeout(3)
-                        chan.exec_command('echo ping')
-                        exit_status = chan.recv_exit_status()
-                        chan.close()
-                        if exit_status != 0:
-                            raise Exception("SSH command test failed")
-                    except Exception as cmd_err:
-                        logger.warning(f"SSH连接测试失败: {hostname}:{port} - {str(cmd_err)}")
-                        raise Exception(f"SSH connection test failed: {str(cmd_err)}")
-                    
-                    # 连接正常
-                    logger.debug(f"复用SSH连接: {hostname}:{port}")
-                    self._last_used[conn_key] = time.time()
-                    return ssh
-                except Exception as e:
-                    logger.warning(f"缓存的连接已失效，将建立新连接: {str(e)}")
-                    # 尝试关闭失效的连接
-                    try:
-                        ssh.close()
-                    except:
-                        pass
-                    # 连接已失效，删除
-                    del self._connections[conn_key]
-                    del self._last_used[conn_key]
+        try:
+            connect_kwargs = {
+                'hostname': hostname,
+                'port': port,
+                'username': username,
+                'timeout': timeout,
+                'banner_timeout': 10,  # 设置banner超时
+                'auth_timeout': 15     # 设置认证超时
+            }
+            
+            if password:
+                connect_kwargs['password'] = password
+            elif key_filename:
+                connect_kwargs['key_filename'] = key_filename
             
-            # 创建新连接
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            # 添加TCP连接保活选项
+            connect_kwargs['disabled_algorithms'] = {'pubkeys': ['rsa-sha2-256', 'rsa-sha2-512']}
             
+            ssh.connect(**connect_kwargs)
+            
+            # 设置传输层keepalive
+            if ssh.get_transport():
+                ssh.get_transport().set_keepalive(30)  # 每30秒发送一个keepalive包
+        except Exception as e:
+            logger.error(f"建立SSH连接失败: {str(e)}")
             try:
-                connect_kwargs = {
-                    'hostname': hostname,
-                    'port': port,
-                    'username': username,
-                    'timeout': timeout,
-                    'banner_timeout': 10,  # 设置banner超时
-                    'auth_timeout': 15     # 设置认证超时
-                }
-                
-                if password:
-                    connect_kwargs['password'] = password
-                elif key_filename:
-                    connect_kwargs['key_filename'] = key_filename
-                
-                # 添加TCP连接保活选项
-                connect_kwargs['disabled_algorithms'] = {'pubkeys': ['rsa-sha2-256', 'rsa-sha2-512']}
-                
-                ssh.connect(**connect_kwargs)
-                
-                # 设置传输层keepalive
-                if ssh.get_transport():
-                    ssh.get_transport().set_keepalive(30)  # 每30秒发送一个keepalive包
-                
-                # 缓存连接
-                self._connections[conn_key] = ssh
-                self._last_used[conn_key] = time.time()
-                logger.debug(f"创建新SSH连接: {hostname}:{port}")
-                return ssh
-            except Exception as e:
-                logger.error(f"建立SSH连接失败: {str(e)}")
-                try:
-                    ssh.close()
-                except:
-                    pass
-                raise
+                ssh.close()
+            except:
+                pass
+            with pool.cond:
+                pool.creating -= 1
+                pool.cond.notify_all()
+            self._count('create_failures')
+            raise
+
+        # 缓存连接
+        conn = PooledConnection(pool, ssh, channels)
+        with pool.cond:
+            pool.creating -= 1
+            pool.connections.append(conn)
+            pool.cond.notify_all()
+        self._clients[id(ssh)] = conn
+        self._count('creations')
+        logger.debug(f"创建新SSH连接: {hostname}:{port} (当前 {len(pool.connections)} 个)")
+        return conn
+
+    def release(self, conn: PooledConnection, channels: int = 1):
+        """归还借出的通道，连接已断开时从连接池移除"""
+        self._release(conn, max(1, min(channels, self._max_channels)), evict=not conn.is_active())
+
+    def _release(self, conn: PooledConnection, channels: int, evict: bool = False):
+        """
+        归还通道。evict 时连接移出连接池不再借出，其他借用者仍在使用时等通道全部归还后再关闭
+        """
+        pool = conn.pool
+        with pool.cond:
+            conn.channels = max(0, conn.channels - channels)
+            conn.last_used = time.time()
+            if evict and not conn.retired:
+                conn.retired = True
+                if conn in pool.connections:
+                    pool.connections.remove(conn)
+            close = conn.retired and conn.channels == 0 and not conn.closed
+            if close:
+                conn.closed = True
+            pool.cond.notify_all()
+        if close:
+            self._close(conn)
+
+    @contextmanager
+    def connection(self, hostname, port, username, key_filename=None, password=None,
+                   timeout=10, channels: int = 1) -> Iterator[paramiko.SSHClient]:
+        """借出连接的上下文管理器，退出时自动归还"""
+        conn = self.checkout(hostname, port, username, key_filename, password, timeout, channels)
+        try:
+            yield conn.ssh
+        finally:
+            self.release(conn, channels)
+
+    @contextmanager
+    def connection_upto(self, hostname, port, username, key_filename=None, password=None,
+                        timeout=10, channels: int = 1) -> Iterator[Tuple[paramiko.SSHClient, int]]:
+        """借出最多 channels 个通道的上下文管理器，通道不足时按剩余通道借出，返回 (连接, 实际通道数)"""
+        conn, granted = self.checkout_upto(hostname, port, username, key_filename, password, timeout, channels)
+        try:
+            yield conn.ssh, granted
+        finally:
+            self.release(conn, granted)
+    
+    def get_connection(self, hostname, port, username, key_filename=None, 
+                      password=None, timeout=10):
+        """
+        获取SSH连接，选择负载最低的连接并立即归还，不占用通道
+
+        长时间或并发使用多个通道的操作应使用 connection/checkout 占用通道。
+        """
+        conn = self.checkout(hostname, port, username, key_filename, password, timeout)
+        self._release(conn, 1)
+        return conn.ssh
     
     def close_connection(self, hostname, port, username, key_filename=None, password=None):
-        """关闭指定的连接"""
+        """关闭指定主机的全部连接"""
         conn_key = self._get_connection_key(hostname, port, username, key_filename, password)
-        
         with self._lock:
-            if conn_key in self._connections:
-                try:
-                    self._connections[conn_key].close()
-                except Exception as e:
-                    logger.error(f"关闭SSH连接出错: {e}")
-                finally:
-                    del self._connections[conn_key]
-                    del self._last_used[conn_key]
-                    logger.debug(f"已关闭SSH连接: {hostname}:{port}")
+            pool = self._pools.get(conn_key)
+        if pool is None:
+            return
+        with pool.cond:
+            connections = list(pool.connections)
+        for conn in connections:
+            self._evict(conn)
+        logger.debug(f"已关闭SSH连接: {hostname}:{port}")
     
     def close_all_connections(self):
         """关闭所有连接"""
-        with self._lock:
-            for key, ssh in list(self._connections.items()):
-                try:
-                    ssh.close()
-                except Exception as e:
-                    logger.error(f"关闭SSH连接出错: {e}")
-                finally:
-                    del self._connections[key]
-                    del self._last_used[key]
-            logger.debug("已关闭所有SSH连接")
+        for pool in self._all_pools():
+            with pool.cond:
+                connections = list(pool.connections)
+            for conn in connections:
+                self._evict(conn)
+        logger.debug("已关闭所有SSH连接")
+
+    def get_metrics(self) -> Dict:
+        """连接池统计信息，包括借出、等待、新建、移除次数和各主机的连接与通道占用"""
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        metrics['wait_time'] = round(metrics['wait_time'], 3)
+        hosts = {}
+        for pool in self._all_pools():
+            with pool.cond:
+                hosts[pool.key] = {
+                    'connections': len(pool.connections),
+                    'creating': pool.creating,
+                    'channels_in_use': sum(conn.channels for conn in pool.connections),
+                }
+        metrics['hosts'] = hosts
+        return metrics
 
 # 创建全局连接管理器实例
 connection_manager = SSHConnectionManager()
 
+
+class RemoteDirCache:
+    """
+    已确认存在的远程目录缓存
+
+    按主机（连接键）记录创建过或确认存在的目录，缓存有效期内再次创建时跳过远程命令。
+    删除、移动或清空目录时需调用 invalidate 清除该目录及其子目录的缓存。
+    """
+
+    def __init__(self):
+        self._dirs: Dict[str, Dict[str, float]] = {}  # 连接键 -> {目录: 过期时间}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(path: str) -> str:
+        return posixpath.normpath(path.replace('\\', '/'))
+
+    def missing(self, host_key: str, paths: List[str]) -> List[str]:
+        """返回缓存中不存在或已过期的目录"""
+        now = time.time()
+        with self._lock:
+            known = self._dirs.get(host_key, {})
+            return [p for p in paths if known.get(self._normalize(p), 0) <= now]
+
+    def add(self, host_key: str, paths: List[str]):
+        """记录目录及其上级目录已存在"""
+        expires = time.time() + config.SYSTEM_CONFIG.get('remote_dir_cache_ttl', 300)
+        with self._lock:
+            known = self._dirs.setdefault(host_key, {})
+            for path in paths:
+                path = self._normalize(path)
+                while path and path not in ('/', '.'):
+                    known[path] = expires
+                    path = posixpath.dirname(path)
+
+    def invalidate(self, host_key: str, path: str):
+        """清除目录及其全部子目录的缓存"""
+        path = self._normalize(path)
+        with self._lock:
+            known = self._dirs.get(host_key)
+            if not known:
+                return
+            for cached in [p for p in known if p == path or p.startswith(path + '/')]:
+                del known[cached]
+
+    def clear(self, host_key: Optional[str] = None):
+        with self._lock:
+            if host_key is None:
+                self._dirs.clear()
+            else:
+                self._dirs.pop(host_key, None)
+
+
+remote_dir_cache = RemoteDirCache()
+
 class CommandResult(NamedTuple):
     returncode: int
     stdout: str
@@ -383,6 +734,52 @@ def close_ssh_connection_pool():
 
 
 
+class _RemoteFileStream:
+    """
+    远程文件流迭代器
+
+    读完、调用 close 或被回收时关闭远程文件和SFTP会话，并归还借出的连接通道。
+    """
+
+    def __init__(self, remote_file, sftp: paramiko.SFTPClient, conn: PooledConnection, chunk_size: int):
+        self._remote_file = remote_file
+        self._sftp = sftp
+        self._conn = conn
+        self._chunk_size = chunk_size
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> bytes:
+        if self._closed:
+            raise StopIteration
+        try:
+            data = self._remote_file.read(self._chunk_size)
+        except Exception:
+            self.close()
+            raise
+        if not data:
+            self.close()
+            raise StopIteration
+        return data
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._remote_file.close()
+            self._sftp.close()
+        except Exception as e:
+            logger.warning(f"关闭远程文件流出错: {e}")
+        finally:
+            connection_manager.release(self._conn)
+
+    def __del__(self):
+        self.close()
+
+
 class SSHClientTool:
     """
     SSH客户端工具类，封装SSH连接和操作，避免重复传入连接信息
@@ -424,6 +821,43 @@ class SSHClientTool:
             password=self.password,
             timeout=self.timeout
         )
+
+    def _host_key(self) -> str:
+        """远程目录缓存使用的主机键，与连接池的连接键一致"""
+        return connection_manager._get_connection_key(
+            self.hostname, self.port, self.username, self.key_path, self.password
+        )
+
+    def connection(self, channels: int = 1):
+        """
+        借出SSH连接的上下文管理器，占用指定数量的通道，退出时归还
+
+        Args:
+            channels: 操作期间同时使用的通道数
+        """
+        return connection_manager.connection(
+            hostname=self.hostname,
+            port=self.port,
+            username=self.username,
+            key_filename=self.key_path,
+            password=self.password,
+            timeout=self.timeout,
+            channels=channels
+        )
+
+    def connection_upto(self, channels: int):
+        """
+        借出最多 channels 个通道的上下文管理器，连接池繁忙时按剩余通道借出，返回 (连接, 实际通道数)
+        """
+        return connection_manager.connection_upto(
+            hostname=self.hostname,
+            port=self.port,
+            username=self.username,
+            key_filename=self.key_path,
+            password=self.password,
+            timeout=self.timeout,
+            channels=channels
+        )
     
     def execute_command(self, command: str) -> CommandResult:
         """
@@ -436,18 +870,17 @@ class SSHClientTool:
             CommandResult: 包含返回码、标准输出和标准错误的元组
         """
         try:
-            # 获取SSH连接
-            ssh = self.get_connection()
-            
-            # 执行命令
-            stdin, stdout, stderr = ssh.exec_command(command)
-            exit_status = stdout.channel.recv_exit_status()
-            
-            return CommandResult(
-                returncode=exit_status,
-                stdout=stdout.read().decode('utf-8').strip(),
-                stderr=stderr.read().decode('utf-8').strip()
-            )
+            # 借出SSH连接，执行命令期间占用一个通道
+            with self.connection() as ssh:
+                stdin, stdout, stderr = ssh.exec_command(command)
+                exit_status = stdout.channel.recv_exit_status()
+                connection_manager.mark_alive(ssh)
+                
+                return CommandResult(
+                    returncode=exit_status,
+                    stdout=stdout.read().decode('utf-8').strip(),
+                    stderr=stderr.read().decode('utf-8').strip()
+                )
             
         except Exception as e:
             logger.error(f"执行命令失败: {str(e)}")
@@ -469,19 +902,19 @@ class SSHClientTool:
             Tuple[bool, str]: (成功标志, 消息)
         """
         try:
-            # 获取SSH连接
-            ssh = self.get_connection()
+            # 借出SSH连接，操作期间占用一个通道
+            with self.connection() as ssh:
             
-            # 创建SFTP客户端
-            sftp = ssh.open_sftp()
+                # 创建SFTP客户端
+                sftp = ssh.open_sftp()
             
-            # 上传文件
-            sftp.put(local_path, remote_path)
+                # 上传文件
+                sftp.put(local_path, remote_path)
             
-            # 关闭SFTP会话（不关闭SSH连接）
-            sftp.close()
+                # 关闭SFTP会话（不关闭SSH连接）
+                sftp.close()
             
-            return True, f"文件上传成功: {remote_path}"
+                return True, f"文件上传成功: {remote_path}"
             
         except Exception as e:
             logger.error(f"文件上传失败: {str(e)}")
@@ -499,19 +932,19 @@ class SSHClientTool:
             Tuple[bool, str]: (成功标志, 消息)
         """
         try:
-            # 获取SSH连接
-            ssh = self.get_connection()
+            # 借出SSH连接，操作期间占用一个通道
+            with self.connection() as ssh:
             
-            # 创建SFTP客户端
-            sftp = ssh.open_sftp()
+                # 创建SFTP客户端
+                sftp = ssh.open_sftp()
             
-            # 下载文件
-            sftp.get(remote_path, local_path)
+                # 下载文件
+                sftp.get(remote_path, local_path)
             
-            # 关闭SFTP会话（不关闭SSH连接）
-            sftp.close()
+                # 关闭SFTP会话（不关闭SSH连接）
+                sftp.close()
             
-            return True, f"文件下载成功: {local_path}"
+                return True, f"文件下载成功: {local_path}"
             
         except Exception as e:
             logger.error(f"文件下载失败: {str(e)}")
@@ -528,46 +961,48 @@ class SSHClientTool:
             Tuple[bool, str]: (成功标志, 消息)
         """
         try:
-            # 获取SSH连接
-            ssh = self.get_connection()
-            
-            # 创建SFTP客户端
-            sftp = ssh.open_sftp()
+            # 借出SSH连接，操作期间占用一个通道
+            with self.connection() as ssh:
             
-            # 检查文件/目录是否存在
-            try:
-                file_attr = sftp.stat(remote_path)
-                is_dir = stat.S_ISDIR(file_attr.st_mode)
-            except FileNotFoundError:
-                sftp.close()
-                return False, f"文件或目录不存在: {remote_path}"
+                # 创建SFTP客户端
+                sftp = ssh.open_sftp()
             
-            # 如果是目录
-            if is_dir:
-                # 如果是目录，递归删除
+                # 检查文件/目录是否存在
                 try:
-                    # 先删除目录中的所有文件
-                    rm_cmd = f"rm -rf {remote_path}"
-                    stdin, stdout, stderr = ssh.exec_command(rm_cmd)
-                    exit_status = stdout.channel.recv_exit_status()
+                    file_attr = sftp.stat(remote_path)
+                    is_dir = stat.S_ISDIR(file_attr.st_mode)
+                except FileNotFoundError:
+                    sftp.close()
+                    return False, f"文件或目录不存在: {remote_path}"
+            
+                # 如果是目录
+                if is_dir:
+                    # 如果是目录，递归删除
+                    try:
+                        # 先删除目录中的所有文件
+                        rm_cmd = f"rm -rf {remote_path}"
+                        stdin, stdout, stderr = ssh.exec_command(rm_cmd)
+                        exit_status = stdout.channel.recv_exit_status()
                     
-                    if exit_status != 0:
+                        if exit_status != 0:
+                            sftp.close()
+                            return False, f"删除目录失败: {stderr.read().decode('utf-8')}"
+                    except Exception as e:
                         sftp.close()
-                        return False, f"删除目录失败: {stderr.read().decode('utf-8')}"
-                except Exception as e:
-                    sftp.close()
-                    return False, f"删除目录失败: {str(e)}"
-            else:
-                # 如果是文件，直接删除
-                try:
-                    sftp.remove(remote_path)
-                except Exception as e:
-                    sftp.close()
-                    return False, f"删除文件失败: {str(e)}"
+                        return False, f"删除目录失败: {str(e)}"
+                else:
+                    # 如果是文件，直接删除
+                    try:
+                        sftp.remove(remote_path)
+                    except Exception as e:
+                        sftp.close()
+                        return False, f"删除文件失败: {str(e)}"
             
-            # 关闭SFTP会话（不关闭SSH连接）
-            sftp.close()
-            return True, f"删除成功: {remote_path}"
+                # 关闭SFTP会话（不关闭SSH连接）
+                sftp.close()
+                if is_dir:
+                    remote_dir_cache.invalidate(self._host_key(), remote_path)
+                return True, f"删除成功: {remote_path}"
             
         except Exception as e:
             logger.error(f"删除远程文件失败: {str(e)}")
@@ -584,50 +1019,50 @@ class SSHClientTool:
             Tuple[bool, List[SshFileInfo], str]: (成功标志, 文件列表, 消息)
         """
         try:
-            # 获取SSH连接
-            ssh = self.get_connection()
+            # 借出SSH连接，操作期间占用一个通道
+            with self.connection() as ssh:
             
-            # 创建SFTP客户端
-            sftp = ssh.open_sftp()
+                # 创建SFTP客户端
+                sftp = ssh.open_sftp()
             
-            # 获取目录列表
-            file_list = []
-            for attr in sftp.listdir_attr(remote_path):
-                # 构建完整路径
-                full_path = os.path.join(remote_path, attr.filename).replace('\\', '/')
+                # 获取目录列表
+                file_list = []
+                for attr in sftp.listdir_attr(remote_path):
+                    # 构建完整路径
+                    full_path = os.path.join(remote_path, attr.filename).replace('\\', '/')
                 
-                # 判断是否为目录
-                is_dir = stat.S_ISDIR(attr.st_mode)
+                    # 判断是否为目录
+                    is_dir = stat.S_ISDIR(attr.st_mode)
                 
-                # 获取权限字符串
-                permission_str = ''
-                permission_str += 'd' if is_dir else '-'
-                permission_str += 'r' if attr.st_mode & stat.S_IRUSR else '-'
-                permission_str += 'w' if attr.st_mode & stat.S_IWUSR else '-'
-                permission_str += 'x' if attr.st_mode & stat.S_IXUSR else '-'
-                permission_str += 'r' if attr.st_mode & stat.S_IRGRP else '-'
-                permission_str += 'w' if attr.st_mode & stat.S_IWGRP else '-'
-                permission_str += 'x' if attr.st_mode & stat.S_IXGRP else '-'
-                permission_str += 'r' if attr.st_mode & stat.S_IROTH else '-'
-                permission_str += 'w' if attr.st_mode & stat.S_IWOTH else '-'
-                permission_str += 'x' if attr.st_mode & stat.S_IXOTH else '-'
+                    # 获取权限字符串
+                    permission_str = ''
+                    permission_str += 'd' if is_dir else '-'
+                    permission_str += 'r' if attr.st_mode & stat.S_IRUSR else '-'
+                    permission_str += 'w' if attr.st_mode & stat.S_IWUSR else '-'
+                    permission_str += 'x' if attr.st_mode & stat.S_IXUSR else '-'
+                    permission_str += 'r' if attr.st_mode & stat.S_IRGRP else '-'
+                    permission_str += 'w' if attr.st_mode & stat.S_IWGRP else '-'
+                    permission_str += 'x' if attr.st_mode & stat.S_IXGRP else '-'
+                    permission_str += 'r' if attr.st_mode & stat.S_IROTH else '-'
+                    permission_str += 'w' if attr.st_mode & stat.S_IWOTH else '-'
+                    permission_str += 'x' if attr.st_mode & stat.S_IXOTH else '-'
                 
-                # 创建文件信息对象
-                file_info = SshFileInfo(
-                    name=attr.filename,
-                    path=full_path,
-                    size=attr.st_size,
-                    is_dir=is_dir,
-                    permissions=permission_str,
-                    modified_time=str(attr.st_mtime)
-                )
+                    # 创建文件信息对象
+                    file_info = SshFileInfo(
+                        name=attr.filename,
+                        path=full_path,
+                        size=attr.st_size,
+                        is_dir=is_dir,
+                        permissions=permission_str,
+                        modified_time=str(attr.st_mtime)
+                    )
                 
-                file_list.append(file_info)
+                    file_list.append(file_info)
             
-            # 关闭SFTP会话（不关闭SSH连接）
-            sftp.close()
+                # 关闭SFTP会话（不关闭SSH连接）
+                sftp.close()
             
-            return True, file_list, "目录列表获取成功"
+                return True, file_list, "目录列表获取成功"
             
         except Exception as e:
             logger.error(f"获取目录列表失败: {str(e)}")
@@ -646,30 +1081,64 @@ class SSHClientTool:
         """
         try:
             if recursive:
-                # 使用命令行创建目录（支持递归创建）
-                cmd = f"mkdir -p {remote_path}"
-                result = self.execute_command(cmd)
-                
-                if result.returncode != 0:
-                    return False, f"创建目录失败: {result.stderr}"
+                # 使用命令行创建目录（支持递归创建），已缓存的目录不再执行命令
+                return self.make_dirs([remote_path])
             else:
                 # 使用SFTP创建单层目录
-                ssh = self.get_connection()
-                sftp = ssh.open_sftp()
+                with self.connection() as ssh:
+                    sftp = ssh.open_sftp()
                 
-                try:
-                    sftp.mkdir(remote_path)
-                except Exception as e:
-                    sftp.close()
-                    return False, f"创建目录失败: {str(e)}"
+                    try:
+                        sftp.mkdir(remote_path)
+                    except Exception as e:
+                        sftp.close()
+                        return False, f"创建目录失败: {str(e)}"
                 
-                sftp.close()
+                    sftp.close()
+                    remote_dir_cache.add(self._host_key(), [remote_path])
             
             return True, f"目录创建成功: {remote_path}"
             
         except Exception as e:
             logger.error(f"创建远程目录失败: {str(e)}")
             return False, f"创建远程目录失败: {str(e)}"
+
+    def make_dirs(self, remote_paths: List[str]) -> Tuple[bool, str]:
+        """
+        一条 mkdir -p 命令创建多个远程目录，跳过缓存中已存在的目录
+        
+        Args:
+            remote_paths: 远程目录路径列表
+        
+        Returns:
+            Tuple[bool, str]: (成功标志, 消息)
+        """
+        host_key = self._host_key()
+        missing = remote_dir_cache.missing(host_key, remote_paths)
+        if missing:
+            result = self.execute_command('mkdir -p ' + ' '.join(shlex.quote(p) for p in missing))
+            if result.returncode != 0:
+                return False, f"创建目录失败: {result.stderr}"
+            remote_dir_cache.add(host_key, missing)
+        return True, f"目录创建成功: {', '.join(remote_paths)}"
+
+    def clear_directory(self, remote_path: str) -> CommandResult:
+        """清空远程目录（不存在时创建），一次往返完成"""
+        quoted = shlex.quote(remote_path)
+        result = self.execute_command(f"mkdir -p {quoted} && rm -rf {quoted}/*")
+        host_key = self._host_key()
+        remote_dir_cache.invalidate(host_key, remote_path)
+        if result.returncode == 0:
+            remote_dir_cache.add(host_key, [remote_path])
+        return result
+
+    def remove_directories(self, remote_paths: List[str]) -> CommandResult:
+        """一条 rm -rf 命令删除多个远程目录，并清除这些目录的缓存"""
+        result = self.execute_command('rm -rf ' + ' '.join(shlex.quote(p) for p in remote_paths))
+        host_key = self._host_key()
+        for path in remote_paths:
+            remote_dir_cache.invalidate(host_key, path)
+        return result
     
     def copy_remote_file(self, source_path: str, target_path: str) -> Tuple[bool, str]:
         """
@@ -708,25 +1177,26 @@ class SSHClientTool:
             Tuple[bool, str]: (成功标志, 消息)
         """
         try:
-            # 获取SSH连接
-            ssh = self.get_connection()
-            sftp = ssh.open_sftp()
+            # 借出SSH连接，操作期间占用一个通道
+            with self.connection() as ssh:
+                sftp = ssh.open_sftp()
             
-            # 检查原文件是否存在
-            try:
-                sftp.stat(old_path)
-            except FileNotFoundError:
-                sftp.close()
-                return False, f"文件或目录不存在: {old_path}"
+                # 检查原文件是否存在
+                try:
+                    sftp.stat(old_path)
+                except FileNotFoundError:
+                    sftp.close()
+                    return False, f"文件或目录不存在: {old_path}"
                 
-            # 执行重命名操作
-            try:
-                sftp.rename(old_path, new_path)
-                sftp.close()
-                return True, f"重命名成功: {old_path} -> {new_path}"
-            except Exception as e:
-                sftp.close()
-                return False, f"重命名失败: {str(e)}"
+                # 执行重命名操作
+                try:
+                    sftp.rename(old_path, new_path)
+                    sftp.close()
+                    remote_dir_cache.invalidate(self._host_key(), old_path)
+                    return True, f"重命名成功: {old_path} -> {new_path}"
+                except Exception as e:
+                    sftp.close()
+                    return False, f"重命名失败: {str(e)}"
                 
         except Exception as e:
             logger.error(f"重命名远程文件失败: {str(e)}")
@@ -744,43 +1214,44 @@ class SSHClientTool:
             Tuple[bool, str]: (成功标志, 消息)
         """
         try:
-            # 获取SSH连接
-            ssh = self.get_connection()
-            sftp = ssh.open_sftp()
+            # 借出SSH连接，操作期间占用一个通道
+            with self.connection() as ssh:
+                sftp = ssh.open_sftp()
             
-            # 检查源文件是否存在
-            try:
-                sftp.stat(source_path)
-            except FileNotFoundError:
-                sftp.close()
-                return False, f"源文件或目录不存在: {source_path}"
+                # 检查源文件是否存在
+                try:
+                    sftp.stat(source_path)
+                except FileNotFoundError:
+                    sftp.close()
+                    return False, f"源文件或目录不存在: {source_path}"
             
-            # 检查目标目录是否存在
-            try:
-                target_stat = sftp.stat(target_dir)
-                if not stat.S_ISDIR(target_stat.st_mode):
+                # 检查目标目录是否存在
+                try:
+                    target_stat = sftp.stat(target_dir)
+                    if not stat.S_ISDIR(target_stat.st_mode):
+                        sftp.close()
+                        return False, f"目标路径不是目录: {target_dir}"
+                except FileNotFoundError:
                     sftp.close()
-                    return False, f"目标路径不是目录: {target_dir}"
-            except FileNotFoundError:
-                sftp.close()
-                return False, f"目标目录不存在: {target_dir}"
+                    return False, f"目标目录不存在: {target_dir}"
                 
-            # 获取文件名
-            filename = os.path.basename(source_path)
+                # 获取文件名
+                filename = os.path.basename(source_path)
             
-            # 构建目标文件完整路径
-            if not target_dir.endswith('/'):
-                target_dir += '/'
-            target_path = target_dir + filename
+                # 构建目标文件完整路径
+                if not target_dir.endswith('/'):
+                    target_dir += '/'
+                target_path = target_dir + filename
             
-            # 执行移动操作
-            try:
-                sftp.rename(source_path, target_path)
-                sftp.close()
-                return True, f"移动成功: {source_path} -> {target_path}"
-            except Exception as e:
-                sftp.close()
-                return False, f"移动失败: {str(e)}"
+                # 执行移动操作
+                try:
+                    sftp.rename(source_path, target_path)
+                    sftp.close()
+                    remote_dir_cache.invalidate(self._host_key(), source_path)
+                    return True, f"移动成功: {source_path} -> {target_path}"
+                except Exception as e:
+                    sftp.close()
+                    return False, f"移动失败: {str(e)}"
                 
         except Exception as e:
             logger.error(f"移动远程文件失败: {str(e)}")
@@ -797,12 +1268,19 @@ class SSHClientTool:
         Returns:
             Tuple[bool, Iterator[bytes], Dict, str]: (成功标志, 文件流迭代器, 文件信息, 消息)
         """
+        # 借出SSH连接，文件流关闭时才归还，避免长时间下载期间连接被关闭或通道超额借出
+        try:
+            conn = connection_manager.checkout(
+                self.hostname, self.port, self.username, self.key_path, self.password, self.timeout
+            )
+        except Exception as e:
+            logger.error(f"创建文件流失败: {str(e)}")
+            return False, iter([]), {}, f"创建文件流失败: {str(e)}"
+
+        sftp = None
         try:
-            # 获取SSH连接
-            ssh = self.get_connection()
-            
             # 创建SFTP客户端
-            sftp = ssh.open_sftp()
+            sftp = conn.ssh.open_sftp()
             
             # 获取文件信息
             file_stat = sftp.stat(remote_path)
@@ -819,23 +1297,16 @@ class SSHClientTool:
                 'mime_type': 'application/octet-stream'  # 默认MIME类型
             }
             
-            # 注意：这里需要特殊处理，因为流式传输需要保持连接打开
-            # 定义流迭代器 - 在迭代完成时关闭文件和SFTP会话，但不关闭SSH连接
-            def file_stream():
-                try:
-                    while True:
-                        data = remote_file.read(chunk_size)
-                        if not data:
-                            break
-                        yield data
-                finally:
-                    remote_file.close()
-                    sftp.close()
-            
-            return True, file_stream(), file_info, "文件流创建成功"
+            return True, _RemoteFileStream(remote_file, sftp, conn, chunk_size), file_info, "文件流创建成功"
             
         except Exception as e:
             logger.error(f"创建文件流失败: {str(e)}")
+            if sftp is not None:
+                try:
+                    sftp.close()
+                except Exception:
+                    pass
+            connection_manager.release(conn)
             return False, iter([]), {}, f"创建文件流失败: {str(e)}"
     
     def stream_upload_file(self, remote_path: str, file_obj: BinaryIO, progress_callback: Optional[Callable[[int, int], None]] = None) -> Tuple[bool, str]:
@@ -851,262 +1322,110 @@ class SSHClientTool:
             Tuple[bool, str]: (成功标志, 消息)
         """
         try:
-            # 获取SSH连接
-            ssh = self.get_connection()
+            # 借出SSH连接，操作期间占用一个通道
+            with self.connection() as ssh:
             
-            # 创建SFTP客户端
-            sftp = ssh.open_sftp()
+                # 创建SFTP客户端
+                sftp = ssh.open_sftp()
             
-            # 创建远程文件
-            with sftp.open(remote_path, 'wb') as remote_file:
-                chunk_size = 8192
-                uploaded_bytes = 0
+                # 创建远程文件
+                with sftp.open(remote_path, 'wb') as remote_file:
+                    chunk_size = 8192
+                    uploaded_bytes = 0
                 
-                # 读取并写入数据
-                while True:
-                    data = file_obj.read(chunk_size)
-                    if not data:
-                        break
+                    # 读取并写入数据
+                    while True:
+                        data = file_obj.read(chunk_size)
+                        if not data:
+                            break
                         
-                    remote_file.write(data)
-                    uploaded_bytes += len(data)
+                        remote_file.write(data)
+                        uploaded_bytes += len(data)
                     
-                    # 调用进度回调
-                    if progress_callback:
-                        try:
-                            # 尝试获取文件总大小
-                            total_size = file_obj.seek(0, io.SEEK_END)
-                            file_obj.seek(uploaded_bytes)  # 重新定位到当前位置
-                            progress_callback(uploaded_bytes, total_size)
-                        except (AttributeError, IOError):
-                            # 如果无法获取总大小，则只传递已上传大小
-                            progress_callback(uploaded_bytes, -1)
-            
-            # 关闭SFTP会话（不关闭SSH连接）
-            sftp.close()
+                        # 调用进度回调
+                        if progress_callback:
+                            try:
+                                # 尝试获取文件总大小
+                                total_size = file_obj.seek(0, io.SEEK_END)
+                                file_obj.seek(uploaded_bytes)  # 重新定位到当前位置
+                                progress_callback(uploaded_bytes, total_size)
+                            except (AttributeError, IOError):
+                                # 如果无法获取总大小，则只传递已上传大小
+                                progress_callback(uploaded_bytes, -1)
+            
+                # 关闭SFTP会话（不关闭SSH连接）
+                sftp.close()
             
-            return True, f"文件流上传成功: {remote_path}"
+                return True, f"文件流上传成功: {remote_path}"
             
         except Exception as e:
             logger.error(f"文件流上传失败: {str(e)}")
             return False, f"文件流上传失败: {str(e)}"
     
-    def upload_directory(self, local_path: str, remote_path: str, recursive: bool = True) -> Tuple[bool, str, Dict]:
+    def upload_directory(self, local_path: str, remote_path: str, recursive: bool = True,
+                         parallelism: Optional[int] = None, prune: bool = False,
+                         mode: str = 'auto') -> Tuple[bool, str, Dict]:
         """
-        上传本地目录到远程服务器
+        上传本地目录到远程服务器，按内容hash清单增量同步，多个SFTP通道并发传输
         
         Args:
             local_path: 本地目录路径
             remote_path: 远程目录路径
             recursive: 是否递归上传子目录
+            parallelism: 并发通道数，默认读取 SYSTEM_CONFIG['sftp_parallelism']
+            prune: 是否删除远程目录中本地不存在的文件
+            mode: 传输方式，auto（小文件较多时使用tar流）、tar 或 sftp
         
         Returns:
-            Tuple[bool, str, Dict]: (成功标志, 消息, 统计信息)
+            Tuple[bool, str, Dict]: (成功标志, 消息, 统计信息)，统计信息包含传输字节数、耗时和吞吐量
         """
-        stats = {
-            'added': 0,      # 新增文件数
-            'updated': 0,    # 更新文件数
-            'unchanged': 0,  # 未变更文件数
-            'failed': 0      # 失败文件数
-        }
+        stats = new_transfer_stats()
         
         try:
-            # 确保远程目录存在
-            mkdir_result = self.mkdir(remote_path)
-            if not mkdir_result[0]:
-                return False, mkdir_result[1], stats
-            
-            # 获取SSH连接
-            ssh = self.get_connection()
-            sftp = ssh.open_sftp()
-            
-            if recursive:
-                # 递归上传目录
-                for root, dirs, files in os.walk(local_path):
-                    # 计算当前目录相对路径
-                    rel_path = os.path.relpath(root, local_path)
-                    if rel_path == '.':
-                        rel_path = ''
-                    
-                    # 创建远程目录
-                    if rel_path:
-                        remote_dir = os.path.join(remote_path, rel_path).replace('\\', '/')
-                        try:
-                            self.mkdir(remote_dir)
-                        except Exception as e:
-                            logger.error(f"创建远程目录失败: {remote_dir}, {str(e)}")
-                            stats['failed'] += 1
-                    
-                    # 上传文件
-                    for file in files:
-                        local_file = os.path.join(root, file)
-                        if rel_path:
-                            remote_file = os.path.join(remote_path, rel_path, file).replace('\\', '/')
-                        else:
-                            remote_file = os.path.join(remote_path, file).replace('\\', '/')
-                        
-                        try:
-                            # 检查远程文件是否存在
-                            try:
-                                remote_stat = sftp.stat(remote_file)
-                                remote_size = remote_stat.st_size
-                                local_size = os.path.getsize(local_file)
-                                
-                                # 如果大小不同，则更新文件
-                                if remote_size != local_size:
-                                    sftp.put(local_file, remote_file)
-                                    stats['updated'] += 1
-                                else:
-                                    stats['unchanged'] += 1
-                            except FileNotFoundError:
-                                # 远程文件不存在，直接上传
-                                sftp.put(local_file, remote_file)
-                                stats['added'] += 1
-                        except Exception as e:
-                            logger.error(f"上传文件失败: {local_file} -> {remote_file}, {str(e)}")
-                            stats['failed'] += 1
-            else:
-                # 非递归模式，只上传根目录下的文件
-                for item in os.listdir(local_path):
-                    local_item_path = os.path.join(local_path, item)
-                    remote_item_path = os.path.join(remote_path, item).replace('\\', '/')
-                    
-                    # 只处理文件，跳过目录
-                    if os.path.isfile(local_item_path):
-                        try:
-                            # 检查远程文件是否存在
-                            try:
-                                remote_stat = sftp.stat(remote_item_path)
-                                remote_size = remote_stat.st_size
-                                local_size = os.path.getsize(local_item_path)
-                                
-                                # 如果大小不同，则更新文件
-                                if remote_size != local_size:
-                                    sftp.put(local_item_path, remote_item_path)
-                                    stats['updated'] += 1
-                                else:
-                                    stats['unchanged'] += 1
-                            except FileNotFoundError:
-                                # 远程文件不存在，直接上传
-                                sftp.put(local_item_path, remote_item_path)
-                                stats['added'] += 1
-                        except Exception as e:
-                            logger.error(f"上传文件失败: {local_item_path} -> {remote_item_path}, {str(e)}")
-                            stats['failed'] += 1
-            
-            # 关闭SFTP会话
-            sftp.close()
-            
-            summary = f"目录上传完成！新增:{stats['added']}, 更新:{stats['updated']}, 未变更:{stats['unchanged']}, 失败:{stats['failed']}"
+            sync_channels = parallelism or config.SYSTEM_CONFIG.get('sftp_parallelism', 4)
+            # 并发SFTP通道加一个命令通道，连接池繁忙时降低并发数而不是等待
+            with self.connection_upto(sync_channels + 1) as (ssh, granted):
+                stats = ManifestSync(ssh, max(1, granted - 1), mode).upload(local_path, remote_path, recursive, prune)
+                connection_manager.mark_alive(ssh)
+            # 清理多余文件时可能删除了子目录
+            host_key = self._host_key()
+            if prune:
+                remote_dir_cache.invalidate(host_key, remote_path)
+            remote_dir_cache.add(host_key, [remote_path])
+            summary = format_transfer_summary('上传', stats)
+            logger.info(summary)
             return True, summary, stats
             
         except Exception as e:
             logger.error(f"上传目录失败: {str(e)}")
             return False, f"上传目录失败: {str(e)}", stats
     
-    def download_directory(self, remote_path: str, local_path: str, recursive: bool = True) -> Tuple[bool, str, Dict]:
+    def download_directory(self, remote_path: str, local_path: str, recursive: bool = True,
+                           parallelism: Optional[int] = None, mode: str = 'auto',
+                           include: Optional[Callable[[str, Dict], bool]] = None) -> Tuple[bool, str, Dict]:
         """
-        从远程服务器下载目录
+        从远程服务器下载目录，按内容hash清单增量同步，多个SFTP通道并发传输
         
         Args:
             remote_path: 远程目录路径
             local_path: 本地目录路径
             recursive: 是否递归下载子目录
+            parallelism: 并发通道数，默认读取 SYSTEM_CONFIG['sftp_parallelism']
+            mode: 传输方式，auto（小文件较多时使用tar流）、tar 或 sftp
+            include: 远程文件过滤函数 (相对路径, {size, mtime}) -> 是否下载
         
         Returns:
-            Tuple[bool, str, Dict]: (成功标志, 消息, 统计信息)
+            Tuple[bool, str, Dict]: (成功标志, 消息, 统计信息)，统计信息包含传输字节数、耗时和吞吐量
         """
-        stats = {
-            'added': 0,      # 新增文件数
-            'updated': 0,    # 更新文件数
-            'unchanged': 0,  # 未变更文件数
-            'failed': 0      # 失败文件数
-        }
+        stats = new_transfer_stats()
         
         try:
-            # 确保本地目录存在
-            os.makedirs(local_path, exist_ok=True)
-            
-            # 获取SSH连接
-            ssh = self.get_connection()
-            sftp = ssh.open_sftp()
-            
-            if recursive:
-                # 递归下载目录
-                def download_dir(sftp, remote_dir, local_dir):
-                    try:
-                        sftp.chdir(remote_dir)
-                        os.makedirs(local_dir, exist_ok=True)
-                        
-                        for entry in sftp.listdir_attr():
-                            remote_path = os.path.join(remote_dir, entry.filename).replace('\\', '/')
-                            local_path = os.path.join(local_dir, entry.filename)
-                            
-                            if stat.S_ISDIR(entry.st_mode):
-                                download_dir(sftp, remote_path, local_path)
-                            else:
-                                try:
-                                    # 检查本地文件是否存在
-                                    if os.path.exists(local_path):
-                                        local_size = os.path.getsize(local_path)
-                                        remote_size = entry.st_size
-                                        
-                                        # 如果大小不同，则更新文件
-                                        if local_size != remote_size:
-                                            sftp.get(remote_path, local_path)
-                                            stats['updated'] += 1
-                                        else:
-                                            stats['unchanged'] += 1
-                                    else:
-                                        # 本地文件不存在，直接下载
-                                        sftp.get(remote_path, local_path)
-                                        stats['added'] += 1
-                                except Exception as e:
-                                    logger.error(f"下载文件失败: {remote_path} -> {local_path}, {str(e)}")
-                                    stats['failed'] += 1
-                    except Exception as e:
-                        logger.error(f"下载目录失败: {remote_dir}, {str(e)}")
-                        stats['failed'] += 1
-                
-                # 开始递归下载
-                download_dir(sftp, remote_path, local_path)
-            else:
-                # 非递归模式，只下载根目录下的文件
-                try:
-                    # 列出远程目录中的文件和文件夹
-                    for entry in sftp.listdir_attr(remote_path):
-                        remote_item_path = os.path.join(remote_path, entry.filename).replace('\\', '/')
-                        local_item_path = os.path.join(local_path, entry.filename)
-                        
-                        # 只处理文件，跳过目录
-                        if not stat.S_ISDIR(entry.st_mode):
-                            try:
-                                # 检查本地文件是否存在
-                                if os.path.exists(local_item_path):
-                                    local_size = os.path.getsize(local_item_path)
-                                    remote_size = entry.st_size
-                                    
-                                    # 如果大小不同，则更新文件
-                                    if local_size != remote_size:
-                                        sftp.get(remote_item_path, local_item_path)
-                                        stats['updated'] += 1
-                                    else:
-                                        stats['unchanged'] += 1
-                                else:
-                                    # 本地文件不存在，直接下载
-                                    sftp.get(remote_item_path, local_item_path)
-                                    stats['added'] += 1
-                            except Exception as e:
-                                logger.error(f"下载文件失败: {remote_item_path} -> {local_item_path}, {str(e)}")
-                                stats['failed'] += 1
-                except Exception as e:
-                    logger.error(f"列出远程目录失败: {remote_path}, {str(e)}")
-                    stats['failed'] += 1
-            
-            # 关闭SFTP会话
-            sftp.close()
-            
-            summary = f"目录下载完成！新增:{stats['added']}, 更新:{stats['updated']}, 未变更:{stats['unchanged']}, 失败:{stats['failed']}"
+            sync_channels = parallelism or config.SYSTEM_CONFIG.get('sftp_parallelism', 4)
+            with self.connection_upto(sync_channels + 1) as (ssh, granted):
+                stats = ManifestSync(ssh, max(1, granted - 1), mode).download(remote_path, local_path, recursive, include)
+                connection_manager.mark_alive(ssh)
+            summary = format_transfer_summary('下载', stats)
+            logger.info(summary)
             return True, summary, stats
             
         except Exception as e:
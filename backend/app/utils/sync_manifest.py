@@ -0,0 +1,428 @@
+import hashlib
+import json
+import os
+import shlex
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+import paramiko
+from .logger import setup_logger
+from .sftp_transfer import PART_SUFFIX, SftpTransferEngine, TransferItem, file_sha256, new_transfer_stats
+from .tar_transfer import TarStreamTransfer
+from ..config import Config
+
+logger = setup_logger('sync_manifest')
+
+# 远程目录中的清单文件名，记录文件的大小、修改时间和sha256
+MANIFEST_NAME = '.rlt_manifest.json'
+# 本地清单缓存目录，避免在数据目录中写入额外文件
+LOCAL_MANIFEST_DIR = os.path.join(Config.DATA_DIR, '.sync_manifest')
+# 远程命令输出中清单与文件列表的分隔行
+_LISTING_MARK = '<<<RLT_LISTING>>>'
+
+
+def _local_cache_path(local_dir: str) -> str:
+    key = hashlib.sha1(os.path.abspath(local_dir).encode('utf-8')).hexdigest()
+    return os.path.join(LOCAL_MANIFEST_DIR, f'{key}.json')
+
+
+def build_local_manifest(local_dir: str, recursive: bool = True) -> Dict[str, Dict]:
+    """
+    生成本地目录清单 {相对路径: {size, mtime, sha256}}
+
+    大小和修改时间与上次缓存一致的文件直接复用缓存的sha256，不重新计算。
+    """
+    cache_path = _local_cache_path(local_dir)
+    cached = {}
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+        except Exception:
+            cached = {}
+
+    manifest = {}
+    for root, dirs, files in os.walk(local_dir):
+        for name in files:
+            # 跳过清单和未完成传输的临时文件
+            if name == MANIFEST_NAME or name.endswith(PART_SUFFIX):
+                continue
+            path = os.path.join(root, name)
+            rel_path = os.path.relpath(path, local_dir).replace('\\', '/')
+            st = os.stat(path)
+            entry = cached.get(rel_path)
+            if entry and entry.get('size') == st.st_size and entry.get('mtime') == st.st_mtime_ns:
+                sha256 = entry['sha256']
+            else:
+                sha256 = file_sha256(path)
+            manifest[rel_path] = {'size': st.st_size, 'mtime': st.st_mtime_ns, 'sha256': sha256}
+        if not recursive:
+            break
+
+    save_local_manifest(local_dir, manifest)
+    return manifest
+
+
+def save_local_manifest(local_dir: str, manifest: Dict[str, Dict]):
+    """保存本地清单缓存"""
+    try:
+        os.makedirs(LOCAL_MANIFEST_DIR, exist_ok=True)
+        with open(_local_cache_path(local_dir), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+    except Exception as e:
+        logger.warning(f"保存本地清单缓存失败: {local_dir}, {str(e)}")
+
+
+def parse_remote_listing(output: str) -> Tuple[Dict[str, Dict], Dict[str, Dict], List[str]]:
+    """
+    解析远程清单和文件列表命令的输出
+
+    Returns:
+        (远程清单, 远程文件 {相对路径: {size, mtime}}, 远程子目录列表)
+    """
+    manifest_text, _, listing = output.partition(_LISTING_MARK)
+    try:
+        manifest = json.loads(manifest_text.strip() or '{}')
+        if not isinstance(manifest, dict):
+            manifest = {}
+    except ValueError:
+        manifest = {}
+
+    files, dirs = {}, []
+    for line in listing.splitlines():
+        parts = line.split('\t')
+        if len(parts) != 4 or not parts[1]:
+            continue
+        file_type, rel_path, size, mtime = parts
+        if file_type == 'd':
+            dirs.append(rel_path)
+        elif file_type == 'f' and rel_path != MANIFEST_NAME and not rel_path.endswith(PART_SUFFIX):
+            files[rel_path] = {'size': int(size), 'mtime': mtime}
+    return manifest, files, dirs
+
+
+def diff_manifests(local: Dict[str, Dict], remote_files: Dict[str, Dict],
+                   remote_manifest: Dict[str, Dict]) -> Tuple[List[str], List[str], List[str], List[str]]:
+    """
+    对比本地清单和远程文件
+
+    远程文件的大小和修改时间与远程清单一致时使用清单中的sha256，否则需要在远程计算。
+
+    Returns:
+        (新增, 大小不同需更新, 大小相同但需在远程计算hash的文件, 内容一致的文件)
+    """
+    added, updated, unknown, unchanged = [], [], [], []
+    for rel_path, entry in local.items():
+        remote = remote_files.get(rel_path)
+        if remote is None:
+            added.append(rel_path)
+            continue
+        if remote['size'] != entry['size']:
+            updated.append(rel_path)
+            continue
+        cached = remote_manifest.get(rel_path)
+        if not cached or cached.get('size') != remote['size'] or cached.get('mtime') != remote['mtime']:
+            unknown.append(rel_path)
+        elif cached.get('sha256') == entry['sha256']:
+            unchanged.append(rel_path)
+        else:
+            updated.append(rel_path)
+    return added, updated, unknown, unchanged
+
+
+class ManifestSync:
+    """
+    基于内容hash清单的增量目录同步
+
+    一次远程命令同时读取远程清单和文件列表（find），大小和修改时间未变的远程文件直接使用
+    清单中的hash；大小相同但无法确认内容的文件在远程批量计算sha256。只传输内容不同的文件，
+    同步后更新两端的清单。
+
+    需要传输的小文件较多时通过tar流一次传输（mode=auto），远程没有tar或tar传输失败时
+    回退到多通道SFTP；大文件始终走SFTP分块续传和sha256校验。
+    """
+
+    def __init__(self, ssh: paramiko.SSHClient, parallelism: Optional[int] = None, mode: str = 'auto'):
+        """
+        Args:
+            ssh: 已连接的SSH客户端
+            parallelism: SFTP并发通道数
+            mode: 传输方式，auto（按文件数量和大小选择）、tar 或 sftp
+        """
+        self.ssh = ssh
+        self.mode = mode
+        self.engine = SftpTransferEngine(ssh, parallelism)
+        self.tar = TarStreamTransfer(ssh, compress=Config.SYSTEM_CONFIG.get('tar_transfer_compress', False))
+
+    def _exec(self, command: str, stdin_data: Optional[bytes] = None) -> Tuple[int, str, str]:
+        stdin, stdout, stderr = self.ssh.exec_command(command)
+        if stdin_data is not None:
+            stdin.write(stdin_data)
+            stdin.channel.shutdown_write()
+        exit_status = stdout.channel.recv_exit_status()
+        return exit_status, stdout.read().decode('utf-8', 'replace'), stderr.read().decode('utf-8', 'replace')
+
+    @staticmethod
+    def _listing_command(recursive: bool) -> str:
+        """列出当前目录下文件和子目录的命令，输出格式见 parse_remote_listing"""
+        depth = '' if recursive else '-maxdepth 1 '
+        return (
+            f"echo '{_LISTING_MARK}'; "
+            f"find . -mindepth 1 {depth}\\( -type f -o -type d \\) -printf '%y\\t%P\\t%s\\t%T@\\n'"
+        )
+
+    def read_remote_state(self, remote_dir: str, recursive: bool = True) -> Tuple[Dict, Dict, List[str]]:
+        """一次往返读取远程清单和文件列表，目录不存在时返回空"""
+        command = (
+            f"cd {shlex.quote(remote_dir)} 2>/dev/null || exit 0; "
+            f"cat {MANIFEST_NAME} 2>/dev/null; echo; {self._listing_command(recursive)}"
+        )
+        exit_status, output, error = self._exec(command)
+        if exit_status != 0:
+            raise IOError(f"读取远程目录失败: {remote_dir}, {error.strip()}")
+        return parse_remote_listing(output)
+
+    def remote_sha256(self, remote_dir: str, rel_paths: List[str]) -> Dict[str, str]:
+        """在远程批量计算文件的sha256"""
+        if not rel_paths:
+            return {}
+        stdin_data = b'\0'.join(p.encode('utf-8') for p in rel_paths) + b'\0'
+        exit_status, output, error = self._exec(
+            f"cd {shlex.quote(remote_dir)} && xargs -0 sha256sum --", stdin_data
+        )
+        hashes = {}
+        for line in output.splitlines():
+            # 文件名包含特殊字符时sha256sum会转义输出，此类文件按内容不同处理
+            if line.startswith('\\') or '  ' not in line:
+                continue
+            digest, rel_path = line.split('  ', 1)
+            hashes[rel_path] = digest
+        return hashes
+
+    def write_remote_manifest(self, remote_dir: str, recursive: bool, hashes: Dict[str, str],
+                              files: Optional[Dict[str, Dict]] = None):
+        """
+        按同步后的远程文件列表写入远程清单
+
+        Args:
+            files: 同步后的远程文件列表，为空时重新读取
+        """
+        try:
+            if files is None:
+                _, files, _ = self.read_remote_state(remote_dir, recursive)
+            manifest = {
+                rel_path: dict(info, sha256=hashes[rel_path])
+                for rel_path, info in files.items() if rel_path in hashes
+            }
+            sftp = self.ssh.open_sftp()
+            try:
+                with sftp.open(f"{remote_dir.rstrip('/')}/{MANIFEST_NAME}", 'w') as f:
+                    f.write(json.dumps(manifest))
+            finally:
+                sftp.close()
+        except Exception as e:
+            logger.warning(f"写入远程清单失败: {remote_dir}, {str(e)}")
+
+    def _prune_remote(self, remote_dir: str, rel_paths: List[str]) -> int:
+        if not rel_paths:
+            return 0
+        stdin_data = b'\0'.join(p.encode('utf-8') for p in rel_paths) + b'\0'
+        exit_status, _, error = self._exec(f"cd {shlex.quote(remote_dir)} && xargs -0 rm -rf --", stdin_data)
+        if exit_status != 0:
+            logger.warning(f"清理远程多余文件失败: {error.strip()}")
+        return len(rel_paths)
+
+    def _use_tar(self, items: List[TransferItem]) -> bool:
+        """是否使用tar流传输：文件数量多且平均大小较小"""
+        if self.mode == 'sftp' or not items:
+            return False
+        if self.mode == 'auto':
+            min_files = Config.SYSTEM_CONFIG.get('bulk_transfer_min_files', 16)
+            max_avg_size = Config.SYSTEM_CONFIG.get('bulk_transfer_max_avg_size', 2 * 1024 * 1024)
+            if len(items) < min_files or sum(i.size for i in items) / len(items) > max_avg_size:
+                return False
+        try:
+            return self.tar.is_supported()
+        except Exception as e:
+            logger.warning(f"检测远程tar失败: {str(e)}")
+            return False
+
+    def _transfer(self, items: List[TransferItem], stats: Dict, upload: bool, local_dir: str,
+                  remote_dir: str, recursive: bool) -> Tuple[List[TransferItem], Optional[Dict[str, Dict]]]:
+        """
+        传输文件，小文件优先使用tar流，失败时回退到SFTP
+
+        达到 resumable_transfer_min_size 的大文件始终走SFTP分块续传并校验sha256，不放入tar流。
+
+        Returns:
+            (失败的文件, tar上传后顺带列出的远程文件列表)
+        """
+        large = [item for item in items if item.size >= self.engine.resumable_min_size]
+        small = [item for item in items if item.size < self.engine.resumable_min_size]
+        if not self._use_tar(small):
+            return self._transfer_sftp(items, stats, upload, remote_dir), None
+
+        # 先传大文件，tar上传结束时列出的远程文件列表才包含全部文件
+        failed = self._transfer_sftp(large, stats, upload, remote_dir) if large else []
+        rel_paths = [
+            os.path.relpath(item.local_path, local_dir).replace('\\', '/') for item in small
+        ]
+        try:
+            if upload:
+                total, output = self.tar.upload(local_dir, remote_dir, rel_paths, self._listing_command(recursive))
+                _, files, _ = parse_remote_listing(output)
+            else:
+                total = self.tar.download(remote_dir, local_dir, rel_paths)
+                files = None
+        except Exception as e:
+            logger.warning(f"tar流传输失败，改用SFTP: {str(e)}")
+            return failed + self._transfer_sftp(small, stats, upload, remote_dir), None
+
+        for item in small:
+            stats[item.action] += 1
+        stats['bytes'] += total
+        stats['mode'] = 'tar+sftp' if large else 'tar'
+        return failed, files
+
+    def _transfer_sftp(self, items: List[TransferItem], stats: Dict, upload: bool,
+                       remote_dir: str) -> List[TransferItem]:
+        """多通道SFTP传输，大文件分块续传"""
+        stats['mode'] = 'sftp'
+        if upload:
+            remote_subdirs = {os.path.dirname(item.remote_path) for item in items}
+            self.engine.make_remote_dirs(sorted(remote_subdirs | {remote_dir}))
+        return self.engine.transfer(items, stats, upload)
+
+    def upload(self, local_dir: str, remote_dir: str, recursive: bool = True, prune: bool = False) -> Dict:
+        """
+        增量上传目录
+
+        Args:
+            local_dir: 本地目录
+            remote_dir: 远程目录
+            recursive: 是否包含子目录
+            prune: 是否删除远程目录中本地不存在的文件和子目录
+        """
+        stats = new_transfer_stats()
+        stats['pruned'] = 0
+        start = time.time()
+
+        local = build_local_manifest(local_dir, recursive)
+        remote_manifest, remote_files, remote_dirs = self.read_remote_state(remote_dir, recursive)
+        added, updated, unknown, unchanged = diff_manifests(local, remote_files, remote_manifest)
+
+        remote_hashes = self.remote_sha256(remote_dir, unknown)
+        for rel_path in unknown:
+            if remote_hashes.get(rel_path) == local[rel_path]['sha256']:
+                unchanged.append(rel_path)
+            else:
+                updated.append(rel_path)
+        stats['unchanged'] = len(unchanged)
+
+        if prune:
+            local_dirs = {os.path.dirname(p) for p in local}
+            extra = [p for p in remote_files if p not in local]
+            extra += [d for d in remote_dirs if d not in local_dirs
+                      and not any(ld.startswith(d + '/') for ld in local_dirs)]
+            stats['pruned'] = self._prune_remote(remote_dir, extra)
+
+        changed = added + updated
+        added_set = set(added)
+        if changed:
+            items = [
+                TransferItem(
+                    os.path.join(local_dir, rel_path),
+                    f"{remote_dir.rstrip('/')}/{rel_path}",
+                    local[rel_path]['size'],
+                    'added' if rel_path in added_set else 'updated',
+                    local[rel_path]['sha256']
+                )
+                for rel_path in changed
+            ]
+            failed, remote_files_after = self._transfer(items, stats, True, local_dir, remote_dir, recursive)
+            failed_paths = {os.path.relpath(item.local_path, local_dir).replace('\\', '/') for item in failed}
+        else:
+            failed_paths, remote_files_after = set(), None
+
+        if changed or unknown or stats['pruned']:
+            # 传输失败的文件不写入清单，下次重新比对
+            hashes = {p: e['sha256'] for p, e in local.items() if p not in failed_paths}
+            self.write_remote_manifest(remote_dir, recursive, hashes, remote_files_after)
+        else:
+            logger.info(f"目录清单一致，跳过上传: {local_dir} -> {remote_dir}")
+
+        self.engine.finish_stats(stats, start)
+        return stats
+
+    def download(self, remote_dir: str, local_dir: str, recursive: bool = True,
+                 include: Optional[Callable[[str, Dict], bool]] = None) -> Dict:
+        """
+        增量下载目录
+
+        Args:
+            remote_dir: 远程目录
+            local_dir: 本地目录
+            recursive: 是否包含子目录
+            include: 远程文件过滤函数 (相对路径, {size, mtime}) -> 是否下载，如只下载已写完的文件
+        """
+        stats = new_transfer_stats()
+        start = time.time()
+        os.makedirs(local_dir, exist_ok=True)
+
+        local = build_local_manifest(local_dir, recursive)
+        remote_manifest, remote_files, _ = self.read_remote_state(remote_dir, recursive)
+        if include is not None:
+            remote_files = {p: info for p, info in remote_files.items() if include(p, info)}
+
+        # 以远程为准对比：新增、大小不同、大小相同但hash未知
+        added, updated, unknown = [], [], []
+        remote_hashes = {}
+        for rel_path, info in remote_files.items():
+            entry = local.get(rel_path)
+            if entry is None:
+                added.append(rel_path)
+            elif entry['size'] != info['size']:
+                updated.append(rel_path)
+            else:
+                cached = remote_manifest.get(rel_path)
+                if cached and cached.get('size') == info['size'] and cached.get('mtime') == info['mtime']:
+                    remote_hashes[rel_path] = cached.get('sha256')
+                else:
+                    unknown.append(rel_path)
+        remote_hashes.update(self.remote_sha256(remote_dir, unknown))
+        # 远程未能计算hash的文件重新下载
+        updated.extend(p for p in unknown if p not in remote_hashes)
+
+        for rel_path, digest in remote_hashes.items():
+            if digest == local[rel_path]['sha256']:
+                stats['unchanged'] += 1
+            else:
+                updated.append(rel_path)
+
+        changed = added + updated
+        added_set = set(added)
+        if changed:
+            items = []
+            for rel_path in changed:
+                local_path = os.path.join(local_dir, rel_path)
+                os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                items.append(TransferItem(
+                    local_path,
+                    f"{remote_dir.rstrip('/')}/{rel_path}",
+                    remote_files[rel_path]['size'],
+                    'added' if rel_path in added_set else 'updated',
+                    remote_hashes.get(rel_path)
+                ))
+            failed, _ = self._transfer(items, stats, False, local_dir, remote_dir, recursive)
+            local = build_local_manifest(local_dir, recursive)
+            for item in failed:
+                local.pop(os.path.relpath(item.local_path, local_dir).replace('\\', '/'), None)
+
+        # 下载后本地内容即远程内容，把hash写回远程清单供下次复用
+        if changed or unknown:
+            hashes = {p: local[p]['sha256'] for p in remote_files if p in local}
+            self.write_remote_manifest(remote_dir, recursive, hashes, remote_files)
+        elif remote_files:
+            logger.info(f"目录清单一致，跳过下载: {remote_dir} -> {local_dir}")
+
+        self.engine.finish_stats(stats, start)
+        return stats
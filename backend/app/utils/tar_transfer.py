@@ -0,0 +1,126 @@
+import os
+import shlex
+import tarfile
+import threading
+from typing import Dict, List, Optional, Tuple
+import paramiko
+from .logger import setup_logger
+from .sftp_transfer import PART_SUFFIX
+
+logger = setup_logger('tar_transfer')
+
+
+class TarStreamTransfer:
+    """
+    通过exec通道传输tar流
+
+    上传时本地打包写入远程 tar -x 的标准输入，下载时读取远程 tar -c 的标准输出，
+    大量小文件只需一次往返，避免SFTP逐个文件的请求开销。
+    """
+    # 各SSH连接是否支持tar，key为transport的id
+    _support: Dict[int, bool] = {}
+    _support_lock = threading.Lock()
+
+    def __init__(self, ssh: paramiko.SSHClient, compress: bool = False):
+        """
+        Args:
+            ssh: 已连接的SSH客户端
+            compress: 是否使用gzip压缩tar流（适合文本，图片压缩收益很小）
+        """
+        self.ssh = ssh
+        self.compress = compress
+
+    def is_supported(self) -> bool:
+        """远程是否安装了tar，每个SSH连接只检测一次"""
+        key = id(self.ssh.get_transport())
+        supported = TarStreamTransfer._support.get(key)
+        if supported is None:
+            stdin, stdout, stderr = self.ssh.exec_command('command -v tar >/dev/null 2>&1')
+            supported = stdout.channel.recv_exit_status() == 0
+            with TarStreamTransfer._support_lock:
+                TarStreamTransfer._support[key] = supported
+            if not supported:
+                logger.info("远程服务器未安装tar，使用SFTP逐个传输")
+        return supported
+
+    def upload(self, local_dir: str, remote_dir: str, rel_paths: List[str],
+               post_command: Optional[str] = None) -> Tuple[int, str]:
+        """
+        打包上传文件到远程目录
+
+        Args:
+            local_dir: 本地目录
+            remote_dir: 远程目录
+            rel_paths: 相对local_dir的文件路径
+            post_command: 解包成功后在远程目录中执行的命令（如列出文件），输出一并返回
+
+        Returns:
+            (上传的文件字节数, post_command的输出)
+        """
+        flag = 'z' if self.compress else ''
+        quoted_dir = shlex.quote(remote_dir)
+        command = f"mkdir -p {quoted_dir} && tar -x{flag}f - -C {quoted_dir}"
+        if post_command:
+            command += f" && cd {quoted_dir} && {{ {post_command}; }}"
+
+        stdin, stdout, stderr = self.ssh.exec_command(command)
+        total = 0
+        try:
+            with tarfile.open(fileobj=stdin, mode=f"w|{'gz' if self.compress else ''}") as tar:
+                for rel_path in rel_paths:
+                    local_path = os.path.join(local_dir, rel_path)
+                    tar.add(local_path, arcname=rel_path, recursive=False)
+                    total += os.path.getsize(local_path)
+        finally:
+            stdin.channel.shutdown_write()
+
+        output = stdout.read().decode('utf-8', 'replace')
+        if stdout.channel.recv_exit_status() != 0:
+            raise IOError(f"tar上传失败: {stderr.read().decode('utf-8', 'replace').strip()}")
+        return total, output
+
+    def download(self, remote_dir: str, local_dir: str, rel_paths: List[str]) -> int:
+        """
+        打包下载远程目录中的文件
+
+        Args:
+            remote_dir: 远程目录
+            local_dir: 本地目录
+            rel_paths: 相对remote_dir的文件路径
+
+        Returns:
+            下载的文件字节数
+        """
+        flag = 'z' if self.compress else ''
+        command = f"cd {shlex.quote(remote_dir)} && tar -c{flag}f - --null -T -"
+        stdin, stdout, stderr = self.ssh.exec_command(command)
+        stdin.write(b'\0'.join(p.encode('utf-8') for p in rel_paths) + b'\0')
+        stdin.channel.shutdown_write()
+
+        expected = set(rel_paths)
+        local_root = os.path.abspath(local_dir)
+        total = 0
+        with tarfile.open(fileobj=stdout, mode=f"r|{'gz' if self.compress else ''}") as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                local_path = os.path.abspath(os.path.join(local_root, member.name))
+                # 只接受请求的文件，防止路径穿越
+                if member.name not in expected or not local_path.startswith(local_root + os.sep):
+                    logger.warning(f"忽略tar流中的非预期文件: {member.name}")
+                    continue
+                os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                temp_path = local_path + PART_SUFFIX
+                source = tar.extractfile(member)
+                with open(temp_path, 'wb') as f:
+                    while True:
+                        chunk = source.read(1024 * 1024)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                os.replace(temp_path, local_path)
+                total += member.size
+
+        if stdout.channel.recv_exit_status() != 0:
+            raise IOError(f"tar下载失败: {stderr.read().decode('utf-8', 'replace').strip()}")
+        return total
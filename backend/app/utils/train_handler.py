@@ -1,9 +1,9 @@
 import json
-import requests
 import os
 import uuid
 from typing import Tuple, Dict, Optional, Any, List
 from ..utils.logger import setup_logger
+from .http_client import HttpClientRegistry
 from dataclasses import dataclass, field
 
 logger = setup_logger('train_handler')
@@ -27,6 +27,12 @@ class TrainRequestHandler:
             self.training_port = port
         
         self.api_base_url = f"{self.asset_ip}:{self.training_port}/api"
+        # 复用资产的keep-alive连接，资产信息变更后重建
+        base_url = f"{self.asset_ip}:{self.training_port}"
+        version = getattr(asset, 'updated_at', None)
+        self.session = HttpClientRegistry.get_session(asset.id, base_url, version)
+        # 状态查询使用短超时、不重试的会话，避免无响应的服务长时间占用轮询线程
+        self.poll_session = HttpClientRegistry.get_session(asset.id, base_url, version, poll=True)
 
     def train_request(self, train_config: Dict[str, Any],train_headers: Optional[Dict[str, Any]] = None) -> str:
         """
@@ -47,7 +53,7 @@ class TrainRequestHandler:
         logger.debug(f"发送训练请求到 {url}")
         
         # 发送请求
-        response = requests.post(url, json=train_config, headers=headers, timeout=60)
+        response = self.session.post(url, json=train_config, headers=headers, timeout=60)
         response.raise_for_status()
         
         data = response.json()
@@ -105,6 +111,14 @@ class TrainRequestHandler:
             # 返回处理中状态，允许后续重试
             raise e
         
+    def check_status_batch(self, task_ids: List[str], train_headers: Optional[Dict[str, Any]] = None) -> Dict[str, str]:
+        """
+        批量检查多个训练任务的状态，只请求一次任务列表
+        :param task_ids: 训练任务ID列表
+        :return: {task_id: status}，训练引擎中不存在的任务状态为 NOT_FOUND
+        """
+        return self.map_task_statuses(self.get_tasks(train_headers), task_ids)
+        
     def cancel_training(self, task_id: str, train_headers: Optional[Dict[str,any]] = None) -> bool:
         """
         取消训练任务
@@ -119,7 +133,7 @@ class TrainRequestHandler:
         if train_headers:
             headers.update(train_headers)
         
-        response = requests.get(url, headers=headers, timeout=30)
+        response = self.session.get(url, headers=headers, timeout=30)
         response.raise_for_status()
         
         data = response.json()
@@ -144,7 +158,7 @@ class TrainRequestHandler:
             'X-TensorBoard-Feature-Flags': '{"enabledColorGroup":true,"enabledColorGroupByRegex":true,"enabledExperimentalPlugins":[],"enabledLinkedTime":false,"enabledCardWidthSetting":true,"enabledScalarDataTable":false,"forceSvg":false,"enableDarkModeOverride":null,"defaultEnableDarkMode":false,"isAutoDarkModeAllowed":true,"inColab":false,"metricsImageSupportEnabled":true,"enableTimeSeriesPromotion":false}'
         }
         
-        response = requests.get(url, headers=headers, timeout=30)
+        response = self.session.get(url, headers=headers, timeout=30)
         response.raise_for_status()
         
         data = response.json()
@@ -190,7 +204,7 @@ class TrainRequestHandler:
             'requests': (None, json.dumps([{"plugin":"scalars","tag":"loss/average","run":matched_key}]))
         }
         
-        response = requests.post(url, files=files, headers=headers, timeout=30)
+        response = self.session.post(url, files=files, headers=headers, timeout=30)
         response.raise_for_status()
         
         data = response.json()
@@ -212,17 +226,29 @@ class TrainRequestHandler:
             headers.update(train_headers)
         
         try:
-            response = requests.get(url, headers=headers, timeout=30)
+            response = self.poll_session.get(url, headers=headers)
             response.raise_for_status()
             
-            data = response.json()
-            
-            # 检查响应是否有效
-            if data.get('status') != 'success' or 'data' not in data:
-                logger.warning(f"训练任务列表响应格式无效: {data}")
-                raise ValueError("训练任务列表响应格式无效")
-            
-            # 标准化返回格式
-            return data.get('data', {}).get('tasks', [])
+            return self.parse_tasks_response(response.json())
         except Exception as e:
-            raise ValueError(f"获取训练任务列表失败: {str(e)}") 
\ No newline at end of file
+            raise ValueError(f"获取训练任务列表失败: {str(e)}")
+    
+    @staticmethod
+    def parse_tasks_response(data: Dict) -> List[Dict]:
+        """
+        解析 /api/tasks 的响应
+        :return: 任务列表
+        """
+        # 检查响应是否有效
+        if data.get('status') != 'success' or 'data' not in data:
+            logger.warning(f"训练任务列表响应格式无效: {data}")
+            raise ValueError("训练任务列表响应格式无效")
+        
+        # 标准化返回格式
+        return data.get('data', {}).get('tasks', [])
+    
+    @staticmethod
+    def map_task_statuses(tasks_data: List[Dict], task_ids: List[str]) -> Dict[str, str]:
+        """把任务列表映射为 {task_id: status}，不存在的任务状态为 NOT_FOUND"""
+        statuses = {task.get('id'): task.get('status', '') for task in tasks_data}
+        return {task_id: statuses.get(task_id, "NOT_FOUND") for task_id in task_ids}
@@ -0,0 +1,88 @@
+import json
+import os
+import threading
+from typing import Any, Dict, Tuple
+from .logger import setup_logger
+
+logger = setup_logger('workflow_templates')
+
+
+class WorkflowTemplateRegistry:
+    """
+    工作流模板注册表
+
+    每个工作流文件只解析一次，按文件修改时间判断是否需要重新加载。渲染时只复制被绑定参数的
+    节点，其余节点与模板共享，提交请求时不再读写文件。模板和渲染结果中未绑定的节点都不能原地修改。
+    """
+    # {文件路径: (修改时间ns, 文件大小, 工作流)}
+    _templates: Dict[str, Tuple[int, int, Dict]] = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get(path: str) -> Dict:
+        """
+        获取解析后的模板（只读）
+
+        Raises:
+            OSError: 文件不存在或无法读取
+            ValueError: 文件不是合法的JSON
+        """
+        stat = os.stat(path)
+        cached = WorkflowTemplateRegistry._templates.get(path)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+
+        with WorkflowTemplateRegistry._lock:
+            cached = WorkflowTemplateRegistry._templates.get(path)
+            if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+                return cached[2]
+            with open(path, 'r', encoding='utf-8') as f:
+                workflow = json.load(f)
+            WorkflowTemplateRegistry._templates[path] = (stat.st_mtime_ns, stat.st_size, workflow)
+            logger.info(f"加载工作流模板: {path}")
+            return workflow
+
+    @staticmethod
+    def render(path: str, bindings: Dict[Tuple[str, str], Any]) -> Dict:
+        """
+        按节点ID绑定参数生成工作流
+
+        Args:
+            path: 模板文件路径
+            bindings: {(节点ID, 输入名): 值}
+
+        Returns:
+            可直接提交的工作流，被绑定的节点为独立副本
+
+        Raises:
+            KeyError: 模板中不存在绑定的节点
+        """
+        template = WorkflowTemplateRegistry.get(path)
+        workflow = dict(template)
+        for (node_id, input_name), value in bindings.items():
+            node = workflow.get(node_id)
+            if node is None:
+                raise KeyError(f"工作流 {os.path.basename(path)} 中不存在节点 {node_id}")
+            if node is template[node_id]:
+                node = {**node, 'inputs': dict(node.get('inputs', {}))}
+                workflow[node_id] = node
+            node['inputs'][input_name] = value
+        return workflow
+
+    @staticmethod
+    def dump(workflow: Dict, path: str):
+        """把渲染结果写入文件用于调试，先写临时文件再替换，并发写入时不会产生不完整的文件"""
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(workflow, f, ensure_ascii=False, indent=4)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"保存调试工作流失败: {str(e)}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    @staticmethod
+    def clear():
+        with WorkflowTemplateRegistry._lock:
+            WorkflowTemplateRegistry._templates.clear()
@@ -5,10 +5,12 @@ import sys
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(ROOT_DIR)
 
-from app.main import app
+from app.main import create_app
 from app.config import config
 
 if __name__ == '__main__':
+    # 只有直接运行时才按配置在Web进程内启动调度
+    app = create_app(start_scheduler=config.RUN_SCHEDULER)
     app.run(
         host=config.HOST,
         port=config.PORT,
@@ -0,0 +1,89 @@
+"""
+独立的任务调度进程，负责任务派发和状态监控
+
+Web进程以 RUN_SCHEDULER=false 启动（纯API模式），调度由本进程负责：
+    RUN_SCHEDULER=false python run.py
+    python run_worker.py --processes 2
+
+使用 gunicorn 部署时Web进程从 wsgi.py 加载：
+    RUN_SCHEDULER=false gunicorn -w 2 --threads 8 -b 0.0.0.0:5000 wsgi:app
+
+多个调度进程之间通过数据库租约协调，不会重复派发任务；
+Web进程提交任务后写入数据库唤醒信号，调度进程轮询到后立即调度。
+"""
+import os
+import sys
+import signal
+import argparse
+import threading
+import multiprocessing
+
+# 添加项目根目录到 Python 路径
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(ROOT_DIR)
+
+
+def run_worker():
+    """运行单个调度进程，直到收到退出信号"""
+    from app.database import init_db
+    from app.services.task_services.scheduler_service import SchedulerService
+    from app.services.task_services.status_poller import StatusPollerService
+    from app.utils.ssh import close_ssh_connection_pool
+    from app.utils.http_client import HttpClientRegistry
+    from app.utils.logger import setup_logger
+
+    logger = setup_logger('worker')
+    stop_event = threading.Event()
+
+    def handle_signal(signum, frame):
+        logger.info(f"调度进程 {os.getpid()} 收到退出信号 {signum}")
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+
+    init_db()
+    SchedulerService.init_scheduler()
+    logger.info(f"调度进程 {os.getpid()} 已启动")
+
+    try:
+        while not stop_event.wait(1):
+            pass
+    finally:
+        SchedulerService.stop_scheduler()
+        StatusPollerService.shutdown()
+        close_ssh_connection_pool()
+        HttpClientRegistry.close_all()
+        logger.info(f"调度进程 {os.getpid()} 已退出")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='RLT任务调度进程')
+    parser.add_argument('--processes', type=int, default=1, help='启动的调度进程数')
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        run_worker()
+        return
+
+    processes = [
+        multiprocessing.Process(target=run_worker, name=f'rlt_worker_{i}')
+        for i in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+
+    def handle_signal(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+
+    for process in processes:
+        process.join()
+
+
+if __name__ == '__main__':
+    main()
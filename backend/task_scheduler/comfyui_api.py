@@ -6,6 +6,9 @@ from pathlib import Path
 import uuid
 import logging
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
 
 # 配置日志，使用已有的日志配置
 logger = logging.getLogger('ComfyUIAPI')
@@ -17,20 +20,26 @@ class ComfyUIConfig:
     port: int = 8188
     client_id: str = "RICK"
     output_dir: str = "output"
+    download_workers: int = 4   # 并发下载输出图像的线程数
 
     def __post_init__(self):
         if not self.client_id:
             self.client_id = str(uuid.uuid4())
-        if not self.host.startswith("http://"):
+        if not self.host.startswith(("http://", "https://")):
             self.host = f"http://{self.host}"
         self.base_url = f"{self.host}:{self.port}"
 
 class ComfyUIAPI:
     """ComfyUI API 工具类"""
     
-    def __init__(self, config: ComfyUIConfig):
+    def __init__(self, config: ComfyUIConfig, session: Optional[requests.Session] = None):
+        """
+        Args:
+            config: ComfyUI配置
+            session: 复用的HTTP会话，不提供时创建新会话
+        """
         self.config = config
-        self.session = requests.Session()
+        self.session = session or requests.Session()
         
     def _make_request(self, method: str, endpoint: str, **kwargs) -> Dict:
         """发送 HTTP 请求并处理响应"""
@@ -199,6 +208,85 @@ class ComfyUIAPI:
             logger.error(error_message)
             raise Exception(error_message)
 
+    def download_image(self, filename: str, local_path: str, chunk_size: int = 1024 * 1024) -> bool:
+        """
+        流式下载生成的图片到本地，先写临时文件再重命名，不在内存中缓存整张图片
+
+        ComfyUI 的输出文件名会重复使用，本地已有同名文件时先发HEAD请求，只有大小与 Content-Length 一致、
+        且修改时间与 Last-Modified 一致（响应带该头时）才跳过，否则重新下载覆盖，一致时不请求图片内容。
+        HEAD请求失败时按GET响应头比对。下载完成后把本地文件的修改时间设为 Last-Modified，供下次比对。
+        
+        Args:
+            filename: 图片在ComfyUI中的文件名（可包含子文件夹）
+            local_path: 本地保存路径
+            chunk_size: 每次写入的块大小
+            
+        Returns:
+            是否实际下载，本地文件与远程一致时跳过并返回False
+        """
+        url = f"{self.config.base_url}/view?filename={filename}"
+        temp_path = f"{local_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        if os.path.isfile(local_path):
+            head = self._head(url)
+            if head is not None and self._is_same_file(
+                    local_path, head.headers.get('Content-Length'), self._last_modified(head)):
+                logger.info(f"图像已存在且与远程一致，跳过下载: {local_path}")
+                return False
+        try:
+            with self.session.get(url, stream=True) as response:
+                response.raise_for_status()
+                modified = self._last_modified(response)
+                if self._is_same_file(local_path, response.headers.get('Content-Length'), modified):
+                    logger.info(f"图像已存在且与远程一致，跳过下载: {local_path}")
+                    return False
+                logger.info(f"下载图片: {url}")
+                with open(temp_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+            if modified is not None:
+                os.utime(temp_path, (modified, modified))
+            os.replace(temp_path, local_path)
+            return True
+        except (requests.exceptions.RequestException, OSError) as e:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            error_message = f"下载图片失败: {str(e)}"
+            logger.error(error_message)
+            raise Exception(error_message)
+
+    def _head(self, url: str) -> Optional[requests.Response]:
+        """发送HEAD请求获取文件大小和修改时间，失败返回None"""
+        try:
+            response = self.session.head(url)
+            response.raise_for_status()
+            return response
+        except requests.exceptions.RequestException as e:
+            logger.debug(f"HEAD请求失败，改用GET响应头比对: {url}, {str(e)}")
+            return None
+
+    @staticmethod
+    def _last_modified(response) -> Optional[float]:
+        """解析响应的 Last-Modified 头，返回时间戳"""
+        value = response.headers.get('Last-Modified')
+        if not value:
+            return None
+        try:
+            return parsedate_to_datetime(value).timestamp()
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _is_same_file(local_path: str, content_length: Optional[str], modified: Optional[float]) -> bool:
+        """本地文件与响应的大小一致，且响应带修改时间时修改时间也一致"""
+        if not content_length or not os.path.isfile(local_path):
+            return False
+        try:
+            if os.path.getsize(local_path) != int(content_length):
+                return False
+        except ValueError:
+            return False
+        return modified is None or int(os.path.getmtime(local_path)) == int(modified)
+
     def save_image(self, image_data: bytes, filename: str) -> None:
         """保存图片到本地"""
         logger.info(f"保存图片到: {filename}")
@@ -226,7 +314,7 @@ class ComfyUIAPI:
         
         # 找出 SaveImage 节点的输出
         output_images = []
-        downloaded_images = []
+        downloads = {}  # {本地路径: 图像文件名}，同名图像只下载一次
 
         history_content = history[prompt_id]
         outputs = history_content.get("outputs", {})
@@ -253,24 +341,24 @@ class ComfyUIAPI:
                     # 构建完整文件名(包含子文件夹)
                     full_filename = os.path.join(subfolder, image_filename) if subfolder else image_filename
                     output_images.append(full_filename)
-                    
-                    # 下载图像到output目录
-                    try:
-                        # 获取图像数据
-                        image_data = self.get_image(full_filename)
-                        
-                        # 保存图像到output目录，保持子文件夹结构
-                        # local_dir = os.path.join(self.output_dir, subfolder) if subfolder else self.output_dir
-                        # os.makedirs(local_dir, exist_ok=True)
-                        
-                        local_path = os.path.join(local_dir, image_filename)
-                        with open(local_path, 'wb') as f:
-                            f.write(image_data)
+                    downloads[os.path.join(local_dir, image_filename)] = full_filename
+        
+        # 并发流式下载图像到output目录
+        downloaded_images = []
+        if downloads:
+            def download(item):
+                local_path, full_filename = item
+                try:
+                    if self.download_image(full_filename, local_path):
                         logger.info(f"图像已保存到: {local_path}")
-                        
-                        downloaded_images.append(local_path)
-                    except Exception as e:
-                        logger.error(f"下载图像 {full_filename} 失败: {str(e)}")
+                    return local_path
+                except Exception as e:
+                    logger.error(f"下载图像 {full_filename} 失败: {str(e)}")
+                    return None
+            
+            workers = max(1, min(self.config.download_workers, len(downloads)))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ComfyUIDownload") as executor:
+                downloaded_images = [path for path in executor.map(download, downloads.items()) if path]
 
         if output_images:
             logger.info(f"处理了 {len(output_images)} 个图像: {', '.join(output_images)}")
@@ -0,0 +1,145 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger('ComfyUICache')
+
+
+class ComfyUIInfoCache:
+    """
+    ComfyUI 节点信息和模型列表的磁盘缓存
+
+    object_info 按 ComfyUI 版本指纹缓存，同一版本（相同的ComfyUI、Python、PyTorch版本和扩展）的
+    多个资产共用一份；模型列表与资产上的文件有关，按资产和指纹缓存。缓存以gzip压缩的JSON保存，
+    进程内保留解压后的结果，文件未变化时不重复读取。
+    """
+    # 进程内已解压的缓存 {文件路径: (修改时间ns, 保存时间, 数据)}
+    _loaded: Dict[str, Tuple[int, float, Any]] = {}
+    # 资产的版本指纹 {资产地址: (指纹, 获取时间)}
+    _fingerprints: Dict[str, Tuple[str, float]] = {}
+    _lock = threading.Lock()
+    # 后台刷新，同一缓存同时只刷新一次
+    _refreshing = set()
+    _executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="ComfyUICacheRefresh")
+
+    def __init__(self, cache_dir: str, ttl: int = 3600, fingerprint_ttl: int = 600):
+        """
+        Args:
+            cache_dir: 缓存目录
+            ttl: 缓存有效期（秒），过期的缓存仍可使用，同时在后台刷新
+            fingerprint_ttl: 资产版本指纹的有效期（秒）
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.fingerprint_ttl = fingerprint_ttl
+
+    @staticmethod
+    def compute_fingerprint(system_stats: Dict, extensions: Any = None) -> str:
+        """根据 /system_stats 中的版本信息和已安装的扩展计算指纹"""
+        system = (system_stats or {}).get('system', {})
+        parts = {
+            'comfyui_version': system.get('comfyui_version'),
+            'python_version': system.get('python_version'),
+            'pytorch_version': system.get('pytorch_version'),
+            'extensions': sorted(extensions) if isinstance(extensions, list) else None,
+        }
+        return hashlib.sha1(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+    def get_fingerprint(self, api) -> str:
+        """
+        获取资产的版本指纹，有效期内不发起请求
+
+        指纹过期但已有旧值时先返回旧值，在后台重新获取。
+        """
+        asset_key = api.config.base_url
+        cached = ComfyUIInfoCache._fingerprints.get(asset_key)
+        if cached and time.time() - cached[1] < self.fingerprint_ttl:
+            return cached[0]
+        if cached:
+            self.refresh_async(f"fingerprint:{asset_key}", lambda: self._fetch_fingerprint(api))
+            return cached[0]
+        return self._fetch_fingerprint(api)
+
+    def _fetch_fingerprint(self, api) -> str:
+        try:
+            extensions = api.get_extensions()
+        except Exception:
+            extensions = None
+        fingerprint = self.compute_fingerprint(api.get_system_stats(), extensions)
+        ComfyUIInfoCache._fingerprints[api.config.base_url] = (fingerprint, time.time())
+        return fingerprint
+
+    @staticmethod
+    def asset_key(api) -> str:
+        """资产在缓存文件名中的标识"""
+        return hashlib.sha1(api.config.base_url.encode('utf-8')).hexdigest()[:12]
+
+    def _path(self, kind: str, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{kind}_{key}.json.gz")
+
+    def load(self, kind: str, key: str) -> Optional[Tuple[Any, float]]:
+        """
+        读取缓存
+
+        Returns:
+            (数据, 保存时间)，没有缓存或缓存损坏时返回None
+        """
+        path = self._path(kind, key)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        loaded = ComfyUIInfoCache._loaded.get(path)
+        if loaded and loaded[0] == mtime:
+            return loaded[2], loaded[1]
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                content = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取ComfyUI缓存失败，忽略: {path}, {str(e)}")
+            return None
+        ComfyUIInfoCache._loaded[path] = (mtime, content['saved_at'], content['data'])
+        return content['data'], content['saved_at']
+
+    def save(self, kind: str, key: str, data: Any):
+        """写入缓存，先写临时文件再替换"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(kind, key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        saved_at = time.time()
+        try:
+            with gzip.open(temp_path, 'wt', encoding='utf-8', compresslevel=6) as f:
+                json.dump({'saved_at': saved_at, 'data': data}, f, ensure_ascii=False)
+            os.replace(temp_path, path)
+            ComfyUIInfoCache._loaded[path] = (os.stat(path).st_mtime_ns, saved_at, data)
+        except OSError as e:
+            logger.warning(f"保存ComfyUI缓存失败: {path}, {str(e)}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def is_expired(self, saved_at: float) -> bool:
+        return time.time() - saved_at >= self.ttl
+
+    def refresh_async(self, key: str, refresh: Callable[[], Any]):
+        """在后台执行刷新，同一key正在刷新时跳过"""
+        with ComfyUIInfoCache._lock:
+            if key in ComfyUIInfoCache._refreshing:
+                return
+            ComfyUIInfoCache._refreshing.add(key)
+
+        def run():
+            try:
+                refresh()
+            except Exception as e:
+                logger.warning(f"后台刷新ComfyUI缓存失败 [{key}]: {str(e)}")
+            finally:
+                with ComfyUIInfoCache._lock:
+                    ComfyUIInfoCache._refreshing.discard(key)
+
+        ComfyUIInfoCache._executor.submit(run)
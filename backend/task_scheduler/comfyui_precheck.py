@@ -1,14 +1,130 @@
 import json
-from typing import Dict, List, Optional, Any, Union
+import logging
+from collections import OrderedDict, defaultdict, deque
+from typing import Dict, List, Optional, Any, Union, FrozenSet, Tuple
 import os
-from comfyui_api import ComfyUIAPI
+import threading
 import time
+try:
+    from .comfyui_api import ComfyUIAPI
+    from .comfyui_cache import ComfyUIInfoCache
+except ImportError:  # 在task_scheduler目录中直接运行时
+    from comfyui_api import ComfyUIAPI
+    from comfyui_cache import ComfyUIInfoCache
+
+logger = logging.getLogger('ComfyUIPreCheck')
+
+
+class NodeSchema:
+    """单个节点类型的输入定义"""
+    __slots__ = ('required', 'optional', 'names', 'enums')
+
+    def __init__(self, required: FrozenSet[str], optional: FrozenSet[str], enums: Dict[str, FrozenSet]):
+        self.required = required
+        self.optional = optional
+        self.names = required | optional
+        self.enums = enums
+
+    @staticmethod
+    def from_node_info(node_info: Dict) -> 'NodeSchema':
+        input_info = node_info.get("input") or {}
+        required = input_info.get("required") or {}
+        optional = input_info.get("optional") or {}
+        enums = {}
+        for name, spec in list(required.items()) + list(optional.items()):
+            # 枚举输入的定义形如 [["a", "b"], {...}]
+            if isinstance(spec, (list, tuple)) and spec and isinstance(spec[0], list):
+                try:
+                    enums[name] = frozenset(spec[0])
+                except TypeError:
+                    pass
+        return NodeSchema(frozenset(required), frozenset(optional), enums)
+
+
+class NodeSchemaIndex:
+    """
+    object_info 的节点定义索引
+
+    每份 object_info 只预编译一次，校验时按节点类型直接取出输入名集合和枚举值集合，
+    不再逐个节点查询原始的 object_info。
+    """
+    # {id(object_info): (object_info, 索引)}，保留最近使用的几份
+    _indexes: "OrderedDict[int, Tuple[Dict, NodeSchemaIndex]]" = OrderedDict()
+    _lock = threading.Lock()
+    MAX_INDEXES = 8
+
+    def __init__(self, object_info: Dict):
+        self.schemas: Dict[str, Optional[NodeSchema]] = {}
+        for node_type, node_info in object_info.items():
+            self.schemas[node_type] = NodeSchema.from_node_info(node_info) \
+                if isinstance(node_info, dict) and "input" in node_info else None
+
+    def __contains__(self, node_type: str) -> bool:
+        return node_type in self.schemas
+
+    def get(self, node_type: str) -> Optional[NodeSchema]:
+        """节点类型的输入定义，未知类型或没有输入定义时返回None"""
+        return self.schemas.get(node_type)
+
+    @staticmethod
+    def for_object_info(object_info: Dict) -> 'NodeSchemaIndex':
+        """获取 object_info 对应的索引，同一个 object_info 对象复用已编译的索引"""
+        key = id(object_info)
+        with NodeSchemaIndex._lock:
+            entry = NodeSchemaIndex._indexes.get(key)
+            if entry and entry[0] is object_info:
+                NodeSchemaIndex._indexes.move_to_end(key)
+                return entry[1]
+        index = NodeSchemaIndex(object_info)
+        with NodeSchemaIndex._lock:
+            NodeSchemaIndex._indexes[key] = (object_info, index)
+            NodeSchemaIndex._indexes.move_to_end(key)
+            while len(NodeSchemaIndex._indexes) > NodeSchemaIndex.MAX_INDEXES:
+                NodeSchemaIndex._indexes.popitem(last=False)
+        return index
+
+
+def find_cycle_nodes(edges: Dict[str, List[str]], node_ids) -> List[str]:
+    """
+    检测节点连接中的环
+
+    Args:
+        edges: {源节点: [目标节点]}
+        node_ids: 所有节点ID
+
+    Returns:
+        处于环上（或依赖环）的节点ID，无环时为空列表
+    """
+    indegree = {node_id: 0 for node_id in node_ids}
+    for targets in edges.values():
+        for target in targets:
+            indegree[target] += 1
+    queue = deque(node_id for node_id, degree in indegree.items() if degree == 0)
+    visited = 0
+    while queue:
+        node_id = queue.popleft()
+        visited += 1
+        for target in edges.get(node_id, ()):
+            indegree[target] -= 1
+            if indegree[target] == 0:
+                queue.append(target)
+    if visited == len(indegree):
+        return []
+    return [node_id for node_id, degree in indegree.items() if degree > 0]
+
+
 #comfyui执行预检测
 class ComfyUIPreCheck:
     """ComfyUI 预检测工具类"""
     
-    def __init__(self, api: ComfyUIAPI):
+    def __init__(self, api: ComfyUIAPI, cache: Optional[ComfyUIInfoCache] = None):
+        """
+        Args:
+            api: ComfyUI API
+            cache: 磁盘缓存，提供时预缓存结果会持久化并在实例和资产间共享
+        """
         self.api = api
+        self.cache = cache
         # 缓存相关属性
         self._node_types_cache = {}  # 节点类型缓存
         self._model_files_cache = {} # 模型文件缓存
@@ -57,12 +173,69 @@ class ComfyUIPreCheck:
             # 更新缓存时间戳
             self._cache_timestamp = cache_result["timestamp"]
             
+            # 写入磁盘缓存，获取失败的空结果不写入
+            if self.cache and self._node_types_cache:
+                fingerprint = self.cache.get_fingerprint(self.api)
+                self.cache.save('object_info', fingerprint, self._node_types_cache)
+                if cache_models and self._model_files_cache:
+                    self.cache.save('models', self._models_cache_key(fingerprint), self._model_files_cache)
+            
         except Exception as e:
             cache_result["success"] = False
             cache_result["errors"].append(f"预缓存过程出错: {str(e)}")
         
         return cache_result
     
+    def _models_cache_key(self, fingerprint: str) -> str:
+        return f"{self.cache.asset_key(self.api)}_{fingerprint}"
+    
+    def ensure_cache(self, cache_models: bool = True) -> bool:
+        """
+        准备节点和模型缓存
+        
+        内存缓存有效时直接使用；其次读取磁盘缓存，过期时仍先使用并在后台刷新；
+        都没有时同步拉取。预热后不发起网络请求。
+        
+        Args:
+            cache_models: 是否需要模型文件缓存
+            
+        Returns:
+            缓存是否可用
+        """
+        max_age = self.cache.ttl if self.cache else 3600
+        if self._node_types_cache and self.is_cache_valid(max_age):
+            return True
+        if self.cache is None:
+            return self.pre_cache(cache_models)["success"]
+        
+        try:
+            fingerprint = self.cache.get_fingerprint(self.api)
+        except Exception as e:
+            logger.warning(f"获取ComfyUI版本指纹失败: {str(e)}")
+            return False
+        object_info = self.cache.load('object_info', fingerprint)
+        if object_info is None:
+            return self.pre_cache(cache_models)["success"] and bool(self._node_types_cache)
+        
+        self._node_types_cache = object_info[0]
+        self._cache_timestamp = object_info[1]
+        if cache_models:
+            model_files = self.cache.load('models', self._models_cache_key(fingerprint))
+            if model_files is None:
+                # 同版本的其他资产已缓存节点信息，只需获取本资产的模型列表
+                self._model_files_cache = self.analyze_model_files()
+                self.cache.save('models', self._models_cache_key(fingerprint), self._model_files_cache)
+            else:
+                self._model_files_cache = model_files[0]
+                self._cache_timestamp = min(self._cache_timestamp, model_files[1])
+        
+        if self.cache.is_expired(self._cache_timestamp):
+            self.cache.refresh_async(
+                f"precheck:{self._models_cache_key(fingerprint)}",
+                lambda: ComfyUIPreCheck(self.api, self.cache).pre_cache(cache_models)
+            )
+        return True
+    
     def update_cache(self, cache_models: bool = True, model_types: Optional[List[str]] = None) -> Dict:
         """
         更新缓存信息
@@ -169,16 +342,24 @@ class ComfyUIPreCheck:
             print(f"分析节点 {node_type} 失败: {str(e)}")
             return {}
     
-    def analyze_workflow(self, prompt: Dict, use_cache: bool = True) -> Dict:
+    def get_schema_index(self, use_cache: bool = True) -> NodeSchemaIndex:
+        """获取节点定义索引，使用缓存时复用缓存的 object_info 编译出的索引"""
+        if use_cache and self._node_types_cache:
+            return NodeSchemaIndex.for_object_info(self._node_types_cache)
+        return NodeSchemaIndex.for_object_info(self.api.get_object_info())
+    
+    def check_graph(self, prompt: Dict, index: Optional[NodeSchemaIndex] = None,
+                    check_enum_values: bool = False) -> Dict:
         """
-        分析工作流结构
+        单次遍历完成工作流的结构和参数检查
         
         Args:
             prompt: 工作流数据
-            use_cache: 是否使用缓存的节点信息
+            index: 节点定义索引，为None时不检查节点类型和参数
+            check_enum_values: 是否检查枚举参数的取值
             
         Returns:
-            工作流分析结果
+            analyze_workflow 的分析结果，另含 missing_connections、invalid_node_types 和 cycle_nodes
         """
         result = {
             "node_count": len(prompt),
@@ -186,77 +367,110 @@ class ComfyUIPreCheck:
             "connections": [],
             "inputs": {},
             "outputs": [],
-            "parameter_issues": [] # 添加参数问题列表
+            "parameter_issues": [],
+            "missing_connections": [],
+            "invalid_node_types": [],
+            "cycle_nodes": []
         }
+        node_types = result["node_types"]
+        connections = result["connections"]
+        parameter_issues = result["parameter_issues"]
+        edges: Dict[str, List[str]] = defaultdict(list)
         
-        # 分析节点类型数量
         for node_id, node_data in prompt.items():
             node_type = node_data.get("class_type")
-            if node_type not in result["node_types"]:
-                result["node_types"][node_type] = 0
-            result["node_types"][node_type] += 1
-            
-            # 分析连接
+            node_types[node_type] = node_types.get(node_type, 0) + 1
             inputs = node_data.get("inputs", {})
+            
+            # 标识可能的输入和输出节点
+            if node_type:
+                if "CheckpointLoader" in node_type or ("Image" in node_type and "Empty" not in node_type):
+                    result["inputs"][node_id] = node_type
+                if "SaveImage" in node_type or "Preview" in node_type:
+                    result["outputs"].append(node_id)
+            
+            schema = None
+            if index is not None:
+                if node_type not in index:
+                    result["invalid_node_types"].append(f"节点 {node_id} 的类型 '{node_type}' 无效")
+                else:
+                    schema = index.get(node_type)
+            
+            enums = None
+            if schema is not None:
+                # 参数齐全时用集合比较一次完成，有问题时才逐个找出
+                input_names = inputs.keys()
+                if not input_names >= schema.required:
+                    for req_input in schema.required.difference(input_names):
+                        parameter_issues.append({
+                            "node_id": node_id,
+                            "node_type": node_type,
+                            "issue_type": "missing_required_input",
+                            "message": f"节点 {node_id} ({node_type}) 缺少必需的输入参数 '{req_input}'"
+                        })
+                if not input_names <= schema.names:
+                    for input_name in input_names - schema.names:
+                        parameter_issues.append({
+                            "node_id": node_id,
+                            "node_type": node_type,
+                            "issue_type": "unknown_input",
+                            "message": f"节点 {node_id} ({node_type}) 使用了未知的输入参数 '{input_name}'"
+                        })
+                if check_enum_values:
+                    enums = schema.enums
+            
             for input_name, input_value in inputs.items():
-                if isinstance(input_value, list) and len(input_value) == 2:
+                if type(input_value) is list and len(input_value) == 2:
                     source_node, source_output = input_value
-                    result["connections"].append({
+                    connections.append({
                         "from_node": source_node,
                         "from_output": source_output,
                         "to_node": node_id,
                         "to_input": input_name
                     })
-            
-            # 标识可能的输入和输出节点
-            if "CheckpointLoader" in node_type or ("Image" in node_type and "Empty" not in node_type):
-                result["inputs"][node_id] = node_type
-            
-            if "SaveImage" in node_type or "Preview" in node_type:
-                result["outputs"].append(node_id)
+                    if source_node in prompt:
+                        edges[source_node].append(node_id)
+                    else:
+                        result["missing_connections"].append(
+                            f"节点 {node_id} 的输入 '{input_name}' 引用了不存在的节点 {source_node}"
+                        )
+                    # 连接类型的输入跳过值检查
+                    continue
                 
-            # 使用缓存检查节点参数有效性
-            if use_cache and self._node_types_cache and node_type in self._node_types_cache:
-                node_info = self._node_types_cache[node_type]
-                if "input" in node_info:
-                    required_inputs = node_info["input"].get("required",{})
-                    optional_inputs = node_info["input"].get("optional",{})
-                    
-                    # 检查必需输入是否存在
-                    for req_input, input_info in required_inputs.items():
-                        if req_input not in inputs:
-                            result["parameter_issues"].append({
-                                "node_id": node_id,
-                                "node_type": node_type,
-                                "issue_type": "missing_required_input",
-                                "message": f"节点 {node_id} ({node_type}) 缺少必需的输入参数 '{req_input}'"
-                            })
-                    
-                    # 检查输入类型和值的有效性
-                    for input_name, input_value in inputs.items():
-                        input_info = required_inputs.get(input_name) or optional_inputs.get(input_name)
-                        if not input_info:
-                            result["parameter_issues"].append({
-                                "node_id": node_id,
-                                "node_type": node_type,
-                                "issue_type": "unknown_input",
-                                "message": f"节点 {node_id} ({node_type}) 使用了未知的输入参数 '{input_name}'"
-                            })
-                            continue
-                        
-                        # 如果是连接类型的输入，跳过值检查
-                        if isinstance(input_value, list) and len(input_value) == 2:
-                            continue
-                        
-                        # 检查枚举值
-                        # if "values" in input_info and input_value not in input_info["values"]:
-                        #     result["parameter_issues"].append({
-                        #         "node_id": node_id,
-                        #         "node_type": node_type,
-                        #         "issue_type": "invalid_enum_value",
-                        #         "message": f"节点 {node_id} ({node_type}) 参数 '{input_name}' 的值 '{input_value}' 不在有效值列表中"
-                        #     })
+                if not enums:
+                    continue
+                values = enums.get(input_name)
+                try:
+                    invalid = values is not None and input_value not in values
+                except TypeError:
+                    invalid = True
+                if invalid:
+                    parameter_issues.append({
+                        "node_id": node_id,
+                        "node_type": node_type,
+                        "issue_type": "invalid_enum_value",
+                        "message": f"节点 {node_id} ({node_type}) 参数 '{input_name}' 的值 '{input_value}' 不在有效值列表中"
+                    })
         
+        result["cycle_nodes"] = find_cycle_nodes(edges, prompt.keys())
+        return result
+    
+    def analyze_workflow(self, prompt: Dict, use_cache: bool = True) -> Dict:
+        """
+        分析工作流结构
+        
+        Args:
+            prompt: 工作流数据
+            use_cache: 是否使用缓存的节点信息
+            
+        Returns:
+            工作流分析结果
+        """
+        index = NodeSchemaIndex.for_object_info(self._node_types_cache) \
+            if use_cache and self._node_types_cache else None
+        result = self.check_graph(prompt, index)
+        for key in ("missing_connections", "invalid_node_types", "cycle_nodes"):
+            result.pop(key)
         return result
 
     def validate_prompt(self, prompt: Dict, use_cache: bool = True) -> Dict[str, List[str]]:
@@ -276,34 +490,12 @@ class ComfyUIPreCheck:
             "other_issues": []
         }
         
-        # 获取有效的节点类型
         try:
-            # 使用缓存或从API获取节点信息
-            if use_cache and self._node_types_cache:
-                # 从缓存中提取所有节点类型
-                valid_node_types = self._node_types_cache
-            else:
-                valid_node_types = self.api.get_object_info()
-            
-            # 检查节点类型是否有效
-            for node_id, node_data in prompt.items():
-                node_type = node_data.get("class_type")
-                
-                if node_type not in valid_node_types:
-                    issues["invalid_node_types"].append(f"节点 {node_id} 的类型 '{node_type}' 无效")
-                
-                # 检查输入连接
-                inputs = node_data.get("inputs", {})
-                for input_name, input_value in inputs.items():
-                    if isinstance(input_value, list) and len(input_value) == 2:
-                        source_node, source_output = input_value
-                        
-                        # 检查源节点是否存在
-                        if source_node not in prompt:
-                            issues["missing_connections"].append(
-                                f"节点 {node_id} 的输入 '{input_name}' 引用了不存在的节点 {source_node}"
-                            )
-            
+            result = self.check_graph(prompt, self.get_schema_index(use_cache))
+            issues["missing_connections"] = result["missing_connections"]
+            issues["invalid_node_types"] = result["invalid_node_types"]
+            if result["cycle_nodes"]:
+                issues["other_issues"].append(f"节点之间存在循环连接: {', '.join(map(str, result['cycle_nodes']))}")
             return issues
         except Exception as e:
             issues["other_issues"].append(f"验证过程出错: {str(e)}")
@@ -376,13 +568,14 @@ class ComfyUIPreCheck:
         
         return result
     
-    def validate_workflow(self, prompt: Dict, use_cache: bool = True) -> Dict:
+    def validate_workflow(self, prompt: Dict, use_cache: bool = True, check_enum_values: bool = False) -> Dict:
         """
         全面验证工作流的有效性
         
         Args:
             prompt: 工作流数据
             use_cache: 是否使用缓存
+            check_enum_values: 是否检查枚举参数的取值
             
         Returns:
             包含验证结果的字典
@@ -396,56 +589,48 @@ class ComfyUIPreCheck:
             "workflow_analysis": {}
         }
         
-        # 1. 结构验证（节点连接）
-        try:
-            structure_issues = self.validate_prompt(prompt, use_cache)
-            if any(len(issues) > 0 for issues in structure_issues.values()):
-                result["valid"] = False
-                
-                # 统计并添加结构问题
-                for issue_type, issues in structure_issues.items():
-                    if issues:
-                        result["structure_issues"].extend([
-                            {"type": issue_type, "message": message}
-                            for message in issues
-                        ])
-                        result["issues_count"] += len(issues)
-        except Exception as e:
-            result["structure_issues"].append({
-                "type": "validation_error",
-                "message": f"验证结构时出错: {str(e)}"
-            })
-            result["valid"] = False
-            result["issues_count"] += 1
-        
-        # 2. 分析工作流（包括参数验证）
+        # 1. 结构和参数验证，节点连接图只构建一次
         try:
-            workflow_analysis = self.analyze_workflow(prompt, use_cache)
-            result["workflow_analysis"] = workflow_analysis
+            graph = self.check_graph(prompt, self.get_schema_index(use_cache), check_enum_values)
+            structure_issues = {
+                "missing_connections": graph.pop("missing_connections"),
+                "invalid_node_types": graph.pop("invalid_node_types"),
+            }
+            cycle_nodes = graph.pop("cycle_nodes")
+            result["workflow_analysis"] = graph
+            
+            for issue_type, issues in structure_issues.items():
+                result["structure_issues"].extend([
+                    {"type": issue_type, "message": message}
+                    for message in issues
+                ])
+            if cycle_nodes:
+                result["structure_issues"].append({
+                    "type": "cycle",
+                    "message": f"节点之间存在循环连接: {', '.join(map(str, cycle_nodes))}"
+                })
+            
+            result["parameter_issues"] = graph["parameter_issues"]
             
-            # 添加参数问题
-            if "parameter_issues" in workflow_analysis and workflow_analysis["parameter_issues"]:
-                result["parameter_issues"] = workflow_analysis["parameter_issues"]
-                result["issues_count"] += len(workflow_analysis["parameter_issues"])
-                result["valid"] = False
-                
             # 检查是否有输出节点
-            if not workflow_analysis.get("outputs"):
+            if not graph["outputs"]:
                 result["structure_issues"].append({
                     "type": "no_output_nodes",
                     "message": "工作流中没有输出节点（如SaveImage或Preview）"
                 })
-                result["issues_count"] += 1
+            
+            result["issues_count"] += len(result["structure_issues"]) + len(result["parameter_issues"])
+            if result["issues_count"]:
                 result["valid"] = False
         except Exception as e:
             result["structure_issues"].append({
-                "type": "analysis_error",
-                "message": f"分析工作流时出错: {str(e)}"
+                "type": "validation_error",
+                "message": f"验证工作流时出错: {str(e)}"
             })
             result["valid"] = False
             result["issues_count"] += 1
         
-        # 3. 检查模型文件
+        # 2. 检查模型文件
         try:
             for node_id, node_type in result["workflow_analysis"].get("inputs", {}).items():
                 node_data = prompt.get(node_id, {})
@@ -3,16 +3,28 @@ import logging
 import threading
 import time
 import uuid
+from collections import OrderedDict
 from dataclasses import dataclass
 from typing import Dict, List, Optional, Any, Callable, Union
 
 from websocket import WebSocketApp
 
-from comfyui_api import ComfyUIConfig
+try:
+    from .comfyui_api import ComfyUIConfig
+except ImportError:  # 直接运行本文件时使用同目录导入
+    from comfyui_api import ComfyUIConfig
 
 # 配置日志，使用已有的日志配置
 logger = logging.getLogger('ComfyUIWebSocketAPI')
 
+# prompt结束事件
+PROMPT_COMPLETED = "completed"
+PROMPT_ERROR = "error"
+PROMPT_INTERRUPTED = "interrupted"
+
+# 保留最近结束的prompt数量，监听注册晚于结束事件时仍能收到结果
+RECENT_FINISHED_LIMIT = 256
+
 @dataclass
 class WebSocketCallbacks:
     """WebSocket回调函数集合"""
@@ -32,21 +44,65 @@ class WebSocketCallbacks:
 class ComfyUIWebSocketAPI:
     """ComfyUI WebSocket API 客户端"""
     
-    def __init__(self, config: ComfyUIConfig, callbacks: Optional[WebSocketCallbacks] = None):
+    def __init__(self, config: ComfyUIConfig, callbacks: Optional[WebSocketCallbacks] = None,
+                 max_retries: Optional[int] = 5):
         """
         初始化WebSocket客户端
         
         Args:
             config: ComfyUI配置
             callbacks: 回调函数集合
+            max_retries: 连接断开后的最大重试次数，None表示一直重试
         """
         self.config = config
+        self.max_retries = max_retries
         self.callbacks = callbacks or WebSocketCallbacks()
         self.ws = None
         self.ws_thread = None
         self.is_connected = False
         self.is_running = False
         self.current_prompt_id = None
+        self._opened_since_retry = False
+        # prompt_id -> 结束监听函数 listener(event, data)
+        self._prompt_listeners: Dict[str, Callable[[str, Dict], None]] = {}
+        self._recent_finished: "OrderedDict[str, tuple]" = OrderedDict()
+        self._listeners_lock = threading.Lock()
+        
+    def add_prompt_listener(self, prompt_id: str, listener: Callable[[str, Dict], None]) -> None:
+        """
+        监听指定prompt的结束事件，多个prompt可以同时监听
+        
+        prompt已经结束时立即回调。listener在WebSocket线程中调用，event为
+        completed、error 或 interrupted，回调后自动移除。
+        """
+        with self._listeners_lock:
+            finished = self._recent_finished.pop(prompt_id, None)
+            if not finished:
+                self._prompt_listeners[prompt_id] = listener
+                return
+        listener(*finished)
+        
+    def remove_prompt_listener(self, prompt_id: str) -> None:
+        """移除prompt的结束监听"""
+        with self._listeners_lock:
+            self._prompt_listeners.pop(prompt_id, None)
+            
+    def _finish_prompt(self, prompt_id: Optional[str], event: str, data: Dict) -> None:
+        """分发prompt结束事件"""
+        if not prompt_id:
+            return
+        with self._listeners_lock:
+            listener = self._prompt_listeners.pop(prompt_id, None)
+            if not listener:
+                # 出错后ComfyUI仍会发送node为空的executing，保留最先收到的结束事件
+                self._recent_finished.setdefault(prompt_id, (event, data))
+                while len(self._recent_finished) > RECENT_FINISHED_LIMIT:
+                    self._recent_finished.popitem(last=False)
+                return
+        try:
+            listener(event, data)
+        except Exception as e:
+            logger.error(f"处理任务结束回调异常: {str(e)}")
         
     def connect(self) -> None:
         """建立WebSocket连接"""
@@ -54,7 +110,10 @@ class ComfyUIWebSocketAPI:
             logger.warning("WebSocket已连接，无需重复连接")
             return
             
-        ws_url = f"ws://{self.config.host.replace('http://', '')}:{self.config.port}/ws?clientId={self.config.client_id}"
+        # https地址使用wss协议
+        scheme = "wss" if self.config.host.startswith("https://") else "ws"
+        host = self.config.host.replace("https://", "").replace("http://", "")
+        ws_url = f"{scheme}://{host}:{self.config.port}/ws?clientId={self.config.client_id}"
         logger.info(f"正在连接WebSocket: {ws_url}")
         
         if self.callbacks.on_connecting:
@@ -74,7 +133,7 @@ class ComfyUIWebSocketAPI:
         
     def disconnect(self) -> None:
         """断开WebSocket连接"""
-        if not self.is_connected:
+        if not self.is_connected and not self.is_running:
             logger.warning("WebSocket未连接，无需断开")
             return
             
@@ -94,18 +153,23 @@ class ComfyUIWebSocketAPI:
     def _run_websocket(self) -> None:
         """在后台线程中运行WebSocket连接"""
         retry_count = 0
-        max_retries = 5
+        max_retries = self.max_retries
         
-        while self.is_running and retry_count < max_retries:
+        while self.is_running and (max_retries is None or retry_count < max_retries):
             try:
                 self.ws.run_forever()
                 
                 if not self.is_running:
                     break
+                
+                # 连接建立过说明网络已恢复，重新计算重试次数
+                if self._opened_since_retry:
+                    retry_count = 0
+                self._opened_since_retry = False
                     
                 retry_count += 1
                 wait_time = min(30, 2 ** retry_count)  # 指数退避策略
-                logger.warning(f"WebSocket连接断开，{wait_time}秒后重试 ({retry_count}/{max_retries})")
+                logger.warning(f"WebSocket连接断开，{wait_time}秒后重试 ({retry_count}/{max_retries or '∞'})")
                 time.sleep(wait_time)
                 
             except Exception as e:
@@ -113,12 +177,14 @@ class ComfyUIWebSocketAPI:
                 retry_count += 1
                 time.sleep(5)
                 
-        if retry_count >= max_retries:
+        if max_retries is not None and retry_count >= max_retries:
             logger.error(f"WebSocket连接重试次数超过限制 ({max_retries})，停止重试")
+        self.is_running = False
             
     def _on_open(self, ws) -> None:
         """WebSocket连接打开回调"""
         self.is_connected = True
+        self._opened_since_retry = True
         logger.info("WebSocket连接已建立")
         
         if self.callbacks.on_connected:
@@ -155,11 +221,13 @@ class ComfyUIWebSocketAPI:
             
             # 根据消息类型调用对应的回调函数
             if msg_type == "executing":
-                # 任务开始执行
+                # 任务开始执行，node为空表示整个prompt执行结束
                 self.current_prompt_id = data.get("data", {}).get("prompt_id")
                 logger.info(f"开始执行任务: {self.current_prompt_id}")
                 if self.callbacks.on_executing:
                     self.callbacks.on_executing(data.get("data", {}))
+                if data.get("data", {}).get("node") is None:
+                    self._finish_prompt(self.current_prompt_id, PROMPT_COMPLETED, data.get("data", {}))
                     
             elif msg_type == "executed":
                 # 任务执行完成
@@ -195,11 +263,14 @@ class ComfyUIWebSocketAPI:
                 logger.error(f"任务执行错误: {json.dumps(data.get('data', {}), ensure_ascii=False)}")
                 if self.callbacks.on_execution_error:
                     self.callbacks.on_execution_error(data.get("data", {}))
+                self._finish_prompt(data.get("data", {}).get("prompt_id"), PROMPT_ERROR, data.get("data", {}))
             elif msg_type == "crystools.monitor":
                 # 监控信息
                 # logger.info(f"监控信息: {json.dumps(data.get('data', {}), ensure_ascii=False)}")
                 pass
             else:
+                if msg_type == "execution_interrupted":
+                    self._finish_prompt(data.get("data", {}).get("prompt_id"), PROMPT_INTERRUPTED, data.get("data", {}))
                 # 其他自定义消息
                 if self.callbacks.on_custom_message:
                     self.callbacks.on_custom_message(data)
@@ -224,49 +295,28 @@ class ComfyUIWebSocketAPI:
             logger.error("WebSocket未连接，无法等待任务执行")
             return False
             
-        self.current_prompt_id = prompt_id
         logger.info(f"等待任务执行完成: {prompt_id}, 超时时间: {timeout}秒")
         
-        # 创建事件用于同步
-        execution_completed = threading.Event()
-        execution_failed = threading.Event()
+        # 只监听该prompt，不替换全局回调，多个prompt可以同时等待
+        finished = threading.Event()
+        result = {}
         
-        # 临时回调函数
-        def on_executed(data):
-            if data.get("prompt_id") == prompt_id:
-                execution_completed.set()
-                
-        def on_execution_error(data):
-            if data.get("prompt_id") == prompt_id:
-                execution_failed.set()
-                
-        # 保存原回调函数
-        original_executed_callback = self.callbacks.on_executed
-        original_error_callback = self.callbacks.on_execution_error
-        
-        # 设置临时回调函数
-        self.callbacks.on_executed = on_executed
-        self.callbacks.on_execution_error = on_execution_error
-        
-        try:
-            # 等待任务执行完成或失败
-            completed = execution_completed.wait(timeout=timeout)
-            failed = execution_failed.wait(timeout=0)  # 立即检查是否失败
+        def on_finished(event, data):
+            result["event"] = event
+            finished.set()
             
-            if failed:
-                logger.error(f"任务执行失败: {prompt_id}")
-                return False
-            elif not completed:
+        self.add_prompt_listener(prompt_id, on_finished)
+        try:
+            if not finished.wait(timeout=timeout):
                 logger.error(f"等待任务执行超时: {prompt_id}")
                 return False
-            else:
-                logger.info(f"任务执行成功完成: {prompt_id}")
-                return True
-                
+            if result["event"] != PROMPT_COMPLETED:
+                logger.error(f"任务执行失败: {prompt_id}")
+                return False
+            logger.info(f"任务执行成功完成: {prompt_id}")
+            return True
         finally:
-            # 恢复原回调函数
-            self.callbacks.on_executed = original_executed_callback
-            self.callbacks.on_execution_error = original_error_callback
+            self.remove_prompt_listener(prompt_id)
 
 # 使用示例
 def example_usage():
@@ -3,13 +3,14 @@ import logging
 import queue
 import threading
 import time
-from dataclasses import dataclass
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
 from typing import Dict, Optional, Any, Callable, List
 from enum import Enum
 import os
 
 from comfyui_api import ComfyUIAPI, ComfyUIConfig
-from comfyui_ws_api import ComfyUIWebSocketAPI, WebSocketCallbacks
+from comfyui_ws_api import ComfyUIWebSocketAPI, WebSocketCallbacks, PROMPT_COMPLETED, PROMPT_INTERRUPTED
 from comfyui_error_parser import ComfyUIErrorParser
 from comfyui_precheck import ComfyUIPreCheck
 
@@ -32,30 +33,51 @@ class Task:
     status: TaskStatus = TaskStatus.PENDING
     result: Optional[Dict] = None
     error: Optional[str] = None
-    created_at: float = time.time()
+    created_at: float = field(default_factory=time.time)
     started_at: Optional[float] = None
     completed_at: Optional[float] = None
     prompt_id: Optional[str] = None
+    # 任务结束时设置结果（Task对象本身）
+    future: Future = field(default_factory=Future, repr=False, compare=False)
 
 class TaskScheduler:
-    """任务调度器"""
+    """
+    任务调度器
     
-    def __init__(self, config: ComfyUIConfig,enable_precheck=False):
+    同时保持最多 max_in_flight 个prompt在ComfyUI队列中，一个prompt执行完成后立即补充下一个，
+    ComfyUI的GPU队列在两次提交之间不会空闲。在途任务通过 prompt_id -> Task 映射跟踪，
+    结果通过 Task.future 返回。
+    """
+    
+    def __init__(self, config: ComfyUIConfig, enable_precheck=False, max_in_flight: int = 2,
+                 execution_timeout: int = 3600):
         """
         初始化任务调度器
         
         Args:
             config: ComfyUI配置
+            enable_precheck: 是否在提交前预检测工作流
+            max_in_flight: 同时提交到ComfyUI的最大prompt数
+            execution_timeout: 单个prompt从提交到结束的超时时间(秒)
         """
         self.config = config
         self.http_api = ComfyUIAPI(config)
         self.ws_api = None
         self.task_queue = queue.Queue()
         self.tasks: Dict[str, Task] = {}
-        self.current_task: Optional[Task] = None
+        self.in_flight: Dict[str, Task] = {}
+        self.max_in_flight = max(1, max_in_flight)
+        self.execution_timeout = execution_timeout
         self.is_running = False
         self.worker_thread = None
         self.error_parser = ComfyUIErrorParser()
+        self._task_seq = 0
+        self._lock = threading.Lock()
+        self._completing = set()
+        # 在途名额，重复归还时抛出异常而不是悄悄扩大并发数
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        # 结果获取和图像下载在线程池中执行，不阻塞WebSocket线程
+        self._result_pool = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="ComfyUIResult")
 
         self.precheck_enabled = enable_precheck
         if self.precheck_enabled:
@@ -72,7 +94,7 @@ class TaskScheduler:
             on_execution_error=self._on_ws_error,
             on_progress=self._on_ws_progress
         )
-        self.ws_api = ComfyUIWebSocketAPI(config, callbacks)
+        self.ws_api = ComfyUIWebSocketAPI(config, callbacks, max_retries=None)
 
     def init_precheck(self) -> None:
         logger.info("正在初始化预检测，缓存系统信息...")
@@ -88,7 +110,7 @@ class TaskScheduler:
             logger.warning("任务调度器已在运行中")
             return
             
-        logger.info("启动任务调度器")
+        logger.info(f"启动任务调度器，最大在途任务数: {self.max_in_flight}")
         self.is_running = True
         
         # 启动WebSocket连接
@@ -107,9 +129,9 @@ class TaskScheduler:
         logger.info("停止任务调度器")
         self.is_running = False
         
-        # 中断当前任务
-        if self.current_task:
-            self.interrupt_task(self.current_task.task_id)
+        # 中断所有在途任务
+        for task in list(self.in_flight.values()):
+            self.interrupt_task(task.task_id)
             
         # 等待工作线程结束
         if self.worker_thread and self.worker_thread.is_alive():
@@ -117,6 +139,7 @@ class TaskScheduler:
             
         # 断开WebSocket连接
         self.ws_api.disconnect()
+        self._result_pool.shutdown(wait=False)
         
     def submit_task(self, prompt: Dict) -> str:
         """
@@ -126,21 +149,35 @@ class TaskScheduler:
             prompt: 任务提示词
             
         Returns:
-            任务ID
+            任务ID，可通过 get_task_future 等待结果
         """
-        task_id = f"task_{int(time.time())}_{len(self.tasks)}"
-        task = Task(task_id=task_id, prompt=prompt)
-        self.tasks[task_id] = task
+        with self._lock:
+            self._task_seq += 1
+            task_id = f"task_{int(time.time())}_{self._task_seq}"
+            task = Task(task_id=task_id, prompt=prompt)
+            self.tasks[task_id] = task
         
         logger.info(f"提交新任务: {task_id}")
         self.task_queue.put(task)
         
         return task_id
         
+    def get_task_future(self, task_id: str) -> Optional[Future]:
+        """
+        获取任务的Future，任务结束（完成、失败或中断）时返回Task对象
+        
+        Args:
+            task_id: 任务ID
+        """
+        task = self.tasks.get(task_id)
+        return task.future if task else None
+        
     def interrupt_task(self, task_id: str) -> bool:
         """
         中断指定任务
         
+        正在执行的prompt通过 /interrupt 中断，仍在ComfyUI队列中等待的prompt从队列删除。
+        
         Args:
             task_id: 任务ID
             
@@ -152,15 +189,17 @@ class TaskScheduler:
             logger.warning(f"任务不存在: {task_id}")
             return False
             
-        if task.status != TaskStatus.RUNNING:
+        if task.status != TaskStatus.RUNNING or not task.prompt_id:
             logger.warning(f"任务未在运行中: {task_id}")
             return False
             
         logger.info(f"中断任务: {task_id}")
         try:
-            self.http_api.interrupt()
-            task.status = TaskStatus.INTERRUPTED
-            task.completed_at = time.time()
+            if self.ws_api.current_prompt_id == task.prompt_id:
+                self.http_api.interrupt()
+            else:
+                self.http_api.delete_queue_items([task.prompt_id])
+            self._finish_task(task, TaskStatus.INTERRUPTED)
             return True
         except Exception as e:
             logger.error(f"中断任务失败: {str(e)}")
@@ -188,35 +227,47 @@ class TaskScheduler:
         return list(self.tasks.values())
         
     def _worker_loop(self) -> None:
-        """工作线程循环"""
+        """工作线程循环：有空闲的在途名额时从队列取出任务提交"""
         while self.is_running:
             try:
-                # 如果WebSocket未连接，则跳过任务
+                self._check_timeouts()
+                
+                # 如果WebSocket未连接，则暂停提交
                 if not self.ws_api.is_connected:
+                    time.sleep(0.5)
+                    continue
+                
+                if not self._slots.acquire(timeout=1):
+                    continue
+                try:
+                    task = self.task_queue.get(timeout=1)
+                except queue.Empty:
+                    self._slots.release()
                     continue
-                # 从队列获取任务
-                task = self.task_queue.get(timeout=1)
                 
-                # 执行任务
-                self._execute_task(task)
+                # 提交任务，名额未交给在途任务时立即归还
+                if not self._submit_task(task):
+                    self._slots.release()
                 
-            except queue.Empty:
-                continue
             except Exception as e:
                 logger.error(f"工作线程异常: {str(e)}")
                 
-    def _execute_task(self, task: Task) -> None:
+    def _submit_task(self, task: Task) -> bool:
         """
-        执行任务
+        提交任务到ComfyUI队列，不等待执行结束
         
         Args:
             task: 任务对象
+            
+        Returns:
+            任务是否已登记为在途任务。登记后名额只由 _finish_task 归还（之后的步骤失败时也是），
+            返回False时由调用方归还
         """
+        registered = False
         try:
             # 更新任务状态
             task.status = TaskStatus.RUNNING
             task.started_at = time.time()
-            self.current_task = task
             
             logger.info(f"开始执行任务: {task.task_id}")
             
@@ -224,9 +275,7 @@ class TaskScheduler:
             if self.precheck_enabled:
                 # 使用预检测结果
                 precheck_result = self.precheck.validate_workflow(task.prompt,True)
-                if precheck_result.get("valid", False):
-                    response = self.http_api.submit_prompt(task.prompt)
-                else:
+                if not precheck_result.get("valid", False):
                     # 显示验证结果
                     print(f"工作流有效: {precheck_result['valid']}")
                     print(f"问题数量: {precheck_result['issues_count']}")
@@ -246,76 +295,151 @@ class TaskScheduler:
                         for issue in precheck_result["model_issues"]:
                             print(f"- {issue['message']}")
 
-                    task.status = TaskStatus.FAILED
                     task.error = ("工作流验证无效", None)
-                    return
-            else:
-                response = self.http_api.submit_prompt(task.prompt)
+                    self._finish_task(task, TaskStatus.FAILED)
+                    return False
+                    
+            response = self.http_api.submit_prompt(task.prompt)
             task.prompt_id = response.get("prompt_id")
+            if not task.prompt_id:
+                raise Exception(f"提交任务未返回prompt_id: {response}")
             
-            # 等待任务完成
-            if not self.ws_api.wait_for_execution(task.prompt_id):
-                # 获取任务结果
-                history = self.http_api.get_history_by_id(task.prompt_id)
-                # 检查任务是否执行成功
-                has_error, error_message, detailed_error = self.error_parser.process_history_error(history, task.prompt)
-                if has_error:
-                    logger.error(f"任务执行失败: {error_message}")
-                    if detailed_error:
-                        logger.debug(f"详细错误信息:\n{detailed_error}")
+            with self._lock:
+                self.in_flight[task.prompt_id] = task
+            registered = True
+            # prompt在注册前已结束时会立即回调
+            self.ws_api.add_prompt_listener(
+                task.prompt_id,
+                lambda event, data, task=task: self._result_pool.submit(self._complete_task, task, event)
+            )
+            return True
 
-                task.result = history.get("outputs", {})
-                task.status = TaskStatus.FAILED
-                task.error = (error_message, detailed_error)
+        except Exception as e:
+            logger.error(f"执行任务异常: {str(e)}")
+            task.error = (self.error_parser.process_error(str(e),task.prompt),None)
+            self._finish_task(task, TaskStatus.FAILED)
+            return registered
+            
+    def _complete_task(self, task: Task, event: str) -> None:
+        """
+        prompt结束后获取结果（在结果线程池中执行）
+        
+        Args:
+            task: 任务对象
+            event: 结束事件，completed、error 或 interrupted
+        """
+        # WebSocket回调和重连检查可能同时结束同一任务
+        with self._lock:
+            if self.in_flight.get(task.prompt_id) is not task or task.prompt_id in self._completing:
                 return
-                
-            # 获取任务结果
+            self._completing.add(task.prompt_id)
+            
+        try:
+            if event == PROMPT_INTERRUPTED:
+                self._finish_task(task, TaskStatus.INTERRUPTED)
+                return
+
             history = self.http_api.get_history_by_id(task.prompt_id)
-            task.result = history.get("outputs", {})
-            task.status = TaskStatus.COMPLETED
+            task_history = history.get(task.prompt_id, {})
+            task.result = task_history.get("outputs", {})
             
-            # 异步处理图像，避免阻塞主任务流程
-            threading.Thread(
-                target=self.http_api.process_successful_generation,
-                args=(task.prompt_id, history, self.config.output_dir),
-                daemon=True
-            ).start()
+            # 检查任务是否执行成功
+            has_error, error_message, detailed_error = self.error_parser.process_history_error(history, task.prompt)
+            if has_error or event != PROMPT_COMPLETED:
+                logger.error(f"任务执行失败: {error_message}")
+                if detailed_error:
+                    logger.debug(f"详细错误信息:\n{detailed_error}")
+                task.error = (error_message, detailed_error)
+                self._finish_task(task, TaskStatus.FAILED)
+                return
+                
+            # 名额先归还，下一个prompt可以立即提交，图像在当前线程中继续下载
+            self._finish_task(task, TaskStatus.COMPLETED, resolve=False)
+            try:
+                self.http_api.process_successful_generation(task.prompt_id, history, self.config.output_dir)
+            finally:
+                task.future.set_result(task)
 
         except Exception as e:
-            logger.error(f"执行任务异常: {str(e)}")
-            task.status = TaskStatus.FAILED
+            logger.error(f"获取任务结果异常: {str(e)}")
             task.error = (self.error_parser.process_error(str(e),task.prompt),None)
-            
+            self._finish_task(task, TaskStatus.FAILED)
         finally:
-            task.completed_at = time.time()
-            self.current_task = None
+            with self._lock:
+                self._completing.discard(task.prompt_id)
+            
+    def _finish_task(self, task: Task, status: TaskStatus, resolve: bool = True) -> None:
+        """
+        结束任务：更新状态，移出在途映射并归还名额
+        
+        Args:
+            task: 任务对象
+            status: 最终状态
+            resolve: 是否立即设置Future结果
+        """
+        with self._lock:
+            released = task.prompt_id is not None and self.in_flight.pop(task.prompt_id, None) is task
+        if task.prompt_id:
+            self.ws_api.remove_prompt_listener(task.prompt_id)
+        task.status = status
+        task.completed_at = time.time()
+        if released:
+            self._slots.release()
+        if resolve and not task.future.done():
+            task.future.set_result(task)
+            
+    def _check_timeouts(self) -> None:
+        """结束超时的在途任务"""
+        now = time.time()
+        for task in list(self.in_flight.values()):
+            if task.started_at and now - task.started_at > self.execution_timeout:
+                logger.error(f"等待任务执行超时: {task.task_id}")
+                task.error = ("等待任务执行超时", None)
+                self._finish_task(task, TaskStatus.FAILED)
+                
+    def _reconcile_in_flight(self) -> None:
+        """WebSocket重连后检查在途任务，断线期间已结束的任务从历史记录中补齐"""
+        for task in list(self.in_flight.values()):
+            try:
+                history = self.http_api.get_history_by_id(task.prompt_id)
+                if task.prompt_id in history:
+                    self._complete_task(task, PROMPT_COMPLETED)
+            except Exception as e:
+                logger.error(f"检查任务 {task.task_id} 状态失败: {str(e)}")
             
     def _on_ws_connected(self) -> None:
         """WebSocket连接建立回调"""
         logger.info("WebSocket连接已建立")
+        if self.in_flight:
+            self._result_pool.submit(self._reconcile_in_flight)
         
     def _on_ws_executing(self, data: Dict) -> None:
         """任务开始执行回调"""
-        if self.current_task:
-            logger.info(f"任务开始执行: {self.current_task.task_id}")
+        task = self.in_flight.get(data.get("prompt_id"))
+        if task and data.get("node") is not None:
+            logger.info(f"任务开始执行: {task.task_id}")
             
     def _on_ws_executed(self, data: Dict) -> None:
-        """任务执行完成回调"""
-        if self.current_task:
-            logger.info(f"任务执行完成: {self.current_task.task_id}")
+        """节点执行完成回调"""
+        task = self.in_flight.get(data.get("prompt_id"))
+        if task:
+            logger.info(f"任务节点执行完成: {task.task_id}, 节点: {data.get('node')}")
             
     def _on_ws_error(self, data: Dict) -> None:
         """任务执行错误回调"""
-        if self.current_task:
-            logger.error(f"任务执行错误: {self.current_task.task_id}")
+        task = self.in_flight.get(data.get("prompt_id"))
+        if task:
+            logger.error(f"任务执行错误: {task.task_id}")
             
     def _on_ws_progress(self, data: Dict) -> None:
         """任务进度更新回调"""
-        if self.current_task:
+        prompt_id = data.get("prompt_id") or self.ws_api.current_prompt_id
+        task = self.in_flight.get(prompt_id)
+        if task:
             value = data.get("value", 0)
             max_value = data.get("max", 100)
             progress = (value / max_value) * 100 if max_value > 0 else 0
-            logger.debug(f"任务进度: {progress:.2f}%")
+            logger.debug(f"任务 {task.task_id} 进度: {progress:.2f}%")
 
 # 使用示例
 def example_usage():
@@ -346,16 +470,12 @@ def example_usage():
         print(f"提交任务: {task_id}")
         
         # 等待任务完成
-        while True:
-            task = scheduler.get_task_status(task_id)
-            if task.status in [TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.INTERRUPTED]:
-                print(f"任务状态: {task.status.value}")
-                if task.result:
-                    print(f"任务结果: {task.result}")
-                if task.error:
-                    print(f"任务错误: {task.error}")
-                break
-            time.sleep(1)
+        task = scheduler.get_task_future(task_id).result()
+        print(f"任务状态: {task.status.value}")
+        if task.result:
+            print(f"任务结果: {task.result}")
+        if task.error:
+            print(f"任务错误: {task.error}")
             
         # 等待用户操作
         print("按Enter键退出...")
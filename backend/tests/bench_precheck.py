@@ -0,0 +1,120 @@
+"""
+工作流预检测基准测试
+
+对比原有的多次遍历校验（validate_prompt 与 analyze_workflow 各遍历一次工作流，逐个节点查询
+object_info）与预编译节点定义索引后的单次遍历校验在大工作流上的耗时。
+
+运行方式（在backend目录下）：
+    python tests/bench_precheck.py
+"""
+import os
+import sys
+import time
+import timeit as timeit_module
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from task_scheduler.comfyui_precheck import ComfyUIPreCheck, NodeSchemaIndex
+
+NODE_TYPES = 3000       # object_info 中的节点类型数量
+INPUTS_PER_TYPE = 12    # 每个节点类型的输入数量
+WORKFLOW_SIZES = [100, 1000, 5000]
+ROUNDS = 20
+
+
+def make_object_info():
+    object_info = {}
+    for t in range(NODE_TYPES):
+        required = {f"in_{i}": [[f"v{j}" for j in range(50)], {}] if i % 3 == 0 else ["IMAGE"]
+                    for i in range(INPUTS_PER_TYPE)}
+        optional = {f"opt_{i}": ["FLOAT", {"default": 1.0}] for i in range(4)}
+        object_info[f"Node{t}"] = {"input": {"required": required, "optional": optional}}
+    object_info["SaveImage"] = {"input": {"required": {"images": ["IMAGE"]}}}
+    return object_info
+
+
+def make_workflow(size):
+    """链式工作流，每个节点连接前一个节点"""
+    workflow = {}
+    for n in range(size):
+        inputs = {f"in_{i}": "v1" if i % 3 == 0 else ([str(n - 1), 0] if n else "x")
+                  for i in range(INPUTS_PER_TYPE)}
+        workflow[str(n)] = {"class_type": f"Node{n % NODE_TYPES}", "inputs": inputs}
+    workflow[str(size)] = {"class_type": "SaveImage", "inputs": {"images": [str(size - 1), 0]}}
+    return workflow
+
+
+def legacy_validate(object_info, prompt):
+    """原有实现：validate_prompt 和 analyze_workflow 分别遍历工作流（省略了无问题时不执行的分支）"""
+    issues = []
+    for node_id, node_data in prompt.items():
+        if node_data.get("class_type") not in object_info:
+            issues.append(node_id)
+        for input_name, input_value in node_data.get("inputs", {}).items():
+            if isinstance(input_value, list) and len(input_value) == 2:
+                source_node, source_output = input_value
+                if source_node not in prompt:
+                    issues.append(node_id)
+
+    result = {"node_types": {}, "connections": [], "inputs": {}, "outputs": []}
+    for node_id, node_data in prompt.items():
+        node_type = node_data.get("class_type")
+        if node_type not in result["node_types"]:
+            result["node_types"][node_type] = 0
+        result["node_types"][node_type] += 1
+        inputs = node_data.get("inputs", {})
+        for input_name, input_value in inputs.items():
+            if isinstance(input_value, list) and len(input_value) == 2:
+                source_node, source_output = input_value
+                result["connections"].append({"from_node": source_node, "from_output": source_output,
+                                              "to_node": node_id, "to_input": input_name})
+        if "CheckpointLoader" in node_type or ("Image" in node_type and "Empty" not in node_type):
+            result["inputs"][node_id] = node_type
+        if "SaveImage" in node_type or "Preview" in node_type:
+            result["outputs"].append(node_id)
+        if node_type in object_info:
+            node_info = object_info[node_type]
+            if "input" in node_info:
+                required = node_info["input"].get("required", {})
+                optional = node_info["input"].get("optional", {})
+                for req_input, input_info in required.items():
+                    if req_input not in inputs:
+                        issues.append(node_id)
+                for input_name, input_value in inputs.items():
+                    input_info = required.get(input_name) or optional.get(input_name)
+                    if not input_info:
+                        issues.append(node_id)
+                        continue
+                    if isinstance(input_value, list) and len(input_value) == 2:
+                        continue
+    return issues, result
+
+
+def timeit(fn):
+    """多轮取最小值（毫秒），计时时关闭gc减少抖动"""
+    return min(timeit_module.repeat(fn, number=1, repeat=ROUNDS)) * 1000
+
+
+def main():
+    object_info = make_object_info()
+    precheck = ComfyUIPreCheck(SimpleNamespace(config=SimpleNamespace(base_url='http://bench')))
+    precheck._node_types_cache = object_info
+
+    start = time.perf_counter()
+    NodeSchemaIndex.for_object_info(object_info)
+    print(f"编译节点定义索引（{NODE_TYPES}个节点类型）: {(time.perf_counter() - start) * 1000:.1f}ms，每份object_info只编译一次")
+
+    for size in WORKFLOW_SIZES:
+        workflow = make_workflow(size)
+        result = precheck.validate_workflow(workflow, check_enum_values=True)
+        assert result["valid"], result["structure_issues"][:3] + result["parameter_issues"][:3]
+        legacy = timeit(lambda: legacy_validate(object_info, workflow))
+        indexed = timeit(lambda: precheck.validate_workflow(workflow))
+        with_enums = timeit(lambda: precheck.validate_workflow(workflow, check_enum_values=True))
+        print(f"{size:>5}个节点: 原有多次遍历 {legacy:.2f}ms, 索引单次遍历 {indexed:.2f}ms "
+              f"(含环检测), 另检查枚举值 {with_enums:.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+目录传输方式基准测试
+
+对比多通道SFTP与tar流两种方式上传、下载大量小文件（打标结果：图片 + 同名txt标注）的耗时。
+需要一台可SSH登录的服务器，通过环境变量配置：
+    BENCH_SSH_HOST, BENCH_SSH_PORT(默认22), BENCH_SSH_USER, BENCH_SSH_KEY 或 BENCH_SSH_PASSWORD
+    BENCH_REMOTE_DIR（默认 /tmp/rlt_bench）
+
+运行方式（在backend目录下）：
+    python tests/bench_transfer_modes.py
+"""
+import os
+import sys
+import shutil
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.ssh import SSHClientTool
+from app.utils import sync_manifest
+
+IMAGES = 150            # 图片数量，每张图片对应一个txt标注文件
+IMAGE_SIZE = 64 * 1024  # 模拟图片大小（字节）
+CAPTION_SIZE = 300      # 标注文件大小（字节）
+
+
+def make_dataset(path):
+    os.makedirs(path, exist_ok=True)
+    for i in range(IMAGES):
+        with open(os.path.join(path, f'{i:04d}.png'), 'wb') as f:
+            f.write(os.urandom(IMAGE_SIZE))
+        with open(os.path.join(path, f'{i:04d}.txt'), 'w') as f:
+            f.write(('1girl, solo, ' * 30)[:CAPTION_SIZE])
+
+
+def run(client, mode, local_dir, remote_dir, work_dir):
+    client.execute_command(f"rm -rf {remote_dir}")
+    start = time.time()
+    success, message, stats = client.upload_directory(local_dir, remote_dir, mode=mode)
+    upload_time = time.time() - start
+    assert success and stats['failed'] == 0, message
+
+    download_dir = os.path.join(work_dir, f'download_{mode}')
+    start = time.time()
+    success, message, stats = client.download_directory(remote_dir, download_dir, mode=mode)
+    download_time = time.time() - start
+    assert success and stats['failed'] == 0, message
+
+    client.execute_command(f"rm -rf {remote_dir}")
+    return upload_time, download_time, stats.get('mode')
+
+
+def main():
+    host = os.getenv('BENCH_SSH_HOST')
+    if not host:
+        print("未设置 BENCH_SSH_HOST，跳过基准测试")
+        return
+
+    client = SSHClientTool(
+        hostname=host,
+        port=int(os.getenv('BENCH_SSH_PORT', 22)),
+        username=os.getenv('BENCH_SSH_USER', 'root'),
+        key_path=os.getenv('BENCH_SSH_KEY'),
+        password=os.getenv('BENCH_SSH_PASSWORD'),
+    )
+    remote_root = os.getenv('BENCH_REMOTE_DIR', '/tmp/rlt_bench')
+    work_dir = tempfile.mkdtemp()
+    # 清单缓存写入临时目录，不影响数据目录
+    sync_manifest.LOCAL_MANIFEST_DIR = os.path.join(work_dir, 'manifest')
+
+    try:
+        local_dir = os.path.join(work_dir, 'dataset')
+        make_dataset(local_dir)
+        total_mb = IMAGES * (IMAGE_SIZE + CAPTION_SIZE) / 1024 / 1024
+        print(f"数据集: {IMAGES * 2} 个文件, {total_mb:.1f}MB")
+
+        for mode in ('sftp', 'tar'):
+            upload_time, download_time, used = run(client, mode, local_dir, f"{remote_root}/{mode}", work_dir)
+            print(f"{mode:>5}: 上传 {upload_time:6.2f}s ({total_mb / upload_time:6.2f}MB/s), "
+                  f"下载 {download_time:6.2f}s ({total_mb / download_time:6.2f}MB/s), 实际方式: {used}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from unittest import mock
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.database import Base
+from app.models import task as _task, training as _training, asset as _asset, setting as _setting  # noqa
+from app.models import task_lease as _task_lease, scheduler_signal as _scheduler_signal  # noqa
+
+
+def use_temp_db(test_case, *modules):
+    """
+    为测试创建临时SQLite数据库并建表，替换 modules 中的 get_db，测试结束时释放连接并删除数据库
+
+    设置 test_case.engine、test_case.Session 和 test_case.get_db。
+
+    Args:
+        test_case: 当前的 unittest.TestCase
+        modules: 需要替换 get_db 的被测模块
+    """
+    db_dir = tempfile.mkdtemp()
+    test_case.addCleanup(shutil.rmtree, db_dir, ignore_errors=True)
+    test_case.engine = create_engine(
+        'sqlite:///' + os.path.join(db_dir, 'test.db'),
+        connect_args={"check_same_thread": False, "timeout": 30}
+    )
+    test_case.addCleanup(test_case.engine.dispose)
+    Base.metadata.create_all(bind=test_case.engine)
+    test_case.Session = sessionmaker(autocommit=False, autoflush=False, bind=test_case.engine)
+
+    @contextmanager
+    def get_db():
+        db = test_case.Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    test_case.get_db = get_db
+    for module in modules:
+        patcher = mock.patch.object(module, 'get_db', get_db)
+        patcher.start()
+        test_case.addCleanup(patcher.stop)
+    return get_db
@@ -0,0 +1,139 @@
+import threading
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+from app.models.task import Task, TaskStatus
+from app.models.asset import Asset
+from app.models.task_lease import TaskLease
+from app.services.task_services import claim_service, scheduler_service
+from app.services.task_services.claim_service import ClaimService
+from app.services.task_services.scheduler_service import SchedulerService
+from app.services.task_services.placement_service import AssetSlot, PlacementPlan, PLACEMENT_STRATEGIES
+from tests.db_fixture import use_temp_db
+
+class ClaimServiceTestCase(unittest.TestCase):
+    """测试多个调度进程并发认领租约和资产槽位"""
+
+    def setUp(self):
+        use_temp_db(self, claim_service, scheduler_service)
+        # 每个线程模拟一个调度进程；线程ident在线程结束后会被复用，用线程名区分
+        patcher = mock.patch.object(ClaimService, 'get_owner_id',
+                                    staticmethod(lambda: f"owner-{threading.current_thread().name}"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def race(self, fn, workers=6):
+        """多个线程同时执行fn，返回各线程的结果"""
+        barrier = threading.Barrier(workers)
+        results = []
+        lock = threading.Lock()
+
+        def run():
+            barrier.wait()
+            result = fn()
+            with lock:
+                results.append(result)
+
+        threads = [threading.Thread(target=run) for _ in range(workers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    def add_asset(self, db, capacity=1):
+        asset = Asset(name='a', ip='10.0.0.1', ssh_username='u', status='CONNECTED',
+                      marking_tasks_count=0, training_tasks_count=0, max_concurrent_tasks=capacity)
+        db.add(asset)
+        db.commit()
+        return asset.id
+
+    def test_acquire_lease_contention(self):
+        """测试同一租约只有一个进程认领成功，过期后也只被一个进程接管"""
+        results = self.race(lambda: ClaimService.acquire_lease('marking_1'))
+        self.assertEqual(results.count(True), 1)
+
+        with self.get_db() as db:
+            lease = db.query(TaskLease).filter(TaskLease.resource == 'marking_1').one()
+            first_owner = lease.owner
+            lease.expires_at = datetime.now() - timedelta(seconds=1)
+            db.commit()
+
+        results = self.race(lambda: ClaimService.acquire_lease('marking_1'))
+        self.assertEqual(results.count(True), 1)
+        with self.get_db() as db:
+            self.assertNotEqual(db.query(TaskLease).filter(TaskLease.resource == 'marking_1').one().owner, first_owner)
+
+    def test_claim_asset_contention(self):
+        """测试多个会话并发认领时不超出资产容量，同一任务只分配一次"""
+        with self.get_db() as db:
+            asset_id = self.add_asset(db, capacity=2)
+            tasks = [Task(name=f't{i}', status=TaskStatus.SUBMITTED) for i in range(4)]
+            db.add_all(tasks)
+            db.commit()
+            task_ids = [task.id for task in tasks]
+
+        def claim(task_id):
+            with self.get_db() as db:
+                task = db.query(Task).filter(Task.id == task_id).first()
+                plan = PlacementPlan('marking', [AssetSlot(asset_id, 2, 0)], PLACEMENT_STRATEGIES['least_loaded'])
+                return SchedulerService._claim_asset(db, task, plan)
+
+        # 不同任务争抢同一资产的2个槽位
+        counter = iter(task_ids)
+        counter_lock = threading.Lock()
+
+        def claim_next():
+            with counter_lock:
+                task_id = next(counter)
+            return claim(task_id)
+
+        results = self.race(claim_next, workers=4)
+        self.assertEqual(results.count(asset_id), 2)
+        with self.get_db() as db:
+            self.assertEqual(db.query(Asset).get(asset_id).marking_tasks_count, 2)
+            self.assertEqual(db.query(Task).filter(Task.marking_asset_id == asset_id).count(), 2)
+
+        # 多个会话争抢同一个已分配的任务
+        with self.get_db() as db:
+            db.query(Asset).filter(Asset.id == asset_id).update({Asset.marking_tasks_count: 0})
+            db.commit()
+        waiting = [task_id for task_id in task_ids if task_id not in self.assigned(asset_id)][0]
+        results = self.race(lambda: claim(waiting), workers=4)
+        self.assertEqual(results.count(asset_id), 1)
+        with self.get_db() as db:
+            self.assertEqual(db.query(Asset).get(asset_id).marking_tasks_count, 1)
+
+    def assigned(self, asset_id):
+        with self.get_db() as db:
+            return {task.id for task in db.query(Task).filter(Task.marking_asset_id == asset_id).all()}
+
+    def test_sweep_expired_leases(self):
+        """测试接管已退出进程的任务：已提交的任务恢复监控，未提交的任务释放槽位后重新排队"""
+        expired = datetime.now() - timedelta(seconds=1)
+        with self.get_db() as db:
+            asset_id = self.add_asset(db, capacity=2)
+            db.query(Asset).filter(Asset.id == asset_id).update({Asset.marking_tasks_count: 2})
+            running = Task(name='running', status=TaskStatus.MARKING, marking_asset_id=asset_id, prompt_id='p1')
+            pending = Task(name='pending', status=TaskStatus.SUBMITTED, marking_asset_id=asset_id)
+            db.add_all([running, pending])
+            db.commit()
+            running_id, pending_id = running.id, pending.id
+            for task_id in (running_id, pending_id):
+                db.add(TaskLease(resource=f"marking_{task_id}", owner='dead', expires_at=expired))
+            db.commit()
+
+        with mock.patch.object(SchedulerService, '_attach_task_monitor') as attach:
+            SchedulerService.sweep_expired_leases()
+
+        self.assertEqual([call.args[1].id for call in attach.call_args_list], [running_id])
+        with self.get_db() as db:
+            self.assertEqual(db.query(Asset).get(asset_id).marking_tasks_count, 1)
+            pending = db.query(Task).get(pending_id)
+            self.assertEqual(pending.status, TaskStatus.SUBMITTED)
+            self.assertIsNone(pending.marking_asset_id)
+            leases = {lease.resource: lease.owner for lease in db.query(TaskLease).all()}
+        self.assertEqual(leases, {f"marking_{running_id}": ClaimService.get_owner_id()})
+
+if __name__ == '__main__':
+    unittest.main()
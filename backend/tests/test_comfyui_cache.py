@@ -0,0 +1,149 @@
+import gzip
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from task_scheduler.comfyui_cache import ComfyUIInfoCache
+from task_scheduler.comfyui_precheck import ComfyUIPreCheck
+
+OBJECT_INFO = {"SaveImage": {"input": {"required": {"images": ["IMAGE"]}}}}
+
+
+class FakeAPI:
+    """记录请求的ComfyUI接口"""
+
+    def __init__(self, base_url, comfyui_version='0.3'):
+        self.config = SimpleNamespace(base_url=base_url)
+        self.comfyui_version = comfyui_version
+        self.calls = []
+
+    def get_system_stats(self):
+        self.calls.append('system_stats')
+        return {'system': {'comfyui_version': self.comfyui_version, 'python_version': '3.11'}}
+
+    def get_extensions(self):
+        self.calls.append('extensions')
+        return ['/extensions/a.js']
+
+    def get_object_info(self, node_type=None):
+        self.calls.append('object_info')
+        return OBJECT_INFO
+
+    def get_models(self):
+        self.calls.append('models')
+        return ['checkpoints']
+
+    def get_model_files(self, model_type):
+        self.calls.append('model_files')
+        return [f'{self.config.base_url}.safetensors']
+
+
+class ComfyUIInfoCacheTestCase(unittest.TestCase):
+    """测试ComfyUI磁盘缓存的读写、过期、后台刷新去重，以及预检测按版本指纹共用缓存"""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = ComfyUIInfoCache(self.cache_dir, ttl=60)
+        ComfyUIInfoCache._loaded.clear()
+        ComfyUIInfoCache._fingerprints.clear()
+        self.addCleanup(ComfyUIInfoCache._loaded.clear)
+        self.addCleanup(ComfyUIInfoCache._fingerprints.clear)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_save_and_load(self):
+        self.assertIsNone(self.cache.load('object_info', 'fp'))
+        self.cache.save('object_info', 'fp', OBJECT_INFO)
+        data, saved_at = self.cache.load('object_info', 'fp')
+        self.assertEqual(data, OBJECT_INFO)
+        self.assertFalse(self.cache.is_expired(saved_at))
+        self.assertTrue(self.cache.is_expired(saved_at - 60))
+        self.assertEqual([name for name in os.listdir(self.cache_dir) if name.endswith('.tmp')], [])
+
+        # 其他进程写入的文件重新读取
+        ComfyUIInfoCache._loaded.clear()
+        self.assertEqual(self.cache.load('object_info', 'fp')[0], OBJECT_INFO)
+
+    def test_corrupted_file_ignored(self):
+        with gzip.open(self.cache._path('object_info', 'fp'), 'wt') as f:
+            f.write('{broken')
+        self.assertIsNone(self.cache.load('object_info', 'fp'))
+
+    def test_refresh_single_flight(self):
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def refresh():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+
+        self.cache.refresh_async('key', refresh)
+        self.assertTrue(started.wait(5))
+        # 刷新进行中时同一key不再提交
+        self.cache.refresh_async('key', refresh)
+        release.set()
+        self.wait_refreshed('key')
+        self.assertEqual(len(calls), 1)
+
+        # 刷新结束后可以再次刷新，失败不影响后续刷新
+        self.cache.refresh_async('key', lambda: 1 / 0)
+        self.wait_refreshed('key')
+        started.clear()
+        self.cache.refresh_async('key', refresh)
+        self.assertTrue(started.wait(5))
+        self.wait_refreshed('key')
+        self.assertEqual(len(calls), 2)
+
+    def wait_refreshed(self, key):
+        deadline = time.time() + 5
+        while key in ComfyUIInfoCache._refreshing and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertNotIn(key, ComfyUIInfoCache._refreshing)
+
+    def test_precheck_shares_object_info_by_fingerprint(self):
+        first = FakeAPI('http://a:8188')
+        self.assertTrue(ComfyUIPreCheck(first, self.cache).ensure_cache())
+        self.assertEqual(first.calls.count('object_info'), 1)
+
+        # 同一资产的新实例从磁盘缓存读取，指纹有效期内不发起请求
+        first.calls.clear()
+        precheck = ComfyUIPreCheck(first, self.cache)
+        self.assertTrue(precheck.ensure_cache())
+        self.assertEqual(first.calls, [])
+        self.assertEqual(precheck.get_cached_node_types(), OBJECT_INFO)
+
+        # 同版本的其他资产共用节点信息，只获取自己的模型列表
+        second = FakeAPI('http://b:8188')
+        precheck = ComfyUIPreCheck(second, self.cache)
+        self.assertTrue(precheck.ensure_cache())
+        self.assertNotIn('object_info', second.calls)
+        self.assertEqual(precheck.get_cached_model_files('checkpoints'), ['http://b:8188.safetensors'])
+
+        # 版本不同的资产单独缓存
+        third = FakeAPI('http://c:8188', comfyui_version='0.4')
+        self.assertTrue(ComfyUIPreCheck(third, self.cache).ensure_cache())
+        self.assertIn('object_info', third.calls)
+
+    def test_expired_cache_used_while_refreshing(self):
+        api = FakeAPI('http://a:8188')
+        self.cache.ttl = 0.05
+        self.assertTrue(ComfyUIPreCheck(api, self.cache).ensure_cache())
+        time.sleep(0.1)
+        api.calls.clear()
+
+        self.assertTrue(ComfyUIPreCheck(api, self.cache).ensure_cache())
+        fingerprint = self.cache.get_fingerprint(api)
+        key = f"precheck:{self.cache.asset_key(api)}_{fingerprint}"
+        self.wait_refreshed(key)
+        self.assertIn('object_info', api.calls)
+        self.assertFalse(self.cache.is_expired(self.cache.load('object_info', fingerprint)[1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
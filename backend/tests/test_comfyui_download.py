@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+import unittest
+from email.utils import formatdate
+from unittest import mock
+import requests
+from task_scheduler.comfyui_api import ComfyUIAPI, ComfyUIConfig
+
+
+class FakeResponse:
+    def __init__(self, body: bytes, modified: float = None):
+        self.body = body
+        self.modified = modified
+        self.headers = {'Content-Length': str(len(body))}
+        if modified is not None:
+            self.headers['Last-Modified'] = formatdate(modified, usegmt=True)
+        self.read = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        self.read = True
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i:i + chunk_size]
+
+
+class DownloadImageTestCase(unittest.TestCase):
+    """测试下载输出图片时只跳过与远程一致的本地文件"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.local_path = os.path.join(self.tmp_dir, 'ComfyUI_00001_.png')
+        self.session = mock.Mock()
+        self.api = ComfyUIAPI(ComfyUIConfig(), session=self.session)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def download(self, response, head=None):
+        self.session.get.return_value = response
+        self.session.head.return_value = head or FakeResponse(response.body, response.modified)
+        return self.api.download_image('ComfyUI_00001_.png', self.local_path, chunk_size=4)
+
+    def read(self):
+        with open(self.local_path, 'rb') as f:
+            return f.read()
+
+    def test_skip_identical_file(self):
+        self.assertTrue(self.download(FakeResponse(b'first image', modified=1700000000)))
+        self.assertEqual(self.read(), b'first image')
+        self.assertEqual(int(os.path.getmtime(self.local_path)), 1700000000)
+
+        response = FakeResponse(b'first image', modified=1700000000)
+        self.assertFalse(self.download(response))
+        self.assertFalse(response.read)
+        # HEAD确认一致时不发送GET
+        self.session.get.assert_called_once()
+
+    def test_head_unsupported(self):
+        self.assertTrue(self.download(FakeResponse(b'first image', modified=1700000000)))
+        self.session.head.side_effect = requests.exceptions.HTTPError('405 Method Not Allowed')
+
+        # HEAD失败时按GET响应头比对，一致时不读取内容
+        response = FakeResponse(b'first image', modified=1700000000)
+        self.assertFalse(self.download(response))
+        self.assertFalse(response.read)
+        self.assertEqual(self.session.get.call_count, 2)
+
+    def test_redownload_reused_filename(self):
+        self.assertTrue(self.download(FakeResponse(b'first image', modified=1700000000)))
+
+        # 同名文件内容变化：大小不同
+        self.assertTrue(self.download(FakeResponse(b'second, larger image', modified=1700000100)))
+        self.assertEqual(self.read(), b'second, larger image')
+
+        # 大小相同但修改时间不同
+        self.assertTrue(self.download(FakeResponse(b'third,  larger image', modified=1700000200)))
+        self.assertEqual(self.read(), b'third,  larger image')
+
+    def test_existing_file_without_headers(self):
+        with open(self.local_path, 'wb') as f:
+            f.write(b'stale')
+        response, head = FakeResponse(b'fresh'), FakeResponse(b'fresh')
+        del response.headers['Content-Length']
+        del head.headers['Content-Length']
+        self.assertTrue(self.download(response, head))
+        self.assertEqual(self.read(), b'fresh')
+        self.assertEqual([name for name in os.listdir(self.tmp_dir)], ['ComfyUI_00001_.png'])
+
+
+if __name__ == '__main__':
+    unittest.main()
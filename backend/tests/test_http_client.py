@@ -0,0 +1,42 @@
+import unittest
+from datetime import datetime
+from unittest import mock
+from app.config import Config
+from app.utils.http_client import HttpClientRegistry
+
+
+class HttpClientRegistryTestCase(unittest.TestCase):
+    """测试HTTP会话按资产版本失效，以及状态轮询会话不重试"""
+
+    def setUp(self):
+        HttpClientRegistry.close_all()
+        self.addCleanup(HttpClientRegistry.close_all)
+
+    def test_version_change_closes_old_sessions(self):
+        first = datetime(2026, 1, 1)
+        session = HttpClientRegistry.get_session(1, 'http://a:8188', first)
+        poll = HttpClientRegistry.get_session(1, 'http://a:8188', first, poll=True)
+        self.assertIsNot(session, poll)
+        self.assertIs(HttpClientRegistry.get_session(1, 'http://a:8188', first), session)
+        # 不带版本的调用复用已有会话
+        self.assertIs(HttpClientRegistry.get_session(1, 'http://a:8188'), session)
+
+        # 资产地址变更后，其他进程按 updated_at 发现变更并关闭旧地址的会话
+        with mock.patch.object(session, 'close') as close:
+            changed = HttpClientRegistry.get_session(1, 'http://b:8188', datetime(2026, 1, 2))
+            close.assert_called_once()
+        self.assertIsNot(changed, session)
+        self.assertEqual([key for key in HttpClientRegistry._sessions], [(1, 'http://b:8188', False)])
+
+    def test_poll_session_does_not_retry(self):
+        poll = HttpClientRegistry.get_session(1, 'http://a:8188', poll=True)
+        adapter = poll.get_adapter('http://a:8188')
+        self.assertEqual(adapter.max_retries.total, 0)
+        self.assertEqual(adapter.timeout[1], Config.HTTP_CLIENT_CONFIG['poll_read_timeout'])
+
+        session = HttpClientRegistry.get_session(1, 'http://a:8188')
+        self.assertGreater(session.get_adapter('http://a:8188').max_retries.total, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+import os
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+from app.models.task import Task, TaskStatus
+from app.models.asset import Asset
+from app.services.task_services import marking_service
+from app.services.task_services.marking_service import MarkingService
+from app.utils.ssh import CommandResult
+from tests.db_fixture import use_temp_db
+
+
+class PlanBatchesTestCase(unittest.TestCase):
+    """测试小任务按打标参数分组凑批以及任务数、图片数和等待时间的限制"""
+
+    IMAGES = {1: 10, 2: 60, 3: 20, 4: 10, 5: 30, 6: 50, 7: 0}
+    ALGORITHMS = {1: 'a', 2: 'a', 3: 'a', 4: 'b', 5: 'a', 6: 'a', 7: 'a'}
+
+    def setUp(self):
+        MarkingService._batch_waiting.clear()
+        self.tasks = [SimpleNamespace(id=task_id) for task_id in self.IMAGES]
+        patchers = [
+            mock.patch.object(MarkingService, 'count_task_images', staticmethod(lambda task_id: self.IMAGES[task_id])),
+            mock.patch.object(MarkingService, '_load_mark_config',
+                              staticmethod(lambda task_id: {'mark_algorithm': self.ALGORITHMS[task_id]})),
+            mock.patch.object(MarkingService, '_schedule_batch_wakeup'),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(MarkingService._batch_waiting.clear)
+
+    def plan(self, **limits):
+        system_config = {'mark_batch_max_tasks': 3, 'mark_batch_task_max_images': 50,
+                         'mark_batch_max_images': 100, 'mark_batch_max_wait': 0, **limits}
+        with mock.patch.dict(marking_service.Config.SYSTEM_CONFIG, system_config):
+            batches, singles = MarkingService.plan_batches(self.tasks)
+        return [[task.id for task in batch] for batch in batches], sorted(task.id for task in singles)
+
+    def test_disabled(self):
+        self.assertEqual(self.plan(mark_batch_max_tasks=0), ([], sorted(self.IMAGES)))
+
+    def test_group_by_config_and_task_limit(self):
+        # 图片过多或没有图片的任务单独处理，参数不同的任务不合并，只剩一个任务的批次按普通任务处理
+        self.assertEqual(self.plan(), ([[1, 3, 5]], [2, 4, 6, 7]))
+
+    def test_image_limit(self):
+        self.assertEqual(self.plan(mark_batch_max_images=40), ([[1, 3]], [2, 4, 5, 6, 7]))
+
+    def test_wait_for_more_tasks(self):
+        batches, singles = self.plan(mark_batch_max_tasks=5, mark_batch_max_images=200, mark_batch_max_wait=30)
+        self.assertEqual(batches, [])
+        self.assertEqual(singles, [2, 7])
+        self.assertEqual(set(MarkingService._batch_waiting), {1, 3, 4, 5, 6})
+        MarkingService._schedule_batch_wakeup.assert_called_once()
+
+
+class CollectBatchOutputTestCase(unittest.TestCase):
+    """测试从合并输出中拆分各任务的结果、补上触发词，以及整批结束后清理批次目录"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.batch_dir = os.path.join(self.tmp_dir, 'mark_batches')
+        patcher = mock.patch.object(marking_service, 'BATCH_DIR', self.batch_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        use_temp_db(self, marking_service)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def write(self, directory, files):
+        os.makedirs(directory, exist_ok=True)
+        for name, content in files.items():
+            with open(os.path.join(directory, name), 'w', encoding='utf-8') as f:
+                f.write(content)
+
+    def read(self, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def make_task(self, task_id, batch, trigger_words):
+        return SimpleNamespace(
+            id=task_id,
+            marked_images_path=os.path.join(self.tmp_dir, 'marked', str(task_id)),
+            mark_config={'trigger_words': trigger_words, 'batch': {**batch, 'prefix': f"t{task_id}__"}}
+        )
+
+    def test_collect_local_output(self):
+        output_dir = os.path.join(self.batch_dir, '1_0', 'output')
+        self.write(output_dir, {
+            't1__a.png': 'img', 't1__a.txt': ', a cat, sitting',
+            't2__b.png': 'img', 't2__b.txt': ', a dog',
+        })
+        batch = {'id': '1_0', 'task_ids': [1, 2], 'output_dir': output_dir}
+        asset = SimpleNamespace(is_local=True)
+
+        first = self.make_task(1, batch, 'sks')
+        self.assertTrue(MarkingService._collect_batch_output(first, asset)[0])
+        self.assertEqual(sorted(os.listdir(first.marked_images_path)), ['a.png', 'a.txt'])
+        self.assertEqual(self.read(os.path.join(first.marked_images_path, 'a.txt')), 'sks, a cat, sitting')
+        self.assertEqual(sorted(os.listdir(output_dir)), ['t2__b.png', 't2__b.txt'])
+
+        # 没有触发词时只去掉工作流留下的分隔符
+        second = self.make_task(2, batch, '')
+        self.assertTrue(MarkingService._collect_batch_output(second, asset)[0])
+        self.assertEqual(self.read(os.path.join(second.marked_images_path, 'b.txt')), 'a dog')
+
+        self.assertFalse(MarkingService._collect_batch_output(self.make_task(3, batch, ''), asset)[0])
+
+    def test_collect_remote_output(self):
+        remote_output = os.path.join(self.tmp_dir, 'remote_output')
+        self.write(remote_output, {'t1__a.png': 'img', 't1__a.txt': ', a cat', 't2__b.png': 'img'})
+
+        def download_directory(remote_path, local_path, recursive, include):
+            os.makedirs(local_path, exist_ok=True)
+            for name in os.listdir(remote_output):
+                if include(name, None):
+                    shutil.copy(os.path.join(remote_output, name), local_path)
+            return True, 'ok', {}
+
+        ssh_client = mock.Mock()
+        ssh_client.download_directory.side_effect = download_directory
+        task = self.make_task(1, {'id': '1_0', 'task_ids': [1, 2], 'output_dir': '/remote/batch_1_0'}, 'sks')
+        with mock.patch.object(marking_service, 'create_ssh_client_from_asset', return_value=ssh_client):
+            collected, message = MarkingService._collect_batch_output(task, SimpleNamespace(is_local=False))
+
+        self.assertTrue(collected, message)
+        self.assertEqual(sorted(os.listdir(task.marked_images_path)), ['a.png', 'a.txt'])
+        self.assertEqual(self.read(os.path.join(task.marked_images_path, 'a.txt')), 'sks, a cat')
+        self.assertEqual(ssh_client.download_directory.call_args.kwargs['remote_path'], '/remote/batch_1_0')
+
+    def test_cleanup_after_last_member(self):
+        db = self.Session()
+        asset = Asset(name='remote', ip='10.0.0.1', ssh_username='u', is_local=False,
+                      marking_tasks_count=0, training_tasks_count=0)
+        db.add(asset)
+        db.commit()
+        tasks = [Task(name=f't{i}', status=TaskStatus.MARKING) for i in range(2)]
+        db.add_all(tasks)
+        db.commit()
+        batch = {'id': f'{tasks[0].id}_0', 'task_ids': [task.id for task in tasks], 'asset_id': asset.id,
+                 'output_dir': '/remote/marked/batch_x'}
+        for task in tasks:
+            task.mark_config = {'batch': {**batch, 'prefix': f't{task.id}__'}}
+        db.commit()
+        os.makedirs(os.path.join(self.batch_dir, batch['id'], 'input'))
+
+        ssh_client = mock.Mock()
+        ssh_client.remove_directories.return_value = CommandResult(0, '', '')
+        with mock.patch.object(marking_service, 'create_ssh_client_from_asset', return_value=ssh_client):
+            tasks[0].status = TaskStatus.MARKED
+            db.commit()
+            MarkingService._release_batch_member(tasks[0].id)
+            self.assertTrue(os.path.isdir(os.path.join(self.batch_dir, batch['id'])))
+            ssh_client.remove_directories.assert_not_called()
+
+            tasks[1].status = TaskStatus.ERROR
+            db.commit()
+            MarkingService._release_batch_member(tasks[1].id)
+
+        self.assertFalse(os.path.exists(os.path.join(self.batch_dir, batch['id'])))
+        ssh_client.remove_directories.assert_called_once_with([
+            MarkingService._batch_remote_input_dir(batch['id']), '/remote/marked/batch_x'
+        ])
+        db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
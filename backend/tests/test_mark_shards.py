@@ -0,0 +1,129 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from app.models.task import Task, TaskStatus
+from app.models.asset import Asset
+from app.services.task_services import marking_service
+from app.services.task_services.marking_service import MarkingService
+from app.utils.ssh import CommandResult
+from tests.db_fixture import use_temp_db
+
+
+class MarkShardsTestCase(unittest.TestCase):
+    """测试分片打标的图片拆分、结果合并和分片目录清理"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.shard_dir = os.path.join(self.tmp_dir, 'mark_shards')
+        patcher = mock.patch.object(marking_service, 'SHARD_DIR', self.shard_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        use_temp_db(self, marking_service)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def make_files(self, directory, names):
+        os.makedirs(directory, exist_ok=True)
+        for name in names:
+            with open(os.path.join(directory, name), 'w') as f:
+                f.write(name)
+
+    def test_split_keeps_image_and_caption_together(self):
+        source = os.path.join(self.tmp_dir, 'source')
+        self.make_files(source, ['a.jpg', 'a.txt', 'b.png', 'c.jpg', 'c.txt', 'd.webp', 'e.jpg'])
+
+        shards = MarkingService._split_into_shards(1, source, 2)
+
+        self.assertEqual([images for _, images in shards], [3, 2])
+        self.assertEqual(sorted(os.listdir(shards[0][0])), ['a.jpg', 'a.txt', 'c.jpg', 'c.txt', 'e.jpg'])
+        self.assertEqual(sorted(os.listdir(shards[1][0])), ['b.png', 'd.webp'])
+        self.assertTrue(all(os.path.dirname(path) == os.path.join(self.shard_dir, '1') for path, _ in shards))
+
+    def test_merge_shards_and_cleanup(self):
+        source = os.path.join(self.tmp_dir, 'source')
+        output = os.path.join(self.tmp_dir, 'marked')
+        remote_output = os.path.join(self.tmp_dir, 'remote_out')
+        self.make_files(source, ['a.jpg', 'b.jpg'])
+        self.make_files(remote_output, ['b.jpg', 'b.txt'])
+
+        db = self.Session()
+        local = Asset(name='local', ip='127.0.0.1', ssh_username='u', is_local=True,
+                      marking_tasks_count=1, training_tasks_count=0)
+        remote = Asset(name='remote', ip='10.0.0.1', ssh_username='u', is_local=False,
+                       marking_tasks_count=1, training_tasks_count=0)
+        db.add_all([local, remote])
+        db.commit()
+        task = Task(name='t', status=TaskStatus.MARKING, marking_asset_id=local.id, marked_images_path=output,
+                    auto_training=False)
+        db.add(task)
+        db.commit()
+
+        MarkingService._split_into_shards(task.id, source, 2)
+        task.mark_config = {'shards': [
+            {'index': 0, 'asset_id': local.id, 'images': 1, 'status': 'marking',
+             'prompt_id': 'p0', 'remote_output_dir': '/remote/marked/shard_0'},
+            {'index': 1, 'asset_id': remote.id, 'images': 1, 'status': 'marking',
+             'prompt_id': 'p1', 'remote_output_dir': '/remote/marked/shard_1'},
+        ]}
+        db.commit()
+
+        def download_directory(local_path, remote_path):
+            shutil.copytree(remote_output, local_path, dirs_exist_ok=True)
+            return True, 'ok', {}
+
+        ssh_client = mock.Mock()
+        ssh_client.download_directory.side_effect = download_directory
+        ssh_client.remove_directories.return_value = CommandResult(0, '', '')
+
+        with mock.patch.object(marking_service, 'create_ssh_client_from_asset', return_value=ssh_client):
+            # 本地分片的结果直接写入输出目录
+            self.make_files(output, ['a.jpg', 'a.txt'])
+            MarkingService._handle_shard_status(db, task, local.id, True, {})
+            self.assertEqual(task.status, TaskStatus.MARKING)
+            self.assertTrue(os.path.isdir(os.path.join(self.shard_dir, str(task.id))))
+
+            MarkingService._handle_shard_status(db, task, remote.id, True, {})
+
+        self.assertEqual(task.status, TaskStatus.MARKED)
+        self.assertEqual(sorted(os.listdir(output)), ['a.jpg', 'a.txt', 'b.jpg', 'b.txt'])
+        self.assertFalse(os.path.exists(os.path.join(self.shard_dir, str(task.id))))
+        ssh_client.remove_directories.assert_called_once_with([
+            MarkingService._shard_remote_input_dir(task.id, 1), '/remote/marked/shard_1'
+        ])
+        db.close()
+
+    def test_failed_shard_cleans_up(self):
+        source = os.path.join(self.tmp_dir, 'source')
+        self.make_files(source, ['a.jpg', 'b.jpg'])
+
+        db = self.Session()
+        local = Asset(name='local', ip='127.0.0.1', ssh_username='u', is_local=True,
+                      marking_tasks_count=2, training_tasks_count=0)
+        db.add(local)
+        db.commit()
+        task = Task(name='t', status=TaskStatus.MARKING, marking_asset_id=local.id,
+                    marked_images_path=os.path.join(self.tmp_dir, 'marked'))
+        db.add(task)
+        db.commit()
+        MarkingService._split_into_shards(task.id, source, 2)
+        task.mark_config = {'shards': [
+            {'index': index, 'asset_id': local.id, 'images': 1, 'status': 'marking',
+             'prompt_id': f'p{index}', 'remote_output_dir': f'/remote/marked/shard_{index}'}
+            for index in range(2)
+        ]}
+        db.commit()
+
+        with mock.patch.object(marking_service, 'MarkRequestHandler'):
+            MarkingService._handle_shard_status(db, task, local.id, False, {'error_info': {'error_message': 'boom'}})
+
+        self.assertEqual(task.status, TaskStatus.ERROR)
+        self.assertFalse(os.path.exists(os.path.join(self.shard_dir, str(task.id))))
+        db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+from types import SimpleNamespace
+from app.services.task_services.placement_service import (
+    AssetSlot, AssetHistoryStats, PlacementPlan, PLACEMENT_STRATEGIES
+)
+
+class PlacementStrategyTestCase(unittest.TestCase):
+    """测试资产放置策略"""
+
+    def setUp(self):
+        self.task = SimpleNamespace(id=1, marking_asset_id=None)
+
+    def make_plan(self, strategy_name, slots, stats=None):
+        return PlacementPlan('marking', slots, PLACEMENT_STRATEGIES[strategy_name], stats)
+
+    def test_first_available(self):
+        """测试按资产顺序选择"""
+        plan = self.make_plan('first_available', [AssetSlot(1, 10, 9, 0), AssetSlot(2, 10, 0, 1)])
+        self.assertEqual(plan.choose(self.task), 1)
+
+    def test_least_loaded(self):
+        """测试选择负载最低的资产，并在分配后更新容量"""
+        plan = self.make_plan('least_loaded', [AssetSlot(1, 10, 5, 0), AssetSlot(2, 4, 1, 1)])
+        self.assertEqual(plan.choose(self.task), 2)
+        plan.assign(2)
+        plan.assign(2)
+        self.assertEqual(plan.choose(self.task), 1)
+
+    def test_full_assets_are_skipped(self):
+        """测试没有空闲槽位时返回None"""
+        plan = self.make_plan('least_loaded', [AssetSlot(1, 1, 1, 0)])
+        self.assertIsNone(plan.choose(self.task))
+        self.assertFalse(plan.has_capacity())
+
+    def test_data_locality(self):
+        """测试优先选择打标资产，打标资产已满时回退到最低负载"""
+        task = SimpleNamespace(id=2, marking_asset_id=3)
+        slots = [AssetSlot(1, 1, 0, 0), AssetSlot(3, 1, 0, 1)]
+        plan = self.make_plan('data_locality', slots)
+        self.assertEqual(plan.choose(task), 3)
+        plan.assign(3)
+        self.assertEqual(plan.choose(task), 1)
+
+    def test_weighted_throughput(self):
+        """测试选择预计完成最快的资产"""
+        stats = {
+            1: AssetHistoryStats(completed=10, failed=0, avg_duration=600),
+            2: AssetHistoryStats(completed=5, failed=5, avg_duration=200),
+        }
+        slots = [AssetSlot(1, 10, 0, 0), AssetSlot(2, 10, 0, 1)]
+        plan = self.make_plan('weighted_throughput', slots, stats)
+        # 资产2耗时短但成功率只有一半，预计耗时400 < 600
+        self.assertEqual(plan.choose(self.task), 2)
+        # 资产2排队变长后改选资产1
+        for _ in range(3):
+            plan.assign(2)
+        self.assertEqual(plan.choose(self.task), 1)
+
+    def test_choose_idle(self):
+        """测试分片只选择没有运行任务且未被排除的资产"""
+        slots = [AssetSlot(1, 10, 0, 0), AssetSlot(2, 10, 1, 1), AssetSlot(3, 10, 0, 2)]
+        plan = self.make_plan('least_loaded', slots)
+        self.assertEqual(plan.choose_idle(self.task, {1}), 3)
+        plan.assign(3)
+        self.assertIsNone(plan.choose_idle(self.task, {1}))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+from types import SimpleNamespace
+from task_scheduler.comfyui_precheck import ComfyUIPreCheck, NodeSchemaIndex
+
+OBJECT_INFO = {
+    "LoadImage": {"input": {"required": {"image": [["a.png", "b.png"], {}]}}},
+    "Scale": {"input": {"required": {"image": ["IMAGE"], "mode": [["lanczos", "bicubic"]]},
+                        "optional": {"factor": ["FLOAT", {"default": 1.0}]}}},
+    "SaveImage": {"input": {"required": {"images": ["IMAGE"]}}},
+}
+
+class PreCheckTestCase(unittest.TestCase):
+    """测试工作流预检测"""
+
+    def setUp(self):
+        self.precheck = ComfyUIPreCheck(SimpleNamespace(config=SimpleNamespace(base_url='http://test')))
+        self.precheck._node_types_cache = OBJECT_INFO
+        self.workflow = {
+            "1": {"class_type": "LoadImage", "inputs": {"image": "a.png"}},
+            "2": {"class_type": "Scale", "inputs": {"image": ["1", 0], "mode": "lanczos"}},
+            "3": {"class_type": "SaveImage", "inputs": {"images": ["2", 0]}},
+        }
+
+    def test_schema_index(self):
+        """测试节点定义索引的输入名和枚举值，同一份object_info复用索引"""
+        index = NodeSchemaIndex.for_object_info(OBJECT_INFO)
+        self.assertIs(NodeSchemaIndex.for_object_info(OBJECT_INFO), index)
+        schema = index.get("Scale")
+        self.assertEqual(schema.required, frozenset({"image", "mode"}))
+        self.assertEqual(schema.optional, frozenset({"factor"}))
+        self.assertEqual(schema.enums["mode"], frozenset({"lanczos", "bicubic"}))
+
+    def test_valid_workflow(self):
+        result = self.precheck.validate_workflow(self.workflow, check_enum_values=True)
+        self.assertTrue(result["valid"], result)
+        self.assertEqual(len(result["workflow_analysis"]["connections"]), 2)
+
+    def test_issues(self):
+        """测试缺失参数、未知参数、无效枚举值、无效节点和缺失连接"""
+        self.workflow["1"]["inputs"]["image"] = "c.png"
+        self.workflow["2"]["inputs"] = {"image": ["9", 0], "extra": 1}
+        self.workflow["4"] = {"class_type": "Unknown", "inputs": {}}
+        result = self.precheck.validate_workflow(self.workflow, check_enum_values=True)
+        self.assertFalse(result["valid"])
+        issue_types = sorted(issue["issue_type"] for issue in result["parameter_issues"])
+        self.assertEqual(issue_types, ["invalid_enum_value", "missing_required_input", "unknown_input"])
+        structure_types = sorted(issue["type"] for issue in result["structure_issues"])
+        self.assertEqual(structure_types, ["invalid_node_types", "missing_connections"])
+        # 默认不检查枚举值
+        result = self.precheck.validate_workflow(self.workflow)
+        self.assertEqual(len(result["parameter_issues"]), 2)
+
+    def test_cycle(self):
+        """测试检测循环连接"""
+        self.workflow["2"]["inputs"]["image"] = ["3", 0]
+        self.workflow["3"]["inputs"]["images"] = ["2", 0]
+        result = self.precheck.validate_workflow(self.workflow)
+        cycles = [issue for issue in result["structure_issues"] if issue["type"] == "cycle"]
+        self.assertEqual(len(cycles), 1)
+        self.assertIn("2", cycles[0]["message"])
+        self.assertTrue(self.precheck.validate_prompt(self.workflow)["other_issues"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import threading
+import time
+import unittest
+from unittest import mock
+from app.services.task_services import scheduler_events
+from app.services.task_services.scheduler_events import SchedulerEvents
+from tests.db_fixture import use_temp_db
+
+
+class SchedulerEventsTestCase(unittest.TestCase):
+    """测试纯API模式的Web进程通过数据库信号唤醒独立调度进程"""
+
+    def setUp(self):
+        use_temp_db(self, scheduler_events)
+        patcher = mock.patch.dict(scheduler_events.Config.SYSTEM_CONFIG, {'scheduler_signal_poll_interval': 0.05})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(SchedulerEvents.set_local_scheduler, False)
+        SchedulerEvents.set_local_scheduler(False)
+        SchedulerEvents.wait(timeout=0)
+
+    def test_remote_notify_wakes_scheduler(self):
+        # 调度进程：开始等待时记录当前序号
+        SchedulerEvents.set_local_scheduler(True)
+        self.assertEqual(SchedulerEvents.wait(timeout=0.1), [])
+
+        def remote_notify():
+            # 模拟Web进程：本进程未运行调度循环时写入数据库信号
+            SchedulerEvents._local_scheduler = False
+            SchedulerEvents._publish()
+            SchedulerEvents._publish()
+            SchedulerEvents._local_scheduler = True
+
+        threading.Timer(0.1, remote_notify).start()
+        started = time.time()
+        reasons = SchedulerEvents.wait(timeout=5)
+        self.assertEqual(reasons, ['remote_notify'])
+        self.assertLess(time.time() - started, 2)
+
+        # 序号未再变化时等待到超时
+        self.assertEqual(SchedulerEvents.wait(timeout=0.15), [])
+
+    def test_local_notify_skips_database(self):
+        SchedulerEvents.set_local_scheduler(True)
+        with mock.patch.object(SchedulerEvents, '_publish') as publish:
+            SchedulerEvents.notify('task_submitted')
+            publish.assert_not_called()
+        self.assertEqual(SchedulerEvents.wait(timeout=1), ['task_submitted'])
+
+        SchedulerEvents.set_local_scheduler(False)
+        with mock.patch.object(SchedulerEvents, '_publish') as publish:
+            SchedulerEvents.notify('task_submitted')
+            publish.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+import threading
+import time
+import unittest
+from unittest import mock
+from app.utils import ssh as ssh_module
+from app.utils.ssh import SSHConnectionManager, SSHClientTool
+
+
+class FakeTransport:
+    def __init__(self):
+        self.active = True
+        self.ping_ok = True
+
+    def is_active(self):
+        return self.active
+
+    def set_keepalive(self, interval):
+        pass
+
+    def open_session(self):
+        if not self.ping_ok:
+            raise EOFError('ping failed')
+        chan = mock.Mock()
+        chan.recv_exit_status.return_value = 0
+        return chan
+
+
+class FakeSSHClient:
+    def __init__(self):
+        self.transport = FakeTransport()
+        self.closed = False
+        self.sftp = mock.Mock()
+
+    def set_missing_host_key_policy(self, policy):
+        pass
+
+    def connect(self, **kwargs):
+        pass
+
+    def get_transport(self):
+        return self.transport
+
+    def open_sftp(self):
+        return self.sftp
+
+    def close(self):
+        self.closed = True
+        self.transport.active = False
+
+
+class SSHPoolTestCase(unittest.TestCase):
+    """测试连接池的连接数与通道上限、等待超时和失效连接的移除"""
+
+    def setUp(self):
+        self.manager = object.__new__(SSHConnectionManager)
+        self.manager._init()
+        self.manager._max_connections = 2
+        self.manager._max_channels = 2
+        self.manager._checkout_timeout = 0.2
+        self.manager._probe_interval = 0
+        self.manager._start_cleanup_thread = lambda: None
+        patcher = mock.patch.object(ssh_module.paramiko, 'SSHClient', FakeSSHClient)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def checkout(self, **kwargs):
+        return self.manager.checkout('host', 22, 'root', password='pw', **kwargs)
+
+    def test_limits_and_wait_timeout(self):
+        conns = [self.checkout() for _ in range(4)]
+        self.assertEqual(len({id(c) for c in conns}), 2)
+        self.assertTrue(all(c.channels == 2 for c in conns))
+
+        with self.assertRaises(TimeoutError):
+            self.checkout(wait_timeout=0.05)
+        metrics = self.manager.get_metrics()
+        self.assertEqual(metrics['creations'], 2)
+        self.assertEqual(metrics['timeouts'], 1)
+
+        # 等待期间归还通道后复用已有连接，不新建
+        threading.Timer(0.05, self.manager.release, args=(conns[0],)).start()
+        conn = self.checkout(wait_timeout=2)
+        self.assertIs(conn, conns[0])
+        metrics = self.manager.get_metrics()
+        self.assertEqual(metrics['creations'], 2)
+        self.assertEqual(metrics['waits'], 2)
+
+    def test_sync_falls_back_to_free_channels(self):
+        self.manager._max_channels = 8
+        first, granted = self.manager.checkout_upto('host', 22, 'root', password='pw', channels=5)
+        second, _ = self.manager.checkout_upto('host', 22, 'root', password='pw', channels=5)
+        self.assertIsNot(first, second)
+
+        # 连接数已达上限，第三个同步按剩余通道借出而不是等待超时
+        third, granted = self.manager.checkout_upto('host', 22, 'root', password='pw', channels=5, wait_timeout=0.05)
+        self.assertEqual(granted, 3)
+        self.assertEqual(third.channels, 8)
+        self.assertEqual(self.manager.get_metrics()['waits'], 0)
+        self.manager.release(third, granted)
+        self.assertEqual(third.channels, 5)
+
+    def test_unbounded_wait_by_default(self):
+        self.manager._checkout_timeout = 0
+        conns = [self.checkout(channels=2) for _ in range(2)]
+        threading.Timer(0.3, self.manager.release, args=(conns[1], 2)).start()
+        # 不设置等待时间时一直等到有通道归还
+        conn = self.checkout()
+        self.assertIs(conn, conns[1])
+        self.assertEqual(self.manager.get_metrics()['timeouts'], 0)
+
+    def test_failed_ping_defers_close_until_released(self):
+        self.manager._max_connections = 1
+        first = self.checkout()
+        first.last_verified = time.time() - 3600
+        first.ssh.transport.ping_ok = False
+
+        # 探测失败：连接不再借出，但仍在使用中，不关闭
+        second = self.checkout()
+        self.assertIsNot(second, first)
+        self.assertTrue(first.retired)
+        self.assertFalse(first.ssh.closed)
+        self.assertEqual(self.manager.get_metrics()['evictions'], 0)
+
+        # 最后一个借用者归还后关闭
+        self.manager.release(first)
+        self.assertTrue(first.ssh.closed)
+        self.assertEqual(self.manager.get_metrics()['evictions'], 1)
+        self.assertFalse(second.ssh.closed)
+        self.assertEqual(second.channels, 1)
+
+    def test_inactive_connection_evicted_on_release(self):
+        conn = self.checkout()
+        conn.ssh.transport.active = False
+        self.manager.release(conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(self.manager.get_metrics()['hosts']['host:22:root:password:***']['connections'], 0)
+
+    def test_stream_download_holds_channel_until_closed(self):
+        tool = SSHClientTool('host', 22, 'root', password='pw')
+        with mock.patch.object(ssh_module, 'connection_manager', self.manager):
+            success, stream, info, _ = tool.stream_download_file('/remote/file.bin', chunk_size=4)
+            self.assertTrue(success)
+            conn = self.manager._pools['host:22:root:password:***'].connections[0]
+            remote_file = conn.ssh.sftp.open.return_value
+            remote_file.read.side_effect = [b'abcd', b'ef', b'']
+            self.assertEqual(conn.channels, 1)
+            self.assertEqual(b''.join(stream), b'abcdef')
+            self.assertEqual(conn.channels, 0)
+            remote_file.close.assert_called_once()
+            conn.ssh.sftp.close.assert_called_once()
+
+            # 未读完就关闭同样归还通道
+            success, stream, info, _ = tool.stream_download_file('/remote/file.bin')
+            self.assertEqual(conn.channels, 1)
+            stream.close()
+            self.assertEqual(conn.channels, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+from app.services.task_services import status_poller
+from app.services.task_services.status_poller import AssetStatusPoller, StatusWatch
+
+class FakeHttp:
+    closed = False
+
+    async def close(self):
+        self.closed = True
+
+class FakePoller(AssetStatusPoller):
+    """不访问数据库和资产的轮询器，状态由测试设置"""
+    kind = 'fake'
+    active_status = 'RUNNING'
+
+    def __init__(self, asset_id):
+        super().__init__(asset_id)
+        self.statuses = {}
+        self.results = {}
+        self.fetches = 0
+        self.completed = []
+        self.cancelled = []
+        self.release = threading.Event()
+
+    def _load_state(self, task_ids):
+        return {task_id: self.statuses.get(task_id) for task_id in task_ids}, object(), 0.02
+
+    async def _fetch(self, asset, remote_ids):
+        self.fetches += 1
+        return {remote_id: self.results.get(remote_id) for remote_id in remote_ids}
+
+    def is_completed(self, result):
+        return result == 'done'
+
+    def handle_result(self, task_id, result):
+        # 模拟耗时较长的结果下载
+        self.release.wait(10)
+        self.completed.append(task_id)
+        return True
+
+    def handle_cancelled(self, task_id):
+        self.cancelled.append(task_id)
+
+class StatusPollerTestCase(unittest.TestCase):
+    """测试状态轮询器的取消和耗时的完成处理"""
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        # 去掉首次轮询的随机延迟和抖动
+        patcher = mock.patch.object(status_poller.random, 'uniform', lambda a, b: 0 if a == 0 else 1)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.finished = []
+
+    def tearDown(self):
+        async def cancel_all():
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(cancel_all(), self.loop).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+        self.loop.close()
+
+    def call(self, fn, *args):
+        async def run():
+            return fn(*args)
+        return asyncio.run_coroutine_threadsafe(run(), self.loop).result(5)
+
+    def watch(self, poller, task_id, status='RUNNING', result=None):
+        poller.statuses[task_id] = status
+        poller.results[f"r{task_id}"] = result
+        self.call(poller.add, StatusWatch(task_id, f"r{task_id}", lambda: self.finished.append(task_id)))
+
+    def wait_until(self, predicate, timeout=5):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if predicate():
+                return True
+            time.sleep(0.01)
+        return False
+
+    def test_slow_completion_does_not_block_polling(self):
+        """测试占满完成处理线程的下载不影响同一资产和其他资产的状态轮询"""
+        busy = FakePoller(1)
+        other = FakePoller(2)
+        try:
+            workers = status_poller.completion_pool._max_workers
+            for task_id in range(1, workers + 1):
+                self.watch(busy, task_id, result='done')
+            self.watch(busy, 100)
+            self.watch(other, 200)
+            self.assertTrue(self.wait_until(lambda: all(
+                busy._watches[task_id].busy for task_id in range(1, workers + 1)
+            )))
+
+            fetches = (busy.fetches, other.fetches)
+            self.assertTrue(self.wait_until(lambda: busy.fetches >= fetches[0] + 3 and other.fetches >= fetches[1] + 3))
+            self.assertEqual(busy.completed, [])
+
+            # 下载中的任务被取消时监控立即结束
+            self.call(busy.cancel, 1)
+            self.assertTrue(self.wait_until(lambda: 1 in self.finished))
+        finally:
+            busy.release.set()
+        self.assertTrue(self.wait_until(lambda: len(busy.completed) == workers))
+        self.assertTrue(self.wait_until(lambda: set(range(1, workers + 1)) <= set(self.finished)))
+
+    def test_cancellation(self):
+        """测试取消监控和任务状态变化时退出监控，没有在途任务时关闭HTTP会话"""
+        poller = FakePoller(1)
+        http = FakeHttp()
+        poller._http = http
+        self.watch(poller, 1)
+        self.watch(poller, 2)
+        self.assertTrue(self.wait_until(lambda: poller.fetches > 0))
+
+        self.assertTrue(self.call(poller.cancel, 1))
+        self.assertTrue(self.wait_until(lambda: self.finished == [1]))
+        self.assertNotIn(1, poller.get_task_ids())
+        self.assertEqual(poller.cancelled, [])
+
+        poller.statuses[2] = 'STOPPED'
+        self.assertTrue(self.wait_until(lambda: poller.cancelled == [2] and 2 in self.finished))
+        self.assertTrue(self.wait_until(lambda: http.closed))
+        self.assertIsNone(poller._http)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from app.utils import sync_manifest
+from app.utils.sync_manifest import (
+    MANIFEST_NAME, ManifestSync, TransferItem, build_local_manifest, diff_manifests, parse_remote_listing,
+    file_sha256
+)
+
+class SyncManifestTestCase(unittest.TestCase):
+    """测试内容hash清单的生成和比对"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data_dir = os.path.join(self.tmp_dir, 'data')
+        os.makedirs(self.data_dir)
+        patcher = mock.patch.object(sync_manifest, 'LOCAL_MANIFEST_DIR', os.path.join(self.tmp_dir, 'cache'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def write(self, name, content):
+        with open(os.path.join(self.data_dir, name), 'w') as f:
+            f.write(content)
+
+    def test_parse_remote_listing(self):
+        """测试解析远程清单和find输出"""
+        output = (
+            '{"a.txt": {"size": 3, "mtime": "1.5", "sha256": "x"}}\n<<<RLT_LISTING>>>\n'
+            f'f\ta.txt\t3\t1.5\nd\tsub\t4096\t2.0\nf\t{MANIFEST_NAME}\t10\t3.0\n'
+        )
+        manifest, files, dirs = parse_remote_listing(output)
+        self.assertEqual(manifest['a.txt']['sha256'], 'x')
+        self.assertEqual(files, {'a.txt': {'size': 3, 'mtime': '1.5'}})
+        self.assertEqual(dirs, ['sub'])
+
+    def test_same_size_edit_is_detected(self):
+        """测试大小相同但内容不同的文件被识别为需要更新"""
+        self.write('a.txt', 'cat')
+        local = build_local_manifest(self.data_dir)
+        remote_files = {'a.txt': {'size': 3, 'mtime': '1.0'}}
+        remote_manifest = {'a.txt': {'size': 3, 'mtime': '1.0', 'sha256': file_sha256(os.path.join(self.data_dir, 'a.txt'))}}
+        self.assertEqual(diff_manifests(local, remote_files, remote_manifest)[3], ['a.txt'])
+
+        self.write('a.txt', 'dog')
+        local = build_local_manifest(self.data_dir)
+        added, updated, unknown, unchanged = diff_manifests(local, remote_files, remote_manifest)
+        self.assertEqual(updated, ['a.txt'])
+        self.assertEqual(unchanged, [])
+
+    def test_stale_remote_manifest_needs_hash(self):
+        """测试远程文件修改时间与清单不一致时需要重新计算hash"""
+        self.write('a.txt', 'cat')
+        self.write('b.txt', 'new')
+        local = build_local_manifest(self.data_dir)
+        remote_files = {'a.txt': {'size': 3, 'mtime': '2.0'}}
+        remote_manifest = {'a.txt': {'size': 3, 'mtime': '1.0', 'sha256': local['a.txt']['sha256']}}
+        added, updated, unknown, unchanged = diff_manifests(local, remote_files, remote_manifest)
+        self.assertEqual(added, ['b.txt'])
+        self.assertEqual(unknown, ['a.txt'])
+
+    def test_large_files_skip_tar(self):
+        """测试小文件走tar流时大文件仍走SFTP分块续传"""
+        sync = ManifestSync(mock.Mock(), parallelism=2)
+        sync.engine.resumable_min_size = 100
+        sync.engine.make_remote_dirs = mock.Mock()
+        sync.engine.transfer = mock.Mock(return_value=[])
+        sync.tar.is_supported = mock.Mock(return_value=True)
+        sync.tar.download = mock.Mock(return_value=20)
+        items = [TransferItem(os.path.join(self.data_dir, f'{i}.txt'), f'/remote/{i}.txt', 1, 'added')
+                 for i in range(20)]
+        items.append(TransferItem(os.path.join(self.data_dir, 'model.safetensors'), '/remote/model.safetensors',
+                                  1000, 'updated'))
+
+        stats = {'added': 0, 'updated': 0, 'bytes': 0}
+        failed, _ = sync._transfer(items, stats, False, self.data_dir, '/remote', True)
+        self.assertEqual(failed, [])
+        self.assertEqual(sync.engine.transfer.call_args[0][0], items[-1:])
+        self.assertEqual(len(sync.tar.download.call_args[0][2]), 20)
+        self.assertNotIn('model.safetensors', sync.tar.download.call_args[0][2])
+        self.assertEqual(stats['mode'], 'tar+sftp')
+        self.assertEqual(stats['added'], 20)
+
+        # tar失败时小文件回退到SFTP
+        sync.tar.download.side_effect = IOError('broken pipe')
+        sync._transfer(items, {'added': 0, 'updated': 0, 'bytes': 0}, False, self.data_dir, '/remote', True)
+        self.assertEqual(len(sync.engine.transfer.call_args[0][0]), 20)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from app.utils.workflow_templates import WorkflowTemplateRegistry
+
+class WorkflowTemplateTestCase(unittest.TestCase):
+    """测试工作流模板缓存和参数绑定"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'workflow.json')
+        self.write({
+            "1": {"class_type": "Simple String", "inputs": {"string": "a"}},
+            "2": {"class_type": "Other", "inputs": {"value": 1}},
+        })
+        WorkflowTemplateRegistry.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def write(self, workflow):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(workflow, f)
+
+    def test_render_does_not_modify_template(self):
+        """测试渲染只复制绑定的节点，模板保持不变"""
+        template = WorkflowTemplateRegistry.get(self.path)
+        workflow = WorkflowTemplateRegistry.render(self.path, {("1", "string"): "b"})
+        self.assertEqual(workflow["1"]["inputs"]["string"], "b")
+        self.assertEqual(template["1"]["inputs"]["string"], "a")
+        self.assertIs(workflow["2"], template["2"])
+        with self.assertRaises(KeyError):
+            WorkflowTemplateRegistry.render(self.path, {("3", "string"): "c"})
+
+    def test_reload_on_change(self):
+        """测试文件未变化时复用缓存，修改后重新加载"""
+        first = WorkflowTemplateRegistry.get(self.path)
+        self.assertIs(WorkflowTemplateRegistry.get(self.path), first)
+        self.write({"1": {"class_type": "Simple String", "inputs": {"string": "changed"}}})
+        os.utime(self.path, ns=(os.stat(self.path).st_atime_ns, os.stat(self.path).st_mtime_ns + 10 ** 9))
+        self.assertEqual(WorkflowTemplateRegistry.get(self.path)["1"]["inputs"]["string"], "changed")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,21 @@
+"""
+WSGI入口，供 gunicorn 等WSGI服务器加载
+
+按 RUN_SCHEDULER 配置决定是否在Web进程内启动调度。多个Web worker时建议关闭，由独立调度进程负责：
+    RUN_SCHEDULER=false gunicorn -w 2 --threads 8 -b 0.0.0.0:5000 wsgi:app
+    python run_worker.py --processes 2
+
+纯API模式下提交任务等唤醒通知通过数据库信号传给调度进程，
+调度进程每隔 SCHEDULER_SIGNAL_POLL_INTERVAL 秒检查一次。
+"""
+import os
+import sys
+
+# 添加项目根目录到 Python 路径
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(ROOT_DIR)
+
+from app.main import create_app
+from app.config import config
+
+app = create_app(start_scheduler=config.RUN_SCHEDULER)